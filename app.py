@@ -14,6 +14,30 @@ import json
 import time as time_module
 import sys
 import re
+from distance_store import DistanceStore, road_haversine
+import distance_store as _dstore_mod
+from spatial_index import SpatialIndex
+from distance_cache_db import DistanceCacheDB, TrackedCache
+from trip_state import TripState
+from local_search import improve_trips
+from planner_profiler import PlannerProfiler, count as profile_count, mark as profile_mark, profile_frame
+from plan_cancel import (CancelToken, PlanningCancelled, check as plan_check, combine_reports as combine_cancel_reports,
+                         current as current_cancel_token, phase as plan_phase, plan_ready, stopped as plan_stopped)
+from parallel_planner import plan_parallel, step9_trip_order, worker_context
+from plan_update import update_plan as _update_plan
+from plan_cache import PlanCache, plan_cache_key, content_version, file_version
+from solver_portfolio import run_portfolio
+from zone_index import ZoneIndex
+from routing_backend import get_backend as get_routing_backend
+import route_legs
+from route_store import RouteStore, open_store as open_route_store
+from route_prefetch import PRIORITY_FOCUS, PRIORITY_PLAN, PRIORITY_VIEW, RoutePrefetcher
+from branch_resolver import BranchResolver
+try:
+    from ortools_vrp import optimize_decomposed
+    ORTOOLS_AVAILABLE = True
+except ImportError:
+    ORTOOLS_AVAILABLE = False
 
 # ฟังก์ชัน safe print สำหรับ Windows console
 def safe_print(*args, **kwargs):
@@ -158,16 +182,32 @@ try:
     import folium
     from folium import plugins
     from streamlit_folium import folium_static  # ใช้ folium_static แทน st_folium เพื่อไม่ให้โหลดซ้ำ
-    import requests
     FOLIUM_AVAILABLE = True
 except ImportError:
     FOLIUM_AVAILABLE = False
 
 # Google Sheets Integration
+# (เชื่อมต่อจริงใน PlannerContext — ครั้งเดียวต่อ process ไม่ใช่ทุก rerun)
+SPREADSHEET_ID = '12DmIfECwVpsWfl8rl2r1A_LB4_5XMrmnmwlPUHKNU-o'
+SHEETS_AVAILABLE = False
+gc = None
+sh = None
 try:
     import gspread
     from oauth2client.service_account import ServiceAccountCredentials
-    
+    GSPREAD_AVAILABLE = True
+except ImportError:
+    safe_print("⚠️ ไม่พบ gspread library - ติดตั้งด้วย: pip install gspread oauth2client")
+    GSPREAD_AVAILABLE = False
+
+def connect_google_sheets():
+    """
+    เชื่อมต่อ Google Sheets (Streamlit Secrets → credentials.json)
+    Returns: (gc, sh, available)
+    """
+    if not GSPREAD_AVAILABLE:
+        return None, None, False
+
     # ตรวจสอบว่ามีไฟล์ credentials.json หรือ Streamlit secrets
     credentials_file = 'credentials.json'
     scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
@@ -197,35 +237,24 @@ try:
             safe_print(f"⚠️ ไม่พบ {credentials_file} และไม่มี Streamlit Secrets")
             safe_print(f"💡 ดูวิธีตั้งค่าได้ที่: CREDENTIALS_SETUP.md")
     
+    if not creds:
+        return None, None, False
+
     # เชื่อมต่อ Google Sheets (ใส่ socket timeout ป้องกัน hang ตอน startup)
-    if creds:
-        import socket as _socket
-        _prev_timeout = _socket.getdefaulttimeout()
-        _socket.setdefaulttimeout(10)  # 10 วินาที max สำหรับ network calls
-        try:
-            gc = gspread.authorize(creds)
-            SPREADSHEET_ID = '12DmIfECwVpsWfl8rl2r1A_LB4_5XMrmnmwlPUHKNU-o'
-            sh = gc.open_by_key(SPREADSHEET_ID)
-            SHEETS_AVAILABLE = True
-            safe_print("✅ เชื่อมต่อ Google Sheets สำเร็จ")
-        except Exception as e:
-            safe_print(f"⚠️ Google Sheets Error: {e}")
-            safe_print(f"💡 ตรวจสอบ credentials หรือดูคู่มือที่ CREDENTIALS_SETUP.md")
-            SHEETS_AVAILABLE = False
-            gc = None
-            sh = None
-        finally:
-            _socket.setdefaulttimeout(_prev_timeout)  # restore
-    else:
-        SHEETS_AVAILABLE = False
-        gc = None
-        sh = None
-        
-except ImportError:
-    safe_print("⚠️ ไม่พบ gspread library - ติดตั้งด้วย: pip install gspread oauth2client")
-    SHEETS_AVAILABLE = False
-    gc = None
-    sh = None
+    import socket as _socket
+    _prev_timeout = _socket.getdefaulttimeout()
+    _socket.setdefaulttimeout(10)  # 10 วินาที max สำหรับ network calls
+    try:
+        _gc = gspread.authorize(creds)
+        _sh = _gc.open_by_key(SPREADSHEET_ID)
+        safe_print("✅ เชื่อมต่อ Google Sheets สำเร็จ")
+        return _gc, _sh, True
+    except Exception as e:
+        safe_print(f"⚠️ Google Sheets Error: {e}")
+        safe_print(f"💡 ตรวจสอบ credentials หรือดูคู่มือที่ CREDENTIALS_SETUP.md")
+        return None, None, False
+    finally:
+        _socket.setdefaulttimeout(_prev_timeout)  # restore
 
 # Auto-refresh component
 try:
@@ -241,19 +270,27 @@ except ImportError:
 # CACHE SYSTEM - ป้องกันการโหลดซ้ำและเพิ่มความเร็ว
 # ==========================================
 USE_CACHE = True  # เปิดใช้งาน cache system
-DISTANCE_CACHE_FILE = 'distance_cache.json'
-ROUTE_CACHE_FILE = 'route_cache.json'
+DISTANCE_CACHE_FILE = 'distance_cache.json'   # รูปแบบเดิม — migrate เข้า distance_cache.db ครั้งแรกอัตโนมัติ
+DISTANCE_CACHE_DB_FILE = 'distance_cache.db'  # SQLite (WAL) เขียนเฉพาะ entry ใหม่
+ROUTE_CACHE_FILE = 'route_cache.json'     # รูปแบบเดิม — migrate เข้า route_store/ ครั้งแรกอัตโนมัติ
+ROUTE_STORE_DIR = 'route_store'           # shard ตาม hash โหลดเฉพาะที่ใช้
+ROUTE_STORE_MAX_MB = 32                   # เพดาน geometry ในหน่วยความจำ (LRU)
+ROUTE_MAP_POLL_SECONDS = 2                # หน้าแผนที่ poll สถานะ prefetch ระหว่างยังโหลดเส้นทาง
+ROUTE_MAP_REBUILD_SECONDS = 6             # สร้างแผนที่ใหม่ระหว่างโหลดไม่ถี่กว่านี้
+_DIST_DB = DistanceCacheDB(DISTANCE_CACHE_DB_FILE)
 
 # โหลด cache จากไฟล์
 @st.cache_data(show_spinner=False)
 def load_distance_cache():
-    """โหลด distance cache จากไฟล์"""
-    if os.path.exists(DISTANCE_CACHE_FILE):
-        try:
-            with open(DISTANCE_CACHE_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {}
+    """โหลด distance cache จาก distance_cache.db (ถ้ายังไม่มี → นำเข้าจาก distance_cache.json)"""
+    try:
+        if not _DIST_DB.exists() and os.path.exists(DISTANCE_CACHE_FILE):
+            _n = _DIST_DB.import_json(DISTANCE_CACHE_FILE)
+            safe_print(f"📦 migrate distance_cache.json → {DISTANCE_CACHE_DB_FILE}: {_n:,} รายการ")
+        if _DIST_DB.exists():
+            return _DIST_DB.load_all()
+    except Exception:
+        return {}
     return {}
 
 # นับ entry ใหม่ที่ยังไม่ได้ save (dirty counter)
@@ -264,56 +301,64 @@ _ROUTE_CACHE_DIRTY = 0
 _ROUTE_CACHE_SAVE_BATCH = 10  # route แต่ละ entry ใหญ่กว่า → batch เล็กกว่า
 
 def save_distance_cache(cache_dict, force=False):
-    """บันทึก distance cache ลงไฟล์ — เฉพาะเมื่อมีการเปลี่ยนแปลงเท่านั้น"""
+    """บันทึก distance cache ลง distance_cache.db — append เฉพาะ entry ใหม่ (ไม่เขียนทั้งไฟล์)"""
     global _DIST_CACHE_DIRTY
     if not force and _DIST_CACHE_DIRTY == 0:
         return  # ไม่มีการเปลี่ยนแปลง ไม่ต้อง save
     try:
-        with open(DISTANCE_CACHE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(cache_dict, f, ensure_ascii=False, indent=2)
+        if isinstance(cache_dict, TrackedCache):
+            _DIST_DB.flush(cache_dict)
+        else:
+            _DIST_DB.put_many(cache_dict.items())
         _DIST_CACHE_DIRTY = 0
     except Exception as e:
         safe_print(f"⚠️ ไม่สามารถบันทึก distance cache: {e}")
 
 def load_route_cache():
-    """โหลด route cache จากไฟล์"""
-    if os.path.exists(ROUTE_CACHE_FILE):
-        try:
-            with open(ROUTE_CACHE_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+    """เปิด route store (ยังไม่มี → นำเข้าจาก route_cache.json) — ไม่โหลดเส้นทางทั้งหมดเข้าหน่วยความจำ"""
+    try:
+        store, migrated = open_route_store(ROUTE_STORE_DIR, ROUTE_CACHE_FILE, max_bytes=ROUTE_STORE_MAX_MB * 1024 * 1024)
+    except Exception as e:
+        safe_print(f"⚠️ เปิด route store ไม่ได้: {e}")
+        return RouteStore(ROUTE_STORE_DIR, max_bytes=ROUTE_STORE_MAX_MB * 1024 * 1024)
+    if migrated:
+        safe_print(f"📦 migrate route_cache.json → {ROUTE_STORE_DIR}/: {migrated:,} เส้นทาง")
+    return store
 
 def save_route_cache(cache_dict, force=False):
-    """บันทึก route cache ลงไฟล์ — เฉพาะเมื่อมีการเปลี่ยนแปลง (dirty counter)"""
+    """เขียน entry ใหม่ของ route store ลง shard (append) — เฉพาะเมื่อมีการเปลี่ยนแปลง (dirty counter)"""
     global _ROUTE_CACHE_DIRTY
     if not force and _ROUTE_CACHE_DIRTY == 0:
         return
+    if not isinstance(cache_dict, RouteStore):
+        return  # dict ในหน่วยความจำ (ปิด cache / backend จำลอง) ไม่บันทึก
     try:
-        with open(ROUTE_CACHE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(cache_dict, f, ensure_ascii=False, separators=(',', ':'))
+        cache_dict.flush()
         _ROUTE_CACHE_DIRTY = 0
     except Exception as e:
         safe_print(f"⚠️ ไม่สามารถบันทึก route cache: {e}")
 
-# โหลด cache ตอนเริ่มต้น
-if USE_CACHE:
-    DISTANCE_CACHE = load_distance_cache()
-    ROUTE_CACHE_DATA = load_route_cache()
+# โหลด cache ตอนเริ่มต้น (เรียกจาก PlannerContext ครั้งเดียวต่อ process)
+DISTANCE_CACHE = TrackedCache()
+ROUTE_CACHE_DATA = {}
+
+def load_cache_files():
+    """โหลด distance cache + route cache → (DISTANCE_CACHE, ROUTE_CACHE_DATA)"""
+    if not USE_CACHE:
+        return TrackedCache(), {}
+    distance_cache = TrackedCache(load_distance_cache())
+    route_cache = load_route_cache()
     
     # แยกประเภท cache
-    dc_distances = sum(1 for k in DISTANCE_CACHE.keys() if k.startswith('14.1') or k.startswith('14.2'))
-    branch_distances = len(DISTANCE_CACHE) - dc_distances
+    dc_distances = sum(1 for k in distance_cache.keys() if k.startswith('14.1') or k.startswith('14.2'))
+    branch_distances = len(distance_cache) - dc_distances
     
-    safe_print(f"✅ โหลด distance_cache.json: {len(DISTANCE_CACHE):,} รายการ")
+    safe_print(f"✅ โหลด {DISTANCE_CACHE_DB_FILE}: {len(distance_cache):,} รายการ")
     if dc_distances > 0 or branch_distances > 0:
         safe_print(f"   - DC→สาขา: ~{dc_distances:,} รายการ")
         safe_print(f"   - สาขา↔สาขา: ~{branch_distances:,} รายการ")
-    safe_print(f"✅ โหลด route_cache.json: {len(ROUTE_CACHE_DATA):,} เส้นทาง")
-else:
-    DISTANCE_CACHE = {}
-    ROUTE_CACHE_DATA = {}
+    safe_print(f"✅ เปิด {ROUTE_STORE_DIR}/: {len(route_cache):,} เส้นทาง (โหลดเมื่อใช้ ≤ {ROUTE_STORE_MAX_MB} MB)")
+    return distance_cache, route_cache
 
 # ==========================================
 # GOOGLE SHEETS SYNC FUNCTION
@@ -349,6 +394,10 @@ def sync_branch_data_from_sheets():
                     sh = gc.open_by_key('12DmIfECwVpsWfl8rl2r1A_LB4_5XMrmnmwlPUHKNU-o')
                     SHEETS_AVAILABLE = True
                     safe_print("✅ Reconnect Google Sheets สำเร็จ")
+                    # เก็บ client ใหม่ใน PlannerContext → rerun ถัดไปไม่ต้อง reconnect อีก
+                    _ctx = globals().get('PLANNER_CONTEXT')
+                    if _ctx is not None:
+                        _ctx.set_sheets(gc, sh, True)
                 finally:
                     _s2.setdefaulttimeout(_pt)
         except Exception as _re:
@@ -1453,6 +1502,9 @@ LOGISTICS_ZONES = {
     },
 }
 
+# 🗂️ index โซน compile ครั้งเดียว (get_logistics_zone / get_zone_priority / get_prov_zone / classify_zones)
+ZONE_INDEX = ZoneIndex(LOGISTICS_ZONES, PROVINCE_ZONE_MAP)
+
 # ==========================================
 # ZONE/REGION CONFIG - รหัสภาคและจังหวัด
 # ==========================================
@@ -1644,17 +1696,7 @@ def get_prov_zone(province: str, district: str = '') -> str:
     BKK  → BKK_{เขต}    |    จังหวัดอื่น → {ภาค}_{จังหวัด}
     ใช้เป็น primary key สำหรับจัดทริป ป้องกันกระโดดข้ามภาค/จังหวัด
     """
-    if not province:
-        return 'ไม่ระบุ'
-    prov = str(province).strip()
-    _alias = {'กรุงเทพฯ': 'กรุงเทพมหานคร', 'กทม': 'กรุงเทพมหานคร',
-              'กทม.': 'กรุงเทพมหานคร', 'โคราช': 'นครราชสีมา'}
-    prov = _alias.get(prov, prov)
-    rz = PROVINCE_ZONE_MAP.get(prov)
-    if rz == '__BKK__':
-        dist = str(district).strip() if district else ''
-        return f'BKK_{dist}' if dist else 'BKK_ไม่ระบุ'
-    return rz if rz else f'ไม่ระบุ_{prov}'
+    return ZONE_INDEX.province_zone(province, district)
 
 
 def classify_all_branch_zones(master_df=None):
@@ -1670,41 +1712,40 @@ def classify_all_branch_zones(master_df=None):
     if master_df is None or master_df.empty:
         return {}, {}
 
+    def _text(col):
+        values = master_df[col].tolist() if col in master_df.columns else [''] * len(master_df)
+        return pd.Series([str(v or '').strip() for v in values], index=master_df.index, dtype=object)
+
+    codes = _text('Plan Code').str.upper()
+
+    # ──── กรุงเทพมหานคร: แบ่ง sub-zone / จังหวัดอื่น: ใช้ LOGISTICS_ZONES (classify_zones) ────
+    _prov_alias = {'กรุงเทพฯ': 'กรุงเทพมหานคร', 'กทม': 'กรุงเทพมหานคร', 'กทม.': 'กรุงเทพมหานคร'}
+    provinces = _text('จังหวัด').map(lambda p: _prov_alias.get(p, p))
+    zones = classify_zones(provinces, _text('อำเภอ'), _text('ตำบล'))
+    is_bkk = (provinces == 'กรุงเทพมหานคร').to_numpy()
+    for i in np.nonzero(is_bkk)[0]:
+        row = master_df.iloc[i]
+        lat_val = row.get('ละติจูด', 0) or 0
+        lon_val = row.get('ลองติจูด', 0) or 0
+        try:
+            lat_val = float(lat_val)
+            lon_val = float(lon_val)
+        except (ValueError, TypeError):
+            lat_val = lon_val = 0
+        zones[i] = get_bkk_sub_zone(lat_val, lon_val)
+
     branch_zone_map = {}
     zone_summary = {}
-
-    for _, row in master_df.iterrows():
-        code = str(row.get('Plan Code', '')).strip().upper()
+    for code, zone, prov in zip(codes.tolist(), zones.tolist(), provinces.tolist()):
         if not code:
             continue
-
-        province = str(row.get('จังหวัด', '') or '').strip()
-        district  = str(row.get('อำเภอ', '')  or '').strip()
-        subdistrict = str(row.get('ตำบล', '') or '').strip()
-
-        # ──── กรุงเทพมหานคร: แบ่ง sub-zone ────
-        _prov_alias = {'กรุงเทพฯ': 'กรุงเทพมหานคร', 'กทม': 'กรุงเทพมหานคร', 'กทม.': 'กรุงเทพมหานคร'}
-        _prov_clean = _prov_alias.get(province, province)
-        if _prov_clean == 'กรุงเทพมหานคร':
-            lat_val = row.get('ละติจูด', 0) or 0
-            lon_val = row.get('ลองติจูด', 0) or 0
-            try:
-                lat_val = float(lat_val)
-                lon_val = float(lon_val)
-            except (ValueError, TypeError):
-                lat_val = lon_val = 0
-            zone = get_bkk_sub_zone(lat_val, lon_val)
-        else:
-            # ──── จังหวัดอื่น: ใช้ LOGISTICS_ZONES ────
-            zone = get_logistics_zone(_prov_clean, district, subdistrict)
-            if not zone:
-                zone = f'UNCLASSIFIED_{_prov_clean}' if _prov_clean else 'UNCLASSIFIED'
-
+        if not zone:
+            zone = f'UNCLASSIFIED_{prov}' if prov else 'UNCLASSIFIED'
         branch_zone_map[code] = zone
 
         # สะสมสถิติ
         if zone not in zone_summary:
-            zone_summary[zone] = {'count': 0, 'branches': [], 'province': _prov_clean}
+            zone_summary[zone] = {'count': 0, 'branches': [], 'province': prov}
         zone_summary[zone]['count'] += 1
         zone_summary[zone]['branches'].append(code)
 
@@ -1995,73 +2036,23 @@ def get_logistics_zone(province, district='', subdistrict=''):
     """
     หาโซนโลจิสติกส์จาก จังหวัด/อำเภอ/ตำบล
     
-    หลักการ: ใช้โซนหลัก (ระดับจังหวัด) ก่อน แล้วค่อยใช้โซนย่อย (ระดับอำเภอ/ตำบล)
+    หลักการ: ใช้โซนย่อย (ระดับอำเภอ/ตำบล) ถ้าตรง ไม่งั้นใช้โซนหลัก (ระดับจังหวัด, priority น้อยสุด)
+    lookup จาก ZONE_INDEX (compile ครั้งเดียว) แทนการวนทุกโซนทุกครั้ง
     
     Returns:
         zone_name (str): เช่น 'ZONE_A_พะเยา', 'ZONE_NEARBY_กทม', None ถ้าไม่พบ
     """
-    if not province or str(province).strip() == '':
-        return None
-    
-    province = str(province).strip()
-    district = str(district).strip() if district else ''
-    subdistrict = str(subdistrict).strip() if subdistrict else ''
-    
-    # 🎯 หลักการ: ใช้โซนหลักก่อน (ไม่มี districts/subdistricts กำหนด)
-    # แล้วค่อยไล่ลงไปโซนย่อย (มี districts/subdistricts กำหนด)
-    
-    main_zones = []  # โซนหลัก (ระดับจังหวัด)
-    sub_zones = []   # โซนย่อย (ระดับอำเภอ/ตำบล)
-    
-    # แยกโซนเป็นหลัก/ย่อย
-    for zone_name, zone_info in LOGISTICS_ZONES.items():
-        if province in zone_info['provinces']:
-            # ถ้าไม่มี districts กำหนด = โซนหลัก
-            if 'districts' not in zone_info or not zone_info['districts']:
-                main_zones.append((zone_name, zone_info))
-            else:
-                # มี districts กำหนด = โซนย่อย
-                sub_zones.append((zone_name, zone_info))
-    
-    # 1️⃣ ลองหาโซนย่อยก่อน (ถ้ามีอำเภอระบุมา)
-    if district:
-        for zone_name, zone_info in sub_zones:
-            if district in zone_info['districts']:
-                # ถ้ามี subdistricts กำหนดด้วย → เช็คให้แม่นยำยิ่งขึ้น
-                if 'subdistricts' in zone_info and zone_info['subdistricts']:
-                    if subdistrict and subdistrict in zone_info['subdistricts']:
-                        return zone_name
-                else:
-                    # ไม่มี subdistricts กำหนด → return โซนย่อยนี้
-                    return zone_name
-    
-    # 2️⃣ ถ้าไม่เจอโซนย่อย → ใช้โซนหลัก
-    if main_zones:
-        # เลือกโซนแรกที่เจอ (เรียงตาม priority)
-        main_zones_sorted = sorted(main_zones, key=lambda x: x[1].get('priority', 999))
-        return main_zones_sorted[0][0]
-    
-    return None
+    return ZONE_INDEX.logistics_zone(province, district, subdistrict)
 
 def get_zone_priority(zone_name):
     """
     ดึงค่า Priority ของโซน (สำหรับ LIFO: ไกลส่งก่อน ใกล้ส่งทีหลัง)
+    LOGISTICS_ZONES format (ZONE_A_พะเยา) หรือ zone_viewer format (เหนือ_จังหวัด_อำเภอ / BKK_เขต)
     
     Returns:
         int: 1-99 (1 = ไกลสุด, 99 = ใกล้สุด)
     """
-    if not zone_name:
-        return 999
-    # LOGISTICS_ZONES format (ZONE_A_พะเยา)
-    if zone_name in LOGISTICS_ZONES:
-        return LOGISTICS_ZONES[zone_name]['priority']
-    # zone_viewer format (เหนือ_จังหวัด_อำเภอ / BKK_เขต)
-    _ZV_PRIORITY = {
-        'เหนือ': 5, 'อีสาน': 12, 'ใต้': 20, 'ตะวันออก': 16,
-        'ตะวันตก': 18, 'ปริมณฑล': 80, 'BKK': 90,
-    }
-    prefix = zone_name.split('_')[0] if '_' in zone_name else zone_name
-    return _ZV_PRIORITY.get(prefix, 50)
+    return ZONE_INDEX.priority(zone_name)
 
 def get_zone_highway(zone_name):
     """
@@ -2070,17 +2061,23 @@ def get_zone_highway(zone_name):
     Returns:
         str: เช่น 'สาย 1 (พหลโยธิน)', 'สาย 2 (มิตรภาพ)'
     """
-    if not zone_name:
-        return ''
-    if zone_name in LOGISTICS_ZONES:
-        return LOGISTICS_ZONES[zone_name].get('highway', '')
-    # zone_viewer format — derive highway from zone prefix
-    _ZV_HW = {
-        'เหนือ': '1/11', 'อีสาน': '2/24', 'ใต้': '4',
-        'ตะวันออก': '3', 'ตะวันตก': '32/4', 'ปริมณฑล': '',
-    }
-    prefix = zone_name.split('_')[0] if '_' in zone_name else zone_name
-    return _ZV_HW.get(prefix, '')
+    return ZONE_INDEX.highway(zone_name)
+
+def classify_zones(provinces, districts=None, subdistricts=None, codes=None, scheme='logistics'):
+    """
+    โซนของหลายแถวพร้อมกัน (คอลัมน์/array) ผ่าน ZONE_INDEX
+    scheme: 'logistics' = LOGISTICS_ZONES | 'province' = get_prov_zone | 'viewer' = โซนระดับอำเภอแบบ zone_viewer
+    codes: ถ้าส่งมา → ใช้โซนจาก BRANCH_ZONES_CACHE (branch_zones.json) ก่อน
+    คืน ndarray (object)
+    """
+    zones = ZONE_INDEX.classify(provinces, districts, subdistricts, scheme=scheme)
+    if codes is not None and BRANCH_ZONES_CACHE:
+        for i, code in enumerate(codes):
+            code = str(code).strip().upper()
+            z = BRANCH_ZONES_CACHE.get(code) if code else None
+            if z:
+                zones[i] = z
+    return zones
 
 def can_combine_zones_by_highway(zone1, zone2):
     """
@@ -2335,8 +2332,7 @@ def load_master_data():
         safe_print(f"❌ Error loading MASTER_DATA: {e}")
         return pd.DataFrame()
 
-# โหลด Master Data จาก Google Sheets
-MASTER_DATA = load_master_data()
+# โหลด Master Data จาก Google Sheets → MASTER_DATA (สร้างใน PlannerContext)
 
 # ──────────────────────────────────────────────────────────────────
 # 🔑 MASTER_DATA_DICT  — Plan Code (upper) เป็น PK → O(1) lookup
@@ -2374,7 +2370,8 @@ def _build_master_dict(md: 'pd.DataFrame') -> dict:
     safe_print(f"🔑 MASTER_DATA_DICT: {len(result)} สาขา (PK=Plan Code) | truck col='{found_truck_col}'")
     return result
 
-MASTER_DATA_DICT: dict = _build_master_dict(MASTER_DATA)
+# MASTER_DATA_DICT: dict = _build_master_dict(MASTER_DATA)  (สร้างใน PlannerContext)
+# BRANCH_RESOLVER: BranchResolver = alias (ตัด prefix / Z / WMS) → Plan Code  (สร้างใน PlannerContext)
 
 # ══════════════════════════════════════════════════════════════════════════════
 # 🗺️ BRANCH_ZONES_CACHE — โหลดจาก branch_zones.json ที่ zone_viewer.py สร้าง
@@ -2395,7 +2392,7 @@ def _load_branch_zones() -> dict:
         safe_print(f"⚠️ โหลด branch_zones.json ล้มเหลว: {e}")
         return {}
 
-BRANCH_ZONES_CACHE: dict = _load_branch_zones()
+# BRANCH_ZONES_CACHE: dict = _load_branch_zones()  (สร้างใน PlannerContext)
 
 # ==========================================
 # 🔄 BRANCH GROUPING (จุดส่งเดียวกัน ≤200 เมตร)
@@ -2423,8 +2420,7 @@ def load_branch_groups():
         safe_print(f"⚠️ โหลด branch_groups.json ไม่สำเร็จ: {e}")
         return {}, {}
 
-# โหลด branch groups
-BRANCH_GROUPS, BRANCH_TO_GROUP = load_branch_groups()
+# โหลด branch groups → BRANCH_GROUPS, BRANCH_TO_GROUP (สร้างใน PlannerContext)
 
 def get_group_branches(code: str) -> list:
     """
@@ -2482,8 +2478,26 @@ def load_branch_clusters():
         safe_print(f"⚠️ โหลด branch_clusters.json ไม่สำเร็จ: {e}")
         return {}, {}, {}
 
-# โหลด branch clusters
-BRANCH_INFO, NEARBY_BRANCHES, BRANCH_CLUSTERS = load_branch_clusters()
+# โหลด branch clusters → BRANCH_INFO, NEARBY_BRANCHES, BRANCH_CLUSTERS (สร้างใน PlannerContext)
+
+# ==========================================
+# 📐 DISTANCE STORE — ระยะทางแบบ integer index (แทน string key ใน hot-path)
+# ==========================================
+def build_distance_store():
+    """
+    สร้าง DistanceStore จาก BRANCH_INFO + DISTANCE_CACHE + ระยะ pre-computed ใน NEARBY_BRANCHES
+    parse key ของ distance_cache.json ครั้งเดียว → planner ใช้ id แทน string key
+    """
+    store = DistanceStore()
+    for code, info in BRANCH_INFO.items():
+        if info.get('lat') and info.get('lon'):
+            store.add_point(info['lat'], info['lon'], code)
+    _n_cache = store.ingest_cache(DISTANCE_CACHE) if USE_CACHE else 0
+    _n_near = store.ingest_nearby(NEARBY_BRANCHES)
+    if _n_cache or _n_near:
+        safe_print(f"📐 Distance store: {len(store):,} จุด, cache {_n_cache:,} + nearby {_n_near:,} คู่")
+    return store
+
 
 # ==========================================
 # �️ PRE-SEED DISTANCE CACHE จาก branch_clusters.json
@@ -2502,74 +2516,46 @@ def _preseed_distance_cache_from_clusters():
     import threading
     import time as _time
 
+    _dc_id = DISTANCE_STORE.add_point(DC_WANG_NOI_LAT, DC_WANG_NOI_LON)
+    _dc_key = f"{DC_WANG_NOI_LAT:.4f},{DC_WANG_NOI_LON:.4f}"
+
     def _run():
         global _DIST_CACHE_DIRTY
         _injected = 0
-        _to_fetch: list = []  # [(key, lat1, lon1, lat2, lon2)]
+        _store = DISTANCE_STORE
 
         for code, nearby_list in NEARBY_BRANCHES.items():
-            code_up = str(code).strip().upper()
-            info1 = BRANCH_INFO.get(code_up, {})
-            lat1 = info1.get('lat', 0)
-            lon1 = info1.get('lon', 0)
-            if not lat1 or not lon1:
+            i = _store.index.get(str(code).strip().upper())
+            if i is None:
                 continue
             for item in nearby_list:
                 if isinstance(item, dict):
                     nb_code = str(item.get('code', '')).strip().upper()
-                    pre_dist = item.get('distance', None)
                 else:
                     nb_code = str(item).strip().upper()
-                    pre_dist = None
-                if not nb_code:
-                    continue
-                info2 = BRANCH_INFO.get(nb_code, {})
-                lat2 = info2.get('lat', 0)
-                lon2 = info2.get('lon', 0)
-                if not lat2 or not lon2:
+                j = _store.index.get(nb_code)
+                if j is None:
                     continue
-                ck  = f"{lat1:.4f},{lon1:.4f}_{lat2:.4f},{lon2:.4f}"
-                ckr = f"{lat2:.4f},{lon2:.4f}_{lat1:.4f},{lon1:.4f}"
+                ck  = f"{_store.point_key(i)}_{_store.point_key(j)}"
+                ckr = f"{_store.point_key(j)}_{_store.point_key(i)}"
                 if ck in DISTANCE_CACHE or ckr in DISTANCE_CACHE:
                     continue  # มีแล้ว
-                if pre_dist and pre_dist > 0:
-                    # inject จาก pre-computed ทันที
-                    DISTANCE_CACHE[ck] = round(pre_dist, 2)
-                    _DIST_CACHE_DIRTY += 1
-                    _injected += 1
-                else:
-                    # ไม่มี pre_dist → inject haversine×1.35 ทันที (ไม่เรียก OSRM)
-                    from math import radians, sin, cos, sqrt, atan2
-                    R = 6371.0
-                    phi1, phi2 = radians(lat1), radians(lat2)
-                    dphi = radians(lat2 - lat1)
-                    dlambda = radians(lon2 - lon1)
-                    a = sin(dphi/2)**2 + cos(phi1)*cos(phi2)*sin(dlambda/2)**2
-                    hav_dist = round(R * 2 * atan2(sqrt(a), sqrt(1-a)) * 1.35, 2)
-                    DISTANCE_CACHE[ck] = hav_dist
-                    _DIST_CACHE_DIRTY += 1
-                    _injected += 1
-
-        # inject DC → ทุกสาขาใน BRANCH_INFO (haversine×1.35, zero-network)
+                # ระยะ pre-computed อยู่ใน store แล้ว (ingest_nearby) — ไม่มี → haversine×1.35 (ไม่เรียก OSRM)
+                DISTANCE_CACHE[ck] = _store.distance(i, j)
+                _DIST_CACHE_DIRTY += 1
+                _injected += 1
+
+        # inject DC → ทุกสาขาใน BRANCH_INFO (haversine×1.35, zero-network) — คำนวณทั้งแถวครั้งเดียว
         _dc_injected = 0
-        _dc_lat = DC_WANG_NOI_LAT
-        _dc_lon = DC_WANG_NOI_LON
-        from math import radians as _r, sin as _s, cos as _c, sqrt as _sq, atan2 as _at
-        for _bc_code, _bc_info in BRANCH_INFO.items():
-            _blat = _bc_info.get('lat', 0)
-            _blon = _bc_info.get('lon', 0)
-            if not _blat or not _blon:
-                continue
-            _ck_dc  = f"{_dc_lat:.4f},{_dc_lon:.4f}_{_blat:.4f},{_blon:.4f}"
-            _ck_dcr = f"{_blat:.4f},{_blon:.4f}_{_dc_lat:.4f},{_dc_lon:.4f}"
+        _ids = sorted({_store.index[c] for c in (str(k).strip().upper() for k in BRANCH_INFO) if c in _store.index})
+        _dc_row = _store.distances(_dc_id, _ids) if _ids else []
+        for _bid, _bd in zip(_ids, _dc_row):
+            _bkey = _store.point_key(_bid)
+            _ck_dc  = f"{_dc_key}_{_bkey}"
+            _ck_dcr = f"{_bkey}_{_dc_key}"
             if _ck_dc in DISTANCE_CACHE or _ck_dcr in DISTANCE_CACHE:
                 continue
-            _phi1, _phi2 = _r(_dc_lat), _r(_blat)
-            _dphi = _r(_blat - _dc_lat)
-            _dlam = _r(_blon - _dc_lon)
-            _a = _s(_dphi/2)**2 + _c(_phi1)*_c(_phi2)*_s(_dlam/2)**2
-            _hav = round(6371.0 * 2 * _at(_sq(_a), _sq(1-_a)) * 1.35, 2)
-            DISTANCE_CACHE[_ck_dc] = _hav
+            DISTANCE_CACHE[_ck_dc] = float(_bd)
             _DIST_CACHE_DIRTY += 1
             _dc_injected += 1
 
@@ -2581,7 +2567,6 @@ def _preseed_distance_cache_from_clusters():
     t = threading.Thread(target=_run, daemon=True, name="preseed-cache")
     t.start()
 
-_preseed_distance_cache_from_clusters()
 
 # ==========================================
 # �🚀 PRE-COMPUTE: Distance Matrix & Nearby Branches
@@ -2630,18 +2615,11 @@ def precompute_branch_distances(master_df):
                         # ใช้ค่า pre-computed จาก branch_clusters.json (OSRM road dist)
                         dist = pre_dist
                     else:
-                        # Inline: ตรวจ DISTANCE_CACHE ก่อน → fallback haversine × 1.35
-                        _ck  = f"{lat1:.4f},{lon1:.4f}_{lat2:.4f},{lon2:.4f}"
-                        _ckr = f"{lat2:.4f},{lon2:.4f}_{lat1:.4f},{lon1:.4f}"
-                        if USE_CACHE and _ck in DISTANCE_CACHE:
-                            dist = DISTANCE_CACHE[_ck]
-                        elif USE_CACHE and _ckr in DISTANCE_CACHE:
-                            dist = DISTANCE_CACHE[_ckr]
-                        else:
-                            from math import radians, sin, cos, sqrt, atan2
-                            _phi1, _phi2 = radians(lat1), radians(lat2)
-                            _a = sin((radians(lat2-lat1))/2)**2 + cos(_phi1)*cos(_phi2)*sin((radians(lon2-lon1))/2)**2
-                            dist = round(6371.0 * 2 * atan2(sqrt(_a), sqrt(1-_a)) * 1.35, 2)
+                        # DISTANCE_STORE (ระยะถนนจาก cache ด้วย id) → fallback haversine × 1.35
+                        _i = DISTANCE_STORE.point_id(lat1, lon1)
+                        _j = DISTANCE_STORE.point_id(lat2, lon2)
+                        _road = DISTANCE_STORE.road(_i, _j) if _i is not None and _j is not None else None
+                        dist = _road if _road is not None else road_haversine(lat1, lon1, lat2, lon2)
                     nearby_with_dist.append((nearby_code, round(dist, 2)))
             nearby_dict[code_upper] = sorted(nearby_with_dist, key=lambda x: x[1])
         
@@ -2696,8 +2674,215 @@ def precompute_branch_distances(master_df):
     
     return branch_coords, nearby_branches, same_area_branches
 
-# Pre-compute distances
-BRANCH_COORDS, NEARBY_BRANCHES, SAME_AREA_BRANCHES = precompute_branch_distances(MASTER_DATA)
+# ==========================================
+# 🧠 PLANNER CONTEXT — ข้อมูลระดับ process สร้างครั้งเดียว (st.cache_resource)
+# Streamlit รัน app.py ใหม่ทุก interaction → เดิมโหลด cache/master/index/Sheets ใหม่ทุกครั้ง
+# ตอนนี้ rerun แค่ผูกค่าจาก context เข้า globals (มิลลิวินาที)
+# ==========================================
+MASTER_DATA_TTL_SEC = 300   # โหลด MASTER_DATA ใหม่ทุก 5 นาที (เท่ากับ ttl เดิมของ load_master_data)
+
+class PlannerContext:
+    """
+    master data + index + cache + Google Sheets client ของทั้ง process
+
+    - build()          โหลดทุกอย่าง (ลำดับเดียวกับการโหลดระดับ module เดิม)
+    - refresh_master() โหลด MASTER_DATA ใหม่ + index ที่ขึ้นกับมัน (ตาม TTL — ทำใน thread เบื้องหลัง)
+    - invalidate()     ให้ rebuild ทั้งหมดตอน ensure_fresh() ครั้งถัดไป (ปุ่มซิงค์ข้อมูล)
+    - bind(namespace)  ผูกค่าเข้า globals ของ app.py — ฟังก์ชันเดิมอ่าน global ได้เหมือนเดิม
+    """
+
+    def __init__(self):
+        import threading
+        self._lock = threading.RLock()
+        self.values: dict = {}
+        self.built_at = 0.0
+        self.master_loaded_at = 0.0
+        self._stale = True
+        self._refreshing = False
+        self._pinned = False
+        self.versions: dict = {}
+
+    def _set(self, **kw):
+        # เขียนทั้ง context และ globals ของ module ที่สร้าง context (ฟังก์ชันที่โหลดขั้นถัดไปอ่านได้ทันที)
+        self.values.update(kw)
+        globals().update(kw)
+
+    def set_sheets(self, gc_client, sheet, available):
+        self._set(gc=gc_client, sh=sheet, SHEETS_AVAILABLE=available)
+
+    def _capture_sheets(self):
+        # sync_branch_data_from_sheets อาจ reconnect แล้วเปลี่ยน global gc/sh
+        self.values.update(gc=gc, sh=sh, SHEETS_AVAILABLE=SHEETS_AVAILABLE)
+
+    def build(self):
+        with self._lock:
+            _t0 = time_module.time()
+            self.set_sheets(*connect_google_sheets())
+            _dist, _route = load_cache_files()
+            self._set(DISTANCE_CACHE=_dist, ROUTE_CACHE_DATA=_route)
+            self._load_master()
+            self._set(BRANCH_ZONES_CACHE=_load_branch_zones())
+            _groups, _b2g = load_branch_groups()
+            self._set(BRANCH_GROUPS=_groups, BRANCH_TO_GROUP=_b2g)
+            _info, _nearby, _clusters = load_branch_clusters()
+            self._set(BRANCH_INFO=_info, NEARBY_BRANCHES=_nearby, BRANCH_CLUSTERS=_clusters)
+            self._set(DISTANCE_STORE=build_distance_store())
+            _preseed_distance_cache_from_clusters()
+            self._build_branch_index()
+            self.versions = self._content_versions()
+            self.built_at = time_module.time()
+            self._stale = False
+            safe_print(f"🧠 PlannerContext พร้อมใช้งาน ({self.built_at - _t0:.1f}s)")
+
+    def _load_master(self):
+        _md = load_master_data()
+        self._capture_sheets()
+        _md_dict = _build_master_dict(_md)
+        self._set(MASTER_DATA=_md, MASTER_DATA_DICT=_md_dict, BRANCH_RESOLVER=BranchResolver.from_master(_md, _md_dict))
+        self.master_loaded_at = time_module.time()
+
+    def _build_branch_index(self):
+        # Pre-compute distances (NEARBY_BRANCHES ถูกแทนด้วยรูปแบบ [(code, dist)])
+        _coords, _nearby, _same = precompute_branch_distances(self.values['MASTER_DATA'])
+        self._set(BRANCH_COORDS=_coords, NEARBY_BRANCHES=_nearby, SAME_AREA_BRANCHES=_same)
+
+    def refresh_master(self):
+        """โหลด MASTER_DATA + index ใหม่นอก lock แล้วสลับเข้า context ทีเดียว (request อื่นเห็นชุดเก่าหรือชุดใหม่ครบชุด)"""
+        _started = time_module.time()
+        _md = load_master_data()
+        _md_dict = _build_master_dict(_md)
+        _resolver = BranchResolver.from_master(_md, _md_dict)
+        _coords, _nearby, _same = precompute_branch_distances(_md)
+        _master_version = content_version(_md)
+        with self._lock:
+            if self._stale or self.master_loaded_at > _started:
+                return  # ระหว่างโหลดมี build()/refresh ที่ใหม่กว่าแล้ว
+            self._capture_sheets()
+            self._set(MASTER_DATA=_md, MASTER_DATA_DICT=_md_dict, BRANCH_RESOLVER=_resolver,
+                      BRANCH_COORDS=_coords, NEARBY_BRANCHES=_nearby, SAME_AREA_BRANCHES=_same)
+            self.versions = dict(self.versions, master=_master_version)
+            self.master_loaded_at = time_module.time()
+
+    def _content_versions(self):
+        # hash ครั้งเดียวต่อการโหลด (ไม่ใช่ทุกครั้งที่กดจัดทริป)
+        return {
+            'master': content_version(self.values['MASTER_DATA']),
+            'zones': content_version(self.values['BRANCH_ZONES_CACHE']),
+            'groups': content_version(self.values['BRANCH_GROUPS']),
+            'clusters': content_version(self.values['BRANCH_CLUSTERS']),
+        }
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh_master()
+        except Exception as e:
+            safe_print(f"⚠️ refresh master data ไม่สำเร็จ (ใช้ชุดเดิมต่อ): {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def invalidate(self):
+        with self._lock:
+            self._stale = True
+
+    def ensure_fresh(self):
+        """
+        - stale → build ใน request นี้ (ต้องมีข้อมูลก่อนใช้) — เช็คซ้ำภายใต้ lock กันหลาย session build พร้อมกัน
+        - หมด TTL → refresh ใน thread เบื้องหลัง (ทีละตัว) request นี้ใช้ชุดเดิมไปก่อน
+        """
+        if self._stale:
+            with self._lock:
+                if self._stale:
+                    self.build()
+            return
+        if self._pinned:
+            return
+        if time_module.time() - self.master_loaded_at <= MASTER_DATA_TTL_SEC:
+            return
+        with self._lock:
+            if self._refreshing or time_module.time() - self.master_loaded_at <= MASTER_DATA_TTL_SEC:
+                return
+            self._refreshing = True
+        import threading
+        threading.Thread(target=self._refresh_in_background, daemon=True, name="planner-context-refresh").start()
+
+    def bind(self, namespace: dict):
+        namespace.update(self.values)
+
+    # ค่าที่ส่งข้าม process ไม่ได้/ไม่ควรส่ง (client Google Sheets, cache ที่มี lock)
+    _LOCAL_ONLY = ('gc', 'sh', 'SHEETS_AVAILABLE', 'DISTANCE_CACHE', 'ROUTE_CACHE_DATA')
+
+    def snapshot(self):
+        """(values, versions) ที่ pickle ได้ → ส่งให้ worker ของ parallel_planner ผ่าน pool initializer"""
+        with self._lock:
+            values = {k: v for k, v in self.values.items() if k not in self._LOCAL_ONLY}
+            _dist = self.values.get('DISTANCE_CACHE')
+            if _dist is not None:
+                with _dist.lock:
+                    values['DISTANCE_CACHE'] = dict(_dist)
+            return values, dict(self.versions)
+
+    def adopt(self, values, versions):
+        """ใช้ snapshot จาก process หลักแทน build() (worker ไม่ต่อ Google Sheets / ไม่โหลด master ซ้ำ)"""
+        with self._lock:
+            self._set(**dict(values, gc=None, sh=None, SHEETS_AVAILABLE=False,
+                             DISTANCE_CACHE=TrackedCache(values.get('DISTANCE_CACHE', {})),
+                             ROUTE_CACHE_DATA=load_route_cache() if USE_CACHE else {}))
+            self.versions = dict(versions)
+            self.built_at = self.master_loaded_at = time_module.time()
+            self._stale = False
+            self._pinned = True   # ensure_fresh() ไม่ refresh ตาม TTL (worker อายุสั้น ใช้ชุดเดียวกับ process หลัก)
+
+
+@st.cache_resource(show_spinner=False)
+def get_planner_context() -> PlannerContext:
+    """PlannerContext เดียวต่อ process (ใช้ร่วมกันทุก session / ทุก rerun)"""
+    return PlannerContext()
+
+PLANNER_CONTEXT = get_planner_context()
+_WORKER_CONTEXT = worker_context()
+if _WORKER_CONTEXT is not None and not PLANNER_CONTEXT.values:
+    PLANNER_CONTEXT.adopt(*_WORKER_CONTEXT)   # worker ของ plan_parallel: ใช้ข้อมูลจาก process หลัก
+PLANNER_CONTEXT.ensure_fresh()
+PLANNER_CONTEXT.bind(globals())
+
+
+@st.cache_resource(show_spinner=False)
+def get_plan_cache() -> PlanCache:
+    """plan cache เดียวต่อ process (memory LRU + plan_cache/ บน disk)"""
+    return PlanCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plan_cache'))
+
+# โค้ดที่มีผลต่อผลจัดทริป → เปลี่ยนโค้ด = ไม่ใช้ผลใน plan cache เดิม
+PLANNER_CODE_FILES = tuple(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), _f)
+    for _f in ('app.py', 'trip_state.py', 'spatial_index.py', 'distance_store.py', 'parallel_planner.py',
+               'zone_index.py', 'branch_resolver.py', 'local_search.py', 'ortools_vrp.py',
+               'solver_portfolio.py', 'fleet_cost.py', 'plan_update.py')
+)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _planner_code_version(stamps) -> str:
+    """hash ของไฟล์โค้ด planner — คำนวณใหม่เฉพาะเมื่อ stamps (ขนาด/mtime ของไฟล์) เปลี่ยน"""
+    return file_version(*PLANNER_CODE_FILES)
+
+def planner_code_version() -> str:
+    """version ของโค้ด planner (ตอนสร้าง plan cache key) — os.stat 12 ไฟล์แทนการ hash ทุกครั้ง"""
+    stamps = []
+    for path in PLANNER_CODE_FILES:
+        try:
+            _stat = os.stat(path)
+            stamps.append((path, _stat.st_size, _stat.st_mtime_ns))
+        except OSError:
+            stamps.append((path, None, None))
+    return _planner_code_version(tuple(stamps))
+
+def plan_data_versions():
+    """
+    version ของ master data / zone / group / โค้ด สำหรับ plan_cache_key
+    ไม่รวม distance cache — Step 7 / preseed เติมระยะ OSRM ลง cache ทุกครั้งที่จัด (version เปลี่ยนเอง)
+    → กดจัดเที่ยวซ้ำกับไฟล์เดิมต้องได้ผลจาก plan cache
+    """
+    return {'code': planner_code_version(), **PLANNER_CONTEXT.versions}
 
 # ==========================================
 # CLEAN NAME FUNCTION (สำหรับทำ Join_Key)
@@ -2747,38 +2932,15 @@ def normalize(val):
 
 def get_max_vehicle_for_branch(branch_code, test_df=None, debug=False):
     """ดึงรถใหญ่สุดที่สาขานี้รองรับ
-    ใช้ MASTER_DATA_DICT (PK=Plan Code) เพื่อ O(1) lookup
+    ใช้ MASTER_DATA_DICT (PK=Plan Code) + BRANCH_RESOLVER เพื่อ O(1) lookup
     """
     branch_code_str = str(branch_code).strip().upper()
 
-    # ── 1. Fast path: ค้นจาก MASTER_DATA_DICT โดยตรง ──
+    # ── 1. Fast path: Plan Code ตรงตัว / alias (ตัด prefix, Z, WMS) จาก BRANCH_RESOLVER ──
     if MASTER_DATA_DICT:
-        entry = MASTER_DATA_DICT.get(branch_code_str)
-
-        # ── 2. ถ้าไม่พบ ลอง prefix-strip fallback ──
-        if entry is None:
-            prefixes = ['PUN-', 'MAX-', 'MM-', 'PT-']
-            code_clean = branch_code_str
-            for p in prefixes:
-                if code_clean.startswith(p):
-                    code_clean = code_clean[len(p):]
-                    break
-            if code_clean != branch_code_str:
-                entry = MASTER_DATA_DICT.get(code_clean)
-            # ลอง match แบบ strip prefix จากฝั่ง master
-            if entry is None:
-                for mk, mv in MASTER_DATA_DICT.items():
-                    mk_clean = mk
-                    for p in prefixes:
-                        if mk_clean.startswith(p):
-                            mk_clean = mk_clean[len(p):]
-                            break
-                    if mk_clean == code_clean:
-                        entry = mv
-                        break
-
-        if entry is not None:
-            return entry['max_truck']   # '4W' / 'JB' / '6W'
+        key = BRANCH_RESOLVER.resolve(branch_code_str)
+        if key is not None:
+            return MASTER_DATA_DICT[key]['max_truck']   # '4W' / 'JB' / '6W'
 
     # ── 3. Legacy fallback: scan DataFrame (ถ้า dict ยังไม่ build) ──
     if not MASTER_DATA.empty and 'Plan Code' in MASTER_DATA.columns:
@@ -2804,6 +2966,15 @@ def get_max_vehicle_for_branch(branch_code, test_df=None, debug=False):
     # Default: ไม่มีข้อจำกัด = ใช้รถใหญ่ได้
     return '6W'
 
+def get_max_vehicles(codes, wms=None):
+    """get_max_vehicle_for_branch แบบ batch (Series/list ของรหัส) → list '4W'/'JB'/'6W'"""
+    codes = list(codes)
+    if not MASTER_DATA_DICT:
+        return [get_max_vehicle_for_branch(c) for c in codes]
+    keys = BRANCH_RESOLVER.resolve_codes(codes, wms).tolist()
+    return [MASTER_DATA_DICT[k]['max_truck'] if k is not None else get_max_vehicle_for_branch(c)
+            for c, k in zip(codes, keys)]
+
 def get_max_vehicle_for_trip(trip_codes):
     """
     หารถใหญ่สุดที่ทริปนี้ใช้ได้ (เช็คข้อจำกัดของทุกสาขาในทริป)
@@ -2829,110 +3000,106 @@ def get_max_vehicle_for_trip(trip_codes):
     
     return max_allowed
 
+def _route_cache_for(backend):
+    """cache เส้นทางของ backend: ของจริง → ROUTE_CACHE_DATA (บันทึกไฟล์) | จำลอง → ในหน่วยความจำของ backend"""
+    return backend.route_cache if backend.simulated else ROUTE_CACHE_DATA
+
+
+def _note_route_legs(backend, stored):
+    """นับช่วงใหม่เข้า dirty counter → save ตาม batch (backend จำลองไม่บันทึก)"""
+    global _ROUTE_CACHE_DIRTY
+    if not stored or backend.simulated:
+        return
+    _ROUTE_CACHE_DIRTY += stored
+    if _ROUTE_CACHE_DIRTY >= _ROUTE_CACHE_SAVE_BATCH:
+        save_route_cache(ROUTE_CACHE_DATA)
+
+
 def get_route_osrm(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, max_retries=1):
     """
     ขอเส้นทางจริงจาก OSRM API (วิ่งตามถนน)
-    ตรวจ ROUTE_CACHE_DATA ก่อนเสมอ — เรียก API เฉพาะตอนที่ยังไม่เคย cache ไว้
+    ตรวจ cache ระดับช่วง (leg) ก่อนเสมอ — เรียก API เฉพาะตอนที่ยังไม่เคย cache ไว้
     """
     if not FOLIUM_AVAILABLE:
         return [[pickup_lat, pickup_lon], [dropoff_lat, dropoff_lon]]
+    waypoints = [[pickup_lat, pickup_lon], [dropoff_lat, dropoff_lon]]
+    if not USE_CACHE:
+        routed = get_routing_backend().route(waypoints, timeout=4, retries=max_retries - 1)
+        return routed[0] if routed else waypoints
 
-    # ตรวจ cache ก่อน
-    cache_key = f"{pickup_lat:.4f},{pickup_lon:.4f}|{dropoff_lat:.4f},{dropoff_lon:.4f}"
-    if USE_CACHE and cache_key in ROUTE_CACHE_DATA:
-        cached = ROUTE_CACHE_DATA[cache_key]
-        if isinstance(cached, dict):
-            return cached.get('coords', [[pickup_lat, pickup_lon], [dropoff_lat, dropoff_lon]])
-        return cached  # backward compat (list)
-
-    # OSRM Public Server (lon, lat format!)
-    loc = f"{pickup_lon},{pickup_lat};{dropoff_lon},{dropoff_lat}"
-    url = f"http://router.project-osrm.org/route/v1/driving/{loc}?overview=full&geometries=geojson"
-
-    for attempt in range(max_retries):
-        try:
-            r = requests.get(url, timeout=4)
-            res = r.json()
-
-            if "routes" in res and len(res["routes"]) > 0:
-                coords = res["routes"][0]["geometry"]["coordinates"]
-                route_coords = [[lat, lon] for lon, lat in coords]
-                # บันทึก cache ทันที
-                if USE_CACHE:
-                    ROUTE_CACHE_DATA[cache_key] = {'coords': route_coords, 'distance': 0}
-                    global _ROUTE_CACHE_DIRTY
-                    _ROUTE_CACHE_DIRTY += 1
-                    if _ROUTE_CACHE_DIRTY >= _ROUTE_CACHE_SAVE_BATCH:
-                        save_route_cache(ROUTE_CACHE_DATA)
-                return route_coords
-            else:
-                return [[pickup_lat, pickup_lon], [dropoff_lat, dropoff_lon]]
-        except Exception:
-            return [[pickup_lat, pickup_lon], [dropoff_lat, dropoff_lon]]
-
-    return [[pickup_lat, pickup_lon], [dropoff_lat, dropoff_lon]]
+    backend = get_routing_backend()
+    routed = route_legs.route(_route_cache_for(backend), waypoints, backend, timeout=4, retries=max_retries - 1)
+    if routed is None:
+        return waypoints
+    _note_route_legs(backend, routed[2])
+    return routed[0]
 
 
-def get_multi_point_route_osrm(waypoints, max_retries=2):
+def get_multi_point_route_osrm(waypoints, max_retries=2, level='full'):
     """
-    ขอเส้นทางจริงจาก OSRM API สำหรับหลายจุด พร้อม cache
+    ขอเส้นทางจริงจาก OSRM API สำหรับหลายจุด พร้อม cache ระดับช่วง
+    ต่อจากช่วงที่ cache ไว้ → ขอเฉพาะช่วงที่ขาดใน request เดียว
     
     Args:
         waypoints: list ของ [lat, lon] เช่น [[14.1, 100.6], [14.2, 100.7], ...]
         max_retries: จำนวนครั้งที่ลองใหม่
+        level: ความละเอียด geometry ('full' / '100m' / '500m' — polyline_codec.LEVELS)
     
     Returns:
         tuple: (route_coords, distance_km) - พิกัดเส้นทาง และระยะทางรวม
     """
     if not FOLIUM_AVAILABLE or len(waypoints) < 2:
         return waypoints, 0
-    
-    # สร้าง cache key
-    cache_key = "|".join([f"{lat:.4f},{lon:.4f}" for lat, lon in waypoints])
-    
-    # ตรวจสอบ cache ก่อน
-    if USE_CACHE and cache_key in ROUTE_CACHE_DATA:
-        cached = ROUTE_CACHE_DATA[cache_key]
-        return cached['coords'], cached['distance']
-    
-    # OSRM รับพิกัดแบบ lon,lat (ไม่ใช่ lat,lon!)
-    coords_str = ";".join([f"{lon},{lat}" for lat, lon in waypoints])
-    url = f"http://router.project-osrm.org/route/v1/driving/{coords_str}?overview=full&geometries=geojson"
-    
-    for attempt in range(max_retries):
-        try:
-            r = requests.get(url, timeout=10)
-            res = r.json()
-            
-            if "routes" in res and len(res["routes"]) > 0:
-                route = res["routes"][0]
-                # แปลง GeoJSON coordinates (lon, lat) เป็น (lat, lon)
-                coords = route["geometry"]["coordinates"]
-                route_coords = [[lat, lon] for lon, lat in coords]
-                # ระยะทางจาก OSRM เป็นเมตร
-                distance_km = route.get("distance", 0) / 1000
-                
-                # บันทึก cache ทันทีทุกครั้งที่ได้ข้อมูลใหม่
-                if USE_CACHE:
-                    ROUTE_CACHE_DATA[cache_key] = {
-                        'coords': route_coords,
-                        'distance': distance_km
-                    }
-                    global _ROUTE_CACHE_DIRTY
-                    _ROUTE_CACHE_DIRTY += 1
-                    if _ROUTE_CACHE_DIRTY >= _ROUTE_CACHE_SAVE_BATCH:
-                        save_route_cache(ROUTE_CACHE_DATA)
-                
-                return route_coords, distance_km
-            else:
-                return waypoints, 0
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time_module.sleep(0.3)
-                continue
-            return waypoints, 0
-    
-    return waypoints, 0
+    backend = get_routing_backend()
+    if not USE_CACHE:
+        routed = backend.route([tuple(p) for p in waypoints], timeout=10, retries=max_retries - 1)
+        return routed if routed is not None else (waypoints, 0)
+
+    routed = route_legs.route(_route_cache_for(backend), waypoints, backend, timeout=10,
+                              retries=max_retries - 1, level=level)
+    if routed is None:
+        return waypoints, 0
+    _note_route_legs(backend, routed[2])
+    return routed[0], routed[1]
+
+def trip_waypoints(trip_rows):
+    """waypoints ของทริป: DC → สาขาตามลำดับแถว (มีพิกัด) → DC"""
+    pts = [[float(la or 0), float(lo or 0)] for la, lo in zip(trip_rows['_lat'], trip_rows['_lon'])]
+    pts = [p for p in pts if p[0] > 0 and p[1] > 0]
+    if not pts:
+        return []
+    return [[DC_WANG_NOI_LAT, DC_WANG_NOI_LON]] + pts + [[DC_WANG_NOI_LAT, DC_WANG_NOI_LON]]
+
+
+def trip_routes(df_snapshot):
+    """waypoints ของทุกทริป (Trip > 0) เรียงตามเลขทริป — groupby ครั้งเดียว"""
+    _trips = df_snapshot[df_snapshot['Trip'] > 0]
+    return [_wp for _, _rows in _trips.groupby('Trip', sort=True) if (_wp := trip_waypoints(_rows))]
+
+
+def precache_trip_routes(df_snapshot):
+    """
+    ขอช่วงเส้นทาง (leg) ของทุกทริปที่ยังไม่อยู่ใน cache — ช่วงที่ขาดของทุกทริปรวมเป็น request ชุดเดียว
+    แล้วบันทึกลง route store | คืนจำนวนทริปที่ต้องขอใหม่ (แบบรอผล — benchmark / สคริปต์; UI ใช้ get_route_prefetcher)
+    """
+    if not USE_CACHE:
+        return 0
+    backend = get_routing_backend()
+    cache = _route_cache_for(backend)
+    _routes = [_wp for _wp in trip_routes(df_snapshot) if not route_legs.is_cached(cache, _wp)]
+    if not _routes:
+        return 0
+    _stored = route_legs.fetch_missing(cache, _routes, backend)
+    if _stored > 0 and not backend.simulated:
+        save_route_cache(ROUTE_CACHE_DATA, force=True)
+        safe_print(f"🗺️ Pre-cached {len(_routes)} trip routes ({_stored} ช่วงใหม่) → {ROUTE_STORE_DIR}/")
+    return len(_routes)
+
+
+@st.cache_resource(show_spinner=False)
+def get_route_prefetcher() -> RoutePrefetcher:
+    """คิว prefetch เส้นทางเดียวต่อ process (ใช้ร่วมทุก session — ทริปเดียวกันไม่ขอซ้ำ)"""
+    return RoutePrefetcher(cache_for=_route_cache_for, on_stored=_note_route_legs)
 
 def calculate_bearing(lat1, lon1, lat2, lon2):
     """
@@ -2954,6 +3121,15 @@ def calculate_bearing(lat1, lon1, lat2, lon2):
     
     return bearing
 
+def calculate_bearings(lat1, lon1, lats, lons):
+    """calculate_bearing แบบ vectorized (NumPy): จุดเดียว → หลายจุด คืน ndarray องศา (0-360)"""
+    lat1_rad = np.radians(lat1)
+    lat2_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    dlon = np.radians(np.asarray(lons, dtype=np.float64) - lon1)
+    x = np.sin(dlon) * np.cos(lat2_rad)
+    y = np.cos(lat1_rad) * np.sin(lat2_rad) - np.sin(lat1_rad) * np.cos(lat2_rad) * np.cos(dlon)
+    return (np.degrees(np.arctan2(x, y)) + 360) % 360
+
 def get_bearing_zone(bearing):
     """
     แบ่งทิศทางเป็น 8 โซน (ทุก 45 องศา)
@@ -2967,21 +3143,9 @@ def get_osrm_distance_live(lat1, lon1, lat2, lon2):
     """
     เรียก OSRM Table API เพื่อดึงระยะทางถนนจริงระหว่างสองจุด (km)
     คืนค่า float km ถ้าสำเร็จ หรือ None ถ้าล้มเหลว
+    (ผ่าน routing backend — OSRM: คำขอพร้อมกันหลาย thread ถูกรวมเป็น /table เดียว)
     """
-    try:
-        url = (
-            f"http://router.project-osrm.org/table/v1/driving/"
-            f"{lon1},{lat1};{lon2},{lat2}?annotations=distance"
-        )
-        r = requests.get(url, timeout=6)
-        data = r.json()
-        if data.get("code") == "Ok":
-            dist_m = data["distances"][0][1]  # จากจุด 0 → จุด 1
-            if dist_m and dist_m > 0:
-                return dist_m / 1000.0
-    except Exception:
-        pass
-    return None
+    return get_routing_backend().distance((lat1, lon1), (lat2, lon2), timeout=6)
 
 
 def haversine_distance(lat1, lon1, lat2, lon2, use_osrm_cache=True):
@@ -2993,14 +3157,18 @@ def haversine_distance(lat1, lon1, lat2, lon2, use_osrm_cache=True):
       3. Cache miss + use_osrm_cache=False → haversine×1.35 ทันที (zero-latency, hot-path)
     """
     # 1. ตรวจ DISTANCE_CACHE ก่อนเสมอ (ทั้งสองโหมดได้ระยะทางจริงถ้ามีแคช)
+    profile_count('haversine_distance')
     cache_key = f"{lat1:.4f},{lon1:.4f}_{lat2:.4f},{lon2:.4f}"
     cache_key_reverse = f"{lat2:.4f},{lon2:.4f}_{lat1:.4f},{lon1:.4f}"
 
     if USE_CACHE:
         if cache_key in DISTANCE_CACHE:
+            profile_count('distance_cache_hit')
             return DISTANCE_CACHE[cache_key]
         if cache_key_reverse in DISTANCE_CACHE:
+            profile_count('distance_cache_hit')
             return DISTANCE_CACHE[cache_key_reverse]
+    profile_count('distance_cache_miss')
 
     # 2a. Cache miss + hot-path → haversine×1.35 ทันที (ไม่ network เด็ดขาด)
     if not use_osrm_cache:
@@ -3011,27 +3179,18 @@ def haversine_distance(lat1, lon1, lat2, lon2, use_osrm_cache=True):
         a = sin(dphi/2)**2 + cos(phi1)*cos(phi2)*sin(dlambda/2)**2
         return round(R * 2 * atan2(sqrt(a), sqrt(1-a)) * 1.35, 2)
 
-    # 2b. Cache miss + precision → OSRM live, cache ไว้
-    try:
-        _url = (
-            f"http://router.project-osrm.org/table/v1/driving/"
-            f"{lon1},{lat1};{lon2},{lat2}?annotations=distance"
-        )
-        _r = requests.get(_url, timeout=6)
-        _data = _r.json()
-        if _data.get("code") == "Ok":
-            _dist_m = _data["distances"][0][1]
-            if _dist_m and _dist_m > 0:
-                dist_km = round(_dist_m / 1000.0, 2)
-                if USE_CACHE:
-                    DISTANCE_CACHE[cache_key] = dist_km
-                    global _DIST_CACHE_DIRTY
-                    _DIST_CACHE_DIRTY += 1
-                    if _DIST_CACHE_DIRTY >= _DIST_CACHE_SAVE_BATCH:
-                        save_distance_cache(DISTANCE_CACHE)
-                return dist_km
-    except Exception:
-        pass
+    # 2b. Cache miss + precision → OSRM live (client ร่วม: รวม miss ที่มาพร้อมกันเป็น /table เดียว), cache ไว้
+    _live_km = get_osrm_distance_live(lat1, lon1, lat2, lon2)
+    if _live_km:
+        dist_km = round(_live_km, 2)
+        if USE_CACHE and not get_routing_backend().simulated:
+            DISTANCE_CACHE[cache_key] = dist_km
+            DISTANCE_STORE.set_road_by_coords(lat1, lon1, lat2, lon2, dist_km)
+            global _DIST_CACHE_DIRTY
+            _DIST_CACHE_DIRTY += 1
+            if _DIST_CACHE_DIRTY >= _DIST_CACHE_SAVE_BATCH:
+                save_distance_cache(DISTANCE_CACHE)
+        return dist_km
 
     # 3. OSRM ล้มเหลว/timeout → haversine×1.35 (fallback)
     R = 6371.0
@@ -3041,6 +3200,19 @@ def haversine_distance(lat1, lon1, lat2, lon2, use_osrm_cache=True):
     a = sin(dphi/2)**2 + cos(phi1)*cos(phi2)*sin(dlambda/2)**2
     return round(R * 2 * atan2(sqrt(a), sqrt(1-a)) * 1.35, 2)
 
+def distance_matrix(src_coords, dst_coords):
+    """
+    ระยะทาง (km) แบบ batch หลายจุด → หลายจุด (NumPy) — กฎเดียวกับ haversine_distance(use_osrm_cache=False)
+    DISTANCE_CACHE (ผ่าน DISTANCE_STORE) ก่อน → haversine×1.35
+    คืน ndarray (len(src_coords) × len(dst_coords))
+    """
+    profile_count('distance_pairs', len(src_coords) * len(dst_coords))
+    return _dstore_mod.distance_matrix(src_coords, dst_coords, DISTANCE_STORE if USE_CACHE else None)
+
+def distances_from(lat, lon, coords):
+    """ระยะทาง (km) จากจุดเดียว → หลายจุด (NumPy) — ดู distance_matrix"""
+    return distance_matrix([(lat, lon)], coords)[0]
+
 def load_model():
     """โหลดโมเดลที่เทรนไว้"""
     if not os.path.exists(MODEL_PATH):
@@ -3377,19 +3549,26 @@ def process_dataframe(df):
     
     if not province_col or df[province_col].isna().all():
         if not MASTER_DATA.empty and 'Plan Code' in MASTER_DATA.columns and 'Code' in df.columns:
-            # สร้าง mapping จาก Master
+            # สร้าง mapping จาก Master: Plan Code (upper) → จังหวัด
             province_map = {}
-            for _, row in MASTER_DATA.iterrows():
-                code = row.get('Plan Code', '')
-                province = row.get('จังหวัด', '')
+            _md_provinces = MASTER_DATA['จังหวัด'].tolist() if 'จังหวัด' in MASTER_DATA.columns else [''] * len(MASTER_DATA)
+            for code, province in zip(MASTER_DATA['Plan Code'].tolist(), _md_provinces):
                 if code and province:
-                    province_map[code] = province
+                    province_map[str(code).strip().upper()] = province
+            # รหัสในไฟล์ → Plan Code (ตรงตัว / ตัด prefix / Z / WMS) ครั้งเดียวทั้งคอลัมน์
+            resolved = BRANCH_RESOLVER.resolve_codes(df['Code'], df['WMSCode'] if 'WMSCode' in df.columns else None)
+            
+            # ชื่อสาขาใน Master (10 ตัวอักษรแรก) → จังหวัด สร้างครั้งเดียว
+            name_lookup = {}
+            if 'สาขา' in MASTER_DATA.columns and 'จังหวัด' in MASTER_DATA.columns:
+                for rec in MASTER_DATA[['สาขา', 'จังหวัด']].dropna().to_dict('records'):
+                    name_lookup[str(rec['สาขา'])[:10]] = str(rec.get('จังหวัด', ''))
             
             # ฟังก์ชันค้นหาจังหวัดจากชื่อสาขา
-            def find_province_by_name(code, name):
+            def find_province_by_name(master_code, name):
                 # ลองหาจาก code ก่อน
-                if code in province_map:
-                    return province_map[code]
+                if master_code in province_map:
+                    return province_map[master_code]
                 
                 # ถ้าไม่เจอ ลองค้นหาจากชื่อสาขา
                 if not name or pd.isna(name):
@@ -3399,12 +3578,6 @@ def process_dataframe(df):
                 keywords = str(name).replace('MAX MART-', '').replace('PUNTHAI-', '').replace('LUBE', '').strip()
                 if not keywords:
                     return ''
-                
-                # ค้นหาในชื่อสาขาของ Master (ใช้ vectorized แทน iterrows)
-                name_lookup = {}
-                if not MASTER_DATA.empty and 'สาขา' in MASTER_DATA.columns and 'จังหวัด' in MASTER_DATA.columns:
-                    for rec in MASTER_DATA[['สาขา', 'จังหวัด']].dropna().to_dict('records'):
-                        name_lookup[str(rec['สาขา'])[:10]] = str(rec.get('จังหวัด', ''))
                 for prefix, prov in name_lookup.items():
                     if keywords[:10] == prefix or prefix in keywords:
                         return prov if prov else ''
@@ -3413,9 +3586,10 @@ def process_dataframe(df):
             # ใส่จังหวัดให้แต่ละสาขา (สร้างคอลัมน์ Province ถ้ายังไม่มี)
             target_col = 'Province' if 'Province' in df.columns else 'จังหวัด'
             if 'Name' in df.columns:
-                df[target_col] = df.apply(lambda row: find_province_by_name(row['Code'], row.get('Name', '')), axis=1).fillna('')
+                df[target_col] = pd.Series([find_province_by_name(k, n) for k, n in zip(resolved.tolist(), df['Name'].tolist())],
+                                           index=df.index).fillna('')
             else:
-                df[target_col] = df['Code'].map(province_map).fillna('')
+                df[target_col] = resolved.map(province_map).fillna('')
             
             # สร้าง Province ถ้ายังไม่มี (เพื่อ backward compatibility)
             if 'Province' not in df.columns and 'จังหวัด' in df.columns:
@@ -3423,7 +3597,208 @@ def process_dataframe(df):
     
     return df.reset_index(drop=True)
 
-def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10, fleet_limits=None, max_qty_per_trip=0):
+# ชื่อจังหวัดที่ normalize ตอนจัดทริป (Step 1)
+PROVINCE_ALIAS = {'พระนครศรีอยุธยา': 'อยุธยา', 'กรุงเทพฯ': 'กรุงเทพมหานคร',
+                  'กทม': 'กรุงเทพมหานคร', 'กทม.': 'กรุงเทพมหานคร', 'โคราช': 'นครราชสีมา'}
+_LAT_COLUMNS = ['Latitude', 'latitude', 'ละติจูด', 'lat', 'ละ']
+_LON_COLUMNS = ['Longitude', 'longitude', 'ลองจิจูด', 'ลองติจูด', 'lon', 'long', 'ลอง']
+LOCATION_COLUMNS = ['_region_name', '_province', '_district', '_subdistrict', '_route',
+                    '_distance_from_dc', '_lat', '_lon']
+
+def order_provinces(test_df):
+    """จังหวัดของแต่ละแถว (normalize แบบเดียวกับ Step 1) → list"""
+    if 'Province' not in test_df.columns:
+        return [''] * len(test_df)
+    out = []
+    for prov in test_df['Province'].tolist():
+        prov = clean_name(prov) if pd.notna(prov) else ''
+        out.append(PROVINCE_ALIAS.get(prov, prov))
+    return out
+
+def _map_unique(series, func):
+    """func ต่อค่า unique ครั้งเดียว แล้ว map กลับทั้งคอลัมน์"""
+    return series.map({v: func(v) for v in series.unique()})
+
+def _text_column(series):
+    """str(v).strip() ทั้งคอลัมน์ (NaN/None → '')"""
+    return series.where(series.notna(), '').astype(str).str.strip()
+
+def _first_number(df, columns):
+    """ค่าตัวเลขแรกที่อ่านได้ตามลำดับ columns (ไม่มีเลย → 0)"""
+    out = pd.Series(np.nan, index=df.index)
+    for col in columns:
+        if col in df.columns:
+            out = out.fillna(pd.to_numeric(df[col], errors='coerce'))
+    return out.fillna(0.0)
+
+def _master_rows(master_df, codes, columns):
+    """แถวแรกของ master ต่อ Plan Code (index ครั้งเดียว) → reindex ตาม codes; ไม่มี master → None"""
+    if not isinstance(master_df, pd.DataFrame) or master_df.empty or 'Plan Code' not in master_df.columns:
+        return None
+    cols = [c for c in columns if c in master_df.columns]
+    indexed = master_df.drop_duplicates('Plan Code')[['Plan Code'] + cols].set_index('Plan Code')
+    indexed['_found'] = True
+    return indexed.reindex(codes)
+
+def order_locations(test_df, model_data):
+    """
+    ข้อมูลพื้นที่ + พิกัด + ระยะจาก DC ของแต่ละแถว (Step 1) แบบ columnar
+    - พื้นที่/Route: model_data (ถ้าเป็นตาราง master) ก่อน → คอลัมน์ในไฟล์
+    - พิกัด: คอลัมน์ในไฟล์ → MASTER_DATA ถ้าไม่มี lat หรือ lon
+    - Code ซ้ำ → ใช้แถวสุดท้าย (เหมือนเดิม), Code ว่าง → ไม่ระบุ / 9999 km
+    คืน DataFrame คอลัมน์ LOCATION_COLUMNS index เดียวกับ test_df
+    """
+    keys = pd.Series([str(c).strip().upper() for c in test_df['Code'].tolist()] if 'Code' in test_df.columns
+                     else [''] * len(test_df), index=test_df.index)
+    rows = test_df[(keys != '').to_numpy()].assign(_key=keys[keys != '']).drop_duplicates('_key', keep='last')
+    codes = rows['_key'].tolist()
+    loc = pd.DataFrame(index=pd.Index(codes, name='Code'))
+
+    master = _master_rows(model_data, codes, ['จังหวัด', 'อำเภอ', 'ตำบล', 'Route'])
+    for out_col, master_col, file_col in [('_province', 'จังหวัด', 'Province'), ('_district', 'อำเภอ', 'District'),
+                                          ('_subdistrict', 'ตำบล', 'Subdistrict'), ('_route', 'Route', 'Route')]:
+        value = pd.Series('', index=loc.index)
+        if master is not None and master_col in master.columns:
+            value = _text_column(master[master_col])
+        if file_col in rows.columns:
+            value = value.where(value != '', _text_column(rows[file_col]).to_numpy())
+        loc[out_col] = value.to_numpy()
+    loc['_province'] = _map_unique(loc['_province'], lambda p: PROVINCE_ALIAS.get(clean_name(p), clean_name(p)))
+    loc['_district'] = _map_unique(loc['_district'], clean_name)
+    loc['_subdistrict'] = _map_unique(loc['_subdistrict'], clean_name)
+
+    lat = _first_number(rows, _LAT_COLUMNS).to_numpy(dtype=float, copy=True)
+    lon = _first_number(rows, _LON_COLUMNS).to_numpy(dtype=float, copy=True)
+    coords = _master_rows(MASTER_DATA, codes, ['ละติจูด', 'ลองติจูด'])
+    if coords is not None:
+        use_master = ((lat == 0) | (lon == 0)) & coords['_found'].notna().to_numpy()
+        for arr, col in ((lat, 'ละติจูด'), (lon, 'ลองติจูด')):
+            master_val = pd.to_numeric(coords[col], errors='coerce').fillna(0.0).to_numpy() \
+                if col in coords.columns else np.zeros(len(codes))
+            arr[use_master] = master_val[use_master]
+    loc['_lat'] = lat
+    loc['_lon'] = lon
+
+    # ระยะทางจาก DC: DISTANCE_CACHE/ระยะถนน → haversine×1.35 (กฎเดียวกับ haversine_distance hot-path)
+    dist = np.full(len(codes), 9999.0)
+    has_coord = (lat != 0) & (lon != 0)
+    if has_coord.any():
+        dist[has_coord] = distances_from(DC_WANG_NOI_LAT, DC_WANG_NOI_LON,
+                                         np.column_stack([lat[has_coord], lon[has_coord]]))
+    loc['_distance_from_dc'] = dist
+    loc['_region_name'] = _map_unique(loc['_province'], get_region_name)
+
+    out = loc.reindex(keys.tolist())[LOCATION_COLUMNS].set_axis(test_df.index)
+    return out.fillna({'_region_name': 'ไม่ระบุ', '_province': '', '_district': '', '_subdistrict': '',
+                       '_route': '', '_distance_from_dc': 9999, '_lat': 0, '_lon': 0})
+
+def planning_partitions(test_df):
+    """
+    แบ่งแถวของ test_df ตามภาค (จังหวัดแบบเดียวกับ Step 1) + แยกกรุงเทพฯ เป็นกลุ่มของตัวเอง
+    คืน [((ภาค, 'BKK' หรือ ''), positions), ...] เรียงตาม key
+    """
+    groups = {}
+    for pos, prov in enumerate(order_provinces(test_df)):
+        key = (get_region_name(prov), 'BKK' if prov == 'กรุงเทพมหานคร' else '')
+        groups.setdefault(key, []).append(pos)
+    return sorted(groups.items())
+
+def order_coords(test_df):
+    """พิกัดของแต่ละแถว: Latitude/Longitude ในไฟล์ ถ้าไม่มี → BRANCH_COORDS ของ master"""
+    out = []
+    lats = test_df['Latitude'].tolist() if 'Latitude' in test_df.columns else [None] * len(test_df)
+    lons = test_df['Longitude'].tolist() if 'Longitude' in test_df.columns else [None] * len(test_df)
+    for code, lat, lon in zip(test_df['Code'].tolist(), lats, lons):
+        try:
+            lat, lon = float(lat), float(lon)
+        except (TypeError, ValueError):
+            lat, lon = 0.0, 0.0
+        if not (lat > 0 and lon > 0):
+            lat, lon = BRANCH_COORDS.get(str(code).strip().upper(), (0.0, 0.0))
+        out.append((lat, lon))
+    return out
+
+def update_plan(previous_result, delta_orders, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
+                fleet_limits=None, max_qty_per_trip=0, removed_codes=None, strategy='insert'):
+    """
+    ปรับแผนเดิมเฉพาะออเดอร์ที่เพิ่ม/แก้/ลบ (ดู plan_update) — ทริปอื่นคงเดิม
+    previous_result = (result_df, summary_df, fleet_used) จาก predict_trips รอบก่อน
+    delta_orders    = DataFrame ออเดอร์ (ผ่าน process_dataframe) น้ำหนัก+คิว 0 = ลบสาขานั้น
+    strategy        = 'insert' เติมเข้าทริปใกล้เคียง / 'replan' จัดทริปในรัศมีใหม่ทั้งหมด
+    """
+    def _plan(subset):
+        return predict_trips(subset, model_data, punthai_buffer=punthai_buffer, maxmart_buffer=maxmart_buffer,
+                             fleet_limits=None, max_qty_per_trip=max_qty_per_trip)
+
+    return _update_plan(
+        previous_result, delta_orders, _plan, order_coords, removed_codes=removed_codes,
+        fleet_limits=fleet_limits, limits={'punthai': PUNTHAI_LIMITS, 'maxmart': LIMITS},
+        punthai_buffer=punthai_buffer, maxmart_buffer=maxmart_buffer, max_qty_per_trip=max_qty_per_trip,
+        strategy=strategy, cross_zone=is_cross_zone_violation, log=safe_print,
+    )
+
+def _plan_state_columns(frame):
+    """Trip / Truck ต่อแถว → profiler นับแถวที่แต่ละ phase assign / เปลี่ยน (คอลัมน์ที่ยังไม่มี = 0)"""
+    return [frame[c].to_numpy(copy=True) if c in frame.columns else np.zeros(len(frame), dtype=np.int64)
+            for c in ('Trip', 'Truck')]
+
+def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10, fleet_limits=None, max_qty_per_trip=0,
+                  parallel=False, max_workers=None, improve_seconds=0, cpsat_seconds=0, cancel=None, deadline_s=None):
+    """
+    จัดทริป (ดู _predict_trips) + จับเวลา/ตัวนับต่อ phase
+    profile แนบไว้ที่ summary_df.attrs['planner_profile'] (list ของ phase → profile_frame() แสดงเป็นตาราง)
+    parallel=True → จัดแยกตามภาคใน process pool แล้วรวมผล (ดู parallel_planner)
+    improve_seconds > 0 → Step 6.9 local search (แบบ parallel แต่ละภาคได้เวลาเท่านี้)
+    cpsat_seconds > 0 → ปรับผล greedy ต่อด้วย OR-Tools CP-SAT แบบแยกปัญหาย่อย (ต้องมี ortools)
+    cancel (CancelToken) / deadline_s → หยุดกลางทางได้ (ดู plan_cancel): หลังจัด greedy เสร็จ
+        คืนแผนที่มีอยู่ + summary_df.attrs['cancelled'] = phase ที่ข้าม/จบกลางทาง
+        หยุดก่อนนั้น → PlanningCancelled | ส่ง cancel มาแล้ว deadline_s จะไม่ถูกใช้ (ใช้ของ token)
+    """
+    token = cancel if cancel is not None else CancelToken(deadline_s)
+    if parallel:
+        result = plan_parallel(
+            test_df, model_data, planning_partitions(test_df),
+            serial=lambda *args, **kwargs: predict_trips(*args, cancel=token, **kwargs),
+            punthai_buffer=punthai_buffer, maxmart_buffer=maxmart_buffer,
+            fleet_limits=fleet_limits, max_qty_per_trip=max_qty_per_trip, max_workers=max_workers,
+            limits={'punthai': PUNTHAI_LIMITS, 'maxmart': LIMITS}, log=safe_print,
+            improve_seconds=improve_seconds, deadline_s=token.remaining(), cancel=token,
+            context=PLANNER_CONTEXT.snapshot,
+        )
+    else:
+        _prof = PlannerProfiler()
+        with _prof.activate(), token.activate():
+            df, summary_df, fleet_used = _predict_trips(
+                test_df, model_data,
+                punthai_buffer=punthai_buffer, maxmart_buffer=maxmart_buffer,
+                fleet_limits=fleet_limits, max_qty_per_trip=max_qty_per_trip, improve_seconds=improve_seconds,
+            )
+        summary_df.attrs['planner_profile'] = _prof.to_records()
+        safe_print(_prof.report())
+        result = df, summary_df, fleet_used
+    if cpsat_seconds and cpsat_seconds > 0:
+        if token.stopped:
+            token.skipped.append('OR-Tools CP-SAT')
+        elif ORTOOLS_AVAILABLE:
+            result = optimize_decomposed(
+                result, {'punthai': PUNTHAI_LIMITS, 'maxmart': LIMITS},
+                buffer_punthai=punthai_buffer, buffer_maxmart=maxmart_buffer,
+                branch_to_group=BRANCH_TO_GROUP, fleet_limits=fleet_limits, max_qty_per_trip=max_qty_per_trip,
+                time_limit_seconds=token.cap(cpsat_seconds), max_workers=max_workers, log=safe_print,
+            )
+        else:
+            safe_print("⚠️ ไม่มี ortools → ใช้ผลจัดทริปแบบ greedy")
+    summary = result[1]
+    if token.stopped or summary.attrs.get('cancelled'):
+        summary.attrs['cancelled'] = combine_cancel_reports(
+            [summary.attrs.get('cancelled'), token.report() if token.stopped else None])
+        _c = summary.attrs['cancelled']
+        safe_print(f"⏹️ หยุดจัดทริป ({_c['reason']}) — ข้าม: {', '.join(_c['skipped']) or '-'}"
+                   f" | จบกลางทาง: {', '.join(_c['cut_short']) or '-'}")
+    return result
+
+def _predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10, fleet_limits=None, max_qty_per_trip=0,
+                   improve_seconds=0):
     """
     จัดทริปแบบใหม่ - เรียบง่ายและมีประสิทธิภาพ
     
@@ -3439,154 +3814,52 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
         model_data: ข้อมูลโมเดล (branch_vehicles, etc.)
         punthai_buffer: Buffer สำหรับ Punthai (เช่น 1.0 = 100%)
         maxmart_buffer: Buffer สำหรับ Maxmart/ผสม (เช่น 1.10 = 110%)
+        improve_seconds: เวลา (วินาที) ของ Step 6.9 local search (0 = ไม่ปรับปรุง)
     """
     branch_vehicles = model_data.get('branch_vehicles', {})
     
     # ==========================================
-    # Step 1: สร้าง location_map จากข้อมูล MASTER_DATA (Google Sheets) + พิกัด
+    # Step 1: ข้อมูลพื้นที่ + พิกัดต่อสาขาจาก MASTER_DATA (Google Sheets) แบบ columnar (order_locations)
     # ==========================================
-    location_map = {}  # {code: {province, district, subdistrict, route, lat, lon, distance_from_dc, region_name}}
-    
-    for _, row in test_df.iterrows():
-        code = str(row.get('Code', '')).strip().upper()
-        if not code:
-            continue
-        
-        province = ''
-        district = ''
-        subdistrict = ''
-        route = ''
-        
-        # ลองหาจาก MASTER_DATA ก่อน (ข้อมูลล่าสุดจาก Sheets)
-        if isinstance(model_data, pd.DataFrame) and not model_data.empty and 'Plan Code' in model_data.columns:
-            master_row = model_data[model_data['Plan Code'] == code]
-            if not master_row.empty:
-                province    = str(master_row.iloc[0].get('จังหวัด', '')).strip() if pd.notna(master_row.iloc[0].get('จังหวัด')) else ''
-                district    = str(master_row.iloc[0].get('อำเภอ', '')).strip()   if pd.notna(master_row.iloc[0].get('อำเภอ'))   else ''
-                subdistrict = str(master_row.iloc[0].get('ตำบล', '')).strip()    if pd.notna(master_row.iloc[0].get('ตำบล'))    else ''
-                route       = str(master_row.iloc[0].get('Route', '')).strip()   if pd.notna(master_row.iloc[0].get('Route'))   else ''
-        
-        # Fallback → Excel upload
-        if not province:    province    = str(row.get('Province', '')).strip()    if pd.notna(row.get('Province'))    else ''
-        if not district:    district    = str(row.get('District', '')).strip()    if pd.notna(row.get('District'))    else ''
-        if not subdistrict: subdistrict = str(row.get('Subdistrict', '')).strip() if pd.notna(row.get('Subdistrict')) else ''
-        if not route:       route       = str(row.get('Route', '')).strip()       if pd.notna(row.get('Route'))       else ''
-        
-        # normalize
-        _prov_alias = {'พระนครศรีอยุธยา':'อยุธยา','กรุงเทพฯ':'กรุงเทพมหานคร',
-                       'กทม':'กรุงเทพมหานคร','กทม.':'กรุงเทพมหานคร','โคราช':'นครราชสีมา'}
-        province    = _prov_alias.get(clean_name(province), clean_name(province))
-        district    = clean_name(district)
-        subdistrict = clean_name(subdistrict)
-        
-        # พิกัด
-        lat = 0; lon = 0
-        for lat_col in ['Latitude', 'latitude', 'ละติจูด', 'lat', 'ละ']:
-            if lat_col in row and pd.notna(row[lat_col]):
-                try: lat = float(row[lat_col]); break
-                except: pass
-        for lon_col in ['Longitude', 'longitude', 'ลองจิจูด', 'ลองติจูด', 'lon', 'long', 'ลอง']:
-            if lon_col in row and pd.notna(row[lon_col]):
-                try: lon = float(row[lon_col]); break
-                except: pass
-        
-        # Fallback พิกัดจาก MASTER_DATA
-        if (lat == 0 or lon == 0) and not MASTER_DATA.empty and 'Plan Code' in MASTER_DATA.columns:
-            master_row = MASTER_DATA[MASTER_DATA['Plan Code'] == code]
-            if not master_row.empty:
-                lat = float(master_row.iloc[0].get('ละติจูด', 0))  if pd.notna(master_row.iloc[0].get('ละติจูด'))  else 0
-                lon = float(master_row.iloc[0].get('ลองติจูด', 0)) if pd.notna(master_row.iloc[0].get('ลองติจูด')) else 0
-        
-        # ระยะทางจาก DC (haversine จากพิกัด)
-        dist_from_dc = haversine_distance(DC_WANG_NOI_LAT, DC_WANG_NOI_LON, lat, lon, use_osrm_cache=False) if (lat and lon) else 9999
-        
-        location_map[code] = {
-            'province': province,
-            'district': district,
-            'subdistrict': subdistrict,
-            'route': route,
-            'lat': lat,
-            'lon': lon,
-            'distance_from_dc': dist_from_dc,
-            'region_name': get_region_name(province)
-        }
+    profile_mark('Step 1 location map', rows=len(test_df))
+    plan_phase('Step 1 location map')
+    locations = order_locations(test_df, model_data)  # {province, district, subdistrict, route, lat, lon, distance_from_dc, region_name}
     
     # ==========================================
-    # Step 2: เพิ่มข้อมูลพื้นที่ให้แต่ละสาขา (pd.merge แบบ manual)
+    # Step 2: เพิ่มข้อมูลพื้นที่ให้แต่ละสาขา (columnar join กับผล Step 1)
     # ==========================================
+    profile_mark('Step 2 area info', rows=len(test_df))
+    plan_phase('Step 2 area info')
     df = test_df.copy()
-    
-    def get_location_info(code):
-        code_upper = str(code).strip().upper()
-        return location_map.get(code_upper, {
-            'province': '', 'district': '', 'subdistrict': '', 'route': '',
-            'lat': 0, 'lon': 0,
-            'distance_from_dc': 9999,
-            'region_name': 'ไม่ระบุ'
-        })
-    
-    # เพิ่มคอลัมน์ข้อมูลพื้นที่
-    _loc_cache = {str(c).strip().upper(): get_location_info(c) for c in df['Code'].unique()}
-    df['_region_name']      = df['Code'].map(lambda c: _loc_cache.get(str(c).strip().upper(), {}).get('region_name', 'ไม่ระบุ'))
-    df['_province']         = df['Code'].map(lambda c: _loc_cache.get(str(c).strip().upper(), {}).get('province', ''))
-    df['_district']         = df['Code'].map(lambda c: _loc_cache.get(str(c).strip().upper(), {}).get('district', ''))
-    df['_subdistrict']      = df['Code'].map(lambda c: _loc_cache.get(str(c).strip().upper(), {}).get('subdistrict', ''))
-    df['_route']            = df['Code'].map(lambda c: _loc_cache.get(str(c).strip().upper(), {}).get('route', ''))
-    df['_distance_from_dc'] = df['Code'].map(lambda c: _loc_cache.get(str(c).strip().upper(), {}).get('distance_from_dc', 9999))
-    df['_lat']              = df['Code'].map(lambda c: _loc_cache.get(str(c).strip().upper(), {}).get('lat', 0))
-    df['_lon']              = df['Code'].map(lambda c: _loc_cache.get(str(c).strip().upper(), {}).get('lon', 0))
+    for _col in LOCATION_COLUMNS:
+        df[_col] = locations[_col]
     
     # 🎯 คำนวณ Bearing (ทิศทาง) จาก DC เพื่อจัดกลุ่มสาขาที่อยู่ทิศเดียวกัน
     DC_LAT = 14.117451
     DC_LON = 100.633408
     
-    def calc_bearing(row):
-        if row['_lat'] > 0 and row['_lon'] > 0:
-            return calculate_bearing(DC_LAT, DC_LON, row['_lat'], row['_lon'])
-        return 0
-    
-    df['_bearing_from_dc'] = df.apply(calc_bearing, axis=1)
-    df['_bearing_zone'] = df['_bearing_from_dc'].apply(get_bearing_zone)
+    _lat_arr = df['_lat'].to_numpy(dtype=float)
+    _lon_arr = df['_lon'].to_numpy(dtype=float)
+    df['_bearing_from_dc'] = np.where((_lat_arr > 0) & (_lon_arr > 0),
+                                      calculate_bearings(DC_LAT, DC_LON, _lat_arr, _lon_arr), 0.0)
+    df['_bearing_zone'] = ((df['_bearing_from_dc'] + 11.25) / 22.5).astype(int) % 16  # = get_bearing_zone
     
     # 🚨 เพิ่ม Logistics Zone สำหรับ routing ตามทางหลวง
     # 🗺️ ลำดับความสำคัญ:
     #   1. BRANCH_ZONES_CACHE (จาก zone_viewer.py) — ถ้ามี branch_zones.json
-    #   2. PROVINCE_ZONE_MAP fallback — ใช้ logic เดียวกับ zone_viewer.py
-    def _zone_from_prov_dist(prov: str, dist: str) -> str:
-        """Fallback zone ใช้ logic เดียวกับ zone_viewer.py load_and_classify()"""
-        prov = str(prov or '').strip()
-        for _alias, _full in [("กรุงเทพฯ","กรุงเทพมหานคร"),("กทม","กรุงเทพมหานคร"),("กทม.","กรุงเทพมหานคร"),("โคราช","นครราชสีมา")]:
-            if prov == _alias: prov = _full; break
-        dist = str(dist or '').strip()
-        rz = PROVINCE_ZONE_MAP.get(prov)
-        if rz == '__BKK__':
-            return f'BKK_{dist}' if dist else 'BKK_ไม่ระบุ'
-        if rz:
-            parts = rz.split('_', 1)
-            prefix, prov_short = parts[0], parts[1] if len(parts) > 1 else rz
-            return f'{prefix}_{prov_short}_{dist}' if dist else rz
-        return f'ไม่ระบุ_{prov}' if prov else 'ไม่ระบุ'
-
-    def _get_zone_for_row(row):
-        code = str(row.get('Code', '')).strip().upper()
-        if code and BRANCH_ZONES_CACHE:
-            z = BRANCH_ZONES_CACHE.get(code)
-            if z:
-                return z
-        return _zone_from_prov_dist(row['_province'], row['_district'])
-
-    df['_logistics_zone'] = df.apply(_get_zone_for_row, axis=1)
-    df['_zone_priority'] = df['_logistics_zone'].apply(get_zone_priority)
-    df['_zone_highway'] = df['_logistics_zone'].apply(get_zone_highway)
+    #   2. PROVINCE_ZONE_MAP fallback — ใช้ logic เดียวกับ zone_viewer.py load_and_classify()
+    df['_logistics_zone'] = classify_zones(df['_province'], df['_district'], codes=df['Code'], scheme='viewer')
+    df['_zone_priority'] = ZONE_INDEX.priorities(df['_logistics_zone'])
+    df['_zone_highway'] = ZONE_INDEX.highways(df['_logistics_zone'])
     # 🎯 Province Zone (zone_viewer.py system) — ใช้ป้องกันกระโดดข้ามจังหวัด
-    df['_prov_zone'] = df.apply(
-        lambda row: get_prov_zone(row['_province'], row['_district']), axis=1
-    )
+    df['_prov_zone'] = classify_zones(df['_province'], df['_district'], scheme='province')
     
     # ==========================================
     # Step 3: เรียงลำดับแบบ Hierarchical (Zone Priority > Region > Province Max Dist > District Max Dist > Distance)
     # 🎯 หัวใจสำคัญ: เรียงตาม Region Order ก่อน (ไกลมาใกล้)
     # ==========================================
+    profile_mark('Step 3 hierarchical sort', rows=len(df))
+    plan_phase('Step 3 hierarchical sort')
     
     # เพิ่ม Region Order สำหรับ sorting
     df['_region_order'] = df['_region_name'].map(REGION_ORDER).fillna(99)
@@ -3619,6 +3892,8 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     # ==========================================
     # Step 4: จับกลุ่ม Route เดียวกัน รวมน้ำหนัก
     # ==========================================
+    profile_mark('Step 4 route groups', rows=len(df))
+    plan_phase('Step 4 route groups')
     # สร้าง grouping key จาก route (ถ้ามี) หรือ ตำบล+อำเภอ+จังหวัด
     def get_group_key(row):
         route = row['_route']
@@ -3632,16 +3907,14 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     # ==========================================
     # Step 5: หารถที่เหมาะสมจากข้อจำกัดสาขา + Central Region Rule
     # ==========================================
-    def get_max_vehicle_for_code(code):
-        """หารถที่ใหญ่ที่สุดที่สาขาสามารถใช้ได้ - อ่านจาก Sheets"""
-        max_vehicle = get_max_vehicle_for_branch(code, test_df=test_df)
-        return max_vehicle
-    
+    profile_mark('Step 5 vehicle limits', rows=len(df))
+    plan_phase('Step 5 vehicle limits')
     def get_allowed_vehicles_for_region(region_name):
         """หารถที่ใช้ได้ (อิงตาม Master data เท่านั้น)"""
         return ['4W', 'JB', '6W']  # All vehicles - restrictions from Master data only
     
-    df['_max_vehicle'] = df['Code'].apply(get_max_vehicle_for_code)
+    # หารถที่ใหญ่ที่สุดที่สาขาสามารถใช้ได้ - อ่านจาก Sheets (batch ผ่าน BRANCH_RESOLVER, รหัส WMS เป็นตัวสำรอง)
+    df['_max_vehicle'] = get_max_vehicles(df['Code'], df['WMSCode'] if 'WMSCode' in df.columns else None)
     df['_region_allowed_vehicles'] = df['_region_name'].apply(get_allowed_vehicles_for_region)
     
     # 🎯 สร้าง Vehicle Priority: สาขา 4W = 1 (จัดก่อน), JB = 2, 6W = 3 (จัดทีหลัง)
@@ -3678,6 +3951,9 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     # Step 6: DISTRICT CLUSTERING ALLOCATION (OPTIMIZED)
     # จัดทริปตาม District Buckets พร้อม Split เมื่อเกิน
     # ==========================================
+    _plan_rows = lambda: _plan_state_columns(df)  # rows ของ phase = แถวที่ Trip / Truck เปลี่ยน
+    profile_mark('Step 6 district clustering', track=_plan_rows)
+    plan_phase('Step 6 district clustering')
     trip_counter = 1
     df['Trip'] = 0
     
@@ -3773,10 +4049,10 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
         
         # เช็คว่าทุกสาขาห่างจาก centroid ไม่เกิน 80km
         max_dist_from_center = 0
-        for _, row in trip_df.iterrows():
-            if row['_lat'] > 0 and row['_lon'] > 0:
-                dist = haversine_distance(trip_lat_mean, trip_lon_mean, row['_lat'], row['_lon'], use_osrm_cache=False)
-                max_dist_from_center = max(max_dist_from_center, dist)
+        _valid = trip_df[(trip_df['_lat'] > 0) & (trip_df['_lon'] > 0)]
+        if not _valid.empty:
+            max_dist_from_center = float(distances_from(
+                trip_lat_mean, trip_lon_mean, _valid[['_lat', '_lon']].to_numpy(dtype=float)).max())
         
         # ถ้า spread เกิน 80km ถือว่ากระจายเกินไป (คนละทิศ)
         return max_dist_from_center <= 80
@@ -3803,6 +4079,8 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     # Step 6.4: 🎯 ZONE-STRICT GREEDY - จัดทริปแบบแยกโซน + ห้ามข้ามโซน
     # หลักการ: ใช้ LOGISTICS_ZONES + NO_CROSS_ZONE_PAIRS
     # ==========================================
+    profile_mark('Step 6.4 zone-strict greedy', track=_plan_rows)
+    plan_phase('Step 6.4 zone-strict greedy')
     safe_print("🎯 กำลังจัดทริปใหม่แบบ Zone-Strict (LOGISTICS_ZONES + NO_CROSS_ZONE_PAIRS)...")
 
     # ─── Runtime Nearby Groups (≤10km) ──────────────────────────────────────
@@ -3824,7 +4102,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
             if _nearby_in_run:
                 _rt_same_loc[_nc] = [_nc] + _nearby_in_run
 
-    # Pass 2: สาขาที่ไม่อยู่ใน NEARBY_BRANCHES → ใช้ haversine จาก df พิกัด
+    # Pass 2: สาขาที่ไม่อยู่ใน NEARBY_BRANCHES → ใช้ระยะจาก df พิกัด
     _df_coord_map = {}
     for _, _sr in df.iterrows():
         _slat = float(_sr.get('_lat', 0) or 0)
@@ -3832,12 +4110,25 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
         if _slat > 0 and _slon > 0:
             _df_coord_map[str(_sr['Code']).strip().upper()] = (_slat, _slon)
 
+    # 📐 distance store ของรอบนี้ (id = ลำดับใน _df_coord_map) — cache-then-haversine×1.35 ครบทุกคู่
+    _run_codes = list(_df_coord_map.keys())
+    _dstore = DISTANCE_STORE.subset(
+        _run_codes,
+        [_df_coord_map[c][0] for c in _run_codes],
+        [_df_coord_map[c][1] for c in _run_codes],
+    )
+
+    # 🗺️ spatial index ของรอบนี้ (ตำแหน่งเดียวกับ _dstore) — ใช้ร่วมกันทุก step (radius / nearest)
+    _sidx = SpatialIndex(_dstore.lats, _dstore.lons, keys=_run_codes)
+
     for _nc in _df_codes_upper:
         if _nc not in _rt_same_loc and _nc in _df_coord_map:
-            _nlat, _nlon = _df_coord_map[_nc]
+            _ni = _dstore.index[_nc]
+            _cand = _sidx.within(_df_coord_map[_nc][0], _df_coord_map[_nc][1], _NEARBY_GROUP_KM)
+            _nd = _dstore.distances(_ni, _cand)
             _nearby_hv = [
-                _oc for _oc, (_olat, _olon) in _df_coord_map.items()
-                if _oc != _nc and haversine_distance(_nlat, _nlon, _olat, _olon, use_osrm_cache=False) <= _NEARBY_GROUP_KM
+                _run_codes[_oj] for _oj in _cand[_nd <= _NEARBY_GROUP_KM]
+                if _oj != _ni
             ]
             if _nearby_hv:
                 _rt_same_loc[_nc] = [_nc] + _nearby_hv
@@ -3880,6 +4171,58 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     
     # สร้าง set ของสาขาที่ยังไม่ได้จัด
     unassigned = set(df['Code'].tolist())
+
+    # 🔢 Greedy core ทำงานบนตำแหน่งแถว (df เรียงแล้ว index 0..n-1 และไม่เปลี่ยนจนจบ Step 6.4)
+    # _g_live[pos] = แถวนี้ยังไม่ได้จัด (ตรงกับ df['Code'].isin(unassigned)) → ไม่ต้องกรอง df ทั้งตารางทุกรอบ
+    _g_codes = df['Code'].to_numpy()
+    _g_lat = df['_lat'].to_numpy(dtype=float)
+    _g_lon = df['_lon'].to_numpy(dtype=float)
+    _g_weight = df['Weight'].to_numpy()
+    _g_cube = df['Cube'].to_numpy()
+    _g_qty = df['OriginalQty'].to_numpy() if 'OriginalQty' in df.columns else np.zeros(len(df))
+    _g_province = df['_province'].to_numpy()
+    _g_district = df['_district'].to_numpy()
+    _g_subdistrict = df['_subdistrict'].to_numpy()
+    _g_region = [get_region_name(str(_p or '')) for _p in _g_province]
+    _g_live = np.ones(len(df), dtype=bool)
+
+    def _g_na_key(v):
+        """key ของ dict ที่ให้ NaN ทุกตัวเท่ากัน (เหมือน Series.isin)"""
+        return None if pd.isna(v) else v
+
+    _g_pos_by_code: dict = {}       # Code → [pos]
+    _g_pos_by_upper: dict = {}      # str(Code).upper() → [pos]
+    _g_pos_by_key: dict = {}        # str(Code).strip().upper() → [pos]
+    _g_pos_by_district: dict = {}   # อำเภอ → [pos]
+    for _gp, _gc in enumerate(_g_codes):
+        _g_pos_by_code.setdefault(_gc, []).append(_gp)
+        _g_pos_by_upper.setdefault(str(_gc).upper(), []).append(_gp)
+        _g_pos_by_key.setdefault(str(_gc).strip().upper(), []).append(_gp)
+        _g_pos_by_district.setdefault(_g_na_key(_g_district[_gp]), []).append(_gp)
+    # spatial index ของแถว df (ตำแหน่งเดียวกับ _g_*) — กรองรัศมีก่อนคำนวณระยะถนน
+    _g_sidx = SpatialIndex(_g_lat, _g_lon)
+
+    def _g_first(index, key):
+        """ตำแหน่งแถวแรกของ key ใน index (None ถ้าไม่มี)"""
+        _ps = index.get(key)
+        return _ps[0] if _ps else None
+
+    def _g_live_of(index, keys):
+        """ตำแหน่งแถวที่ยังไม่ได้จัดของ keys (เรียงตามลำดับใน df)"""
+        return sorted(_p for _k in keys for _p in index.get(_k, ()) if _g_live[_p])
+
+    def _g_is_live(index, key):
+        return any(_g_live[_p] for _p in index.get(key, ()))
+
+    def _g_take(code):
+        """ลบ code ออกจาก unassigned (ตรงตัวก่อน ไม่งั้นเทียบตัวพิมพ์ใหญ่) + ปิด _g_live ของแถวนั้น"""
+        if code not in unassigned:
+            _p = next((_p for _p in _g_pos_by_upper.get(str(code).upper(), ()) if _g_live[_p]), None)
+            if _p is None:
+                return
+            code = _g_codes[_p]
+        unassigned.remove(code)
+        _g_live[_g_pos_by_code[code]] = False
     
     # 3️⃣ เรียงลำดับ 1 ครั้ง (ไกลสุด→ใกล้สุด ตามโซน) แล้วเดิน pointer + epidemic frontier
     _sorted_start_codes = list(df.sort_values(
@@ -3893,9 +4236,9 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     _EPIDEMIC_NEXT_KM = 60             # ระยะสูงสุดที่ถือว่า frontier ของทริปก่อนยังต่อเนื่องกัน
 
     while unassigned:
-        unassigned_df = df[df['Code'].isin(unassigned)]
-        if unassigned_df.empty:
+        if not _g_live.any():
             break
+        plan_check()
 
         farthest_row = None
 
@@ -3907,38 +4250,38 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
             _ep_best_dist = 999.0
             _ep_best_priority = 9  # 0=ตำบล, 1=อำเภอ, 2=nearest
 
-            for _, _eprow in unassigned_df.iterrows():
-                _eplat = float(_eprow.get('_lat', 0) or 0)
-                _eplon = float(_eprow.get('_lon', 0) or 0)
-                if _eplat > 0 and _eplon > 0:
-                    _epd = min(
-                        haversine_distance(_eplat, _eplon, _lt, _ln, False)
-                        for _lt, _ln in _last_trip_all_coords
-                    )
-                    if _epd <= _EPIDEMIC_NEXT_KM:
-                        # ถ้ารู้ภาคของทริปล่าสุด → กรองเฉพาะภาคเดียวกัน
-                        _ep_cand_region = get_region_name(str(_eprow.get('_province', '') or ''))
-                        if (_last_trip_region and _last_trip_region not in ('', 'ไม่ระบุ') and
-                                _ep_cand_region and _ep_cand_region not in ('', 'ไม่ระบุ') and
-                                _ep_cand_region != _last_trip_region):
-                            continue  # ต่างภาค → ข้าม (ปล่อยให้ pointer จัดการ)
-                        # คำนวณ priority: ตำบลเดียวกัน=0, อำเภอเดียวกัน=1, อื่นๆ=2
-                        _ep_sub = str(_eprow.get('_subdistrict', '') or '')
-                        _ep_dis = str(_eprow.get('_district', '') or '')
-                        if _last_trip_subdistricts and _ep_sub and _ep_sub in _last_trip_subdistricts:
-                            _ep_prio = 0
-                        elif _last_trip_districts and _ep_dis and _ep_dis in _last_trip_districts:
-                            _ep_prio = 1
-                        else:
-                            _ep_prio = 2
-                        # เลือก: priority ต่ำก่อน; priority เท่ากัน → ใกล้สุดก่อน
-                        if (_ep_prio < _ep_best_priority or
-                                (_ep_prio == _ep_best_priority and _epd < _ep_best_dist)):
-                            _ep_best_priority = _ep_prio
-                            _ep_best_dist = _epd
-                            _ep_best = _eprow
+            # กรองด้วย spatial index ก่อน (≤ _EPIDEMIC_NEXT_KM จาก frontier) แล้วคำนวณระยะต่ำสุดครั้งเดียว
+            _ep_pos = _g_sidx.within_any(_last_trip_all_coords, _EPIDEMIC_NEXT_KM)
+            _ep_pos = _ep_pos[_g_live[_ep_pos]]
+            _ep_min = (distance_matrix(np.column_stack([_g_lat[_ep_pos], _g_lon[_ep_pos]]),
+                                       _last_trip_all_coords).min(axis=1)
+                       if len(_ep_pos) else [])
+            for _ep_k, _ep_p in enumerate(_ep_pos.tolist()):
+                _epd = float(_ep_min[_ep_k])
+                if _epd <= _EPIDEMIC_NEXT_KM:
+                    # ถ้ารู้ภาคของทริปล่าสุด → กรองเฉพาะภาคเดียวกัน
+                    _ep_cand_region = _g_region[_ep_p]
+                    if (_last_trip_region and _last_trip_region not in ('', 'ไม่ระบุ') and
+                            _ep_cand_region and _ep_cand_region not in ('', 'ไม่ระบุ') and
+                            _ep_cand_region != _last_trip_region):
+                        continue  # ต่างภาค → ข้าม (ปล่อยให้ pointer จัดการ)
+                    # คำนวณ priority: ตำบลเดียวกัน=0, อำเภอเดียวกัน=1, อื่นๆ=2
+                    _ep_sub = str(_g_subdistrict[_ep_p] or '')
+                    _ep_dis = str(_g_district[_ep_p] or '')
+                    if _last_trip_subdistricts and _ep_sub and _ep_sub in _last_trip_subdistricts:
+                        _ep_prio = 0
+                    elif _last_trip_districts and _ep_dis and _ep_dis in _last_trip_districts:
+                        _ep_prio = 1
+                    else:
+                        _ep_prio = 2
+                    # เลือก: priority ต่ำก่อน; priority เท่ากัน → ใกล้สุดก่อน
+                    if (_ep_prio < _ep_best_priority or
+                            (_ep_prio == _ep_best_priority and _epd < _ep_best_dist)):
+                        _ep_best_priority = _ep_prio
+                        _ep_best_dist = _epd
+                        _ep_best = _ep_p
             if _ep_best is not None:
-                farthest_row = _ep_best
+                farthest_row = df.iloc[_ep_best]
 
         if farthest_row is None:
             # ไม่มีสาขาใกล้ frontier (หรือทริปแรก) → ใช้ pointer ตาม sorted order
@@ -3946,14 +4289,11 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 _sc = _sorted_start_codes[_sorted_start_ptr]
                 _sorted_start_ptr += 1
                 if _sc in unassigned:
-                    _frows = df[df['Code'] == _sc]
-                    if not _frows.empty:
-                        farthest_row = _frows.iloc[0]
+                    farthest_row = df.iloc[_g_pos_by_code[_sc][0]]
                     break
         if farthest_row is None:
-            farthest_row = unassigned_df.sort_values(
-                ['_zone_priority', '_distance_from_dc'], ascending=[True, False]
-            ).iloc[0]
+            # df เรียงตาม (_zone_priority, _distance_from_dc) อยู่แล้ว → แถวแรกที่ยังไม่ได้จัด
+            farthest_row = df.iloc[int(np.flatnonzero(_g_live)[0])]
         
         # เลือกสาขาแรก (ไกลสุด + ข้อจำกัดมากสุด)
         start_code = farthest_row['Code']
@@ -3993,7 +4333,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
         # 🎯 ดึงสาขาทั้งกลุ่ม (≤10km = จุดส่งใกล้เคียง) ของสาขาแรก
         # ใช้ get_group_branches_rt: รวม precomputed(≤200m) + runtime nearby(≤10km)
         start_group_codes = get_group_branches_rt(start_code)
-        start_group_unassigned = [c for c in start_group_codes if c in unassigned or c.upper() in [str(x).upper() for x in unassigned]]
+        start_group_unassigned = [c for c in start_group_codes if c in unassigned or _g_is_live(_g_pos_by_upper, c.upper())]
         if not start_group_unassigned:
             start_group_unassigned = [start_code]
 
@@ -4008,10 +4348,10 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 for _nb, _nd in NEARBY_BRANCHES[cu]:
                     if _nb == str(start_code).strip().upper():
                         return _nd
-            sr = df[df['Code'].apply(lambda x: str(x).upper() == cu)]
-            if not sr.empty and start_lat > 0 and start_lon > 0:
-                _slat = float(sr.iloc[0].get('_lat', 0) or 0)
-                _slon = float(sr.iloc[0].get('_lon', 0) or 0)
+            _sp = _g_first(_g_pos_by_upper, cu)
+            if _sp is not None and start_lat > 0 and start_lon > 0:
+                _slat = float(_g_lat[_sp] or 0)
+                _slon = float(_g_lon[_sp] or 0)
                 if _slat > 0 and _slon > 0:
                     return haversine_distance(_slat, _slon, start_lat, start_lon, use_osrm_cache=False)
             return 999.0
@@ -4031,11 +4371,11 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
         trip_cube = 0
         trip_qty = 0  # นับชิ้น (OriginalQty)
         for gc in start_group_unassigned:
-            gc_row = df[df['Code'].apply(lambda x: str(x).upper() == str(gc).upper())]
-            if not gc_row.empty:
-                actual_code = gc_row.iloc[0]['Code']
-                _gc_w = gc_row.iloc[0]['Weight']
-                _gc_c = gc_row.iloc[0]['Cube']
+            _gcp = _g_first(_g_pos_by_upper, str(gc).upper())
+            if _gcp is not None:
+                actual_code = _g_codes[_gcp]
+                _gc_w = _g_weight[_gcp]
+                _gc_c = _g_cube[_gcp]
 
                 # 🚫 Capacity check สำหรับสมาชิกที่ไกลกว่า 0.3km (ไม่ใช่พิกัดเดียวกัน)
                 _gc_is_start = (str(gc).upper() == str(start_code).upper())
@@ -4049,7 +4389,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                             safe_print(f"      📦 START-GROUP SKIP (เต็ม): {actual_code} (+{_gc_w:.0f}kg) → รอ greedy")
                             continue  # ไม่เพิ่ม — greedy loop จะหยิบทีหลัง
                         # region guard
-                        _sg_prov = str(gc_row.iloc[0].get('_province', '') or '')
+                        _sg_prov = str(_g_province[_gcp] or '')
                         _sg_region = get_region_name(_sg_prov) if _sg_prov else ''
                         if trip_original_region and trip_original_region not in ('', 'ไม่ระบุ'):
                             if _sg_region and _sg_region not in ('', 'ไม่ระบุ') and _sg_region != trip_original_region:
@@ -4058,15 +4398,9 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 trip_codes.append(actual_code)
                 trip_weight += _gc_w
                 trip_cube += _gc_c
-                trip_qty += int(float(gc_row.iloc[0].get('OriginalQty', 0) or 0))
+                trip_qty += int(float(_g_qty[_gcp] or 0))
                 # ลบออกจาก unassigned
-                if actual_code in unassigned:
-                    unassigned.remove(actual_code)
-                else:
-                    for u in list(unassigned):
-                        if str(u).upper() == str(actual_code).upper():
-                            unassigned.remove(u)
-                            break
+                _g_take(actual_code)
         
         if len(trip_codes) > 1:
             safe_print(f"  🌏 ทริปใหม่ #{trip_counter} เริ่มที่ {start_code} | จังหวัด='{trip_original_province}' | ภาค='{trip_original_region}' | zone='{trip_logistics_zone}'")
@@ -4078,10 +4412,6 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
         # ใช้ highway number จาก LOGISTICS_ZONES เป็น "ถนนเส้นเดียวกัน" — trip_original_hws lock ไว้แล้ว
         trip_max_dist_dc = float(farthest_row.get('_distance_from_dc', 0) or 0)
 
-        # หา allowed vehicles จาก constraints (จำกัดตาม trip_max_vehicle)
-        trip_allowed = get_allowed_from_codes(trip_codes, ['4W', 'JB', '6W'])
-        trip_is_punthai = all(branch_bu_cache.get(c, False) for c in trip_codes)
-        
         # ─── ระยะ reach สูงสุดที่ยอมขยายออกจากทริป (km) ───
         # ปรับได้: ยิ่งมากยิ่ง "ดึงโซนใกล้เคียง" แต่อาจรวมสาขาไกลเกินไป
         _MAX_EXPAND_KM     = 80   # ขยายสูงสุด 80km จากสาขาใดๆ ในทริป → adjacent zones
@@ -4089,8 +4419,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
 
         # 2️⃣ Greedy: หาสาขาใกล้สุดมาเติมจนเต็ม buffer
         while unassigned:
-            remaining_df = df[df['Code'].isin(unassigned)].copy()
-            if remaining_df.empty:
+            if not _g_live.any():
                 break
             
             # ✅ รีเซ็ต same_zone_df ทุก iteration ป้องกัน stale value จาก iteration ก่อน
@@ -4114,16 +4443,15 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
             filter_level  = ""
 
             # ─── คำนวณ reach codes จาก NEARBY_BRANCHES + haversine ───
-            unassigned_upper_set_vc = {str(c).strip().upper() for c in unassigned}
             reach_codes       = set()   # ≤ _CHAIN_KM จากสาขาใดในทริป
             cross_zone_codes  = set()   # ≤ _CROSS_ZONE_KM (ข้ามโซนได้)
             ultra_close_codes = set()   # < 8 km (bypass ทุก filter)
 
             _trip_coords_reach = []
             for _tc in trip_codes:
-                _tr = df[df['Code'] == _tc]
-                if not _tr.empty:
-                    _tlat = _tr.iloc[0]['_lat']; _tlon = _tr.iloc[0]['_lon']
+                _tp = _g_first(_g_pos_by_code, _tc)
+                if _tp is not None:
+                    _tlat = _g_lat[_tp]; _tlon = _g_lon[_tp]
                     if _tlat and _tlat > 0 and _tlon and _tlon > 0:
                         _trip_coords_reach.append((_tlat, _tlon))
 
@@ -4131,7 +4459,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 _tc_upper = str(_tc).strip().upper()
                 if _tc_upper in NEARBY_BRANCHES:
                     for nearby_code, dist in NEARBY_BRANCHES[_tc_upper]:
-                        if nearby_code in unassigned_upper_set_vc:
+                        if _g_is_live(_g_pos_by_key, nearby_code):
                             if dist <= _CHAIN_KM:
                                 reach_codes.add(nearby_code)
                             if dist <= _CROSS_ZONE_KM:
@@ -4140,12 +4468,14 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                                 ultra_close_codes.add(nearby_code)
 
             if _trip_coords_reach:
-                for _, _rrow in remaining_df.iterrows():
-                    _rc_upper = str(_rrow['Code']).strip().upper()
-                    _rlat = _rrow['_lat']; _rlon = _rrow['_lon']
-                    if _rlat and _rlat > 0 and _rlon and _rlon > 0:
-                        _min_d = min(haversine_distance(_rlat, _rlon, _tlat, _tlon, use_osrm_cache=False)
-                                     for _tlat, _tlon in _trip_coords_reach)
+                # เฉพาะแถวที่ยังไม่ได้จัดในรัศมีเส้นตรง _CHAIN_KM (ระยะถนน ≥ เส้นตรง จึงไม่ตกหล่น)
+                _r_pos = _g_sidx.within_any(_trip_coords_reach, _CHAIN_KM)
+                _r_pos = _r_pos[_g_live[_r_pos]]
+                if len(_r_pos):
+                    _r_min = distance_matrix(
+                        np.column_stack([_g_lat[_r_pos], _g_lon[_r_pos]]), _trip_coords_reach).min(axis=1)
+                    for _rp, _min_d in zip(_r_pos.tolist(), _r_min):
+                        _rc_upper = str(_g_codes[_rp]).strip().upper()
                         if _min_d <= _CHAIN_KM:
                             reach_codes.add(_rc_upper)
                         if _min_d <= _CROSS_ZONE_KM:
@@ -4154,27 +4484,20 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                             ultra_close_codes.add(_rc_upper)
 
             # Level 0: ตำบล/อำเภอเดียวกัน → รวมใน reach เสมอ (ไม่มี distance limit)
-            if trip_subdistricts and trip_districts:
-                _sub0 = remaining_df[
-                    remaining_df['_subdistrict'].isin(trip_subdistricts) &
-                    remaining_df['_district'].isin(trip_districts)
-                ]
-                for _rc0 in _sub0['Code']:
-                    reach_codes.add(str(_rc0).strip().upper())
-            elif trip_districts:
-                _dis0 = remaining_df[remaining_df['_district'].isin(trip_districts)]
-                for _rc0 in _dis0['Code']:
-                    reach_codes.add(str(_rc0).strip().upper())
+            if trip_districts:
+                _subs0 = {_g_na_key(_s) for _s in trip_subdistricts}
+                for _rp0 in _g_live_of(_g_pos_by_district, {_g_na_key(_d) for _d in trip_districts}):
+                    if _subs0 and _g_na_key(_g_subdistrict[_rp0]) not in _subs0:
+                        continue
+                    reach_codes.add(str(_g_codes[_rp0]).strip().upper())
 
             # Level 1: 🦠 Epidemic frontier — ทุกสาขาใน reach_codes (≤_CHAIN_KM จากสาขาใดในทริป)
             # ไม่จำกัด _prov_zone: ให้ epidemic แพร่ข้ามโซนได้ตามธรรมชาติ
             # province/region/BKK guard ทำในลูป candidate ด้านล่าง
             if reach_codes:
-                _sz_df = remaining_df[
-                    remaining_df['Code'].apply(lambda x: str(x).strip().upper() in reach_codes)
-                ].copy()
-                if not _sz_df.empty:
-                    same_zone_df = _sz_df
+                _sz_pos = _g_live_of(_g_pos_by_key, reach_codes)
+                if _sz_pos:
+                    same_zone_df = df.iloc[_sz_pos].copy()
                     filter_level = f"epidemic-frontier({_CHAIN_KM}km)"
 
             # (Level 2 ถูกรวมเข้า Level 1 แล้ว — reach_codes ครอบคลุม ≤_CHAIN_KM ทุกทิศทาง)
@@ -4190,13 +4513,11 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                     _tc_upper = str(_tc).strip().upper()
                     if _tc_upper in NEARBY_BRANCHES:
                         for _nb_code, _nb_dist in NEARBY_BRANCHES[_tc_upper]:
-                            if _nb_code in unassigned_upper_set_vc:
-                                _nb_row = remaining_df[remaining_df['Code'].apply(
-                                    lambda x: str(x).strip().upper() == _nb_code)]
-                                if not _nb_row.empty:
-                                    _nb_zone = _nb_row.iloc[0].get('_prov_zone', '')
-                                    _nb_region = get_region_name(str(_nb_row.iloc[0].get('_province', '') or ''))
-                                    _nb_candidates.append((_nb_dist, _nb_code, _nb_zone, _nb_region))
+                            _nb_pos = _g_live_of(_g_pos_by_key, (_nb_code,))
+                            if _nb_pos:
+                                _nb_zone = df['_prov_zone'].iat[_nb_pos[0]] if '_prov_zone' in df.columns else ''
+                                _nb_region = _g_region[_nb_pos[0]]
+                                _nb_candidates.append((_nb_dist, _nb_code, _nb_zone, _nb_region))
                 # ลบ duplicates (เก็บ min dist ต่อ code)
                 _nb_best: dict = {}
                 for _nd, _nc, _nz, _nr in _nb_candidates:
@@ -4215,11 +4536,11 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                             _nr2 and _nr2 not in ('', 'ไม่ระบุ') and _nr2 != trip_original_region):
                         continue
                     # ตรวจ BKK isolation
-                    _nb_r2 = remaining_df[remaining_df['Code'].apply(
-                        lambda x: str(x).strip().upper() == _nc2)]
-                    if _nb_r2.empty:
+                    _nb_pos2 = _g_live_of(_g_pos_by_key, (_nc2,))
+                    if not _nb_pos2:
                         continue
-                    _nb_prov2 = str(_nb_r2.iloc[0].get('_province', '') or '')
+                    _nb_r2 = df.iloc[_nb_pos2]
+                    _nb_prov2 = str(_g_province[_nb_pos2[0]] or '')
                     _BKK = 'กรุงเทพมหานคร'
                     if ((_nb_prov2 == _BKK and trip_original_province not in ('', None) and trip_original_province != _BKK) or
                             (trip_original_province == _BKK and _nb_prov2 and _nb_prov2 != _BKK)):
@@ -4288,46 +4609,34 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
             same_zone_df.loc[mask_province, '_priority'] = 3
             
             # 🎯 คำนวณระยะทาง - ใช้ pre-computed ถ้ามี
-            unassigned_upper = {str(c).strip().upper() for c in unassigned}
-            
             candidate_distances = {}
             for tc in trip_codes:
                 tc_upper = str(tc).strip().upper()
                 if tc_upper in NEARBY_BRANCHES:
                     for nearby_code, dist in NEARBY_BRANCHES[tc_upper]:
-                        if nearby_code in unassigned_upper:
+                        if _g_is_live(_g_pos_by_key, nearby_code):
                             if nearby_code not in candidate_distances or dist < candidate_distances[nearby_code]:
                                 candidate_distances[nearby_code] = dist
             
             # คำนวณระยะทาง — ใช้ NEARBY_BRANCHES cache ถ้ามี
             # fallback: haversine จาก branch ในทริปที่ใกล้ที่สุด (ไม่ใช่แค่ branch สุดท้าย)
             # → รองรับกรณีที่ branch สุดท้ายอยู่ปลายทาง (เช่น เชียงคำ) แต่ trip มี branch อื่นที่ใกล้กว่า
-            _last_code_d = trip_codes[-1]
-            _last_row_d = df[df['Code'] == _last_code_d].iloc[0]
-            _last_lat_d, _last_lon_d = _last_row_d['_lat'], _last_row_d['_lon']
-
             # Pre-compute valid coords of all branches in trip (for nearest-branch fallback)
-            _trip_valid_coords = []
-            for _tc_coord in trip_codes:
-                _tr = df[df['Code'] == _tc_coord]
-                if not _tr.empty:
-                    _tlat = _tr.iloc[0]['_lat']
-                    _tlon = _tr.iloc[0]['_lon']
-                    if _tlat and _tlat > 0 and _tlon and _tlon > 0:
-                        _trip_valid_coords.append((_tlat, _tlon))
-
-            def _dist_for_row(row):
-                cu = str(row['Code']).strip().upper()
-                if cu in candidate_distances:
-                    return candidate_distances[cu]
-                # fallback: haversine จาก branch ในทริปที่ใกล้ที่สุด (nearest-branch)
-                clat, clon = row['_lat'], row['_lon']
-                if clat and clat > 0 and clon and clon > 0 and _trip_valid_coords:
-                    return min(haversine_distance(clat, clon, tlat, tlon, use_osrm_cache=False)
-                               for tlat, tlon in _trip_valid_coords)
-                return 999
-
-            same_zone_df['_dist_to_trip'] = same_zone_df.apply(_dist_for_row, axis=1)
+            _trip_valid_coords = list(_trip_coords_reach)
+
+            # fallback: ระยะจาก branch ในทริปที่ใกล้ที่สุด (nearest-branch) — คำนวณทั้งชุดครั้งเดียว
+            _sz_codes = same_zone_df['Code'].astype(str).str.strip().str.upper()
+            _sz_lat = same_zone_df['_lat'].astype(float).to_numpy()
+            _sz_lon = same_zone_df['_lon'].astype(float).to_numpy()
+            _sz_dist = np.full(len(same_zone_df), 999.0)
+            _sz_ok = (_sz_lat > 0) & (_sz_lon > 0)
+            if _trip_valid_coords and _sz_ok.any():
+                _sz_dist[_sz_ok] = distance_matrix(
+                    np.column_stack([_sz_lat[_sz_ok], _sz_lon[_sz_ok]]), _trip_valid_coords).min(axis=1)
+            same_zone_df['_dist_to_trip'] = [
+                candidate_distances[cu] if cu in candidate_distances else float(d)
+                for cu, d in zip(_sz_codes, _sz_dist)
+            ]
             
             # เรียงตาม จังหวัดเดียวกันก่อน + priority + distance
             _trip_provs_sort = {p for p in [trip_province, trip_original_province] if p}
@@ -4440,7 +4749,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 # ใช้ get_group_branches_rt: รวม precomputed(≤200m) + runtime same-coord
                 group_codes = get_group_branches_rt(candidate_code)
                 # กรองเฉพาะสาขาที่ยังไม่ได้จัดและมีใน df
-                group_codes_unassigned = [c for c in group_codes if c in unassigned or c.upper() in [str(x).upper() for x in unassigned]]
+                group_codes_unassigned = [c for c in group_codes if c in unassigned or _g_is_live(_g_pos_by_upper, c.upper())]
                 if not group_codes_unassigned:
                     group_codes_unassigned = [candidate_code]
                 
@@ -4448,26 +4757,28 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 group_weight = 0
                 group_cube = 0
                 group_codes_valid = []
+                group_qty = 0
                 for gc in group_codes_unassigned:
-                    gc_row = df[df['Code'].apply(lambda x: str(x).upper() == str(gc).upper())]
-                    if not gc_row.empty:
+                    _cgp = _g_first(_g_pos_by_upper, str(gc).upper())
+                    if _cgp is not None:
                         # 🏠 สมาชิกกลุ่ม (≤200m จาก candidate) = จุดส่งเดียวกัน → ไม่แยกทริปเด็ดขาด
                         # ตรวจระยะก่อน — ถ้าอยู่ใกล้ (<0.3km) ให้ข้าม region guard
-                        _cg_lat = float(gc_row.iloc[0].get('_lat', 0) or 0)
-                        _cg_lon = float(gc_row.iloc[0].get('_lon', 0) or 0)
+                        _cg_lat = float(_g_lat[_cgp] or 0)
+                        _cg_lon = float(_g_lon[_cgp] or 0)
                         _cd_lat = float(candidate_row.get('_lat', 0) or 0)
                         _cd_lon = float(candidate_row.get('_lon', 0) or 0)
                         _cg_phys_dist = haversine_distance(_cg_lat, _cg_lon, _cd_lat, _cd_lon, use_osrm_cache=False) if (_cg_lat > 0 and _cg_lon > 0 and _cd_lat > 0 and _cd_lon > 0) else 999
                         if _cg_phys_dist > 0.3:  # ถ้าไกลกว่า 300m → ตรวจ region guard ตามปกติ
                             if trip_original_region and trip_original_region not in ('', 'ไม่ระบุ'):
-                                _cg_prov = str(gc_row.iloc[0].get('_province', '') or '')
+                                _cg_prov = str(_g_province[_cgp] or '')
                                 _cg_region = get_region_name(_cg_prov) if _cg_prov else ''
                                 if _cg_region and _cg_region not in ('', 'ไม่ระบุ') and _cg_region != trip_original_region:
                                     safe_print(f"      🛑 CAND-GROUP GUARD: ตัด {gc} ภาค {_cg_region} ≠ {trip_original_region} (ห่าง {_cg_phys_dist:.1f}km)")
                                     continue  # ไม่เพิ่มเข้ากลุ่ม — น้ำหนัก/คิวก็ไม่นับ
-                        group_weight += gc_row.iloc[0]['Weight']
-                        group_cube += gc_row.iloc[0]['Cube']
-                        group_codes_valid.append(gc_row.iloc[0]['Code'])
+                        group_weight += _g_weight[_cgp]
+                        group_cube += _g_cube[_cgp]
+                        group_qty += int(float(_g_qty[_cgp] or 0))
+                        group_codes_valid.append(_g_codes[_cgp])
                 
                 if not group_codes_valid:
                     continue
@@ -4495,8 +4806,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 test_weight = trip_weight + group_weight
                 test_cube = trip_cube + group_cube
                 test_drops = len(test_codes)
-                # คำนวณ qty กลุ่มนี้
-                group_qty = sum(int(float(df[df['Code'].apply(lambda x: str(x).upper() == str(gc).upper())].iloc[0].get('OriginalQty', 0) or 0)) for gc in group_codes_valid if not df[df['Code'].apply(lambda x: str(x).upper() == str(gc).upper())].empty)
+                # qty กลุ่มนี้ (รวมไว้แล้วตอนเก็บ group_codes_valid)
                 test_qty = trip_qty + group_qty
                 # ตรวจ max_qty: ถ้าเต็มแล้ว → ปิดทริปก่อนเพิ่ม
                 if max_qty_per_trip > 0 and test_qty > max_qty_per_trip:
@@ -4540,21 +4850,12 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 for gc in group_codes_valid:
                     if gc not in trip_codes:
                         trip_codes.append(gc)
-                    # ลบออกจาก unassigned
-                    if gc in unassigned:
-                        unassigned.remove(gc)
-                    else:
-                        # กรณี code เป็น uppercase/lowercase ต่างกัน
-                        for u in list(unassigned):
-                            if str(u).upper() == str(gc).upper():
-                                unassigned.remove(u)
-                                break
+                    # ลบออกจาก unassigned (รองรับ code ที่ตัวพิมพ์ต่างกัน)
+                    _g_take(gc)
                 
                 trip_weight = test_weight
                 trip_cube = test_cube
                 trip_qty = test_qty
-                trip_allowed = test_allowed
-                trip_is_punthai = test_is_punthai
                 found_candidate = True
                 
                 if len(group_codes_valid) > 1:
@@ -4592,111 +4893,24 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 safe_print(f"      🛑 epidemic candidates ถูกกรองหมด #{trip_counter} ({len(trip_codes)} สาขา) → ปิดทริป")
                 break
 
-            if False:  # _DEAD_CODE: force-fill province (ลบออกแล้ว — epidemic model ไม่เก็บตก)
-                _ff_lims = PUNTHAI_LIMITS if trip_is_punthai else LIMITS
-                _ff_buf = punthai_buffer if trip_is_punthai else maxmart_buffer
-                _ff_cur_veh = next((v for v in reversed(['4W', 'JB', '6W']) if v in (trip_allowed or ['6W'])), '6W')
-                _ff_cur_lim = _ff_lims.get(_ff_cur_veh, _ff_lims['6W'])
-                _ff_max_w = _ff_cur_lim['max_w'] * _ff_buf
-                _ff_max_c = _ff_cur_lim['max_c'] * _ff_buf
-                _ff_util = max(
-                    trip_weight / _ff_max_w if _ff_max_w > 0 else 1,
-                    trip_cube / _ff_max_c if _ff_max_c > 0 else 1
-                )
-                _force_filled = False
-                if _ff_util < 1.0 and trip_original_province:
-                    _ff_rem = df[df['Code'].isin(unassigned)].copy()
-                    _ff_same = _ff_rem[
-                        _ff_rem['_province'].apply(lambda p: str(p or '').strip() == str(trip_original_province).strip())
-                    ].copy()
-                    if not _ff_same.empty:
-                        if _trip_valid_coords:
-                            _ff_same['_ff_dist'] = _ff_same.apply(
-                                lambda row: min(
-                                    haversine_distance(float(row['_lat'] or 0), float(row['_lon'] or 0), tlat, tlon, use_osrm_cache=False)
-                                    for tlat, tlon in _trip_valid_coords
-                                ) if float(row.get('_lat', 0) or 0) > 0 else 999,
-                                axis=1
-                            )
-                        else:
-                            _ff_same['_ff_dist'] = 999
-                        _ff_same = _ff_same.sort_values('_ff_dist')
-                        for _, _ff_row in _ff_same.iterrows():
-                            _ff_code = _ff_row['Code']
-                            _ff_prov = str(_ff_row.get('_province', '') or '')
-                            # BKK isolation
-                            _BKK = 'กรุงเทพมหานคร'
-                            if ((_ff_prov == _BKK and trip_original_province != _BKK) or
-                                    (trip_original_province == _BKK and _ff_prov and _ff_prov != _BKK)):
-                                continue
-                            # ZONE_NEARBY: ห้ามต่างจังหวัด
-                            _ff_zone = str(_ff_row.get('_logistics_zone', '') or '')
-                            _is_trip_nb_ff = str(trip_logistics_zone or '').startswith('ZONE_NEARBY_')
-                            _is_cand_nb_ff = _ff_zone.startswith('ZONE_NEARBY_')
-                            if (_is_trip_nb_ff or _is_cand_nb_ff) and _ff_prov != trip_original_province:
-                                continue
-                            # Region check
-                            _ff_region = get_region_name(_ff_prov) if _ff_prov else ''
-                            if (trip_original_region and trip_original_region not in ('', 'ไม่ระบุ') and
-                                    _ff_region and _ff_region not in ('', 'ไม่ระบุ') and
-                                    _ff_region != trip_original_region):
-                                continue
-                            # Vehicle constraint + capacity check
-                            _ff_test_codes = trip_codes + [_ff_code]
-                            _ff_test_allowed = get_allowed_from_codes(_ff_test_codes, ['4W', 'JB', '6W'])
-                            if not _ff_test_allowed:
-                                continue
-                            _ff_test_w = trip_weight + float(_ff_row.get('Weight', 0) or 0)
-                            _ff_test_c = trip_cube + float(_ff_row.get('Cube', 0) or 0)
-                            _ff_test_d = len(_ff_test_codes)
-                            _ff_veh_ok = None
-                            for _ffv in ['4W', 'JB', '6W']:
-                                if _ffv not in _ff_test_allowed:
-                                    continue
-                                _ffvl = _ff_lims.get(_ffv, _ff_lims['6W'])
-                                if (_ff_test_w <= _ffvl['max_w'] * _ff_buf and
-                                        _ff_test_c <= _ffvl['max_c'] * _ff_buf and
-                                        _ff_test_d <= _ffvl.get('max_drops', 999)):
-                                    _ff_veh_ok = _ffv
-                                    break
-                            if not _ff_veh_ok:
-                                continue
-                            # ✅ เพิ่มสาขา (ไม่จำกัดระยะ)
-                            trip_codes.append(_ff_code)
-                            if _ff_code in unassigned:
-                                unassigned.remove(_ff_code)
-                            else:
-                                for _u in list(unassigned):
-                                    if str(_u).upper() == str(_ff_code).upper():
-                                        unassigned.remove(_u)
-                                        break
-                            trip_weight = _ff_test_w
-                            trip_cube = _ff_test_c
-                            trip_allowed = _ff_test_allowed
-                            trip_is_punthai = all(branch_bu_cache.get(c, False) for c in trip_codes)
-                            safe_print(f"      🔋 Force-fill #{trip_counter}: +{_ff_code} ({_ff_prov}) util={_ff_util*100:.0f}%")
-                            _force_filled = True
-                            break
-                if not _force_filled:
-                    pass  # epidemic model: ไม่ใช้ force-fill → ปิดทริปด้านบนแล้ว
-
         # 3️⃣ Assign ทริป
-        for code in trip_codes:
-            df.loc[df['Code'] == code, 'Trip'] = trip_counter
+        _trip_pos = [_p for code in trip_codes for _p in _g_pos_by_code.get(code, ())]
+        if _trip_pos:
+            df.iloc[_trip_pos, df.columns.get_loc('Trip')] = trip_counter
         
         # 🦠 อัปเดต epidemic frontier สำหรับทริปถัดไป
         _last_trip_all_coords = []
         _last_trip_subdistricts = set()
         _last_trip_districts = set()
         for _ltc in trip_codes:
-            _ltr = df[df['Code'] == _ltc]
-            if not _ltr.empty:
-                _ltlat = float(_ltr.iloc[0].get('_lat', 0) or 0)
-                _ltlon = float(_ltr.iloc[0].get('_lon', 0) or 0)
+            _ltp = _g_first(_g_pos_by_code, _ltc)
+            if _ltp is not None:
+                _ltlat = float(_g_lat[_ltp] or 0)
+                _ltlon = float(_g_lon[_ltp] or 0)
                 if _ltlat > 0 and _ltlon > 0:
                     _last_trip_all_coords.append((_ltlat, _ltlon))
-                _lt_sub = str(_ltr.iloc[0].get('_subdistrict', '') or '')
-                _lt_dis = str(_ltr.iloc[0].get('_district', '') or '')
+                _lt_sub = str(_g_subdistrict[_ltp] or '')
+                _lt_dis = str(_g_district[_ltp] or '')
                 if _lt_sub: _last_trip_subdistricts.add(_lt_sub)
                 if _lt_dis: _last_trip_districts.add(_lt_dis)
         _last_trip_region = trip_original_region
@@ -4705,17 +4919,22 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
         trip_counter += 1
     
     safe_print(f"🎯 จัดทริปเสร็จ: {trip_counter - 1} ทริป")
+    plan_ready()  # มีแผนครบแล้ว → ยกเลิก/หมดเวลาหลังจากนี้ข้าม phase เสริม แล้วคืนแผนนี้
 
     # ==========================================
     # Step 6.4.4: 🔋 FILL-UP PASS — เติมรถที่ยังไม่เต็มด้วยสาขาที่เหลือ
     # สาขาที่ยังไม่ได้จัด (unassigned) → ลองเพิ่มเข้าทริปที่ util < 70%
     # เฉพาะสาขาที่อยู่ในภาค/จังหวัดเดียวกัน และใกล้ทริปนั้น ≤ 60km
     # ==========================================
+    profile_mark('Step 6.4.4 fill-up', track=_plan_rows)
+    plan_phase('Step 6.4.4 fill-up', optional=True)
     safe_print("🔋 Fill-up pass: ตรวจสอบทริปที่ยังไม่เต็ม...")
     _FILLUP_MIN_UTIL = 0.70   # ทริปที่ util < 70% → ลองเติม
     _FILLUP_MAX_KM   = 60.0  # รัศมีเพิ่มสาขา (km)
     _fillup_added = 0
     for _ft in df[df['Trip'] > 0]['Trip'].unique():
+        if plan_stopped():
+            break
         _ft_rows = df[df['Trip'] == _ft]
         _ft_codes = _ft_rows['Code'].tolist()
         _ft_is_pt = all(branch_bu_cache.get(str(c).strip().upper(), False) for c in _ft_codes)
@@ -4756,8 +4975,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 continue
             if not _ft_coords:
                 continue
-            _fu_min_d = min(haversine_distance(_fu_lat, _fu_lon, _tlat, _tlon, use_osrm_cache=False)
-                           for _tlat, _tlon in _ft_coords)
+            _fu_min_d = float(distances_from(_fu_lat, _fu_lon, _ft_coords).min())
             if _fu_min_d > _FILLUP_MAX_KM:
                 continue
             _fu_cands.append((_fu_min_d, _fur['Code'], float(_fur.get('Weight', 0) or 0), float(_fur.get('Cube', 0) or 0)))
@@ -4798,14 +5016,17 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     # สาขาพิกัดเดียวกัน (≤50m) ในต่างทริป → รวมทริปเข้าด้วยกัน (ยอมเกิน capacity)
     # รวมถึงสาขาชื่อเดียวกันที่อยู่ห่างกัน ≤50m
     # ==========================================
+    profile_mark('Step 6.4.4b coordinate merge', track=_plan_rows)
+    plan_phase('Step 6.4.4b coordinate merge', optional=True)
     _SAME_COORD_KM = 0.05   # 50 เมตร
     safe_print("📍 SAME-COORDINATE FORCE MERGE: ตรวจสาขาพิกัดเดียวกันต่างทริป...")
     _samecoord_merged = 0
     _sc_changed = True
-    while _sc_changed:
+    while _sc_changed and not plan_stopped():
         _sc_changed = False
         # สร้าง {trip: [(code, lat, lon, name), ...]}
         _trip_coord_map2: dict = {}
+        _sc_code_trips: dict = {}   # code_upper → {trip, ...}
         for _, _scr2 in df[df['Trip'] > 0].iterrows():
             _sc_t2 = int(_scr2['Trip'])
             _sc_lat2 = float(_scr2.get('_lat', 0) or 0)
@@ -4815,27 +5036,46 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 if _sc_t2 not in _trip_coord_map2:
                     _trip_coord_map2[_sc_t2] = []
                 _trip_coord_map2[_sc_t2].append((str(_scr2['Code']), _sc_lat2, _sc_lon2, _sc_name2))
-        _trip_list2 = sorted(_trip_coord_map2.keys())
-        for _i2, _ta2 in enumerate(_trip_list2):
-            if _sc_changed: break
-            for _tb2 in _trip_list2[_i2+1:]:
-                if _sc_changed: break
-                for (_ca2, _lat_a2, _lon_a2, _nm_a2) in _trip_coord_map2.get(_ta2, []):
-                    if _sc_changed: break
-                    for (_cb2, _lat_b2, _lon_b2, _nm_b2) in _trip_coord_map2.get(_tb2, []):
-                        _d_sc2 = haversine_distance(_lat_a2, _lon_a2, _lat_b2, _lon_b2, use_osrm_cache=False)
-                        # พิกัดใกล้กัน ≤50m หรือ ชื่อสาขาเดียวกัน + ≤200m
-                        _name_match = (_nm_a2 and _nm_b2 and _nm_a2 == _nm_b2 and _d_sc2 <= 0.2)
-                        if _d_sc2 <= _SAME_COORD_KM or _name_match:
-                            _len_a2 = len(_trip_coord_map2.get(_ta2, []))
-                            _len_b2 = len(_trip_coord_map2.get(_tb2, []))
-                            _base_sc2  = _ta2 if _len_a2 >= _len_b2 else _tb2
-                            _other_sc2 = _tb2 if _base_sc2 == _ta2 else _ta2
-                            df.loc[df['Trip'] == _other_sc2, 'Trip'] = _base_sc2
-                            _samecoord_merged += 1
-                            safe_print(f"   📍 รวม trip {_other_sc2} → {_base_sc2} ({_ca2}↔{_cb2} ห่าง {_d_sc2*1000:.0f}m name={_name_match})")
-                            _sc_changed = True
+                _sc_code_trips.setdefault(str(_scr2['Code']).strip().upper(), set()).add(_sc_t2)
+
+        def _sc_pair(_a, _b):
+            """ระยะของคู่ + match: พิกัดใกล้กัน ≤50m หรือ ชื่อสาขาเดียวกัน + ≤200m"""
+            _ia2 = _dstore.index.get(_a[0].strip().upper())
+            _ib2 = _dstore.index.get(_b[0].strip().upper())
+            if _ia2 is not None and _ib2 is not None:
+                _d = _dstore.distance(_ia2, _ib2)
+            else:
+                _d = haversine_distance(_a[1], _a[2], _b[1], _b[2], use_osrm_cache=False)
+            _nm = bool(_a[3] and _b[3] and _a[3] == _b[3] and _d <= 0.2)
+            return _d, _nm, (_d <= _SAME_COORD_KM or _nm)
+
+        # หา (trip a, trip b) คู่แรกตามลำดับ ที่มีสาขาคู่ใดคู่หนึ่ง match — ใช้ spatial index หาเพื่อนบ้าน ≤200m
+        for _ta2 in sorted(_trip_coord_map2.keys()):
+            _tb_cands = set()
+            for _ma in _trip_coord_map2[_ta2]:
+                for _p in _sidx.within(_ma[1], _ma[2], 0.2):
+                    _tb_cands.update(_t for _t in _sc_code_trips.get(_run_codes[_p], ()) if _t > _ta2)
+            _tb_hit = None
+            for _tb2 in sorted(_tb_cands):
+                for _ma in _trip_coord_map2[_ta2]:
+                    for _mb in _trip_coord_map2[_tb2]:
+                        _d_sc2, _name_match, _hit = _sc_pair(_ma, _mb)
+                        if _hit:
+                            _tb_hit = (_tb2, _ma[0], _mb[0], _d_sc2, _name_match)
                             break
+                    if _tb_hit: break
+                if _tb_hit: break
+            if _tb_hit:
+                _tb2, _ca2, _cb2, _d_sc2, _name_match = _tb_hit
+                _len_a2 = len(_trip_coord_map2.get(_ta2, []))
+                _len_b2 = len(_trip_coord_map2.get(_tb2, []))
+                _base_sc2  = _ta2 if _len_a2 >= _len_b2 else _tb2
+                _other_sc2 = _tb2 if _base_sc2 == _ta2 else _ta2
+                df.loc[df['Trip'] == _other_sc2, 'Trip'] = _base_sc2
+                _samecoord_merged += 1
+                safe_print(f"   📍 รวม trip {_other_sc2} → {_base_sc2} ({_ca2}↔{_cb2} ห่าง {_d_sc2*1000:.0f}m name={_name_match})")
+                _sc_changed = True
+                break
     if _samecoord_merged:
         safe_print(f"✅ same-coord merge: รวม {_samecoord_merged} ทริป")
 
@@ -4846,7 +5086,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     safe_print(f"🔀 ตรวจสอบ same-location solo trips (≤{_SOLO_MERGE_KM*1000:.0f}m)...")
     _sc_merged = 0
     _sc_iters = 0
-    while _sc_iters < 100:
+    while _sc_iters < 100 and not plan_stopped():
         _sc_iters += 1
         _changed = False
         # สร้าง {trip_num: list of rows}
@@ -4900,10 +5140,19 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
 
 
     # ==========================================
+    # 📋 TripState: สมาชิก + summary ต่อทริป ใช้ตั้งแต่ตรงนี้ถึง Step 7
+    # (ย้าย/รวม/เรียงเลขทริปผ่าน _trip_state เพื่อให้ summary อัปเดตเฉพาะทริปที่เปลี่ยน)
+    _trip_state = TripState(
+        df,
+        is_punthai=lambda c: branch_bu_cache.get(c, False),
+        vehicle_rank=lambda c: vehicle_priority.get(branch_max_vehicle_cache.get(c, '6W'), 3),
+        region_of=get_region_name,
+    )
+
     # คำนวณระยะทางเฉลี่ยของแต่ละทริป
     trip_avg_distances = {}
-    for trip_num in df[df['Trip'] > 0]['Trip'].unique():
-        trip_data = df[df['Trip'] == trip_num]
+    for trip_num in _trip_state.trips(order='appearance'):
+        trip_data = _trip_state.rows(trip_num)
         avg_dist = trip_data['_distance_from_dc'].mean()
         trip_avg_distances[trip_num] = avg_dist
     
@@ -4914,73 +5163,39 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     trip_mapping = {old_num: new_num for new_num, (old_num, _) in enumerate(sorted_trips, start=1)}
     
     # อัพเดตเลขทริปใหม่
-    df['Trip'] = df['Trip'].map(lambda x: trip_mapping.get(x, x) if x > 0 else x)
+    _trip_state.renumber(trip_mapping)
 
     # ==========================================
     # Step 6.6: 🔄 BRANCH-LEVEL MERGE - ดึงสาขาจากทริปถัดไปมาเติมทริปปัจจุบัน
     # หลักการ: เริ่มจากทริปไกลสุด ถ้ายังไม่เต็ม ดึงสาขาที่ใกล้จากทริปถัดไปมาทีละสาขา
     # ==========================================
+    profile_mark('Step 6.6 branch merge', track=_plan_rows)
+    plan_phase('Step 6.6 branch merge', optional=True)
     safe_print("🔄 กำลังเติมทริปที่ไม่เต็ม buffer ด้วยสาขาใกล้เคียง...")
     
     def get_trip_capacity(trip_num):
-        """คำนวณความจุที่เหลือของทริป"""
-        trip_data = df[df['Trip'] == trip_num]
-        if len(trip_data) == 0:
+        """คำนวณความจุที่เหลือของทริป (summary จาก _trip_state — คำนวณใหม่เฉพาะทริปที่เปลี่ยน)"""
+        profile_count('get_trip_capacity')
+        profile_count('trip_summary_hit' if _trip_state.has_summary(trip_num) else 'trip_summary_build')
+        _summ = _trip_state.summary(trip_num)
+        if _summ is None:
             return None
         
-        total_w = trip_data['Weight'].sum()
-        total_c = trip_data['Cube'].sum()
-        codes = trip_data['Code'].tolist()
-        
         # เช็ค BU
-        is_punthai = all(branch_bu_cache.get(c, False) for c in codes)
+        is_punthai = _summ['is_punthai']
         buffer = punthai_buffer if is_punthai else maxmart_buffer
         
         # หารถที่รับ constraint ได้
-        max_vehicles = [branch_max_vehicle_cache.get(c, '6W') for c in codes]
-        min_priority = min(vehicle_priority.get(v, 3) for v in max_vehicles)
+        min_priority = _summ['min_priority']
         allowed_vehicle = {1: '4W', 2: 'JB', 3: '6W'}.get(min_priority, '6W')
         
         limits = PUNTHAI_LIMITS if is_punthai else LIMITS
-        max_w = limits[allowed_vehicle]['max_w'] * buffer
-        max_c = limits[allowed_vehicle]['max_c'] * buffer
-        max_drops = limits[allowed_vehicle]['max_drops']
-        
-        # รวบรวม zone/highway เพื่อตรวจ compatibility ใน merge loop
-        _provinces = set(trip_data['_province'].dropna().unique()) if '_province' in trip_data.columns else set()
-        _zones     = set(trip_data['_logistics_zone'].dropna().unique()) if '_logistics_zone' in trip_data.columns else set()
-        _hws: set  = set()
-        if '_zone_highway' in trip_data.columns:
-            for _hw in trip_data['_zone_highway'].dropna().unique():
-                _hws.update(str(_hw).split('/'))
-        # 🔒 รวบรวม regions ของทริป (ใช้กรองไม่ให้ข้ามภาค)
-        _regions: set = set()
-        for _p in _provinces:
-            _r = get_region_name(str(_p)) if _p else 'ไม่ระบุ'
-            if _r and _r != 'ไม่ระบุ':
-                _regions.add(_r)
-        # fallback: ดึงจาก _region_name column
-        if not _regions and '_region_name' in trip_data.columns:
-            for _rn in trip_data['_region_name'].dropna().unique():
-                if _rn and _rn != 'ไม่ระบุ':
-                    _regions.add(_rn)
         return {
-            'weight': total_w,
-            'cube': total_c,
-            'codes': codes,
-            'drops': len(codes),
-            'max_w': max_w,
-            'max_c': max_c,
-            'max_drops': max_drops,
-            'is_punthai': is_punthai,
+            **_summ,
+            'max_w': limits[allowed_vehicle]['max_w'] * buffer,
+            'max_c': limits[allowed_vehicle]['max_c'] * buffer,
+            'max_drops': limits[allowed_vehicle]['max_drops'],
             'allowed_vehicle': allowed_vehicle,
-            'min_priority': min_priority,
-            'centroid_lat': trip_data['_lat'].mean(),
-            'centroid_lon': trip_data['_lon'].mean(),
-            'provinces': _provinces,
-            'logistics_zones': _zones,
-            'highways': _hws,
-            'regions': _regions,
         }
     
     def can_add_branch_to_trip(branch_row, trip_capacity):
@@ -5019,34 +5234,34 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
         branch_lon = branch_row['_lon']
         branch_subdistrict = branch_row.get('_subdistrict', '')
         branch_code = branch_row['Code']
-        
-        nearby_codes = []
-        
-        for _, other_row in all_branches_df.iterrows():
-            other_code = other_row['Code']
-            if other_code == branch_code:
-                continue
-            
-            # 1. ตำบลเดียวกัน → ต้องมาด้วยกัน
-            if other_row.get('_subdistrict', '') == branch_subdistrict and branch_subdistrict:
-                nearby_codes.append(other_code)
-                continue
-            
-            # 2. ห่างกัน < 6 km → ต้องมาด้วยกัน
-            other_lat = other_row['_lat']
-            other_lon = other_row['_lon']
-            if other_lat > 0 and other_lon > 0 and branch_lat > 0 and branch_lon > 0:
-                dist = haversine_distance(branch_lat, branch_lon, other_lat, other_lon, use_osrm_cache=False)
-                if dist <= max_dist_km:
-                    nearby_codes.append(other_code)
-        
-        return nearby_codes
+        if all_branches_df.empty:
+            return []
+
+        # 1. ตำบลเดียวกัน → ต้องมาด้วยกัน
+        _sub = all_branches_df['_subdistrict'] if '_subdistrict' in all_branches_df.columns else pd.Series('', index=all_branches_df.index)
+        _same_sub = (_sub == branch_subdistrict).to_numpy() & bool(branch_subdistrict)
+
+        # 2. ห่างกัน < 6 km → ต้องมาด้วยกัน (vectorized)
+        _o_lat = all_branches_df['_lat'].astype(float).to_numpy()
+        _o_lon = all_branches_df['_lon'].astype(float).to_numpy()
+        _close = np.zeros(len(all_branches_df), dtype=bool)
+        if branch_lat > 0 and branch_lon > 0:
+            _ok = (_o_lat > 0) & (_o_lon > 0)
+            if _ok.any():
+                _close[_ok] = distances_from(branch_lat, branch_lon,
+                                             np.column_stack([_o_lat[_ok], _o_lon[_ok]])) <= max_dist_km
+
+        _codes = all_branches_df['Code'].to_numpy()
+        _keep = (_same_sub | _close) & (_codes != branch_code)
+        return _codes[_keep].tolist()
     
     # วนลูปทริปจากไกลสุด (1) ไปใกล้สุด
-    all_trips = sorted(df[df['Trip'] > 0]['Trip'].unique())
+    all_trips = _trip_state.trips()
     moved_branches = 0
     
     for i, current_trip in enumerate(all_trips[:-1]):  # ไม่รวมทริปสุดท้าย
+        if plan_stopped():
+            break
         trip_cap = get_trip_capacity(current_trip)
         if not trip_cap:
             continue
@@ -5060,17 +5275,18 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
         
         # หาสาขาจากทริปถัดไปที่ใกล้กับทริปนี้
         for next_trip in all_trips[i+1:]:
-            next_trip_data = df[df['Trip'] == next_trip].copy()
+            next_trip_data = _trip_state.rows(next_trip).copy()
             if len(next_trip_data) == 0:
                 continue
             
             # คำนวณระยะห่างของแต่ละสาขาใน next_trip จาก centroid ของ current_trip
-            next_trip_data['_dist_to_current'] = next_trip_data.apply(
-                lambda row: haversine_distance(
-                    trip_cap['centroid_lat'], trip_cap['centroid_lon'],
-                    row['_lat'], row['_lon'], use_osrm_cache=False
-                ) if row['_lat'] > 0 and row['_lon'] > 0 else 999,
-                axis=1
+            _nt_lat = next_trip_data['_lat'].astype(float).to_numpy()
+            _nt_lon = next_trip_data['_lon'].astype(float).to_numpy()
+            next_trip_data['_dist_to_current'] = np.where(
+                (_nt_lat > 0) & (_nt_lon > 0),
+                distances_from(trip_cap['centroid_lat'], trip_cap['centroid_lon'],
+                               np.column_stack([_nt_lat, _nt_lon])),
+                999,
             )
             
             # เรียงตามระยะใกล้สุดก่อน
@@ -5172,7 +5388,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 
                 if can_add:
                     # ✅ ย้ายสาขานี้มาทริปปัจจุบัน
-                    df.loc[df['Code'] == branch_code, 'Trip'] = current_trip
+                    _trip_state.assign_codes(branch_code, current_trip)
                     already_moved.add(branch_code)
                     moved_branches += 1
                     safe_print(f"   ✅ ย้าย {branch_code} จาก Trip {next_trip} → Trip {current_trip} (ห่าง {dist_to_trip:.1f} km)")
@@ -5243,7 +5459,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                             continue
                         can_add_nearby, _ = can_add_branch_to_trip(nearby_row, trip_cap)
                         if can_add_nearby:
-                            df.loc[df['Code'] == nearby_code, 'Trip'] = current_trip
+                            _trip_state.assign_codes(nearby_code, current_trip)
                             already_moved.add(nearby_code)
                             moved_branches += 1
                             safe_print(f"   🔗 ย้ายด้วย {nearby_code} (ใกล้กัน/ตำบลเดียวกัน)")
@@ -5258,25 +5474,24 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     if moved_branches > 0:
         safe_print(f"🔄 ย้ายสาขาเสร็จ: ย้าย {moved_branches} สาขา")
         
-        # ลบทริปที่ว่างเปล่า
-        empty_trips = [t for t in df['Trip'].unique() if t > 0 and len(df[df['Trip'] == t]) == 0]
-        
-        # Renumber ทริปใหม่หลังย้าย
-        remaining_trips = sorted(df[df['Trip'] > 0]['Trip'].unique())
+        # Renumber ทริปใหม่หลังย้าย (ทริปที่ว่างเปล่าหายไปเอง)
+        remaining_trips = _trip_state.trips()
         trip_renumber = {old: new for new, old in enumerate(remaining_trips, start=1)}
-        df['Trip'] = df['Trip'].map(lambda x: trip_renumber.get(x, x) if x > 0 else x)
+        _trip_state.renumber(trip_renumber)
 
     # ==========================================
     # Step 6.65: 🔗 AGGRESSIVE CONSOLIDATION — รวมทริปที่ยังว่างอยู่
     # หลักการ: "จะตัดใหม่ต้องเต็มก่อน" — รวม 2 ทริปที่ util ต่ำเข้าด้วยกัน
     # ถ้าน้ำหนัก+ปริมาตร+drops รวมกันแล้วยังพอดีรถ
     # ==========================================
+    profile_mark('Step 6.65 consolidation', track=_plan_rows)
+    plan_phase('Step 6.65 consolidation', optional=True)
     MIN_CONSOLIDATION_UTIL = 1.0  # รวมทริปที่ยังไม่เต็ม 100% เสมอ (ไม่ปล่อยให้หลุด)
     _consol_rounds = 0
     _consol_total = 0
-    while _consol_rounds < 30:
+    while _consol_rounds < 30 and not plan_stopped():
         _consol_rounds += 1
-        _trips_now = sorted(df[df['Trip'] > 0]['Trip'].unique())
+        _trips_now = _trip_state.trips()
 
         # Build capacity info for all trips
         _caps_cs = {}
@@ -5393,7 +5608,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 # ✅ Merge _tb_cs into _ta_cs
                 _new_util = max(_cw_cs / (_clims_cs[_fits_veh_cs]['max_w'] * _cbuf_cs),
                                 _cc_cs / (_clims_cs[_fits_veh_cs]['max_c'] * _cbuf_cs))
-                df.loc[df['Trip'] == _tb_cs, 'Trip'] = _ta_cs
+                _trip_state.merge(_tb_cs, _ta_cs)
                 safe_print(f"   🔗 Consolidate Trip {_tb_cs} → Trip {_ta_cs} "
                            f"[{_fits_veh_cs}] {_cd_cs} drops {_cw_cs:.0f}kg "
                            f"→ {_new_util*100:.0f}%")
@@ -5412,20 +5627,22 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     if _consol_total > 0:
         safe_print(f"🔗 Consolidation done: merged {_consol_total} trips")
         # Renumber after consolidation
-        _remaining_cs = sorted(df[df['Trip'] > 0]['Trip'].unique())
+        _remaining_cs = _trip_state.trips()
         _renumber_cs = {old: new for new, old in enumerate(_remaining_cs, start=1)}
-        df['Trip'] = df['Trip'].map(lambda x: _renumber_cs.get(x, x) if x > 0 else x)
+        _trip_state.renumber(_renumber_cs)
     else:
         safe_print("🔗 Consolidation: no further merges possible")
 
     # ==========================================
     # Step 6.7: 🔍 REGION AUDIT — ตรวจและแยกทริปที่มีการปนภาค
     # ==========================================
+    profile_mark('Step 6.7 region audit', track=_plan_rows)
+    plan_phase('Step 6.7 region audit')
     safe_print("🔍 ตรวจสอบการปนภาคใน trips...")
     _audit_fixed = 0
-    _max_trip_now = df[df['Trip'] > 0]['Trip'].max() if len(df[df['Trip'] > 0]) > 0 else 0
-    for _aud_trip in sorted(df[df['Trip'] > 0]['Trip'].unique()):
-        _aud_data = df[df['Trip'] == _aud_trip]
+    _max_trip_now = max(_trip_state.trips(), default=0)
+    for _aud_trip in _trip_state.trips():
+        _aud_data = _trip_state.rows(_aud_trip)
         _aud_regions = {}
         for _, _aud_row in _aud_data.iterrows():
             _ap = str(_aud_row.get('_province', '') or '')
@@ -5450,15 +5667,15 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 _minority_codes.append(_aud_row['Code'])
         if _minority_codes:
             _max_trip_now += 1
-            df.loc[df['Code'].isin(_minority_codes), 'Trip'] = _max_trip_now
+            _trip_state.assign_codes(_minority_codes, _max_trip_now)
             safe_print(f"   ⚠️ AUDIT: Trip {_aud_trip} ปนภาค {_aud_regions} → แยก {_minority_codes} → Trip ใหม่ {_max_trip_now}")
             _audit_fixed += 1
     if _audit_fixed > 0:
         safe_print(f"   🔧 AUDIT: แก้ไขการปนภาค {_audit_fixed} ทริป")
         # Renumber หลัง audit
-        _aud_remaining = sorted(df[df['Trip'] > 0]['Trip'].unique())
+        _aud_remaining = _trip_state.trips()
         _aud_remap = {old: new for new, old in enumerate(_aud_remaining, start=1)}
-        df['Trip'] = df['Trip'].map(lambda x: _aud_remap.get(x, x) if x > 0 else x)
+        _trip_state.renumber(_aud_remap)
     else:
         safe_print("   ✅ ไม่พบการปนภาค")
 
@@ -5466,12 +5683,14 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     # Step 6.8: 🔗 POST-AUDIT CONSOLIDATION — รวมเศษทริปที่เกิดจากการ audit แตก
     # เพราะ Step 6.7 อาจแยกทริปแล้วทิ้ง fragment เล็กๆ ไว้ ต้องรวมกลับ
     # ==========================================
+    profile_mark('Step 6.8 post-audit consolidation', track=_plan_rows)
+    plan_phase('Step 6.8 post-audit consolidation', optional=True)
     _pa_total = 0
     _pa_rounds = 0
-    while _pa_rounds < 20:
+    while _pa_rounds < 20 and not plan_stopped():
         _pa_rounds += 1
         _pa_caps = {}
-        for _t_pa in sorted(df[df['Trip'] > 0]['Trip'].unique()):
+        for _t_pa in _trip_state.trips():
             _c_pa = get_trip_capacity(_t_pa)
             if _c_pa:
                 _pa_caps[_t_pa] = _c_pa
@@ -5561,7 +5780,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                         break
                 if not _fveh_pa:
                     continue
-                df.loc[df['Trip'] == _tb_pa, 'Trip'] = _ta_pa
+                _trip_state.merge(_tb_pa, _ta_pa)
                 _nutil = max(_cw_pa / (_clim_pa[_fveh_pa]['max_w'] * _cbuf_pa),
                              _cc_pa / (_clim_pa[_fveh_pa]['max_c'] * _cbuf_pa))
                 safe_print(f"   🔗 Post-audit merge Trip {_tb_pa} → Trip {_ta_pa} "
@@ -5577,15 +5796,35 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
             break
     if _pa_total > 0:
         safe_print(f"🔗 Post-audit consolidation: merged {_pa_total} trips")
-        _pa_rem = sorted(df[df['Trip'] > 0]['Trip'].unique())
+        _pa_rem = _trip_state.trips()
         _pa_ren = {old: new for new, old in enumerate(_pa_rem, start=1)}
-        df['Trip'] = df['Trip'].map(lambda x: _pa_ren.get(x, x) if x > 0 else x)
+        _trip_state.renumber(_pa_ren)
     else:
         safe_print("🔗 Post-audit consolidation: nothing to merge")
 
+    # ==========================================
+    # Step 6.9: 🔧 LOCAL SEARCH (optional) — relocate/swap/2-exchange ระหว่างทริปภาคเดียวกัน
+    # ภายในเวลา improve_seconds (0 = ข้าม) กติกาเดียวกับ can_add_branch_to_trip
+    # ==========================================
+    local_search_report = None
+    if improve_seconds and improve_seconds > 0 and plan_phase('Step 6.9 local search', optional=True):
+        profile_mark('Step 6.9 local search', track=_plan_rows)
+        _cancel = current_cancel_token()
+        local_search_report = improve_trips(
+            _trip_state, {'punthai': PUNTHAI_LIMITS, 'maxmart': LIMITS},
+            _cancel.cap(improve_seconds) if _cancel else improve_seconds,
+            punthai_buffer=punthai_buffer, maxmart_buffer=maxmart_buffer,
+            is_punthai=lambda c: branch_bu_cache.get(c, False),
+            vehicle_rank=lambda c: vehicle_priority.get(branch_max_vehicle_cache.get(c, '6W'), 3),
+            region_of=get_region_name, max_qty_per_trip=max_qty_per_trip, should_stop=plan_stopped,
+            cross_zone=is_cross_zone_violation, log=safe_print,
+        )
+        _trip_state.renumber({old: new for new, old in enumerate(_trip_state.trips(), start=1)})
+
     # ==========================================
     # Step 7: สร้าง Summary + Central Rule + Punthai Drop Limits
     # ==========================================
+    profile_mark('Step 7 summary', track=_plan_rows)
     summary_data = []
 
     # 🚛 Fleet Constraint: ติดตามจำนวนรถแต่ละประเภทที่ใช้ไป
@@ -5594,11 +5833,8 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     _fleet_rank = {1: '4W', 2: 'JB', 3: '6W'}
     _rank_fleet = {'4W': 1, 'JB': 2, '6W': 3}
 
-    for trip_num in sorted(df['Trip'].unique()):
-        if trip_num == 0:
-            continue
-        
-        trip_data = df[df['Trip'] == trip_num]
+    for trip_num in _trip_state.trips():
+        trip_data = _trip_state.rows(trip_num)
         total_w = trip_data['Weight'].sum()
         total_c = trip_data['Cube'].sum()
         trip_codes = trip_data['Code'].unique()
@@ -5734,10 +5970,9 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
         if branch_coords:
             # คำนวณระยะทางรวม: ลอง ROUTE_CACHE ก่อน; ถ้าไม่มีใช้ haversine×1.35 ประมาณ (ไม่เรียก network)
             _wp_td = [[DC_WANG_NOI_LAT, DC_WANG_NOI_LON]] + [[la, lo] for la, lo in branch_coords] + [[DC_WANG_NOI_LAT, DC_WANG_NOI_LON]]
-            _ck_td = "|".join([f"{la:.4f},{lo:.4f}" for la, lo in _wp_td])
-            if USE_CACHE and _ck_td in ROUTE_CACHE_DATA:
-                _rc_td = ROUTE_CACHE_DATA[_ck_td]
-                total_distance = _rc_td.get('distance', 0)
+            _rc_td = route_legs.cached_route(ROUTE_CACHE_DATA, _wp_td) if USE_CACHE else None
+            if _rc_td is not None:
+                total_distance = _rc_td[1]
             else:
                 # ประมาณจาก haversine×1.35 (zero-network) DC→b1→b2→...→DC
                 _pts = _wp_td
@@ -5791,6 +6026,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     # ==========================================
     # 🚨 Step 7.5: ตัดสาขาออกถ้าเกิน buffer หรือรถผิดประเภท (Strict Enforcement)
     # ==========================================
+    profile_mark('Step 7.5 buffer enforcement', track=_plan_rows)
     safe_print("\n📋 Step 7.5: ตรวจสอบและตัดสาขาที่เกิน Buffer + ข้อจำกัดรถ...")
     overflow_branches = []
     
@@ -5799,7 +6035,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
         buffer_pct = float(trip_summary['Buffer'].replace('🅿️ ', '').replace('🅼 ', '').replace('%', ''))
         
         # ดึงข้อมูลทริป
-        trip_data = df[df['Trip'] == trip_num].copy()
+        trip_data = _trip_state.rows(trip_num).copy()
         if trip_data.empty:
             continue
             
@@ -5872,7 +6108,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
             if len(trip_data) <= 1:
                 code = trip_data.iloc[0]['Code'] if len(trip_data) == 1 else None
                 if code:
-                    df.loc[df['Code'] == code, 'Trip'] = 0
+                    _trip_state.assign_codes(code, 0)
                     overflow_branches.append(code)
                     safe_print(f"      🔪 ตัด {code} ออก (1 สาขาแต่เกิน buffer → overflow)")
                     # ลบ summary ของทริปนี้
@@ -5925,12 +6161,11 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 safe_print(f"      🔪 ตัด {code} ออก (ไกลสุด {row['_distance_from_dc']:.1f} km)")
             
             # ลบสาขาออกจากทริป (Trip = 0)
-            for code in codes_to_remove:
-                df.loc[df['Code'] == code, 'Trip'] = 0
+            _trip_state.assign_codes(codes_to_remove, 0)
             
             # อัพเดต summary
             if codes_to_remove:
-                new_trip_data = df[df['Trip'] == trip_num]
+                new_trip_data = _trip_state.rows(trip_num)
                 new_w = new_trip_data['Weight'].sum()
                 new_c = new_trip_data['Cube'].sum()
                 new_w_util = (new_w / (limits[truck_str]['max_w'])) * 100
@@ -5945,7 +6180,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     # จัดทริปใหม่สำหรับ overflow branches
     if overflow_branches:
         safe_print(f"\n   📦 สาขาที่ถูกตัด: {len(overflow_branches)} สาขา → จัดทริปใหม่...")
-        max_trip = df['Trip'].max()
+        max_trip = _trip_state.max_trip()
         
         # 🎯 แยกตามข้อจำกัดรถ เพื่อไม่ให้ JB/4W ไปรวมกับ 6W
         overflow_by_max_vehicle = {}
@@ -6027,13 +6262,12 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                         break
                 
                 # Assign trip
-                for code in trip_codes:
-                    df.loc[df['Code'] == code, 'Trip'] = new_trip
+                _trip_state.assign_codes(trip_codes, new_trip)
                 
                 # เพิ่ม summary
                 if trip_codes:
                     # นับแถวจริงจาก df (ไม่ใช้ len(trip_codes) เพราะอาจมี duplicate rows)
-                    _ov_actual = df[df['Trip'] == new_trip]
+                    _ov_actual = _trip_state.rows(new_trip)
                     _ov_w = _ov_actual['Weight'].sum()
                     _ov_c = _ov_actual['Cube'].sum()
                     is_overflow_punthai = all(
@@ -6063,6 +6297,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     # ==========================================
     # Step 8: เพิ่มคอลัมน์เสริม
     # ==========================================
+    profile_mark('Step 8 extra columns', track=_plan_rows)
     # เพิ่มคอลัมน์รถ
     trip_truck_map = {}
     for _, row in summary_df.iterrows():
@@ -6116,6 +6351,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     # ==========================================
     # 🚨 Step 8.5: บังคับแก้ไขสาขาที่เกินข้อจำกัดรถ (Enforce Vehicle Constraints)
     # ==========================================
+    profile_mark('Step 8.5 vehicle constraints', track=_plan_rows)
     safe_print("\n📋 Step 8.5: บังคับข้อจำกัดรถ...")
     vehicle_violations = df[df['VehicleCheck'].str.contains('❌', na=False)]
     
@@ -6129,7 +6365,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
             max_allowed = viol_row['_max_vehicle']
             
             # หาสาขาอื่นในทริปเดียวกันที่มีข้อจำกัดเดียวกันหรือน้อยกว่า
-            same_trip = df[df['Trip'] == viol_trip]
+            same_trip = _trip_state.rows(viol_trip)
             
             # ตรวจสอบว่าสาขาอื่นในทริปมีข้อจำกัดอย่างไร
             vehicle_rank = {'4W': 1, 'JB': 2, '6W': 3}
@@ -6145,14 +6381,14 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 
                 if min_other_rank > max_allowed_rank:
                     # สาขาอื่นมีข้อจำกัดใหญ่กว่า → ย้ายสาขานี้ออก
-                    df.loc[df['Code'] == viol_code, 'Trip'] = 0  # ย้ายออกไปจัดใหม่
+                    _trip_state.assign_codes(viol_code, 0)  # ย้ายออกไปจัดใหม่
                     safe_print(f"      🔄 ย้าย {viol_code} ออกจาก Trip {viol_trip} (Max: {max_allowed})")
     
     # จัดทริปใหม่สำหรับสาขาที่ถูกย้ายออก
-    unassigned_violations = df[df['Trip'] == 0]
+    unassigned_violations = _trip_state.rows(0)
     if len(unassigned_violations) > 0:
         safe_print(f"   📦 จัดทริปใหม่สำหรับ {len(unassigned_violations)} สาขา...")
-        max_trip = df[df['Trip'] > 0]['Trip'].max() if len(df[df['Trip'] > 0]) > 0 else 0
+        max_trip = max(_trip_state.trips(), default=0)
         
         # จัดกลุ่มตาม max_vehicle
         for max_veh in ['4W', 'JB', '6W']:
@@ -6189,7 +6425,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                     current_c = 0
                     current_drops = 0
                 
-                df.loc[df['Code'] == br['Code'], 'Trip'] = new_trip
+                _trip_state.assign_codes(br['Code'], new_trip)
                 current_w += br_w
                 current_c += br_c
                 current_drops += 1
@@ -6198,13 +6434,13 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
             safe_print(f"      ✅ จัด {len(veh_branches)} สาขา {max_veh} เสร็จ")
         
         # อัพเดต Truck และ VehicleCheck หลังจัดใหม่
-        for trip_num in df[df['Trip'] > 0]['Trip'].unique():
-            trip_codes = df[df['Trip'] == trip_num]['Code'].tolist()
+        for trip_num in _trip_state.trips(order='appearance'):
+            trip_codes = _trip_state.codes(trip_num)
             max_vehicles = [get_max_vehicle_for_branch(c) for c in trip_codes]
             _vp_local = {'4W': 1, 'JB': 2, '6W': 3}  # local copy — ไม่ shadow outer vehicle_priority
             min_rank = min(_vp_local.get(v, 3) for v in max_vehicles)
             suggested = {1: '4W', 2: 'JB', 3: '6W'}.get(min_rank, '6W')
-            df.loc[df['Trip'] == trip_num, 'Truck'] = f"{suggested} 📋 จัดใหม่"
+            _trip_state.set_value(trip_num, 'Truck', f"{suggested} 📋 จัดใหม่")
         
         df['VehicleCheck'] = df.apply(check_vehicle_compliance, axis=1)
 
@@ -6212,13 +6448,14 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     # Step 8.8: 🔒 FINAL REGION & BKK ISOLATION AUDIT
     # รันหลังทุก step เพื่อรับประกันไม่มีทริปที่ปนภาค/ปนกรุงเทพฯ
     # ==========================================
+    profile_mark('Step 8.8 final audit', track=_plan_rows)
     safe_print("\n🔒 Step 8.8: Final Region & BKK Isolation Audit...")
     _BKK_PROV = 'กรุงเทพมหานคร'
     _final_audit_fixed = 0
-    _fa_max_trip = df[df['Trip'] > 0]['Trip'].max() if len(df[df['Trip'] > 0]) > 0 else 0
+    _fa_max_trip = max(_trip_state.trips(), default=0)
 
-    for _fa_trip in sorted(df[df['Trip'] > 0]['Trip'].unique()):
-        _fa_data = df[df['Trip'] == _fa_trip]
+    for _fa_trip in _trip_state.trips():
+        _fa_data = _trip_state.rows(_fa_trip)
         _fa_provs = [str(r.get('_province', '') or '') for _, r in _fa_data.iterrows()]
         _fa_provs_clean = [p for p in _fa_provs if p and p != 'nan']
 
@@ -6233,7 +6470,7 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
             ]
             if _fa_split_codes:
                 _fa_max_trip += 1
-                df.loc[df['Code'].isin(_fa_split_codes), 'Trip'] = _fa_max_trip
+                _trip_state.assign_codes(_fa_split_codes, _fa_max_trip)
                 safe_print(f"   🔒 BKK AUDIT: Trip {_fa_trip} → แยก {len(_fa_split_codes)} สาขา non-BKK → Trip {_fa_max_trip}")
                 _final_audit_fixed += 1
             continue  # ตรวจข้ออื่นบนข้อมูลใหม่ในรอบถัดไป
@@ -6266,32 +6503,32 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
                 _fa_minority_codes.append(_far2['Code'])
         if _fa_minority_codes:
             _fa_max_trip += 1
-            df.loc[df['Code'].isin(_fa_minority_codes), 'Trip'] = _fa_max_trip
+            _trip_state.assign_codes(_fa_minority_codes, _fa_max_trip)
             safe_print(f"   🔒 REGION AUDIT: Trip {_fa_trip} ปนภาค {_fa_regions} → แยก {_fa_minority_codes} → Trip {_fa_max_trip}")
             _final_audit_fixed += 1
 
     if _final_audit_fixed > 0:
         safe_print(f"   ✅ Final Audit: แก้ไข {_final_audit_fixed} ทริป")
         # Renumber trips after final audit
-        _fa_rem = sorted(df[df['Trip'] > 0]['Trip'].unique())
+        _fa_rem = _trip_state.trips()
         _fa_ren = {old: new for new, old in enumerate(_fa_rem, start=1)}
-        df['Trip'] = df['Trip'].map(lambda x: _fa_ren.get(x, x) if x > 0 else x)
+        _trip_state.renumber(_fa_ren)
         # อัพเดต Truck mapping หลัง renumber
         try:
-            for _fa_t in df[df['Trip'] > 0]['Trip'].unique():
+            for _fa_t in _trip_state.trips(order='appearance'):
                 if _fa_t not in trip_truck_map:
-                    _fa_codes = df[df['Trip'] == _fa_t]['Code'].tolist()
+                    _fa_codes = _trip_state.codes(_fa_t)
                     _fa_vp = {'4W': 1, 'JB': 2, '6W': 3}
                     _fa_max_veh_list = [branch_max_vehicle_cache.get(str(c).strip().upper(), '6W') for c in _fa_codes]
                     _fa_min_rank = min(_fa_vp.get(v, 3) for v in _fa_max_veh_list)
                     _fa_truck = {1: '4W', 2: 'JB', 3: '6W'}.get(_fa_min_rank, '6W')
-                    df.loc[df['Trip'] == _fa_t, 'Truck'] = f"{_fa_truck} ✂️ audit-split"
+                    _trip_state.set_value(_fa_t, 'Truck', f"{_fa_truck} ✂️ audit-split")
         except Exception:
             pass
         # อัพเดต trip_truck_map ใหม่
         trip_truck_map = {}
-        for _fa_t2 in df[df['Trip'] > 0]['Trip'].unique():
-            _fa_td = df[df['Trip'] == _fa_t2]
+        for _fa_t2 in _trip_state.trips(order='appearance'):
+            _fa_td = _trip_state.rows(_fa_t2)
             if not _fa_td.empty:
                 _raw_trk = str(_fa_td.iloc[0].get('Truck', '6W') or '6W').split()[0]
                 trip_truck_map[_fa_t2] = _raw_trk
@@ -6303,14 +6540,15 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     # Step 8.9: Catch-all — สาขาที่ยังไม่ได้จัดทริป (Trip=0)
     # รองรับ Z*, LUBE, SUPPLY, USE, สาขาไม่มีพิกัด ฯลฯ
     # ==========================================
-    _catchall_remaining = df[df['Trip'] == 0].copy()
+    profile_mark('Step 8.9 catch-all', track=_plan_rows)
+    _catchall_remaining = _trip_state.rows(0).copy()
     if len(_catchall_remaining) > 0:
         safe_print(f"\n⚠️  Step 8.9: พบ {len(_catchall_remaining)} สาขายังไม่ได้จัดทริป → จัดทริปเดี่ยว...")
-        _ca_max_trip = int(df[df['Trip'] > 0]['Trip'].max()) if len(df[df['Trip'] > 0]) > 0 else 0
+        _ca_max_trip = max(_trip_state.trips(), default=0)
         for _, _ca_row in _catchall_remaining.iterrows():
             _ca_max_trip += 1
             _ca_code = _ca_row['Code']
-            df.loc[df['Code'] == _ca_code, 'Trip'] = _ca_max_trip
+            _trip_state.assign_codes(_ca_code, _ca_max_trip)
             _ca_veh = branch_max_vehicle_cache.get(str(_ca_code).strip().upper(), '6W')
             df.loc[df['Code'] == _ca_code, 'Truck'] = f"{_ca_veh} ⚙️ จัดเดี่ยว"
             safe_print(f"   ➕ {_ca_code} → Trip {_ca_max_trip} ({_ca_veh})")
@@ -6319,43 +6557,20 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     # ==========================================
     # Step 9: เรียงทริปใหม่ตามภาค → จังหวัด → ระยะทาง
     # ==========================================
+    profile_mark('Step 9 renumber', track=_plan_rows)
     safe_print("\n📋 Step 9: เรียงทริปใหม่ตามภาค → จังหวัด → ระยะทาง...")
     
-    # หาระยะทางไกลสุดและ dominant province/region ของแต่ละทริป
-    trip_max_distances = {}
-    trip_sort9_keys = {}
-    for trip_num in df[df['Trip'] > 0]['Trip'].unique():
-        trip_data = df[df['Trip'] == trip_num]
-        max_dist = trip_data['_distance_from_dc'].max() if '_distance_from_dc' in trip_data.columns else 0
-        trip_max_distances[trip_num] = max_dist if pd.notna(max_dist) else 0
-        # dominant province (most frequent in trip)
-        _prov_col9 = '_province' if '_province' in trip_data.columns else ('Province' if 'Province' in trip_data.columns else None)
-        _dom_prov9 = ''
-        _rorder9 = 99
-        if _prov_col9:
-            _vc9 = trip_data[_prov_col9].value_counts()
-            if len(_vc9):
-                _dom_prov9 = _vc9.index[0]
-                _rorder9 = REGION_ORDER.get(get_region_name(str(_dom_prov9)), 99)
-        _dist_col9 = '_district' if '_district' in trip_data.columns else ('District' if 'District' in trip_data.columns else None)
-        _dom_dist9 = ''
-        if _dist_col9:
-            _vcd9 = trip_data[_dist_col9].value_counts()
-            if len(_vcd9):
-                _dom_dist9 = _vcd9.index[0]
-        trip_sort9_keys[trip_num] = (-(trip_max_distances[trip_num]),)  # ระยะทางไกลก่อน (ไม่ใช้อักษร)
-    
-    # เรียงทริปตาม ระยะทางไกลก่อน (ไม่ใช้ภาค/จังหวัด/อำเภอ)
-    sorted_trips = sorted(trip_max_distances.keys(), key=lambda x: trip_sort9_keys.get(x, (0,)))
+    # ลำดับเดียวกับ merge_partitions ของโหมดขนาน: ไกล DC ก่อน (ไม่ใช้ภาค/จังหวัด/อำเภอ เป็นตัวตัดสิน)
+    sorted_trips, trip_max_distances = step9_trip_order(_trip_state.df)
     
     # สร้าง mapping ใหม่
     trip_renumber = {old_trip: new_trip for new_trip, old_trip in enumerate(sorted_trips, 1)}
-    df['Trip'] = df['Trip'].map(lambda x: trip_renumber.get(x, 0) if x > 0 else 0)
+    _trip_state.renumber(trip_renumber, missing=0)
     
     # อัพเดต summary_df ใหม่ทั้งหมดหลัง renumber (ให้ข้อมูลตรงกับ df)
     summary_data_new = []
-    for trip_num in sorted(df[df['Trip'] > 0]['Trip'].unique()):
-        trip_data = df[df['Trip'] == trip_num]
+    for trip_num in _trip_state.trips():
+        trip_data = _trip_state.rows(trip_num)
         total_w = trip_data['Weight'].sum()
         total_c = trip_data['Cube'].sum()
         trip_codes_list = trip_data['Code'].tolist()
@@ -6402,6 +6617,8 @@ def predict_trips(test_df, model_data, punthai_buffer=1.0, maxmart_buffer=1.10,
     # ลบคอลัมน์ชั่วคราว (เก็บ _province, _district, _subdistrict, _max_vehicle, _lat, _lon, _distance_from_dc ไว้สำหรับแผนที่)
     cols_to_drop = ['_region_name', '_route', '_group_key', '_region_order', '_prov_max_dist', '_dist_max_dist', '_subdist_max_dist', '_region_allowed_vehicles', '_vehicle_priority']
     df = df.drop(columns=[c for c in cols_to_drop if c in df.columns], errors='ignore')
+    if local_search_report is not None:
+        summary_df.attrs['local_search'] = local_search_report
 
     return df, summary_df, fleet_used
 def main():
@@ -6957,7 +7174,7 @@ hr { border: none !important; border-top: 1.5px solid #d1fae5 !important; margin
                 else:
                     # ตรวจสอบทุก 1 ชั่วโมง
                     st_autorefresh(interval=3600000, limit=24, key="hourly_check")
-        except Exception as e:
+        except Exception:
             # ถ้า autorefresh มีปัญหา → ไม่แสดง error (ฟีเจอร์เสริมเท่านั้น)
             pass
     
@@ -7014,6 +7231,7 @@ hr { border: none !important; border-top: 1.5px solid #d1fae5 !important; margin
             with st.spinner("⏳ กำลังดึงข้อมูล..."):
                 try:
                     st.cache_data.clear()
+                    PLANNER_CONTEXT.invalidate()
                     for _k in ['trip_result', 'trip_summary', '_imap_html', '_imap_key',
                                 'trip_result_excel', '_imap_build_time']:
                         st.session_state.pop(_k, None)
@@ -7059,7 +7277,8 @@ hr { border: none !important; border-top: 1.5px solid #d1fae5 !important; margin
         _prev_file_id = st.session_state.get('_uploaded_file_id')
         _curr_file_id = (uploaded_file.name, uploaded_file.size)
         if _prev_file_id != _curr_file_id:
-            for _k in ('trip_result', 'trip_summary', 'fleet_used', 'fleet_limits', 'trip_buffers', '_trip_result_fresh', '_trip_elapsed'):
+            for _k in ('trip_result', 'trip_summary', 'fleet_used', 'fleet_limits', 'trip_buffers', '_trip_result_fresh', '_trip_elapsed', '_trip_profile', '_trip_local_search', '_trip_cpsat',
+                       '_trip_portfolio', '_trip_cancelled', '_plan_job'):
                 st.session_state.pop(_k, None)
             st.session_state['_uploaded_file_id'] = _curr_file_id
         st.session_state['original_file_content'] = uploaded_file_content
@@ -7236,6 +7455,37 @@ hr { border: none !important; border-top: 1.5px solid #d1fae5 !important; margin
                     min_value=0, value=0, step=100,
                     help="0 = ไม่จำกัด — ระบุตัวเลขเพื่อปิดทริปเมื่อนับชิ้นถึงจำนวนนี้"
                 )
+                parallel_plan = st.checkbox(
+                    "⚡ จัดแบบขนานตามภาค (ใช้ทุก CPU)",
+                    value=False, key="parallel_plan",
+                    help="แยกจัดแต่ละภาค (กรุงเทพฯ แยกกลุ่ม) พร้อมกันหลาย process แล้วรวมผล — เร็วขึ้นเมื่อออเดอร์มาก "
+                         "ผลอาจต่างจากโหมดปกติเล็กน้อย"
+                )
+                improve_seconds = st.number_input(
+                    "🔧 เวลาปรับปรุงแผน (วินาที)",
+                    min_value=0, max_value=600, value=0, step=5, key="improve_seconds",
+                    help="0 = ไม่ปรับปรุง — หลังจัดทริปเสร็จ ลองย้าย/สลับสาขาระหว่างทริปในภาคเดียวกัน "
+                         "ภายในเวลาที่กำหนด เพื่อลดจำนวนรถ/ใช้รถเล็กลง"
+                )
+                cpsat_seconds = st.number_input(
+                    "🤖 เวลา OR-Tools CP-SAT (วินาที)",
+                    min_value=0, max_value=600, value=0, step=10, key="cpsat_seconds",
+                    disabled=not ORTOOLS_AVAILABLE,
+                    help="0 = ไม่ใช้ — ปรับผลจัดทริปต่อด้วย CP-SAT แยกตามภาค/โซนทิศทาง (เริ่มจากผลเดิม) "
+                         "ใช้ได้เมื่อติดตั้ง ortools"
+                ) if ORTOOLS_AVAILABLE else 0
+                portfolio_seconds = st.number_input(
+                    "🏁 แข่งหลาย engine — deadline (วินาที)",
+                    min_value=0, max_value=900, value=0, step=30, key="portfolio_seconds",
+                    help="0 = ไม่ใช้ — รัน greedy / local search / CP-SAT พร้อมกันคนละ process "
+                         "แล้วเลือกแผนที่ใช้รถน้อยสุด (ไม่ผิดกติกา) ที่เสร็จภายในเวลานี้"
+                )
+                plan_deadline_seconds = st.number_input(
+                    "⏳ เวลาจัดเที่ยวสูงสุด (วินาที)",
+                    min_value=0, max_value=3600, value=0, step=30, key="plan_deadline_seconds",
+                    help="0 = ไม่จำกัด — ครบเวลาแล้วข้ามขั้นปรับปรุงที่เหลือ (รวมทริป/local search/CP-SAT) "
+                         "แล้วใช้แผนที่จัดได้ถึงตอนนั้น (กดปุ่มยกเลิกระหว่างจัดได้เช่นกัน)"
+                )
 
                 st.markdown('<div class="divider-label">⏰ เวลาและวันที่โหลดสินค้า</div>', unsafe_allow_html=True)
                 _ld_col1, _ld_col2 = st.columns(2)
@@ -7259,18 +7509,14 @@ hr { border: none !important; border-top: 1.5px solid #d1fae5 !important; margin
 
                 st.markdown('<div class="divider-label">📋 ข้อจำกัดรถจาก Master Data</div>', unsafe_allow_html=True)
                 
-                # บึงแคช: vehicle_restrictions (เร็ว - ไม่ใช้ iterrows)
-                vehicle_restrictions = {code: get_max_vehicle_for_branch(code) for code in df['Code']}
+                # บึงแคช: vehicle_restrictions + สาขาที่ไม่พบ (batch ผ่าน BRANCH_RESOLVER)
+                _wms_col = df['WMSCode'] if 'WMSCode' in df.columns else None
+                vehicle_restrictions = dict(zip(df['Code'], get_max_vehicles(df['Code'], _wms_col)))
                 unmatched_codes = []
                 
                 if not MASTER_DATA.empty and 'Plan Code' in MASTER_DATA.columns:
-                    master_codes_set = set(MASTER_DATA['Plan Code'].str.strip().str.upper())
-                    for code in df['Code']:
-                        code_clean = str(code).strip().upper()
-                        if code_clean not in master_codes_set:
-                            found = any(code_clean in mc or mc in code_clean for mc in master_codes_set)
-                            if not found:
-                                unmatched_codes.append(code_clean)
+                    _resolved = BRANCH_RESOLVER.resolve_codes(df['Code'], _wms_col)
+                    unmatched_codes = [str(c).strip().upper() for c, k in zip(df['Code'], _resolved) if k is None]
                 
                 restriction_counts = pd.Series(vehicle_restrictions).value_counts()
                 total_branches = len(df)
@@ -7312,6 +7558,65 @@ hr { border: none !important; border-top: 1.5px solid #d1fae5 !important; margin
                         display_restricted.columns = ['รหัสสาขา', 'ชื่อสาขา', 'รถสูงสุด']
                         st.dataframe(display_restricted.sort_values('รถสูงสุด'), width="stretch", height=300)
                 
+                def _poll_plan_job(job, progress_bar, status_text, log_area):
+                    """รอ thread จัดทริปจนเสร็จ — อัปเดต log ทุก 0.4s (กด Cancel → rerun แล้วมารอต่อที่นี่)"""
+                    _tick = 0
+                    while not job['box']['done']:
+                        time_module.sleep(0.4)
+                        _tick += 1
+                        _logs_now = st.session_state.get('_ui_log', [])
+                        if _logs_now:
+                            _last_line = _logs_now[-1]
+                            status_text.write(f"⏳ {_last_line[:120]}")
+                            log_area.code('\n'.join(_logs_now[-30:]), language=None)
+                        progress_bar.progress(min(88, 20 + _tick * 2))
+
+                def _finish_plan_job(job, status, progress_bar, status_text, log_area):
+                    """เก็บผลของงานจัดทริปที่เสร็จแล้วลง session_state + เริ่ม pre-cache เส้นทาง"""
+                    st.session_state.pop('_plan_job', None)
+                    _box = job['box']
+                    if isinstance(_box['error'], PlanningCancelled):
+                        status.update(label="⏹️ ยกเลิกการจัดเที่ยว", state="error", expanded=False)
+                        st.warning(f"⏹️ {_box['error']} — ยังจัดทริปไม่เสร็จ จึงไม่มีผลลัพธ์")
+                        st.stop()
+                    if _box['error']:
+                        status.update(label=f"❌ เกิดข้อผิดพลาด", state="error", expanded=True)
+                        st.error(f"❌ {_box['error']}")
+                        st.code(''.join(_box.get('traceback') or []), language='text')
+                        st.stop()
+
+                    result_df, summary, fleet_used = _box['result']
+                    elapsed_time = time_module.time() - job['start']
+
+                    # snapshot log หลังเสร็จ
+                    _collected_log = list(st.session_state.get('_ui_log', []))
+                    st.session_state['_trip_log'] = _collected_log
+                    if _collected_log:
+                        log_area.code('\n'.join(_collected_log[-30:]), language=None)
+
+                    # 💾 เก็บผลลัพธ์ใน session_state
+                    st.session_state['trip_result'] = result_df
+                    st.session_state['trip_summary'] = summary
+                    st.session_state['fleet_used'] = fleet_used
+                    st.session_state['fleet_limits'] = job['fleet_limits']
+                    st.session_state['trip_buffers'] = job['buffers']
+                    st.session_state['_trip_result_fresh'] = True
+                    st.session_state['_trip_elapsed'] = elapsed_time
+                    st.session_state['_trip_profile'] = summary.attrs.get('planner_profile', [])
+                    st.session_state['_trip_local_search'] = summary.attrs.get('local_search')
+                    st.session_state['_trip_cpsat'] = summary.attrs.get('cpsat')
+                    st.session_state['_trip_portfolio'] = summary.attrs.get('portfolio')
+                    st.session_state['_trip_cancelled'] = summary.attrs.get('cancelled')
+
+                    progress_bar.progress(100)
+                    status_text.write(f"✅ จัดทริปเสร็จสิ้น! (ใช้เวลา {elapsed_time:.1f} วินาที)")
+                    status.update(label=f"✅ ประมวลผลเสร็จสมบูรณ์! ({elapsed_time:.1f}s)", state="complete", expanded=False)
+
+                    # 🗺️ Pre-cache เส้นทาง OSRM ทุกทริปผ่านคิว prefetch ของ process (background)
+                    # เพื่อให้แผนที่แสดงเส้นจริงทันทีโดยไม่ต้องรอ API ขณะ render
+                    if USE_CACHE:
+                        get_route_prefetcher().submit(trip_routes(result_df), priority=PRIORITY_PLAN)
+
                 # ปุ่มจัดทริป
                 if st.button("🚀 เริ่มจัดเที่ยว", type="primary", width="stretch"):
                     # เคลียร์ log เก่า
@@ -7329,114 +7634,96 @@ hr { border: none !important; border-top: 1.5px solid #d1fae5 !important; margin
                         df_to_process = df.copy()
                         progress_bar.progress(20)
 
-                        import time as time_module, threading as _threading
-                        start_time = time_module.time()
+                        import threading as _threading, traceback as _tb2
+
+                        # ── plan cache: ออเดอร์ + ค่าตั้ง + ข้อมูลเดิม → ใช้ผลเดิมทันที ──
+                        _plan_cache = get_plan_cache()
+                        _plan_key = plan_cache_key(df_to_process, {
+                            'punthai_buffer': punthai_buffer_value,
+                            'maxmart_buffer': maxmart_buffer_value,
+                            'fleet_limits': fleet_limits_input,
+                            'max_qty_per_trip': int(max_qty_per_trip),
+                            'parallel': bool(parallel_plan),
+                            'improve_seconds': int(improve_seconds),
+                            'cpsat_seconds': int(cpsat_seconds),
+                            'portfolio_seconds': int(portfolio_seconds),
+                        }, versions=plan_data_versions())
+                        _cached_plan = _plan_cache.get(_plan_key)
 
                         # ── รัน predict_trips ใน thread แยก เพื่อให้ log แสดง live ──
-                        _result_box = {'result': None, 'error': None, 'done': False}
+                        # งานเก็บไว้ใน session_state → กด Cancel (rerun) แล้วยังรอผลต่อได้
+                        _cancel_token = CancelToken(deadline_s=int(plan_deadline_seconds) or None)
+                        _result_box = {'result': _cached_plan, 'error': None, 'done': _cached_plan is not None}
+                        _job = {
+                            'token': _cancel_token,
+                            'box': _result_box,
+                            'start': time_module.time(),
+                            'fleet_limits': fleet_limits_input,
+                            'buffers': {'punthai': punthai_buffer_value, 'maxmart': maxmart_buffer_value},
+                        }
+                        if _cached_plan is not None:
+                            safe_print(f"⚡ ใช้ผลจัดเที่ยวเดิมจาก plan cache ({_plan_key[:8]})")
 
                         def _run_predict():
                             try:
-                                _result_box['result'] = predict_trips(
-                                    df_to_process, model_data,
-                                    punthai_buffer=punthai_buffer_value,
-                                    maxmart_buffer=maxmart_buffer_value,
-                                    fleet_limits=fleet_limits_input,
-                                    max_qty_per_trip=int(max_qty_per_trip)
-                                )
+                                if portfolio_seconds:
+                                    _result_box['result'] = run_portfolio(
+                                        df_to_process, model_data, int(portfolio_seconds), predict_trips,
+                                        {'punthai': PUNTHAI_LIMITS, 'maxmart': LIMITS},
+                                        options=dict(punthai_buffer=punthai_buffer_value,
+                                                     maxmart_buffer=maxmart_buffer_value,
+                                                     fleet_limits=fleet_limits_input,
+                                                     max_qty_per_trip=int(max_qty_per_trip)),
+                                        branch_to_group=BRANCH_TO_GROUP, no_cross_pairs=NO_CROSS_ZONE_PAIRS,
+                                        log=safe_print, cancel=_cancel_token,
+                                    )
+                                else:
+                                    _result_box['result'] = predict_trips(
+                                        df_to_process, model_data,
+                                        punthai_buffer=punthai_buffer_value,
+                                        maxmart_buffer=maxmart_buffer_value,
+                                        fleet_limits=fleet_limits_input,
+                                        max_qty_per_trip=int(max_qty_per_trip),
+                                        parallel=bool(parallel_plan),
+                                        improve_seconds=int(improve_seconds),
+                                        cpsat_seconds=int(cpsat_seconds),
+                                        cancel=_cancel_token,
+                                    )
+                                # แผนที่ถูกตัดกลางทางไม่เก็บ cache (ครั้งหน้าต้องได้แผนเต็ม)
+                                if 'cancelled' not in _result_box['result'][1].attrs:
+                                    _plan_cache.put(_plan_key, _result_box['result'])
                             except Exception as _ex:
                                 _result_box['error'] = _ex
+                                _result_box['traceback'] = _tb2.format_exception(_ex)
                             finally:
                                 _result_box['done'] = True
 
-                        _t = _threading.Thread(target=_run_predict, daemon=True)
-                        _t.start()
-
-                        # ── polling loop: อัปเดต log ทุก 0.4s ──
-                        _tick = 0
-                        while not _result_box['done']:
-                            time_module.sleep(0.4)
-                            _tick += 1
-                            _logs_now = st.session_state.get('_ui_log', [])
-                            if _logs_now:
-                                _last_line = _logs_now[-1]
-                                status_text.write(f"⏳ {_last_line[:120]}")
-                                log_area.code('\n'.join(_logs_now[-30:]), language=None)
-                            progress_bar.progress(min(88, 20 + _tick * 2))
-
-                        _t.join()
-
-                        if _result_box['error']:
-                            status.update(label=f"❌ เกิดข้อผิดพลาด", state="error", expanded=True)
-                            st.error(f"❌ {_result_box['error']}")
-                            import traceback as _tb2
-                            st.code(_tb2.format_exc(), language='text')
-                            st.stop()
-
-                        result_df, summary, fleet_used = _result_box['result']
-                        elapsed_time = time_module.time() - start_time
-
-                        # snapshot log หลังเสร็จ
-                        _collected_log = list(st.session_state.get('_ui_log', []))
-                        st.session_state['_trip_log'] = _collected_log
-                        if _collected_log:
-                            log_area.code('\n'.join(_collected_log[-30:]), language=None)
-
-                        # 💾 เก็บผลลัพธ์ใน session_state
-                        st.session_state['trip_result'] = result_df
-                        st.session_state['trip_summary'] = summary
-                        st.session_state['fleet_used'] = fleet_used
-                        st.session_state['fleet_limits'] = fleet_limits_input
-                        st.session_state['trip_buffers'] = {
-                            'punthai': punthai_buffer_value,
-                            'maxmart': maxmart_buffer_value
-                        }
-                        st.session_state['_trip_result_fresh'] = True
-                        st.session_state['_trip_elapsed'] = elapsed_time
-
-                        progress_bar.progress(100)
-                        status_text.write(f"✅ จัดทริปเสร็จสิ้น! (ใช้เวลา {elapsed_time:.1f} วินาที)")
-                        status.update(label=f"✅ ประมวลผลเสร็จสมบูรณ์! ({elapsed_time:.1f}s)", state="complete", expanded=False)
-
-                        # 🗺️ Pre-cache เส้นทาง OSRM ทุกทริปใน background thread
-                        # เพื่อให้แผนที่แสดงเส้นจริงทันทีโดยไม่ต้องรอ API ขณะ render
-                        def _precache_routes(df_snapshot):
-                            import threading
-                            _dc_lat = DC_WANG_NOI_LAT
-                            _dc_lon = DC_WANG_NOI_LON
-                            _trip_ids = sorted(df_snapshot[df_snapshot['Trip'] > 0]['Trip'].unique())
-                            _cached_count = 0
-                            for _tid in _trip_ids:
-                                _tdata = df_snapshot[df_snapshot['Trip'] == _tid]
-                                _pts = []
-                                for _, _r in _tdata.iterrows():
-                                    _la = float(_r.get('_lat', 0) or 0)
-                                    _lo = float(_r.get('_lon', 0) or 0)
-                                    if _la > 0 and _lo > 0:
-                                        _pts.append([_la, _lo])
-                                if not _pts:
-                                    continue
-                                _wp = [[_dc_lat, _dc_lon]] + _pts + [[_dc_lat, _dc_lon]]
-                                _ck = "|".join([f"{la:.4f},{lo:.4f}" for la, lo in _wp])
-                                if USE_CACHE and _ck in ROUTE_CACHE_DATA:
-                                    continue  # มีแล้ว ข้าม
-                                get_multi_point_route_osrm(_wp)  # จะ cache ผลอัตโนมัติ
-                                _cached_count += 1
-                            if _cached_count > 0:
-                                save_route_cache(ROUTE_CACHE_DATA, force=True)
-                                safe_print(f"🗺️ Pre-cached {_cached_count} trip routes → route_cache.json")
-
-                        import threading as _thr
-                        _rt = _thr.Thread(
-                            target=_precache_routes,
-                            args=(result_df.copy(),),
-                            daemon=True,
-                            name="precache-routes"
-                        )
-                        _rt.start()
+                        if _cached_plan is None:
+                            st.session_state['_plan_job'] = _job
+                            _threading.Thread(target=_run_predict, daemon=True).start()
+                            st.button("⏹️ ยกเลิก (ใช้แผนที่จัดได้ถึงตอนนี้)", key="cancel_plan",
+                                      on_click=_cancel_token.cancel)
+
+                        _poll_plan_job(_job, progress_bar, status_text, log_area)
+                        _finish_plan_job(_job, status, progress_bar, status_text, log_area)
 
                     st.rerun()
-                
+                elif st.session_state.get('_plan_job'):
+                    # กด Cancel ระหว่างจัด → script rerun: รอ thread เดิมคืนแผนที่ดีที่สุดที่มี
+                    _job = st.session_state['_plan_job']
+                    _stopping = _job['token'].stopped
+                    with st.status("⏹️ กำลังหยุดจัดเที่ยว..." if _stopping else "🚀 กำลังประมวลผล...",
+                                   expanded=True) as status:
+                        progress_bar = st.progress(20)
+                        status_text = st.empty()
+                        log_area = st.empty()
+                        if not _stopping:
+                            st.button("⏹️ ยกเลิก (ใช้แผนที่จัดได้ถึงตอนนี้)", key="cancel_plan",
+                                      on_click=_job['token'].cancel)
+                        _poll_plan_job(_job, progress_bar, status_text, log_area)
+                        _finish_plan_job(_job, status, progress_bar, status_text, log_area)
+                    st.rerun()
+
                 # 📊 แสดงผลลัพธ์ถ้ามีข้อมูลใน session_state
                 if 'trip_result' in st.session_state and 'trip_summary' in st.session_state:
                     result_df = st.session_state['trip_result']
@@ -7478,6 +7765,12 @@ hr { border: none !important; border-top: 1.5px solid #d1fae5 !important; margin
                         st.balloons()
                         st.session_state['_trip_result_fresh'] = False
                     st.success(f"✅ **จัดทริปเสร็จสมบูรณ์!** รวม **{len(summary)}** ทริป ({len(assigned_df)} สาขา)")
+                    _cancelled = st.session_state.get('_trip_cancelled')
+                    if _cancelled:
+                        _why = 'ครบเวลาที่กำหนด' if _cancelled['reason'] == 'deadline' else 'ผู้ใช้กดยกเลิก'
+                        st.warning(f"⏹️ หยุดจัดเที่ยวก่อนเสร็จ ({_why}, {_cancelled['seconds']:.1f}s) — "
+                                   f"ใช้แผนที่จัดได้ถึงตอนนั้น · ข้าม: {', '.join(_cancelled['skipped']) or '-'}"
+                                   f" · จบกลางทาง: {', '.join(_cancelled['cut_short']) or '-'}")
                     
                     st.markdown('<div class="divider-label">📊 สรุปผลการจัดทริป</div>', unsafe_allow_html=True)
                     
@@ -7527,6 +7820,49 @@ hr { border: none !important; border-top: 1.5px solid #d1fae5 !important; margin
                                 _tc2.metric("🗺️ สร้างแผนที่", f"{_map_elapsed:.1f}s")
                             _tc3.metric("💾 cache", f"{len(st.session_state.get('_imap_key',''))*0:.0f}+{len(summary)} trips")
 
+                            # 📊 เวลาแต่ละ phase ของ predict_trips (waterfall: เริ่ม + สัดส่วนเวลา)
+                            _prof_df = profile_frame(st.session_state.get('_trip_profile', []))
+                            if not _prof_df.empty:
+                                st.dataframe(
+                                    _prof_df, hide_index=True, width="stretch",
+                                    column_config={
+                                        '%': st.column_config.ProgressColumn('%', min_value=0, max_value=100, format="%.1f%%"),
+                                    },
+                                )
+
+                            # 🔧 ผล Step 6.9 local search (ถ้าเปิดใช้)
+                            _ls = st.session_state.get('_trip_local_search')
+                            if _ls:
+                                _lc1, _lc2, _lc3 = st.columns(3)
+                                _lc1.metric("🔧 รถที่ลดได้", f"{_ls['trucks_saved']} คัน",
+                                            f"6W {_ls['six_w_saved']:+d}" if _ls['six_w_saved'] else None)
+                                _lc2.metric("📈 Utilization เฉลี่ย", f"{_ls['after']['avg_util']:.1f}%",
+                                            f"{_ls['util_gain_pts']:+.1f} pts")
+                                _lc3.metric("⏱️ Local search", f"{_ls['seconds']:.1f}s / {_ls['budget_s']:g}s",
+                                            f"{_ls['trucks_saved_per_s']:.2f} คัน/s")
+                                st.caption(f"moves: {_ls['moves'] or '-'} · {_ls['passes']} รอบ"
+                                           + (" · หมดเวลา" if _ls['timed_out'] else ""))
+
+                            # 🤖 ผล CP-SAT (ถ้าเปิดใช้)
+                            _cp = st.session_state.get('_trip_cpsat')
+                            if _cp:
+                                st.caption(f"🤖 CP-SAT: ปรับได้ {_cp['improved']}/{len(_cp['subproblems'])} กลุ่ม · "
+                                           f"ทริป {_cp['trips_before']} → {_cp['trips_after']} · {_cp['seconds']:.1f}s")
+                                st.dataframe(pd.DataFrame(_cp['subproblems']), hide_index=True, width="stretch")
+
+                            # 🏁 ผลแข่ง engine (ถ้าเปิดใช้)
+                            _pf = st.session_state.get('_trip_portfolio')
+                            if _pf:
+                                _winner = next(e for e in _pf['engines'] if e['engine'] == _pf['winner'])
+                                _pc1, _pc2, _pc3 = st.columns(3)
+                                _pc1.metric("🏆 Engine ที่ชนะ", _pf['winner'])
+                                _pc2.metric("🚛 รถ", f"{_winner['trucks']} คัน",
+                                            f"{-_pf['trucks_saved']:+d} vs {_pf['runner_up']}" if _pf['runner_up'] else None,
+                                            delta_color="inverse")
+                                _pc3.metric("📉 Score", f"{_winner['score']:.1f}",
+                                            f"ดีกว่า {_pf['margin']:.1f}" if _pf['runner_up'] else None)
+                                st.dataframe(pd.DataFrame(_pf['engines']), hide_index=True, width="stretch")
+
                     st.markdown('<div class="divider-label">🚛 รายละเอียดแต่ละทริป</div>', unsafe_allow_html=True)
                     
                     # ตรวจสอบว่า summary มีคอลัมน์ที่ต้องการหรือไม่
@@ -8255,52 +8591,94 @@ hr { border: none !important; border-top: 1.5px solid #d1fae5 !important; margin
                     
                     # 🗺️ แผนที่เส้นทาง (Interactive - Leaflet.js)
                     with st.expander("🗺️ แผนที่เส้นทาง (Interactive)", expanded=True):
-                        try:
-                            import importlib as _imp, trip_map_interactive as _tmi
-                            import time as _time_mod
-                            import streamlit.components.v1 as _cmp2
-                            import hashlib as _hl
-                            _build_imap = _tmi.build_interactive_map_html
-
-                            _imap_sig = f"v30|{len(assigned_df)}|{int(assigned_df['Trip'].max())}|{sorted(assigned_df['Trip'].unique().tolist())}"
-                            _imap_key = _hl.md5(_imap_sig.encode()).hexdigest()[:12]
-
-                            if st.session_state.get('_imap_key') != _imap_key:
-                                with st.spinner("🗺️ กำลังสร้างแผนที่..."):
-                                    _t_map = _time_mod.time()
-                                    _imap_html = _build_imap(
-                                        result_df=assigned_df,
-                                        summary_df=summary,
-                                        limits=LIMITS,
-                                        punthai_limits=PUNTHAI_LIMITS,
-                                        trip_no_map=trip_no_map,
-                                        dc_lat=14.1459, dc_lon=100.6873,
-                                        route_cache=ROUTE_CACHE_DATA,
-                                    )
-                                    st.session_state['_imap_html'] = _imap_html
-                                    st.session_state['_imap_key'] = _imap_key
-                                    st.session_state['_imap_build_time'] = _time_mod.time() - _t_map
-
-                            _htm = st.session_state.get('_imap_html', '')
-                            if not _htm:
-                                st.warning("⚠️ ยังไม่มีข้อมูลแผนที่ กดจัดเที่ยวก่อน")
-                            else:
-                                # Sanitize surrogates
-                                try:
-                                    _htm.encode('utf-8')
-                                except UnicodeEncodeError:
-                                    _htm = _htm.encode('utf-8', errors='replace').decode('utf-8')
-                                    st.session_state['_imap_html'] = _htm
-                                import re as _re
-                                _nb = len(_re.findall(r'"code":', _htm))
-                                _build_t = st.session_state.get('_imap_build_time', 0)
-                                st.caption(f"🗺️ HTML: {len(_htm)//1024} KB · {_nb} สาขา · build: {_build_t:.1f}s")
-                                _cmp2.html(_htm, height=860, scrolling=False)
-                        except Exception as _e:
-                            import traceback as _tb
-                            st.error(f"❌ Interactive map error: {_e}")
-                            st.code(_tb.format_exc(), language='text')
-                            st.info(f"📋 columns: {list(assigned_df.columns)} | rows: {len(assigned_df)} | trips: {sorted(assigned_df['Trip'].unique().tolist())}")
+                        # 🛣️ เส้นทางของแผนที่นี้ขึ้นคิว prefetch ก่อนงานเบื้องหลัง (ทริปที่ขอแล้วจาก session อื่นไม่ขอซ้ำ)
+                        _map_routes = trip_routes(assigned_df) if USE_CACHE else []
+                        _prefetcher = get_route_prefetcher()
+                        # ขึ้นคิวครั้งเดียวต่อชุดเส้นทาง — rerun ไม่ส่งเส้นทางที่ล้มเหลวซ้ำ (ไม่งั้น poll วนไม่จบ)
+                        _routes_sig = hash(tuple(route_legs.route_key(_wp) for _wp in _map_routes))
+                        if st.session_state.get('_pf_view_sent') != _routes_sig:
+                            _prefetcher.submit(_map_routes, priority=PRIORITY_VIEW)
+                            st.session_state['_pf_view_sent'] = _routes_sig
+
+                        # 🎯 ทริปที่กำลังดู → หัวคิว prefetch (PRIORITY_FOCUS เลื่อนงานที่ค้างอยู่ขึ้นก่อน)
+                        if _map_routes:
+                            _focus_dist = (assigned_df[assigned_df['Trip'] > 0].groupby('Trip')['_distance_from_dc'].max()
+                                           .fillna(0).sort_values(ascending=False)
+                                           if '_distance_from_dc' in assigned_df.columns else
+                                           pd.Series(0, index=sorted(assigned_df.loc[assigned_df['Trip'] > 0, 'Trip'].unique())))
+                            _focus_trip = st.selectbox(
+                                "🎯 โหลดเส้นทางทริปนี้ก่อน", [None] + _focus_dist.index.tolist(), key="route_focus_trip",
+                                format_func=lambda t: "— ตามลำดับปกติ —" if t is None else f"Trip {t} ({_focus_dist.get(t, 0):.0f}km)",
+                            )
+                            if _focus_trip is not None and st.session_state.get('_pf_focus_sent') != (_focus_trip, _routes_sig):
+                                _prefetcher.submit(trip_routes(assigned_df[assigned_df['Trip'] == _focus_trip]),
+                                                   priority=PRIORITY_FOCUS)
+                                st.session_state['_pf_focus_sent'] = (_focus_trip, _routes_sig)
+                        _pf_pending = _prefetcher.status(_map_routes)['pending'] > 0
+
+                        @st.fragment(run_every=ROUTE_MAP_POLL_SECONDS if _pf_pending else None)
+                        def _route_map_fragment():
+                            """แผนที่ + สถานะ prefetch — poll ระหว่างยังมีเส้นทางค้าง แล้วสร้างแผนที่ใหม่เมื่อได้เส้นทางเพิ่ม"""
+                            _pf = _prefetcher.status(_map_routes)
+                            if _pf['pending']:
+                                st.caption(f"🛣️ กำลังโหลดเส้นทาง {_pf['ready']}/{_pf['total']} ทริป"
+                                           + (f" (ล้มเหลว {_pf['failed']})" if _pf['failed'] else ""))
+                            # สร้างแผนที่ใหม่เมื่อได้เส้นทางเพิ่ม — ไม่ถี่กว่า ROUTE_MAP_REBUILD_SECONDS ระหว่างยังโหลดอยู่
+                            _ready = _pf['ready']
+                            _last = st.session_state.get('_imap_routes_ready', (None, 0.0))
+                            if _ready != _last[0] and (not _pf['pending'] or time_module.time() - _last[1] >= ROUTE_MAP_REBUILD_SECONDS):
+                                st.session_state['_imap_routes_ready'] = (_ready, time_module.time())
+                            _routes_ready = st.session_state['_imap_routes_ready'][0]
+                            try:
+                                import importlib as _imp, trip_map_interactive as _tmi
+                                import time as _time_mod
+                                import streamlit.components.v1 as _cmp2
+                                import hashlib as _hl
+                                _build_imap = _tmi.build_interactive_map_html
+
+                                _imap_sig = f"v30|{len(assigned_df)}|{int(assigned_df['Trip'].max())}|{sorted(assigned_df['Trip'].unique().tolist())}|{_routes_ready}"
+                                _imap_key = _hl.md5(_imap_sig.encode()).hexdigest()[:12]
+
+                                if st.session_state.get('_imap_key') != _imap_key:
+                                    with st.spinner("🗺️ กำลังสร้างแผนที่..."):
+                                        _t_map = _time_mod.time()
+                                        _imap_html = _build_imap(
+                                            result_df=assigned_df,
+                                            summary_df=summary,
+                                            limits=LIMITS,
+                                            punthai_limits=PUNTHAI_LIMITS,
+                                            trip_no_map=trip_no_map,
+                                            dc_lat=14.1459, dc_lon=100.6873,
+                                            route_cache=ROUTE_CACHE_DATA,
+                                        )
+                                        st.session_state['_imap_html'] = _imap_html
+                                        st.session_state['_imap_key'] = _imap_key
+                                        st.session_state['_imap_build_time'] = _time_mod.time() - _t_map
+
+                                _htm = st.session_state.get('_imap_html', '')
+                                if not _htm:
+                                    st.warning("⚠️ ยังไม่มีข้อมูลแผนที่ กดจัดเที่ยวก่อน")
+                                else:
+                                    # Sanitize surrogates
+                                    try:
+                                        _htm.encode('utf-8')
+                                    except UnicodeEncodeError:
+                                        _htm = _htm.encode('utf-8', errors='replace').decode('utf-8')
+                                        st.session_state['_imap_html'] = _htm
+                                    import re as _re
+                                    _nb = len(_re.findall(r'"code":', _htm))
+                                    _build_t = st.session_state.get('_imap_build_time', 0)
+                                    st.caption(f"🗺️ HTML: {len(_htm)//1024} KB · {_nb} สาขา · build: {_build_t:.1f}s")
+                                    _cmp2.html(_htm, height=860, scrolling=False)
+                            except Exception as _e:
+                                import traceback as _tb
+                                st.error(f"❌ Interactive map error: {_e}")
+                                st.code(_tb.format_exc(), language='text')
+                                st.info(f"📋 columns: {list(assigned_df.columns)} | rows: {len(assigned_df)} | trips: {sorted(assigned_df['Trip'].unique().tolist())}")
+                            if _pf_pending and not _pf['pending']:
+                                st.rerun()   # โหลดครบแล้ว → rerun ทั้งหน้าครั้งเดียว ให้ fragment ใหม่ไม่มี run_every (หยุด poll)
+
+                        _route_map_fragment()
 
                     # ── FOLIUM FALLBACK (ใช้เมื่อ interactive map error) ──
                     if 'FOLIUM_AVAILABLE' in dir() and FOLIUM_AVAILABLE and locals().get('_FOLIUM_FALLBACK_', False):
@@ -8336,6 +8714,8 @@ hr { border: none !important; border-top: 1.5px solid #d1fae5 !important; margin
                             if selected_trip != 'ทั้งหมด':
                                 trip_num = int(selected_trip.split()[1])
                                 map_df = map_df[map_df['Trip'] == trip_num]
+                                if USE_CACHE:  # ทริปที่เลือกดู → หัวคิว prefetch
+                                    get_route_prefetcher().submit(trip_routes(map_df), priority=PRIORITY_FOCUS)
                             if selected_truck != 'ทั้งหมด':
                                 map_df = map_df[map_df['Truck'].str.startswith(selected_truck, na=False)]
                             
@@ -8495,7 +8875,8 @@ hr { border: none !important; border-top: 1.5px solid #d1fae5 !important; margin
                                                     waypoints = [[DC_LAT, DC_LON]] + points + [[DC_LAT, DC_LON]]
 
                                                     # ใช้ ROUTE_CACHE_DATA (global file-backed) โดยตรงผ่าน get_multi_point_route_osrm
-                                                    real_route_coords, total_trip_distance = get_multi_point_route_osrm(waypoints)
+                                                    # แผนที่รวมหลายทริป → geometry ระดับ 100m พอ (HTML เล็กลงมาก)
+                                                    real_route_coords, total_trip_distance = get_multi_point_route_osrm(waypoints, level='100m')
 
                                                     # fallback: ถ้า OSRM ล้มเหลว (coords = waypoints เหมือนกัน) → คำนวณ distance จาก cache
                                                     if total_trip_distance == 0 or real_route_coords == waypoints:
@@ -8617,10 +8998,9 @@ hr { border: none !important; border-top: 1.5px solid #d1fae5 !important; margin
                                             if len(points) > 0:
                                                 # ใช้ OSRM multi-point route เพื่อระยะทางถนนจริง
                                                 _wp = [[DC_LAT, DC_LON]] + points
-                                                _cache_k = "|".join([f"{la:.4f},{lo:.4f}" for la, lo in _wp])
-                                                if USE_CACHE and _cache_k in ROUTE_CACHE_DATA:
-                                                    _rc = ROUTE_CACHE_DATA[_cache_k]
-                                                    route_distance = _rc.get('distance', 0)
+                                                _rc = route_legs.cached_route(ROUTE_CACHE_DATA, _wp) if USE_CACHE else None
+                                                if _rc is not None:
+                                                    route_distance = _rc[1]
                                                 else:
                                                     _, route_distance = get_multi_point_route_osrm(_wp)
                                                 # inter_branch = OSRM ไม่รวม DC leg แรก → ประมาณจาก DISTANCE_CACHE
@@ -9163,4 +9543,6 @@ if __name__ == "__main__":
             save_distance_cache(DISTANCE_CACHE, force=True)
             save_route_cache(ROUTE_CACHE_DATA, force=True)
             safe_print(f"💾 บันทึก cache: {len(DISTANCE_CACHE)} ระยะทาง, {len(ROUTE_CACHE_DATA)} เส้นทาง")
+            if isinstance(ROUTE_CACHE_DATA, RouteStore):
+                safe_print(f"   route store: {ROUTE_CACHE_DATA.summary()}")
 
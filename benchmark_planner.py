@@ -0,0 +1,473 @@
+"""
+Planner Benchmark — วัดความเร็ว predict_trips ด้วยไฟล์ออเดอร์สังเคราะห์ (offline ทั้งหมด)
+
+- สุ่มสาขาจริงจาก branch_data.json (+ พิกัดจาก branch_clusters.json ถ้ามี) ตามขนาด/สัดส่วนภาคที่กำหนด
+- สร้าง DataFrame รูปแบบเดียวกับชีต 2.Punthai (BU, BranchCode, Branch, TOTALCUBE, TOTALWGT,
+  Original QTY, latitude, longitude) → process_dataframe → predict_trips แบบ headless
+  น้ำหนัก/คิว/จำนวนชิ้นสุ่มตามการกระจายจริงของแต่ละ BU (จาก Dc/test.xlsx)
+- ทุกขนาดรันใน process แยก (peak RSS / cache ไม่ปนกัน) และปิด network ทั้งหมด
+  (requests ถูกบล็อก → Sheets/OSRM ใช้ไม่ได้ → app ใช้ branch_data.json + haversine×1.35)
+- --routing haversine|standin|osrm → วัดขั้นขอเส้นทางทุกทริปหลังจัดเสร็จ (precache_trip_routes) ผ่าน
+  routing backend นั้นด้วย (standin = OSRM stand-in ในเครื่อง ยิง HTTP จริงแบบ offline;
+  osrm = OSRM_BASE_URL ที่อยู่ในเครื่องเท่านั้น เพราะ network ภายนอกถูกบล็อก)
+- เก็บผล (เวลา, peak RSS, จำนวนทริป, utilization เฉลี่ย, เวลาต่อ phase) ต่อท้าย benchmark_history.json
+  แล้วเทียบกับรอบก่อนของ size/seed/mix เดียวกัน → ⚠️ ถ้าช้าลง/ใช้ RAM เพิ่มเกินเกณฑ์ หรือจำนวนทริปเปลี่ยน
+
+คำสั่ง:
+    python benchmark_planner.py run      [--sizes 500,2000,8000] [--mix กลาง=0.6,อีสาน=0.2,เหนือ=0.2]
+                                         [--seed 42] [--history benchmark_history.json] [--threshold 0.15] [--verbose]
+                                         [--routing haversine|standin|osrm]
+    python benchmark_planner.py generate 2000 orders.xlsx [--mix ...] [--seed 42]
+    python benchmark_planner.py history  [benchmark_history.json]
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_SIZES = (500, 2000, 8000)
+DEFAULT_SEED = 42
+DEFAULT_HISTORY_FILE = 'benchmark_history.json'
+DEFAULT_THRESHOLD = 0.15          # ช้าลง/RAM เพิ่มเกิน 15% → แจ้งเตือน
+BRANCH_DATA_FILE = 'branch_data.json'
+BRANCH_CLUSTERS_FILE = 'branch_clusters.json'
+
+RESULT_MARKER = 'BENCHMARK_RESULT '
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+# คอลัมน์ตามตำแหน่งของชีต 2.Punthai (process_dataframe map ตามลำดับ: 1=BU, 2=Code, ..., 15/16=lat/lon)
+ORDER_COLUMNS = [
+    'Sep.', 'BU', 'BranchCode', 'รหัส WMS', 'Branch', 'TOTALCUBE', 'TOTALWGT', 'Original QTY',
+    'Trip', 'Trip no', 'วันที่โหลด', 'เวลาโหลด(ประมาณ)', 'ประตู', 'WAVE', 'remark', 'latitude', 'longitude',
+]
+
+# การกระจายต่อ BU (จาก Dc/test.xlsx): สัดส่วนแถว, ln(น้ำหนัก) mean/std, คิว/กก., ชิ้น/กก.
+BU_PROFILES = {
+    'PUNTHAI':    {'share': 0.63, 'log_w': (4.37, 1.52), 'cube_per_kg': 0.00451, 'qty_per_kg': 3.32},
+    'MAX MART':   {'share': 0.16, 'log_w': (7.22, 0.26), 'cube_per_kg': 0.00287, 'qty_per_kg': 3.91},
+    'LUBE':       {'share': 0.11, 'log_w': (3.65, 1.01), 'cube_per_kg': 0.00186, 'qty_per_kg': 0.87},
+    'SUPPLY USE': {'share': 0.09, 'log_w': (0.97, 0.75), 'cube_per_kg': 0.00665, 'qty_per_kg': 6.73},
+    'GFA':        {'share': 0.01, 'log_w': (4.37, 0.67), 'cube_per_kg': 0.00343, 'qty_per_kg': 4.33},
+}
+
+# prefix ชื่อสาขาใน master → BU (ชื่อที่ไม่มี prefix สุ่ม BU ตาม share)
+_NAME_BU_PREFIX = (
+    ('MAX MART', 'MAX MART'),
+    ('PUNTHAI', 'PUNTHAI'),
+    ('LUBE', 'LUBE'),
+    ('SUPPLY USE', 'SUPPLY USE'),
+)
+
+
+# ==========================================
+# สร้างออเดอร์สังเคราะห์
+# ==========================================
+def load_branch_pool(data_file=BRANCH_DATA_FILE, clusters_file=BRANCH_CLUSTERS_FILE):
+    """
+    สาขาที่สุ่มได้ (พิกัดถูกต้อง) → DataFrame: code, name, lat, lon, province, district, subdistrict
+    พิกัด/จังหวัดที่ขาดใน branch_data.json เติมจาก branch_info ของ branch_clusters.json (ถ้ามีไฟล์)
+    """
+    with open(data_file, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+    info = {}
+    if os.path.exists(clusters_file):
+        try:
+            with open(clusters_file, 'r', encoding='utf-8') as f:
+                info = json.load(f).get('branch_info', {}) or {}
+        except Exception:
+            info = {}
+
+    def _float(v):
+        try:
+            v = float(v)
+        except (TypeError, ValueError):
+            return 0.0
+        return v if np.isfinite(v) else 0.0
+
+    rows = []
+    for key, rec in raw.items():
+        if not isinstance(rec, dict):
+            continue
+        code = str(rec.get('Plan Code') or key).strip().upper()
+        extra = info.get(code, {})
+        lat = _float(rec.get('ละติจูด')) or _float(extra.get('lat'))
+        lon = _float(rec.get('ลองติจูด')) or _float(extra.get('lon'))
+        if lat <= 0 or lon <= 0:
+            continue
+        rows.append({
+            'code': code,
+            'name': str(rec.get('สาขา') or extra.get('name') or code),
+            'lat': lat,
+            'lon': lon,
+            'province': str(rec.get('จังหวัด') or extra.get('province') or ''),
+            'district': str(rec.get('อำเภอ') or extra.get('district') or ''),
+            'subdistrict': str(rec.get('ตำบล') or extra.get('subdistrict') or ''),
+        })
+    return pd.DataFrame(rows).drop_duplicates('code').reset_index(drop=True)
+
+
+def parse_mix(text):
+    """'กลาง=0.6,อีสาน=0.4' → {'กลาง': 0.6, 'อีสาน': 0.4} (normalize ให้รวม = 1), ว่าง → None"""
+    if not text:
+        return None
+    mix = {}
+    for part in str(text).split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight) if weight.strip() else 1.0
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError(f"สัดส่วนภาคไม่ถูกต้อง: {text}")
+    return {k: v / total for k, v in mix.items()}
+
+
+def _region_counts(size, mix):
+    """แบ่ง size ตามสัดส่วน (largest remainder → รวมได้ size พอดี)"""
+    exact = {k: size * w for k, w in mix.items()}
+    counts = {k: int(v) for k, v in exact.items()}
+    rest = size - sum(counts.values())
+    for k in sorted(exact, key=lambda k: exact[k] - counts[k], reverse=True)[:rest]:
+        counts[k] += 1
+    return counts
+
+
+def _branch_bu(names, rng):
+    """BU ตาม prefix ชื่อสาขา ไม่งั้นสุ่มตาม share"""
+    bus = list(BU_PROFILES)
+    share = np.array([BU_PROFILES[b]['share'] for b in bus])
+    drawn = rng.choice(bus, size=len(names), p=share / share.sum())
+    out = []
+    for name, fallback in zip(names, drawn):
+        upper = name.upper()
+        out.append(next((bu for prefix, bu in _NAME_BU_PREFIX if upper.startswith(prefix)), fallback))
+    return out
+
+
+def make_orders(pool, size, seed=DEFAULT_SEED, mix=None, region_of=None):
+    """
+    ออเดอร์สังเคราะห์ size แถว (1 แถว/สาขา) ในรูปแบบชีต 2.Punthai
+
+    pool      = load_branch_pool()
+    mix       = {ภาค: สัดส่วน} (ชื่อตาม REGION_NAMES ของ app เช่น 'กลาง', 'อีสาน') หรือ None = ตามสัดส่วนใน pool
+    region_of = province → ชื่อภาค (app.get_region_name) ต้องมีเมื่อกำหนด mix
+    ถ้าสาขาในภาคไม่พอ → สุ่มซ้ำ (Code ซ้ำได้ เหมือนไฟล์จริงที่สาขาเดียวมีหลาย BU)
+    """
+    rng = np.random.default_rng(seed)
+    if mix:
+        if region_of is None:
+            raise ValueError("กำหนด mix ต้องส่ง region_of มาด้วย")
+        regions = pool['province'].map(lambda p: region_of(p) if p else 'ไม่ระบุ')
+        picks = []
+        for region, n in _region_counts(size, mix).items():
+            candidates = np.nonzero((regions == region).to_numpy())[0]
+            if n == 0:
+                continue
+            if len(candidates) == 0:
+                raise ValueError(f"ไม่มีสาขาในภาค '{region}' (มี: {sorted(set(regions))})")
+            picks.append(rng.choice(candidates, size=n, replace=n > len(candidates)))
+        idx = np.concatenate(picks)
+    else:
+        idx = rng.choice(len(pool), size=size, replace=size > len(pool))
+    rng.shuffle(idx)
+    branches = pool.iloc[idx].reset_index(drop=True)
+
+    bus = _branch_bu(branches['name'].tolist(), rng)
+    weight = np.empty(size)
+    cube = np.empty(size)
+    qty = np.empty(size)
+    for bu, prof in BU_PROFILES.items():
+        sel = np.array([b == bu for b in bus], dtype=bool)
+        n = int(sel.sum())
+        if not n:
+            continue
+        w = np.exp(rng.normal(prof['log_w'][0], prof['log_w'][1], n))
+        weight[sel] = np.round(w, 3)
+        cube[sel] = np.round(w * prof['cube_per_kg'] * rng.lognormal(0.0, 0.35, n), 5)
+        qty[sel] = np.maximum(1, np.round(w * prof['qty_per_kg'] * rng.lognormal(0.0, 0.3, n)))
+
+    orders = pd.DataFrame({col: [np.nan] * size for col in ORDER_COLUMNS})
+    orders['Sep.'] = np.arange(1, size + 1)
+    orders['BU'] = bus
+    orders['BranchCode'] = branches['code']
+    orders['รหัส WMS'] = branches['code']
+    orders['Branch'] = branches['name']
+    orders['TOTALCUBE'] = cube
+    orders['TOTALWGT'] = weight
+    orders['Original QTY'] = qty
+    orders['latitude'] = branches['lat']
+    orders['longitude'] = branches['lon']
+    return orders
+
+
+# ==========================================
+# รัน predict_trips 1 ขนาด (ใน process ลูก)
+# ==========================================
+def block_network():
+    """
+    บล็อก requests ทั้ง process (Sheets/OSRM) → คืน list ที่นับจำนวนครั้งที่ถูกบล็อก
+    ยกเว้น host ในเครื่อง (OSRM stand-in / OSRM self-hosted บนเครื่องนี้)
+    """
+    from urllib.parse import urlsplit
+
+    import requests
+
+    blocked = [0]
+    _request = requests.sessions.Session.request
+
+    def _offline(self, method, url, *args, **kwargs):
+        if urlsplit(url).hostname in LOCAL_HOSTS:
+            return _request(self, method, url, *args, **kwargs)
+        blocked[0] += 1
+        raise requests.ConnectionError(f"benchmark offline: {method} {url}")
+
+    requests.sessions.Session.request = _offline
+    return blocked
+
+
+def _peak_rss_mb():
+    """peak RSS ของ process นี้ (MB) — None ถ้าวัดไม่ได้ (Windows ไม่มี resource)"""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 1e6, 1)
+        except Exception:
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux = KB, macOS = bytes
+    return round(peak / 1e6 if sys.platform == 'darwin' else peak / 1e3, 1)
+
+
+def _utilization(summary_df):
+    """utilization เฉลี่ยต่อทริป (น้ำหนัก, คิว, max ของทั้งสอง)"""
+    if summary_df is None or summary_df.empty or 'Weight_Use%' not in summary_df.columns:
+        return None, None, None
+    w = pd.to_numeric(summary_df['Weight_Use%'], errors='coerce')
+    c = pd.to_numeric(summary_df['Cube_Use%'], errors='coerce')
+    both = np.fmax(w.to_numpy(dtype=float), c.to_numpy(dtype=float))
+    return round(float(w.mean()), 2), round(float(c.mean()), 2), round(float(np.nanmean(both)), 2)
+
+
+def run_one(size, seed=DEFAULT_SEED, mix=None, routing=None):
+    """
+    สร้างออเดอร์ + predict_trips 1 รอบ → dict ผลลัพธ์ (เรียกใน process ที่ยังไม่ได้ import app)
+    routing = ชื่อ routing backend → ขอเส้นทางทุกทริปต่อ (precache_trip_routes) แล้ววัดเวลาด้วย
+    """
+    import logging
+    logging.disable(logging.WARNING)
+    blocked = block_network()
+
+    t_import = time.perf_counter()
+    import app
+    import_s = time.perf_counter() - t_import
+
+    orders = make_orders(load_branch_pool(), size, seed=seed, mix=mix, region_of=app.get_region_name)
+    df = app.process_dataframe(orders)
+    df['OriginalQty'] = df['OriginalQty'].fillna(0)
+    model = app.load_model()
+
+    t0 = time.perf_counter()
+    result_df, summary_df, _ = app.predict_trips(df, model, 1.0, 1.10)
+    wall_s = time.perf_counter() - t0
+
+    routes = None
+    if routing:
+        from routing_backend import make_backend, set_backend
+        backend = make_backend(routing)
+        set_backend(backend)
+        t1 = time.perf_counter()
+        fetched = app.precache_trip_routes(result_df)
+        routes = {'backend': backend.name, 'seconds': round(time.perf_counter() - t1, 3),
+                  'fetched': int(fetched), 'stats': dict(backend.stats)}
+
+    w_util, c_util, util = _utilization(summary_df)
+    trips = result_df.loc[result_df['Trip'] > 0, 'Trip'].nunique() if 'Trip' in result_df.columns else 0
+    return {
+        'size': int(size),
+        'seed': int(seed),
+        'mix': mix,
+        'routing': routing,
+        'routes': routes,
+        'rows': int(len(df)),
+        'wall_s': round(wall_s, 3),
+        'import_s': round(import_s, 3),
+        'peak_rss_mb': _peak_rss_mb(),
+        'trips': int(trips),
+        'mean_util': util,
+        'mean_weight_util': w_util,
+        'mean_cube_util': c_util,
+        'network_blocked': blocked[0],
+        'phases': [{'name': p['name'], 'seconds': round(p['seconds'], 3)}
+                   for p in summary_df.attrs.get('planner_profile', [])],
+    }
+
+
+def _run_subprocess(size, seed, mix, verbose=False, routing=None):
+    """รัน run_one ใน python process ใหม่ (cwd = โฟลเดอร์ app) → dict ผลลัพธ์"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    cmd = [sys.executable, os.path.abspath(__file__), '_one', str(size), str(seed), json.dumps(mix or {}, ensure_ascii=False),
+           routing or '']
+    env = dict(os.environ, PYTHONIOENCODING='utf-8')
+    proc = subprocess.run(cmd, cwd=here, env=env, capture_output=True, text=True, encoding='utf-8', errors='replace')
+    if verbose:
+        sys.stdout.write(proc.stdout)
+        sys.stderr.write(proc.stderr)
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    tail = '\n'.join((proc.stderr or proc.stdout).splitlines()[-15:])
+    raise RuntimeError(f"benchmark size={size} ล้มเหลว (exit {proc.returncode}):\n{tail}")
+
+
+# ==========================================
+# history + ตรวจ regression
+# ==========================================
+def _git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def load_history(path=DEFAULT_HISTORY_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_history(history, path=DEFAULT_HISTORY_FILE):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _same_case(a, b):
+    return (a['size'] == b['size'] and a['seed'] == b['seed'] and (a.get('mix') or None) == (b.get('mix') or None)
+            and (a.get('routing') or None) == (b.get('routing') or None))
+
+
+def find_regressions(result, history, threshold=DEFAULT_THRESHOLD):
+    """เทียบกับรอบล่าสุดของ size/seed/mix เดียวกัน → list ข้อความแจ้งเตือน (ว่าง = ปกติ)"""
+    prev = next((h for h in reversed(history) if _same_case(h, result)), None)
+    if prev is None:
+        return []
+    notes = []
+    if prev.get('wall_s') and result['wall_s'] > prev['wall_s'] * (1 + threshold):
+        notes.append(f"เวลา {prev['wall_s']:.2f}s → {result['wall_s']:.2f}s "
+                     f"(+{(result['wall_s'] / prev['wall_s'] - 1) * 100:.0f}%, ก่อนหน้า {prev.get('commit')})")
+    if prev.get('peak_rss_mb') and result.get('peak_rss_mb') and result['peak_rss_mb'] > prev['peak_rss_mb'] * (1 + threshold):
+        notes.append(f"peak RSS {prev['peak_rss_mb']:.0f} → {result['peak_rss_mb']:.0f} MB")
+    prev_rt, rt = prev.get('routes') or {}, result.get('routes') or {}
+    if prev_rt.get('seconds') and rt.get('seconds') and rt['seconds'] > prev_rt['seconds'] * (1 + threshold):
+        notes.append(f"เวลาขอเส้นทาง {prev_rt['seconds']:.2f}s → {rt['seconds']:.2f}s")
+    if prev.get('trips') != result['trips']:
+        notes.append(f"จำนวนทริป {prev.get('trips')} → {result['trips']}")
+    return notes
+
+
+def _format_row(r):
+    util = f"{r['mean_util']:.1f}%" if r.get('mean_util') is not None else '-'
+    rss = f"{r['peak_rss_mb']:.0f} MB" if r.get('peak_rss_mb') is not None else '-'
+    return f"{r['size']:>6,} {r['rows']:>6,} {r['wall_s']:>9.2f}s {rss:>9} {r['trips']:>6,} {util:>7}"
+
+
+def _print_table(results):
+    print(f"{'size':>6} {'rows':>6} {'wall':>10} {'peak RSS':>9} {'trips':>6} {'util':>7}  commit / วันที่")
+    for r in results:
+        print(f"{_format_row(r)}  {r.get('commit') or '-'} {r.get('timestamp', '')}")
+
+
+def main(argv):
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+    cmd = argv[0] if argv else 'run'
+    opts = {}
+    args = []
+    i = 1
+    while i < len(argv):
+        if argv[i] == '--verbose':
+            opts['verbose'] = True
+        elif argv[i].startswith('--') and i + 1 < len(argv):
+            opts[argv[i][2:]] = argv[i + 1]
+            i += 1
+        else:
+            args.append(argv[i])
+        i += 1
+
+    if cmd == '_one':
+        # process ลูกของ run: size seed mix_json → พิมพ์ผลบรรทัดสุดท้าย
+        result = run_one(int(args[0]), int(args[1]), json.loads(args[2]) or None,
+                         routing=(args[3] if len(args) > 3 else '') or None)
+        print(RESULT_MARKER + json.dumps(result, ensure_ascii=False))
+        return 0
+    if cmd == 'run':
+        sizes = [int(s) for s in opts.get('sizes', ','.join(map(str, DEFAULT_SIZES))).split(',') if s.strip()]
+        seed = int(opts.get('seed', DEFAULT_SEED))
+        mix = parse_mix(opts.get('mix'))
+        path = opts.get('history', DEFAULT_HISTORY_FILE)
+        threshold = float(opts.get('threshold', DEFAULT_THRESHOLD))
+        routing = opts.get('routing')
+        history = load_history(path)
+        commit = _git_commit()
+        results, flagged = [], 0
+        for size in sizes:
+            print(f"⏳ size={size:,} seed={seed} mix={mix or 'ตาม master'} ...", flush=True)
+            result = _run_subprocess(size, seed, mix, verbose=opts.get('verbose', False), routing=routing)
+            result.update(commit=commit, timestamp=datetime.now().isoformat(timespec='seconds'))
+            notes = find_regressions(result, history, threshold)
+            result['regressions'] = notes
+            print(f"   ✅ {result['wall_s']:.2f}s, {result['trips']:,} ทริป, util {result['mean_util']}%, "
+                  f"RSS {result['peak_rss_mb']} MB")
+            if result.get('routes'):
+                rt = result['routes']
+                print(f"   🛣️ เส้นทาง ({rt['backend']}): {rt['fetched']:,} ทริป ใน {rt['seconds']:.2f}s {rt['stats']}")
+            if result['network_blocked']:
+                print(f"   ℹ️ บล็อก network {result['network_blocked']:,} ครั้ง (ทำงาน offline)")
+            for note in notes:
+                flagged += 1
+                print(f"   ⚠️ regression: {note}")
+            history.append(result)
+            save_history(history, path)
+            results.append(result)
+        print()
+        _print_table(results)
+        print(f"\n💾 บันทึก {len(results)} รายการ → {path}")
+        return 2 if flagged else 0
+    if cmd == 'generate':
+        if len(args) < 2:
+            print(__doc__)
+            return 1
+        import app
+        mix = parse_mix(opts.get('mix'))
+        orders = make_orders(load_branch_pool(), int(args[0]), seed=int(opts.get('seed', DEFAULT_SEED)),
+                             mix=mix, region_of=app.get_region_name)
+        if args[1].lower().endswith('.csv'):
+            orders.to_csv(args[1], index=False, encoding='utf-8-sig')
+        else:
+            orders.to_excel(args[1], sheet_name='2.Punthai', index=False)
+        print(f"✅ สร้างออเดอร์ {len(orders):,} แถว → {args[1]}")
+        return 0
+    if cmd == 'history':
+        history = load_history(args[0] if args else DEFAULT_HISTORY_FILE)
+        if not history:
+            print("⚠️ ยังไม่มีประวัติ benchmark")
+            return 1
+        _print_table(history)
+        return 0
+    print(__doc__)
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,123 @@
+"""
+Branch Resolver — จับคู่รหัสสาขา (ไฟล์ Upload) → Plan Code ใน Master ด้วย hash index เดียว
+
+alias ทั้งหมดสร้างครั้งเดียวตอนโหลด Master (แทนการวนทุกสาขาใน Master ทุกครั้งที่หาไม่เจอ)
+ลำดับการจับคู่ (ตัวแรกที่เจอ):
+  1. Plan Code ตรงตัว
+  2. ตัด prefix PUN-/MAX-/MM-/PT- ฝั่งไฟล์ → ตรงตัว / ตรงกับ Plan Code ที่ตัด prefix แล้ว
+  3. Z-prefix: ZSF37 ↔ SF37 (LUBE กับ SUPPLY USE ใช้สถานที่เดียวกัน)
+  4. รหัส WMS (คอลัมน์ WMS ใน Master ถ้ามี / WMSCode ของแถวในไฟล์)
+alias ซ้ำกันหลายสาขา → ใช้สาขาแรกตามลำดับใน Master
+"""
+import pandas as pd
+
+CODE_PREFIXES = ('PUN-', 'MAX-', 'MM-', 'PT-')
+Z_PREFIX = 'Z'
+WMS_COLUMNS = ('รหัส WMS', 'WMS Code', 'WMSCode', 'WMS')
+
+
+def normalize_code(value):
+    """รหัสมาตรฐานสำหรับ lookup (NaN/None → '')"""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ''
+    return str(value).strip().upper()
+
+
+def strip_prefix(code):
+    """ตัด prefix ตัวแรกที่ตรง (PUN-/MAX-/MM-/PT-)"""
+    for p in CODE_PREFIXES:
+        if code.startswith(p):
+            return code[len(p):]
+    return code
+
+
+def z_alias(code):
+    """ZSF37 → SF37, SF37 → ZSF37"""
+    if code.startswith(Z_PREFIX) and len(code) > 1:
+        return code[1:]
+    return Z_PREFIX + code
+
+
+class BranchResolver:
+    """index alias → Plan Code (upper) ของ Master"""
+
+    def __init__(self, codes, wms_codes=None):
+        self.codes = set()
+        self._stripped = {}
+        self._z = {}
+        self._wms = {}
+        for code in codes:
+            code = normalize_code(code)
+            if not code:
+                continue
+            self.codes.add(code)
+            clean = strip_prefix(code)
+            self._stripped.setdefault(clean, code)
+            self._z.setdefault(z_alias(clean), code)
+        for wms, code in (wms_codes or {}).items():
+            wms, code = normalize_code(wms), normalize_code(code)
+            if wms and code:
+                self._wms.setdefault(wms, code)
+        self._memo = {}
+
+    @classmethod
+    def from_master(cls, master_df, master_dict=None):
+        """
+        master_dict = MASTER_DATA_DICT (ลำดับ key = ลำดับ alias) / ไม่มี → ใช้ Plan Code ของ master_df
+        คอลัมน์ WMS ของ master_df (ถ้ามี) → alias รหัส WMS
+        """
+        if master_dict:
+            codes = list(master_dict)
+        elif master_df is not None and not master_df.empty and 'Plan Code' in master_df.columns:
+            codes = master_df['Plan Code'].tolist()
+        else:
+            codes = []
+        wms = {}
+        if master_df is not None and not master_df.empty and 'Plan Code' in master_df.columns:
+            for col in WMS_COLUMNS:
+                if col in master_df.columns:
+                    for w, c in zip(master_df[col].tolist(), master_df['Plan Code'].tolist()):
+                        wms.setdefault(normalize_code(w), c)
+        return cls(codes, wms)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return self.resolve(code) is not None
+
+    def _lookup(self, code):
+        if code in self.codes:
+            return code
+        clean = strip_prefix(code)
+        if clean in self.codes:
+            return clean
+        hit = self._stripped.get(clean) or self._z.get(clean)
+        if hit:
+            return hit
+        return self._wms.get(code) or self._wms.get(clean)
+
+    def resolve(self, code, wms=None):
+        """Plan Code ของ Master ที่ตรงกับ code (หรือรหัส WMS ของแถว) — ไม่พบ → None"""
+        code = normalize_code(code)
+        wms = normalize_code(wms)
+        key = (code, wms)
+        if key in self._memo:
+            return self._memo[key]
+        hit = self._lookup(code) if code else None
+        if hit is None and wms:
+            hit = self._lookup(wms)
+        self._memo[key] = hit
+        return hit
+
+    def resolve_codes(self, codes, wms=None):
+        """
+        แบบ batch: codes (Series/list) [+ wms คู่กัน] → Series ของ Plan Code (None = ไม่พบ)
+        index เดียวกับ codes ถ้าเป็น Series
+        """
+        index = codes.index if isinstance(codes, pd.Series) else None
+        codes = list(codes)
+        wms = list(wms) if wms is not None else [None] * len(codes)
+        keys = list(zip(codes, wms))
+        lookup = {k: self.resolve(*k) for k in set(keys)}
+        return pd.Series([lookup[k] for k in keys], index=index, dtype=object)
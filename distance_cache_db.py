@@ -0,0 +1,184 @@
+"""
+Distance Cache DB — เก็บ distance cache ใน SQLite (WAL) แทนการเขียน distance_cache.json ทั้งไฟล์
+
+- เขียนเฉพาะ entry ใหม่ (INSERT OR REPLACE) → ต้นทุนตามจำนวนที่เพิ่ม ไม่ใช่ขนาด cache ทั้งหมด
+- WAL mode: อ่าน/เขียนพร้อมกันได้ (app + precompute script) ไม่บล็อกกัน
+- โหลดตอนเริ่มด้วย SELECT ครั้งเดียว (ไม่ต้อง parse JSON หลาย MB)
+
+คำสั่ง (รันครั้งเดียวเพื่อย้ายข้อมูลเดิม):
+    python distance_cache_db.py migrate [distance_cache.json] [distance_cache.db]
+    python distance_cache_db.py compact [distance_cache.db]
+    python distance_cache_db.py stats   [distance_cache.db]
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+DEFAULT_DB_FILE = 'distance_cache.db'
+DEFAULT_JSON_FILE = 'distance_cache.json'
+
+_MISSING = object()
+
+
+class TrackedCache(dict):
+    """
+    dict ที่จำ key ใหม่/ค่าที่เปลี่ยน (pending) → flush ลง DB เฉพาะส่วนที่เพิ่ม
+    (pending ใช้ lock ร่วมกับ flush — thread preseed เขียนระหว่าง flush ได้ไม่หาย)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            if dict.get(self, key, _MISSING) != value:
+                self.pending.add(key)
+            super().__setitem__(key, value)
+
+    def take_pending(self):
+        """สลับ pending เป็นชุดใหม่ภายใต้ lock → [(key, value)] ที่ต้องเขียน"""
+        with self.lock:
+            keys, self.pending = self.pending, set()
+            return [(k, dict.__getitem__(self, k)) for k in keys if dict.__contains__(self, k)]
+
+    def restore_pending(self, items):
+        """เขียนไม่สำเร็จ → คืน key เข้า pending (flush รอบหน้าเขียนใหม่)"""
+        with self.lock:
+            self.pending.update(k for k, _ in items)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+
+class DistanceCacheDB:
+    """ตาราง distances(key TEXT PRIMARY KEY, km REAL) — key รูปแบบเดียวกับ distance_cache.json"""
+
+    def __init__(self, path=DEFAULT_DB_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS distances ('
+                'key TEXT PRIMARY KEY, km REAL NOT NULL) WITHOUT ROWID'
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def load_all(self):
+        """โหลดทั้งตาราง → dict {key: km}"""
+        with self._lock:
+            return dict(self._connect().execute('SELECT key, km FROM distances'))
+
+    def put_many(self, items):
+        """เขียน (key, km) หลายรายการใน transaction เดียว → คืนจำนวนที่เขียน"""
+        rows = [(str(k), float(v)) for k, v in items if v is not None]
+        if not rows:
+            return 0
+        with self._lock:
+            conn = self._connect()
+            conn.executemany('INSERT OR REPLACE INTO distances (key, km) VALUES (?, ?)', rows)
+            conn.commit()
+        return len(rows)
+
+    def flush(self, cache):
+        """เขียนเฉพาะ cache.pending (TrackedCache) → คืนจำนวนที่เขียน"""
+        items = cache.take_pending()
+        try:
+            return self.put_many(items)
+        except Exception:
+            cache.restore_pending(items)
+            raise
+
+    def count(self):
+        with self._lock:
+            return self._connect().execute('SELECT COUNT(*) FROM distances').fetchone()[0]
+
+    def import_json(self, json_path=DEFAULT_JSON_FILE):
+        """นำเข้า distance_cache.json เดิม (one-time migration) → คืนจำนวนที่นำเข้า"""
+        if not os.path.exists(json_path):
+            return 0
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return self.put_many(data.items())
+
+    def compact(self):
+        """รวม WAL กลับเข้าไฟล์หลัก + VACUUM"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conn.execute('VACUUM')
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def load_cache(db_path=DEFAULT_DB_FILE, json_path=DEFAULT_JSON_FILE):
+    """
+    โหลด cache: DB ถ้ามี, ไม่งั้น distance_cache.json เดิม (แล้ว migrate เข้า DB ให้อัตโนมัติ)
+    คืน (TrackedCache, DistanceCacheDB)
+    """
+    db = DistanceCacheDB(db_path)
+    if db.exists():
+        return TrackedCache(db.load_all()), db
+    data = {}
+    if os.path.exists(json_path):
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            db.put_many(data.items())
+        except Exception:
+            pass
+    return TrackedCache(data), db
+
+
+def main(argv):
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+    cmd = argv[0] if argv else 'stats'
+    if cmd == 'migrate':
+        json_path = argv[1] if len(argv) > 1 else DEFAULT_JSON_FILE
+        db = DistanceCacheDB(argv[2] if len(argv) > 2 else DEFAULT_DB_FILE)
+        n = db.import_json(json_path)
+        db.compact()
+        print(f"✅ นำเข้า {n:,} รายการจาก {json_path} → {db.path} (รวม {db.count():,})")
+    elif cmd == 'compact':
+        db = DistanceCacheDB(argv[1] if len(argv) > 1 else DEFAULT_DB_FILE)
+        db.compact()
+        print(f"✅ compact {db.path}: {db.count():,} รายการ")
+    elif cmd == 'stats':
+        db = DistanceCacheDB(argv[1] if len(argv) > 1 else DEFAULT_DB_FILE)
+        if not db.exists():
+            print(f"⚠️ ไม่พบ {db.path}")
+            return 1
+        print(f"📦 {db.path}: {db.count():,} รายการ ({os.path.getsize(db.path) / 1e6:.1f} MB)")
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
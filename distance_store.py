@@ -0,0 +1,335 @@
+"""
+Distance Store — ระยะทางระหว่างสาขาแบบ integer index
+แทนการสร้าง string key "lat,lon_lat,lon" + dict lookup ทุกครั้ง
+
+- ทุก Plan Code ได้ id (int) → ระยะทางเก็บใน NumPy matrix / sparse row
+- ระยะถนนจริง (OSRM) มาจาก distance_cache.json + branch_clusters.json
+- คู่ที่ไม่รู้ระยะถนน → haversine × 1.35 (กฎเดียวกับ haversine_distance(use_osrm_cache=False))
+- matrix บันทึกเป็น .npy แล้ว memory-map กลับมาใช้ได้ (ไม่ต้องโหลดทั้งไฟล์เข้า RAM)
+"""
+import json
+import os
+from math import radians, sin, cos, sqrt, atan2
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+ROAD_FACTOR = 1.35   # haversine → ระยะถนนโดยประมาณ
+
+
+def coord_key(lat, lon):
+    """key พิกัด 4 ตำแหน่ง (รูปแบบเดียวกับ distance_cache.json)"""
+    return f"{lat:.4f},{lon:.4f}"
+
+
+def road_haversine(lat1, lon1, lat2, lon2):
+    """haversine × 1.35 ปัด 2 ตำแหน่ง (scalar) — ตรงกับ fallback ของ haversine_distance"""
+    phi1, phi2 = radians(lat1), radians(lat2)
+    dphi = radians(lat2 - lat1)
+    dlambda = radians(lon2 - lon1)
+    a = sin(dphi/2)**2 + cos(phi1)*cos(phi2)*sin(dlambda/2)**2
+    return round(EARTH_RADIUS_KM * 2 * atan2(sqrt(a), sqrt(1-a)) * ROAD_FACTOR, 2)
+
+
+def road_haversine_matrix(lats1, lons1, lats2, lons2):
+    """haversine × 1.35 แบบ vectorized → matrix (len1 × len2) ปัด 2 ตำแหน่ง"""
+    lat1 = np.radians(np.asarray(lats1, dtype=np.float64))[:, None]
+    lon1 = np.asarray(lons1, dtype=np.float64)[:, None]
+    lat2 = np.radians(np.asarray(lats2, dtype=np.float64))[None, :]
+    lon2 = np.asarray(lons2, dtype=np.float64)[None, :]
+    dphi = lat2 - lat1
+    dlambda = np.radians(lon2 - lon1)
+    a = np.sin(dphi/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin(dlambda/2)**2
+    return np.round(EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a)) * ROAD_FACTOR, 2)
+
+
+def distance_matrix(src_coords, dst_coords, store=None):
+    """
+    ระยะทาง (km) หลายจุด → หลายจุด แบบ vectorized: matrix (len(src) × len(dst))
+    กฎเดียวกับ haversine_distance(use_osrm_cache=False): ระยะถนนที่รู้ใน store ก่อน → haversine × 1.35
+    src_coords / dst_coords: [(lat, lon), ...] หรือ ndarray (n, 2)
+    """
+    src = np.asarray(src_coords, dtype=np.float64).reshape(-1, 2)
+    dst = np.asarray(dst_coords, dtype=np.float64).reshape(-1, 2)
+    out = road_haversine_matrix(src[:, 0], src[:, 1], dst[:, 0], dst[:, 1])
+    if store is not None and out.size:
+        store.overlay_roads(out, src, dst)
+    return out
+
+
+def distances_from(lat, lon, coords, store=None):
+    """ระยะทาง (km) จากจุดเดียวไปยังหลายจุด → ndarray (len(coords),)"""
+    return distance_matrix([(lat, lon)], coords, store)[0]
+
+
+class DistanceStore:
+    """
+    ระยะทางระหว่างจุด (สาขา) ด้วย integer id
+
+    มี 2 โหมด:
+      - sparse (matrix=None): เก็บเฉพาะระยะถนนที่รู้ใน dict ต่อแถว — ใช้กับสาขาทั้งประเทศ (~7.7k)
+        โดย 1 node = 1 พิกัด (key 4 ตำแหน่ง) เพื่อให้ตรงกับ key ของ distance_cache.json
+      - dense (matrix=ndarray): ระยะทางครบทุกคู่ — ใช้ต่อรอบการจัดทริป (subset) หรือโหลดจาก .npy
+        ค่า NaN = ยังไม่รู้ระยะถนน → fallback haversine × 1.35
+
+    index: {code: id}  — หลาย code อาจชี้ node เดียวกันได้ (พิกัดเดียวกัน)
+    """
+
+    def __init__(self, codes=(), lats=(), lons=(), matrix=None):
+        self.codes = [str(c).strip().upper() for c in codes]
+        self._lat_list = [float(v) for v in lats]
+        self._lon_list = [float(v) for v in lons]
+        self._arrays = None      # (lats, lons) ndarray — สร้างใหม่เมื่อมีจุดเพิ่ม
+        self.index = {c: i for i, c in enumerate(self.codes)}
+        self.matrix = matrix
+        self._road = {}          # sparse: {i: {j: km}}
+        self._point_index = {}   # {coord_key: id}
+        for i, (la, lo) in enumerate(zip(self._lat_list, self._lon_list)):
+            self._point_index.setdefault(coord_key(la, lo), i)
+
+    def __len__(self):
+        return len(self._lat_list)
+
+    @property
+    def lats(self):
+        return self._coord_arrays()[0]
+
+    @property
+    def lons(self):
+        return self._coord_arrays()[1]
+
+    def _coord_arrays(self):
+        if self._arrays is None or len(self._arrays[0]) != len(self._lat_list):
+            self._arrays = (np.asarray(self._lat_list, dtype=np.float64),
+                            np.asarray(self._lon_list, dtype=np.float64))
+        return self._arrays
+
+    # ------------------------------------------------------------------
+    # สร้าง store
+    # ------------------------------------------------------------------
+    @classmethod
+    def from_coords(cls, coords):
+        """
+        สร้าง sparse store จาก {code: (lat, lon)} (เช่น BRANCH_COORDS)
+        สาขาพิกัดเดียวกัน (key 4 ตำแหน่ง) ใช้ node เดียวกัน
+        """
+        store = cls()
+        for code, (lat, lon) in coords.items():
+            store.add_point(lat, lon, code)
+        return store
+
+    def add_point(self, lat, lon, code=None):
+        """เพิ่มจุด (sparse mode) → คืน id; ถ้าพิกัดนี้มีอยู่แล้วใช้ id เดิม"""
+        lat, lon = float(lat), float(lon)
+        key = coord_key(lat, lon)
+        i = self._point_index.get(key)
+        if i is None:
+            i = len(self._lat_list)
+            self._point_index[key] = i
+            self._lat_list.append(lat)
+            self._lon_list.append(lon)
+            self.codes.append(str(code).strip().upper() if code else key)
+        if code:
+            self.index.setdefault(str(code).strip().upper(), i)
+        return i
+
+    def point_id(self, lat, lon):
+        """id ของพิกัด (key 4 ตำแหน่ง) หรือ None"""
+        return self._point_index.get(coord_key(lat, lon))
+
+    def point_key(self, i):
+        """key พิกัดของ id i (รูปแบบ distance_cache.json)"""
+        return coord_key(self._lat_list[i], self._lon_list[i])
+
+    # ------------------------------------------------------------------
+    # ระยะถนนที่รู้แล้ว
+    # ------------------------------------------------------------------
+    def set_road(self, i, j, km):
+        """บันทึกระยะถนนจริงของคู่ (i, j) ทั้งสองทิศ"""
+        km = round(float(km), 2)
+        if self.matrix is not None:
+            self.matrix[i, j] = km
+            self.matrix[j, i] = km
+            return
+        self._road.setdefault(i, {})[j] = km
+        self._road.setdefault(j, {}).setdefault(i, km)
+
+    def set_road_by_coords(self, lat1, lon1, lat2, lon2, km):
+        """บันทึกระยะถนนด้วยพิกัด (sparse mode) — เพิ่ม node ให้อัตโนมัติ"""
+        self.set_road(self.add_point(lat1, lon1), self.add_point(lat2, lon2), km)
+
+    def road(self, i, j):
+        """ระยะถนนที่รู้ของคู่ (i, j) หรือ None"""
+        if self.matrix is not None:
+            v = self.matrix[i, j]
+            return None if np.isnan(v) else round(float(v), 2)
+        return self._road.get(i, {}).get(j)
+
+    def ingest_cache(self, cache):
+        """
+        นำเข้า distance_cache.json ({"lat,lon_lat,lon": km}) → คืนจำนวนคู่ที่นำเข้า
+        parse key ครั้งเดียวตอนสร้าง store — หลังจากนั้นไม่ต้องสร้าง string อีก
+        ค่าแรกที่พบของแต่ละทิศชนะ (เหมือน lookup forward ก่อน reverse)
+        """
+        n = 0
+        for key, km in cache.items():
+            try:
+                a, b = key.split('_')
+                la1, lo1 = a.split(',')
+                la2, lo2 = b.split(',')
+                i = self.add_point(float(la1), float(lo1))
+                j = self.add_point(float(la2), float(lo2))
+            except (ValueError, AttributeError):
+                continue
+            self._road.setdefault(i, {})[j] = km
+            self._road.setdefault(j, {}).setdefault(i, km)
+            n += 1
+        return n
+
+    def ingest_nearby(self, nearby):
+        """
+        นำเข้าระยะ pre-computed จาก branch_clusters.json
+        nearby: {code: [{"code": c, "distance": d}, ...]} หรือ {code: [(c, d), ...]}
+        ไม่ทับคู่ที่มีใน cache อยู่แล้ว → คืนจำนวนคู่ที่นำเข้า
+        """
+        n = 0
+        for code, nearby_list in nearby.items():
+            i = self.index.get(str(code).strip().upper())
+            if i is None:
+                continue
+            for item in nearby_list:
+                if isinstance(item, dict):
+                    nb_code, pre_dist = item.get('code', ''), item.get('distance')
+                elif isinstance(item, (tuple, list)) and len(item) >= 2:
+                    nb_code, pre_dist = item[0], item[1]
+                else:
+                    continue
+                j = self.index.get(str(nb_code).strip().upper())
+                if j is None or not pre_dist or pre_dist <= 0 or self.road(i, j) is not None:
+                    continue
+                self.set_road(i, j, pre_dist)
+                n += 1
+        return n
+
+    # ------------------------------------------------------------------
+    # query
+    # ------------------------------------------------------------------
+    def distance(self, i, j):
+        """ระยะทาง (km) ระหว่าง id i, j — ระยะถนนถ้ารู้, ไม่งั้น haversine × 1.35"""
+        if self.matrix is not None:
+            v = self.matrix[i, j]
+            if v == v:   # ไม่ใช่ NaN
+                return float(v) if self.matrix.dtype == np.float64 else round(float(v), 2)
+        else:
+            v = self._road.get(i, {}).get(j)
+            if v is not None:
+                return v
+        return road_haversine(self._lat_list[i], self._lon_list[i], self._lat_list[j], self._lon_list[j])
+
+    def distances(self, i, js=None):
+        """ระยะทาง (km) จาก id i ไปยังหลาย id (js=None → ทุกจุด) → ndarray"""
+        js = np.arange(len(self)) if js is None else np.asarray(js, dtype=np.int64)
+        if self.matrix is not None:
+            out = np.asarray(self.matrix[i, js], dtype=np.float64)
+            if self.matrix.dtype != np.float64:
+                out = np.round(out, 2)
+            miss = np.isnan(out)
+            if miss.any():
+                out[miss] = road_haversine_matrix(
+                    self.lats[i:i+1], self.lons[i:i+1], self.lats[js[miss]], self.lons[js[miss]])[0]
+            return out
+        out = road_haversine_matrix(self.lats[i:i+1], self.lons[i:i+1], self.lats[js], self.lons[js])[0]
+        row = self._road.get(i)
+        if row:
+            for k, j in enumerate(js.tolist()):
+                v = row.get(j)
+                if v is not None:
+                    out[k] = v
+        return out
+
+    def overlay_roads(self, out, src, dst):
+        """
+        แทนค่าใน matrix out (len(src) × len(dst)) ด้วยระยะถนนที่รู้ — map พิกัด → id ครั้งเดียวต่อจุด
+        ไม่สร้าง string key ต่อคู่ (O(src + dst + คู่ที่รู้))
+        """
+        dst_pos = {}
+        for l, (la, lo) in enumerate(dst):
+            g = self._point_index.get(coord_key(la, lo))
+            if g is not None:
+                dst_pos.setdefault(g, []).append(l)
+        if not dst_pos:
+            return out
+        for k, (la, lo) in enumerate(src):
+            g = self._point_index.get(coord_key(la, lo))
+            if g is None:
+                continue
+            row = self._road_row(g)
+            if not row:
+                continue
+            if len(row) <= len(dst_pos):
+                pairs = ((dst_pos.get(j), km) for j, km in row.items())
+            else:
+                pairs = ((ls, row.get(g2)) for g2, ls in dst_pos.items())
+            for ls, km in pairs:
+                if ls is None or km is None:
+                    continue
+                for l in ls:
+                    out[k, l] = km
+        return out
+
+    def subset(self, codes, lats, lons):
+        """
+        สร้าง dense store สำหรับรอบการจัดทริป (1 node ต่อ code, พิกัดตามไฟล์ upload)
+        matrix = ระยะทางครบทุกคู่ (float64): ระยะถนนจาก store นี้ถ้ามี, ไม่งั้น haversine × 1.35
+        """
+        coords = np.column_stack([np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)])
+        matrix = distance_matrix(coords, coords, self)
+        return DistanceStore(codes, coords[:, 0], coords[:, 1], matrix=matrix)
+
+    def _road_row(self, i):
+        """ระยะถนนที่รู้ของแถว i → {j: km}"""
+        if self.matrix is None:
+            return self._road.get(i, {})
+        row = np.asarray(self.matrix[i], dtype=np.float64)
+        return {int(j): round(float(row[j]), 2) for j in np.nonzero(~np.isnan(row))[0]}
+
+    # ------------------------------------------------------------------
+    # บันทึก / โหลด (.npy + .json)
+    # ------------------------------------------------------------------
+    def dense(self, dtype=np.float32):
+        """matrix ระยะถนน n×n (NaN = ไม่รู้) จาก sparse store"""
+        if self.matrix is not None:
+            return self.matrix
+        n = len(self)
+        matrix = np.full((n, n), np.nan, dtype=dtype)
+        for i, row in self._road.items():
+            for j, km in row.items():
+                matrix[i, j] = km
+        return matrix
+
+    def save(self, path):
+        """
+        บันทึกเป็น <path>.npy (float32, NaN = ไม่รู้ระยะถนน) + <path>.json (codes/พิกัด)
+        """
+        base = path[:-4] if path.endswith('.npy') else path
+        np.save(base + '.npy', self.dense(np.float32).astype(np.float32, copy=False))
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump({
+                'codes': self.codes,
+                'lats': self.lats.tolist(),
+                'lons': self.lons.tolist(),
+                'index': self.index,
+            }, f, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """โหลดจาก .npy + .json — mmap=True → memory-map matrix (อ่านเฉพาะแถวที่ใช้)"""
+        base = path[:-4] if path.endswith('.npy') else path
+        if not (os.path.exists(base + '.npy') and os.path.exists(base + '.json')):
+            return None
+        with open(base + '.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        matrix = np.load(base + '.npy', mmap_mode='r' if mmap else None)
+        store = cls(meta['codes'], meta['lats'], meta['lons'], matrix=matrix)
+        store.index.update(meta.get('index', {}))
+        return store
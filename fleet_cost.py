@@ -0,0 +1,62 @@
+"""
+Fleet Cost — ต้นทุนรถ + การเลือกรถของทริป ชุดเดียวที่ทุก solver ใช้ร่วมกัน
+(local_search, ortools_vrp CP-SAT, solver_portfolio) → แผนเดียวกันได้ต้นทุนเท่ากันทุก engine
+
+  - VEHICLE_COST: ต้นทุนเทียบต่อคัน (4W = 1) — 6W แพงสุด → ลด 6W ก่อน
+  - VEHICLE_COST_UNITS: ต้นทุนเดียวกันเป็นจำนวนเต็ม (× COST_SCALE) สำหรับ objective ของ CP-SAT
+  - fleet_cost({vehicle: n}): ต้นทุนรวมของแผน
+  - vehicle_caps / pick_vehicle / truck_label: รถของทริปแบบ Step 7 + ป้ายที่มาแบบ Step 7.5
+"""
+VEHICLE_TYPES = ['4W', 'JB', '6W']
+VEHICLE_RANK = {'4W': 1, 'JB': 2, '6W': 3}
+VEHICLE_COST = {'4W': 1.0, 'JB': 1.3, '6W': 2.0}
+COST_SCALE = 1000
+VEHICLE_COST_UNITS = {v: int(round(c * COST_SCALE)) for v, c in VEHICLE_COST.items()}
+LONG_HAUL_REGIONS = ('เหนือ', 'ใต้')
+
+
+def fleet_cost(vehicles):
+    """ต้นทุนรวมของ {vehicle: จำนวนคัน} (รถที่ไม่รู้จัก = 0)"""
+    return sum(VEHICLE_COST.get(v, 0.0) * n for v, n in vehicles.items())
+
+
+def vehicle_caps(limits, buffer_punthai, buffer_maxmart):
+    """{vehicle: ((w, c, drops) Punthai ล้วน, (w, c, drops) ผสม)} รวม buffer แล้ว — limits = {'punthai', 'maxmart'}"""
+    caps = {}
+    for v in VEHICLE_TYPES:
+        p = limits['punthai'][v]
+        m = limits['maxmart'][v]
+        caps[v] = ((p['max_w'] * buffer_punthai, p['max_c'] * buffer_punthai, p.get('max_drops', 12)),
+                   (m['max_w'] * buffer_maxmart, m['max_c'] * buffer_maxmart, m.get('max_drops', 12)))
+    return caps
+
+
+def pick_vehicle(weight, cube, drops, rank, punthai, long_haul, caps):
+    """
+    รถของทริปแบบ Step 7: เหนือ/ใต้ → รถใหญ่สุดที่อนุญาต, ภาคอื่น → เล็กสุดที่รับได้
+    None = เกินรถใหญ่สุดที่สาขาอนุญาต
+    """
+    allowed = VEHICLE_TYPES[:rank]
+    cap_w, cap_c, cap_d = caps[allowed[-1]][0 if punthai else 1]
+    if weight > cap_w + 1e-6 or cube > cap_c + 1e-6 or drops > cap_d:
+        return None
+    if long_haul:
+        return allowed[-1]
+    for v in allowed:
+        w, c, d = caps[v][0 if punthai else 1]
+        if weight <= w + 1e-6 and cube <= c + 1e-6 and drops <= d:
+            return v
+    return allowed[-1]
+
+
+def truck_label(vehicle, rank, long_haul):
+    """ค่า Truck ของทริปแบบ Step 7.5: รถ + ที่มา (รถใหญ่สุดที่สาขาอนุญาต = rank)"""
+    if long_haul:
+        source = "🚛 ไกล (เหนือ/ใต้)" if rank >= 3 else "📋 จำกัดสาขา (เหนือ/ใต้)"
+    elif rank < 3:
+        source = "📋 จำกัดสาขา"
+    elif VEHICLE_RANK.get(vehicle, 3) < rank:
+        source = "🔽 Downgrade (ขนาดพอดี)"
+    else:
+        source = "🤖 อัตโนมัติ"
+    return f"{vehicle} {source}"
@@ -0,0 +1,370 @@
+"""
+Golden Check — ตรวจว่า predict_trips ยังให้ผลเหมือนเดิมหลังแก้ประสิทธิภาพ
+
+- รัน planner กับชุด input ที่บันทึกไว้ (ไฟล์ใน Dc/ + ออเดอร์สังเคราะห์จาก benchmark_planner)
+- เก็บ fingerprint ของผลลัพธ์ต่อ case ลง golden/<case>.json (ไฟล์เล็ก commit ไว้ใน git เป็น baseline ร่วมกัน):
+    ทริป (สมาชิก Code + รถ ตามเลขทริป), violations (รถเกินข้อจำกัด, ไม่ได้จัด,
+    ทริปหลายภาค, ทริปเกิน buffer) + ตัวชี้วัด (เวลา, จำนวนทริป, utilization)
+- check: รันใหม่แล้ว diff กับ golden → รายงานสาขาที่ย้ายทริป / รถที่เปลี่ยน / violation ใหม่
+  พร้อมเวลาและคุณภาพเทียบกันในตารางเดียว
+- ทำงาน offline (บล็อก network เหมือน benchmark_planner) — ผลขึ้นกับ branch_data.json /
+  distance cache ในเครื่อง จึงเก็บ version ของไฟล์เหล่านี้ไว้ใน golden และเตือนเมื่อไม่ตรงกัน
+
+คำสั่ง:
+    python golden_check.py record [case ...]      # บันทึก golden ใหม่ (ทุก case ถ้าไม่ระบุ)
+    python golden_check.py check  [case ...]      # เทียบกับ golden (exit 1 ถ้าต่าง)
+    python golden_check.py list
+    python golden_check.py mixing [case ...] [--seconds 20]
+                                                  # local search (improve_seconds) ต้องไม่เพิ่มทริปปนจังหวัด/zone
+                                                  # เทียบกับ greedy (exit 1 ถ้าเพิ่ม)
+    --input path.xlsx  เพิ่มไฟล์ออเดอร์เป็น case ชั่วคราว (ชื่อ case = ชื่อไฟล์)
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+GOLDEN_DIR = 'golden'
+
+# case → ('file', path) หรือ ('synthetic', {size, seed, mix})
+# (ไฟล์แผนงาน Punthai Maxmart 24 พ.ย. 2568 ใน Dc/ อ่านได้ออเดอร์ชุดเดียวกับ test.xlsx → ไม่ใช้ซ้ำ)
+DEFAULT_CASES = {
+    'dc_test': ('file', os.path.join('Dc', 'test.xlsx')),
+    'synthetic_500': ('synthetic', {'size': 500, 'seed': 42, 'mix': None}),
+    'synthetic_500_north_east': ('synthetic', {'size': 500, 'seed': 7, 'mix': {'เหนือ': 0.5, 'อีสาน': 0.5}}),
+    'synthetic_400_east_west_south': (
+        'synthetic', {'size': 400, 'seed': 23, 'mix': {'ตะวันออก': 0.4, 'ตะวันตก': 0.3, 'ใต้': 0.3}}),
+}
+
+# case ของ mixing (ค่าเริ่มต้น) — วันสังเคราะห์ที่ local search ย้ายสาขาเยอะ
+MIXING_CASES = {
+    'synthetic_800_s11': ('synthetic', {'size': 800, 'seed': 11, 'mix': None}),
+}
+MIXING_SECONDS = 20
+
+# ไฟล์ที่มีผลต่อผลลัพธ์ (master data / zone / cache) → เก็บ hash ไว้เทียบ
+VERSION_FILES = ('branch_data.json', 'branch_clusters.json', 'branch_groups.json', 'branch_zones.json',
+                 'distance_cache.db', 'distance_cache.json')
+
+def _file_version(path):
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def data_versions():
+    return {p: _file_version(p) for p in VERSION_FILES}
+
+
+# ==========================================
+# fingerprint
+# ==========================================
+def _truck(value):
+    return str(value).split()[0] if pd.notna(value) and str(value).strip() else ''
+
+
+def _buffer_pct(label):
+    """'🅿️ 100%' → 100.0 (เหมือน Step 7.5)"""
+    try:
+        return float(str(label).replace('🅿️ ', '').replace('🅼 ', '').replace('%', ''))
+    except ValueError:
+        return None
+
+
+def fingerprint(result_df, summary_df):
+    """
+    ผลของ predict_trips → dict ที่เทียบกันได้ (ไม่ขึ้นกับลำดับแถว)
+    trips: {เลขทริป: {'codes': [Code เรียง], 'truck': รถ}}
+    """
+    df = result_df
+    trips = {}
+    for trip, g in df[df['Trip'] > 0].groupby('Trip', sort=True):
+        trips[str(int(trip))] = {
+            'codes': sorted(str(c) for c in g['Code']),
+            'truck': _truck(g['Truck'].iloc[0]) if 'Truck' in g.columns else '',
+        }
+
+    violations = {
+        'unassigned': sorted(str(c) for c in df.loc[df['Trip'] <= 0, 'Code']),
+        'vehicle': [],
+        'mixed_region': [],
+        'over_buffer': [],
+    }
+    if 'VehicleCheck' in df.columns:
+        bad = df[df['VehicleCheck'].astype(str).str.contains('❌', na=False)]
+        violations['vehicle'] = sorted(f"{c}@{int(t)}" for c, t in zip(bad['Code'], bad['Trip']))
+    if 'Region' in df.columns:
+        regions = df[df['Trip'] > 0].groupby('Trip')['Region'].agg(
+            lambda s: sorted({str(r) for r in s.dropna() if str(r) and str(r) != 'ไม่ระบุ'}))
+        violations['mixed_region'] = sorted(str(int(t)) for t, r in regions.items() if len(r) > 1)
+
+    util = []
+    if summary_df is not None and not summary_df.empty:
+        for _, row in summary_df.iterrows():
+            w = float(row.get('Weight_Use%', 0) or 0)
+            c = float(row.get('Cube_Use%', 0) or 0)
+            util.append(max(w, c))
+            limit = _buffer_pct(row.get('Buffer', ''))
+            if limit is not None and max(w, c) > limit + 1e-6:
+                violations['over_buffer'].append(str(int(row['Trip'])))
+    violations['over_buffer'].sort(key=int)
+
+    canonical = json.dumps({'trips': trips, 'violations': violations}, sort_keys=True, ensure_ascii=False)
+    return {
+        'hash': hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16],
+        'rows': int(len(df)),
+        'trips': trips,
+        'violations': violations,
+        'metrics': {
+            'trips': len(trips),
+            'mean_util': round(sum(util) / len(util), 2) if util else None,
+            'violations': sum(len(v) for v in violations.values()),
+        },
+    }
+
+
+# ==========================================
+# diff
+# ==========================================
+def _membership(fp):
+    """Code → (เลขทริป, รถ) — Code ซ้ำในไฟล์ → เก็บเป็น list"""
+    out = {}
+    for trip, t in fp['trips'].items():
+        for code in t['codes']:
+            out.setdefault(code, []).append((trip, t['truck']))
+    return out
+
+
+def diff(golden, current, limit=20):
+    """คืน list ข้อความความต่าง (ว่าง = ผลเหมือน golden)"""
+    if golden['hash'] == current['hash']:
+        return []
+    notes = []
+    g_groups = {tuple(t['codes']): (n, t['truck']) for n, t in golden['trips'].items()}
+    c_groups = {tuple(t['codes']): (n, t['truck']) for n, t in current['trips'].items()}
+    same = set(g_groups) & set(c_groups)
+    if len(golden['trips']) != len(current['trips']):
+        notes.append(f"จำนวนทริป {len(golden['trips'])} → {len(current['trips'])}")
+    notes.append(f"ทริปที่สมาชิกเหมือนเดิม {len(same)}/{len(golden['trips'])}")
+
+    renumbered = sorted((g_groups[k][0], c_groups[k][0]) for k in same if g_groups[k][0] != c_groups[k][0])
+    if renumbered:
+        notes.append(f"เลขทริปเปลี่ยน {len(renumbered)} ทริป: "
+                     + ', '.join(f"{a}→{b}" for a, b in sorted(renumbered, key=lambda x: int(x[0]))[:limit]))
+    trucks = sorted((c_groups[k][0], g_groups[k][1], c_groups[k][1]) for k in same if g_groups[k][1] != c_groups[k][1])
+    for trip, old, new in sorted(trucks, key=lambda x: int(x[0]))[:limit]:
+        notes.append(f"Trip {trip}: รถ {old} → {new}")
+
+    g_mem, c_mem = _membership(golden), _membership(current)
+    moved = []
+    for code in sorted(set(g_mem) | set(c_mem)):
+        old = sorted(t for t, _ in g_mem.get(code, []))
+        new = sorted(t for t, _ in c_mem.get(code, []))
+        if old != new:
+            moved.append(f"{code}: Trip {','.join(old) or '-'} → {','.join(new) or '-'}")
+    if moved:
+        notes.append(f"สาขาย้ายทริป {len(moved)} สาขา (เทียบตามเลขทริป):")
+        notes.extend(f"   {m}" for m in moved[:limit])
+        if len(moved) > limit:
+            notes.append(f"   ... อีก {len(moved) - limit} สาขา")
+
+    for kind in ('unassigned', 'vehicle', 'mixed_region', 'over_buffer'):
+        old, new = set(golden['violations'].get(kind, [])), set(current['violations'].get(kind, []))
+        if old != new:
+            added, removed = sorted(new - old), sorted(old - new)
+            notes.append(f"violation {kind}: +{len(added)} -{len(removed)}"
+                         + (f" (ใหม่: {', '.join(added[:limit])})" if added else ''))
+    return notes
+
+
+# ==========================================
+# รัน case
+# ==========================================
+def _load_app():
+    import logging
+    logging.disable(logging.WARNING)
+    from benchmark_planner import block_network
+    block_network()
+    import app
+    return app
+
+
+def load_case_input(app, spec):
+    kind, arg = spec
+    if kind == 'file':
+        with open(arg, 'rb') as f:
+            df = app.load_excel(f.read())
+        df = app.process_dataframe(df)
+    else:
+        from benchmark_planner import load_branch_pool, make_orders
+        orders = make_orders(load_branch_pool(), arg['size'], seed=arg['seed'], mix=arg.get('mix'),
+                             region_of=app.get_region_name)
+        df = app.process_dataframe(orders)
+    if 'OriginalQty' in df.columns:
+        df['OriginalQty'] = df['OriginalQty'].fillna(0)
+    return df
+
+
+def run_case(app, spec, model=None):
+    """รัน predict_trips ของ case → (fingerprint, wall_s)"""
+    df = load_case_input(app, spec)
+    t0 = time.perf_counter()
+    result_df, summary_df, _ = app.predict_trips(df, model, 1.0, 1.10)
+    wall_s = time.perf_counter() - t0
+    fp = fingerprint(result_df, summary_df)
+    fp['metrics']['wall_s'] = round(wall_s, 3)
+    return fp, wall_s
+
+
+def run_mixing(app, spec, model=None, improve_seconds=MIXING_SECONDS):
+    """greedy vs greedy + local search ของ case เดียว → [(ชนิด, ก่อน, หลัง)] ของ local_search.trip_mixing"""
+    from local_search import trip_mixing
+    df = load_case_input(app, spec)
+    greedy_df, _, _ = app.predict_trips(df.copy(), model, 1.0, 1.10)
+    improved_df, _, _ = app.predict_trips(df.copy(), model, 1.0, 1.10, improve_seconds=improve_seconds)
+    before = trip_mixing(greedy_df, app.is_cross_zone_violation)
+    after = trip_mixing(improved_df, app.is_cross_zone_violation)
+    return [(kind, len(before[kind]), len(after[kind])) for kind in before]
+
+
+def _mixing(app, model, cases, selected, improve_seconds):
+    failed = 0
+    for case in selected:
+        spec = cases[case]
+        print(f"⏳ {case}: {_describe(spec)} (improve_seconds={improve_seconds:g})", flush=True)
+        rows = run_mixing(app, spec, model, improve_seconds)
+        worse = [kind for kind, before, after in rows if after > before]
+        for kind, before, after in rows:
+            print(f"   {'❌' if kind in worse else '✅'} {kind:<15} {before:>4} → {after:>4} ทริป")
+        failed += bool(worse)
+    return 1 if failed else 0
+
+
+def _golden_path(case):
+    return os.path.join(GOLDEN_DIR, f"{case}.json")
+
+
+def _describe(spec):
+    kind, arg = spec
+    return arg if kind == 'file' else f"synthetic {json.dumps(arg, ensure_ascii=False)}"
+
+
+def _print_side_by_side(rows):
+    print(f"\n{'case':<34} {'ผล':<6} {'เวลา golden':>12} {'เวลาตอนนี้':>11} {'ทริป':>11} {'util%':>15} {'violations':>11}")
+    for case, status, g, c in rows:
+        gm, cm = g['metrics'] if g else {}, c['metrics']
+
+        def _pair(key, fmt='{}'):
+            a = gm.get(key)
+            return f"{fmt.format(a) if a is not None else '-'}→{fmt.format(cm.get(key)) if cm.get(key) is not None else '-'}"
+
+        g_time = f"{gm['wall_s']:.2f}s" if gm.get('wall_s') is not None else '-'
+        print(f"{case:<34} {status:<6} {g_time:>12} {cm['wall_s']:>10.2f}s "
+              f"{_pair('trips'):>11} {_pair('mean_util', '{:.1f}'):>15} {_pair('violations'):>11}")
+
+
+def main(argv):
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+    cmd = argv[0] if argv else 'check'
+    args = list(argv[1:])
+    cases = dict(DEFAULT_CASES)
+    while '--input' in args:
+        i = args.index('--input')
+        path = args[i + 1]
+        name = os.path.splitext(os.path.basename(path))[0]
+        cases[name] = ('file', path)
+        del args[i:i + 2]
+        args.append(name)
+
+    improve_seconds = MIXING_SECONDS
+    if '--seconds' in args:
+        i = args.index('--seconds')
+        improve_seconds = float(args[i + 1])
+        del args[i:i + 2]
+    if cmd == 'mixing':
+        cases.update(MIXING_CASES)
+        selected = args or list(MIXING_CASES)
+        unknown = [c for c in selected if c not in cases]
+        if unknown:
+            print(f"⚠️ ไม่รู้จัก case: {', '.join(unknown)} (ดู: python golden_check.py list)")
+            return 1
+        app = _load_app()
+        return _mixing(app, app.load_model(), cases, selected, improve_seconds)
+
+    if cmd == 'list':
+        for case, spec in cases.items():
+            mark = '✅' if os.path.exists(_golden_path(case)) else '—'
+            print(f"{mark} {case}: {_describe(spec)}")
+        return 0
+    if cmd not in ('record', 'check'):
+        print(__doc__)
+        return 1
+
+    selected = args or list(cases)
+    unknown = [c for c in selected if c not in cases]
+    if unknown:
+        print(f"⚠️ ไม่รู้จัก case: {', '.join(unknown)} (ดู: python golden_check.py list)")
+        return 1
+
+    app = _load_app()
+    model = app.load_model()
+    versions = data_versions()
+    rows, failed = [], 0
+    for case in selected:
+        spec = cases[case]
+        if spec[0] == 'file' and not os.path.exists(spec[1]):
+            print(f"⚠️ ข้าม {case}: ไม่พบ {spec[1]}")
+            continue
+        print(f"⏳ {case}: {_describe(spec)}", flush=True)
+        fp, _ = run_case(app, spec, model)
+
+        if cmd == 'record':
+            os.makedirs(GOLDEN_DIR, exist_ok=True)
+            fp['case'] = case
+            fp['input'] = _describe(spec)
+            fp['recorded_at'] = datetime.now().isoformat(timespec='seconds')
+            fp['data_versions'] = versions
+            with open(_golden_path(case), 'w', encoding='utf-8') as f:
+                json.dump(fp, f, ensure_ascii=False, indent=2)
+            print(f"   💾 {_golden_path(case)} ({fp['metrics']['trips']} ทริป, hash {fp['hash']})")
+            rows.append((case, 'record', None, fp))
+            continue
+
+        path = _golden_path(case)
+        if not os.path.exists(path):
+            print(f"   ⚠️ ยังไม่มี golden → รัน: python golden_check.py record {case}")
+            rows.append((case, 'ไม่มี', None, fp))
+            failed += 1
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            golden = json.load(f)
+        changed = {k: (golden.get('data_versions', {}).get(k), v) for k, v in versions.items()
+                   if golden.get('data_versions', {}).get(k) != v}
+        if changed:
+            print(f"   ⚠️ ข้อมูลในเครื่องต่างจากตอนบันทึก golden: {', '.join(changed)} (ผลอาจต่างโดยไม่ใช่ความผิดของโค้ด)")
+        notes = diff(golden, fp)
+        if notes:
+            failed += 1
+            print("   ❌ ผลต่างจาก golden:")
+            for note in notes:
+                print(f"      {note}")
+        else:
+            print(f"   ✅ เหมือน golden (hash {fp['hash']})")
+        rows.append((case, '❌' if notes else '✅', golden, fp))
+
+    if rows:
+        _print_side_by_side(rows)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
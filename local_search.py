@@ -0,0 +1,548 @@
+"""
+Local Search — ปรับปรุงแผนหลัง greedy + consolidation (หลัง Step 6.8) ภายในเวลาที่กำหนด
+
+ย้ายสาขาระหว่างทริปในภาคเดียวกัน:
+  - relocate : ย้ายสาขา 1 แห่ง A → B
+  - swap     : สลับสาขา 1 ↔ 1 ระหว่าง A, B
+  - exchange : สลับสาขา 2 แห่งของ A กับ 1 แห่งของ B (2-exchange)
+
+ผลรวมต่อทริป (น้ำหนัก/คิว/ชิ้น/drops/จำนวนสาขาตามข้อจำกัดรถ/Punthai/ภาค/กรุงเทพฯ/ZONE_NEARBY/พิกัด)
+เก็บแบบ incremental → เช็คว่าทำได้ + ต้นทุนที่เปลี่ยน O(จำนวนสาขาที่ย้าย) ต่อ move
+
+กติกาเดียวกับ can_add_branch_to_trip / Step 6.6:
+  - รถ = รถใหญ่สุดที่ทุกสาขาในทริปรับได้, น้ำหนัก/คิว ≤ limit × buffer (Punthai ล้วน → punthai_buffer)
+  - ห้ามปนภาค, กรุงเทพฯ ห้ามปนจังหวัดอื่น, ZONE_NEARBY ต้องจังหวัดเดียวกัน
+  - zone (เข้มกว่า Step 6.6): สาขาที่ย้ายเข้าต้องมีจังหวัดอยู่ในทริปแล้ว (ไม่รู้จังหวัด → _logistics_zone ต้องมีแล้ว)
+    และไม่ทำให้ทริป zone เดียวกลายเป็นหลาย zone → local search ไม่เพิ่มทริปปนจังหวัด/zone
+  - คู่จังหวัดต้องห้าม (cross_zone = is_cross_zone_violation) ห้ามเด็ดขาด
+  - สาขาต้องอยู่ห่าง centroid ของทริปปลายทางไม่เกิน max_km (เส้นตรง)
+ต้นทุน = ค่ารถ (fleet_cost.VEHICLE_COST) ที่ Step 7 จะเลือก (เล็กสุดที่รับได้ / เหนือ-ใต้ใช้รถใหญ่สุดที่อนุญาต)
+ทริปว่าง = 0 — เสมอกัน → เลือก move ที่ทำให้ utilization กระจุก (ผลรวม util²) มากขึ้น → ทริปเล็กค่อยๆ ว่าง
+
+improve_trips(): Step 6.9 ใน predict_trips (บน TripState ก่อน Step 7)
+improve_result(): แผนที่จัดเสร็จแล้ว (seed ของ solver_portfolio) → สร้างรถ/summary ใหม่เฉพาะทริปที่เปลี่ยน
+"""
+import time
+from collections import Counter
+
+from fleet_cost import LONG_HAUL_REGIONS, VEHICLE_COST
+from spatial_index import great_circle_km
+
+RANK_VEHICLE = {1: '4W', 2: 'JB', 3: '6W'}
+VEHICLE_ORDER = ('4W', 'JB', '6W')
+BKK = 'กรุงเทพมหานคร'
+DEFAULT_MAX_KM = 50.0
+# 2-exchange เฉพาะทริปที่มีสาขาไม่เกินนี้ (คู่สาขาโต O(n²))
+EXCHANGE_MAX_UNITS = 12
+_EPS = 1e-9
+
+
+def _text(value):
+    """ค่าข้อความของคอลัมน์ (None / NaN → '')"""
+    value = '' if value is None else str(value).strip()
+    return '' if value in ('nan', 'None') else value
+
+
+class _Unit:
+    """สาขา 1 แห่ง (ทุกแถวของ Code เดียวกัน) ในทริป"""
+    __slots__ = ('code', 'w', 'c', 'q', 'drops', 'rank', 'punthai', 'province', 'region', 'bkk', 'zone', 'nearby',
+                 'lat', 'lon')
+
+
+class _Trip:
+    """ผลรวมของทริปแบบ incremental"""
+
+    def __init__(self, num):
+        self.num = num
+        self.units = []
+        self.w = self.c = self.q = 0.0
+        self.drops = 0
+        self.ranks = Counter()
+        self.non_punthai = 0
+        self.regions = Counter()
+        self.bkk = 0
+        self.non_bkk = 0
+        self.provinces = Counter()
+        self.zones = Counter()
+        self.nearby = 0
+        self.lat_sum = self.lon_sum = 0.0
+        self.n_coords = 0
+
+    def add(self, u, sign=1):
+        self.w += sign * u.w
+        self.c += sign * u.c
+        self.q += sign * u.q
+        self.drops += sign * u.drops
+        self.ranks[u.rank] += sign
+        self.non_punthai += sign * (not u.punthai)
+        if u.region:
+            self.regions[u.region] += sign
+        if u.province:
+            self.provinces[u.province] += sign
+            if u.bkk:
+                self.bkk += sign
+            else:
+                self.non_bkk += sign
+        if u.zone:
+            self.zones[u.zone] += sign
+        self.nearby += sign * u.nearby
+        if u.lat > 0 and u.lon > 0:
+            self.lat_sum += sign * u.lat
+            self.lon_sum += sign * u.lon
+            self.n_coords += sign
+        if sign > 0:
+            self.units.append(u)
+        else:
+            self.units.remove(u)
+
+    def centroid(self, without=()):
+        lat, lon, n = self.lat_sum, self.lon_sum, self.n_coords
+        for u in without:
+            if u.lat > 0 and u.lon > 0:
+                lat, lon, n = lat - u.lat, lon - u.lon, n - 1
+        return (lat / n, lon / n) if n > 0 else (0.0, 0.0)
+
+
+class LocalSearch:
+    """
+    ปรับปรุงทริปใน TripState ให้ใช้รถน้อยลง/เล็กลง
+    limits = {'punthai': PUNTHAI_LIMITS, 'maxmart': LIMITS}
+    cross_zone = (จังหวัด, จังหวัด) → True ถ้าห้ามอยู่ทริปเดียวกัน (is_cross_zone_violation)
+    """
+
+    def __init__(self, trip_state, limits, punthai_buffer=1.0, maxmart_buffer=1.10, is_punthai=None,
+                 vehicle_rank=None, region_of=None, max_qty_per_trip=0, max_km=DEFAULT_MAX_KM, cross_zone=None):
+        self.state = trip_state
+        self.limits = limits
+        self.punthai_buffer = punthai_buffer
+        self.maxmart_buffer = maxmart_buffer
+        self.is_punthai = is_punthai or (lambda code: False)
+        self.vehicle_rank = vehicle_rank or (lambda code: 3)
+        self.region_of = region_of or (lambda province: '')
+        self.max_qty = max_qty_per_trip
+        self.max_km = max_km
+        self.cross_zone = cross_zone
+        self.trips = {}
+        self.moves = Counter()
+        self._build()
+
+    # ------------------------------------------------------------------
+    def _build(self):
+        st = self.state
+        df = st.df
+        col = lambda name: st.column(name) if name in df.columns else None
+        weight, cube, qty = col('Weight'), col('Cube'), col('OriginalQty')
+        province, region_name = col('_province'), col('_region_name')
+        zone, lat, lon = col('_logistics_zone'), col('_lat'), col('_lon')
+        trip_of = df['Trip'].to_numpy()
+
+        def num(arr, pos):
+            if arr is None:
+                return 0.0
+            v = arr[pos]
+            try:
+                v = float(v)
+            except (TypeError, ValueError):
+                return 0.0
+            return 0.0 if v != v else v
+
+        for t in st.trips():
+            trip = _Trip(t)
+            for code in dict.fromkeys(st.codes(t)):
+                pos = st.positions_of((code,))
+                if len({int(trip_of[p]) for p in pos}) != 1:
+                    continue  # Code เดียวกันแยกหลายทริป → ไม่ย้าย
+                u = _Unit()
+                u.code = code
+                u.w = sum(num(weight, p) for p in pos)
+                u.c = sum(num(cube, p) for p in pos)
+                u.q = sum(num(qty, p) for p in pos)
+                u.drops = len(pos)
+                u.rank = self.vehicle_rank(code)
+                u.punthai = bool(self.is_punthai(code))
+                prov = str(province[pos[0]] or '') if province is not None else ''
+                prov = '' if prov == 'nan' else prov
+                region = self.region_of(prov) if prov else ''
+                if (not region or region == 'ไม่ระบุ') and region_name is not None:
+                    region = str(region_name[pos[0]] or '')
+                u.province = prov
+                u.region = '' if region in ('', 'ไม่ระบุ', 'nan') else region
+                u.bkk = prov == BKK
+                u.zone = _text(zone[pos[0]]) if zone is not None else ''
+                u.nearby = u.zone.startswith('ZONE_NEARBY_')
+                u.lat = sum(num(lat, p) for p in pos) / len(pos)
+                u.lon = sum(num(lon, p) for p in pos) / len(pos)
+                trip.add(u)
+            if trip.units:
+                self.trips[t] = trip
+        # ทริปที่มีสาขาย้ายไม่ได้ (Code แยกหลายทริป) → นับน้ำหนักส่วนนั้นเป็นของคงที่
+        for t, trip in self.trips.items():
+            pos = st.members(t)
+            fixed_w = sum(num(weight, p) for p in pos) - trip.w
+            fixed_c = sum(num(cube, p) for p in pos) - trip.c
+            trip.fixed = (fixed_w, fixed_c, len(pos) - trip.drops)
+
+    # ------------------------------------------------------------------
+    def _evaluate(self, trip, remove=(), add=()):
+        """
+        (feasible, vehicle, util) ของทริปหลังเอา remove ออก + ใส่ add (ไม่แก้ trip จริง)
+        vehicle = รถที่ Step 7 จะเลือก (เล็กสุดที่รับได้ / เหนือ-ใต้ใช้รถใหญ่สุดที่อนุญาต), ทริปว่าง → (True, None, 0)
+        ทริปเดิมที่ผิดกติกาอยู่แล้ว → feasible=False แต่ยังคืนรถ/util ไว้นับรายงาน
+        """
+        fw, fc, fd = trip.fixed
+        w, c, q, drops = trip.w + fw, trip.c + fc, trip.q, trip.drops + fd
+        ranks = Counter(trip.ranks)
+        non_punthai = trip.non_punthai
+        regions = Counter(trip.regions)
+        provinces = Counter(trip.provinces)
+        zones = Counter(trip.zones)
+        bkk, non_bkk, nearby = trip.bkk, trip.non_bkk, trip.nearby
+        zone_ok = True
+        for sign, units in ((-1, remove), (1, add)):
+            if sign > 0 and units:
+                zone_ok = self._zone_ok(units, provinces, zones)
+            for u in units:
+                w += sign * u.w
+                c += sign * u.c
+                q += sign * u.q
+                drops += sign * u.drops
+                ranks[u.rank] += sign
+                non_punthai += sign * (not u.punthai)
+                if u.region:
+                    regions[u.region] += sign
+                if u.province:
+                    provinces[u.province] += sign
+                    if u.bkk:
+                        bkk += sign
+                    else:
+                        non_bkk += sign
+                if u.zone:
+                    zones[u.zone] += sign
+                nearby += sign * u.nearby
+        if drops <= 0:
+            return True, None, 0.0
+        known_regions = [r for r, n in regions.items() if n > 0]
+        ok = (zone_ok
+              and len(known_regions) <= 1
+              and not (bkk > 0 and non_bkk > 0)
+              and not (nearby > 0 and sum(1 for n in provinces.values() if n > 0) > 1)
+              and not (self.max_qty and q > self.max_qty + _EPS))
+
+        cap_rank = min((r for r, n in ranks.items() if n > 0), default=3)
+        punthai = non_punthai == 0
+        table = self.limits['punthai' if punthai else 'maxmart']
+        buffer = self.punthai_buffer if punthai else self.maxmart_buffer
+        cap = table[RANK_VEHICLE[cap_rank]]
+        if w > cap['max_w'] * buffer + _EPS or c > cap['max_c'] * buffer + _EPS or drops > cap['max_drops']:
+            ok = False
+
+        vehicle = RANK_VEHICLE[cap_rank]
+        if not (known_regions and known_regions[0] in LONG_HAUL_REGIONS):
+            for v in VEHICLE_ORDER[:cap_rank]:
+                lim = table[v]
+                if w <= lim['max_w'] * buffer and c <= lim['max_c'] * buffer and drops <= lim['max_drops']:
+                    vehicle = v
+                    break
+        lim = table[vehicle]
+        return ok, vehicle, max(w / lim['max_w'], c / lim['max_c'])
+
+    def _zone_ok(self, units, provinces, zones):
+        """สาขาที่ย้ายเข้าอยู่จังหวัดที่ทริปมีแล้ว, ไม่เพิ่ม zone ให้ทริป zone เดียว (ทริปว่าง → สาขาแรกกำหนด), ไม่เกิดคู่ต้องห้าม"""
+        provs = {p for p, n in provinces.items() if n > 0}
+        zs = {z for z, n in zones.items() if n > 0}
+        for u in units:
+            if provs or zs:
+                if not (u.province in provs if u.province else u.zone in zs):
+                    return False
+                if u.zone and len(zs) == 1 and u.zone not in zs:
+                    return False
+                if self.cross_zone is not None and u.province and any(self.cross_zone(u.province, p) for p in provs):
+                    return False
+            if u.province:
+                provs.add(u.province)
+            if u.zone:
+                zs.add(u.zone)
+        return True
+
+    def _near(self, unit, trip, without=()):
+        if unit.lat <= 0 or unit.lon <= 0:
+            return True
+        lat, lon = trip.centroid(without)
+        if lat <= 0 or lon <= 0:
+            return True
+        return float(great_circle_km(unit.lat, unit.lon, lat, lon)) <= self.max_km
+
+    def _gain(self, a, b, out_a, out_b):
+        """
+        ผลของการย้าย out_a: A → B และ out_b: B → A
+        คืน (Δต้นทุน, Δutil²) หรือ None ถ้าทำไม่ได้
+        """
+        ok_a, veh_a, util_a = self._evaluate(a, remove=out_a, add=out_b)
+        if not ok_a:
+            return None
+        ok_b, veh_b, util_b = self._evaluate(b, remove=out_b, add=out_a)
+        if not ok_b:
+            return None
+        _, veh_a0, util_a0 = self._evaluate(a)
+        _, veh_b0, util_b0 = self._evaluate(b)
+        cost = VEHICLE_COST.get
+        return ((cost(veh_a, 0.0) + cost(veh_b, 0.0)) - (cost(veh_a0, 0.0) + cost(veh_b0, 0.0)),
+                (util_a ** 2 + util_b ** 2) - (util_a0 ** 2 + util_b0 ** 2))
+
+    @staticmethod
+    def _better(gain):
+        return gain is not None and (gain[0] < -_EPS or (abs(gain[0]) <= _EPS and gain[1] > 1e-6))
+
+    def _apply(self, a, b, out_a, out_b, kind):
+        for u in out_a:
+            a.add(u, -1)
+            b.add(u)
+        for u in out_b:
+            b.add(u, -1)
+            a.add(u)
+        for u in out_a:
+            self.state.assign_codes([u.code], b.num)
+        for u in out_b:
+            self.state.assign_codes([u.code], a.num)
+        self.moves[kind] += 1
+
+    def _neighbours(self, a):
+        """ทริปอื่นในภาคเดียวกัน (ไม่รู้ภาค = ทุกทริป) เรียงตามระยะ centroid"""
+        region = next((r for r, n in a.regions.items() if n > 0), '')
+        lat, lon = a.centroid()
+        out = []
+        for b in self.trips.values():
+            if b is a or not b.units:
+                continue
+            b_region = next((r for r, n in b.regions.items() if n > 0), '')
+            if region and b_region and region != b_region:
+                continue
+            blat, blon = b.centroid()
+            d = float(great_circle_km(lat, lon, blat, blon)) if lat > 0 and blat > 0 else 0.0
+            if d <= 2 * self.max_km:
+                out.append((d, b.num, b))
+        return [b for _, _, b in sorted(out, key=lambda x: (x[0], x[1]))]
+
+    def _improve_trip(self, a, deadline):
+        """หา move แรกที่ดีขึ้นของทริป a (relocate → swap → exchange) แล้ว apply"""
+        neighbours = self._neighbours(a)
+        for u in list(a.units):
+            for b in neighbours:
+                if self._near(u, b) and self._better(self._gain(a, b, (u,), ())):
+                    self._apply(a, b, (u,), (), 'relocate')
+                    return True
+        if time.perf_counter() > deadline:
+            return False
+        for u in list(a.units):
+            for b in neighbours:
+                if not self._near(u, b):
+                    continue
+                for v in list(b.units):
+                    if self._near(v, a, without=(u,)) and self._better(self._gain(a, b, (u,), (v,))):
+                        self._apply(a, b, (u,), (v,), 'swap')
+                        return True
+        if len(a.units) > EXCHANGE_MAX_UNITS or time.perf_counter() > deadline:
+            return False
+        units = list(a.units)
+        for i in range(len(units)):
+            for j in range(i + 1, len(units)):
+                pair = (units[i], units[j])
+                for b in neighbours:
+                    if not (self._near(pair[0], b) and self._near(pair[1], b)):
+                        continue
+                    for v in list(b.units):
+                        if self._near(v, a, without=pair) and self._better(self._gain(a, b, pair, (v,))):
+                            self._apply(a, b, pair, (v,), 'exchange')
+                            return True
+        return False
+
+    def _snapshot(self):
+        vehicles = Counter()
+        utils = []
+        for trip in self.trips.values():
+            if trip.units:
+                _, vehicle, util = self._evaluate(trip)
+                vehicles[vehicle] += 1
+                utils.append(util)
+        return {
+            'trips': sum(vehicles.values()),
+            'vehicles': {v: vehicles.get(v, 0) for v in VEHICLE_ORDER},
+            'cost': sum(VEHICLE_COST[v] * n for v, n in vehicles.items()),
+            'avg_util': (sum(utils) / len(utils) * 100) if utils else 0.0,
+        }
+
+    # ------------------------------------------------------------------
+    def run(self, time_budget_s, should_stop=None):
+        """ปรับปรุงจนไม่มี move ที่ดีขึ้น หรือหมดเวลา / should_stop() เป็นจริง (ยกเลิก) → รายงานผล"""
+        t0 = time.perf_counter()
+        deadline = t0 + max(0.0, float(time_budget_s))
+        before = self._snapshot()
+        passes = 0
+        timed_out = False
+        improved = True
+        while improved:
+            improved = False
+            passes += 1
+            # ทริป utilization ต่ำก่อน (มีโอกาสว่างได้มากสุด)
+            order = sorted((t for t in self.trips.values() if t.units),
+                           key=lambda t: (self._evaluate(t)[2], t.num))
+            for a in order:
+                if time.perf_counter() > deadline or (should_stop is not None and should_stop()):
+                    timed_out = True
+                    break
+                if a.units and self._improve_trip(a, deadline):
+                    improved = True
+            if timed_out:
+                break
+        after = self._snapshot()
+        seconds = time.perf_counter() - t0
+        trucks_saved = before['trips'] - after['trips']
+        util_gain = after['avg_util'] - before['avg_util']
+        return {
+            'seconds': round(seconds, 3),
+            'budget_s': float(time_budget_s),
+            'timed_out': timed_out,
+            'passes': passes,
+            'moves': dict(self.moves),
+            'before': before,
+            'after': after,
+            'trucks_saved': trucks_saved,
+            'six_w_saved': before['vehicles']['6W'] - after['vehicles']['6W'],
+            'cost_saved': round(before['cost'] - after['cost'], 2),
+            'util_gain_pts': round(util_gain, 2),
+            'trucks_saved_per_s': round(trucks_saved / seconds, 3) if seconds > 0 else 0.0,
+            'util_gain_per_s': round(util_gain / seconds, 3) if seconds > 0 else 0.0,
+        }
+
+
+def improve_trips(trip_state, limits, time_budget_s, punthai_buffer=1.0, maxmart_buffer=1.10, is_punthai=None,
+                  vehicle_rank=None, region_of=None, max_qty_per_trip=0, max_km=DEFAULT_MAX_KM, should_stop=None,
+                  cross_zone=None, log=print):
+    """รัน LocalSearch บน trip_state (แก้ df['Trip'] ผ่าน TripState) → dict รายงาน"""
+    search = LocalSearch(trip_state, limits, punthai_buffer, maxmart_buffer, is_punthai=is_punthai,
+                         vehicle_rank=vehicle_rank, region_of=region_of, max_qty_per_trip=max_qty_per_trip,
+                         max_km=max_km, cross_zone=cross_zone)
+    report = search.run(time_budget_s, should_stop=should_stop)
+    b, a = report['before'], report['after']
+    log(f"🔧 Local search {report['seconds']:.1f}s/{report['budget_s']:g}s: ทริป {b['trips']} → {a['trips']} "
+        f"(6W {b['vehicles']['6W']} → {a['vehicles']['6W']}), util เฉลี่ย {b['avg_util']:.1f}% → {a['avg_util']:.1f}% "
+        f"| moves {report['moves'] or '-'}")
+    return report
+
+
+def improve_result(result, limits, time_budget_s, punthai_buffer=1.0, maxmart_buffer=1.10, max_qty_per_trip=0,
+                   fleet_limits=None, should_stop=None, cross_zone=None, log=print):
+    """
+    local search บนผล (df, summary_df, fleet_used) ที่จัดเสร็จแล้ว — BU / รถของสาขา / ภาค อ่านจากคอลัมน์ของ df
+    ทริปที่สมาชิกเปลี่ยน → รถ + summary ใหม่ (plan_update.rebuild_trips) | report ที่ summary_df.attrs['local_search']
+    """
+    from plan_update import PUNTHAI_BUS, rebuild_trips
+    from trip_state import TripState
+
+    df, summary_df, fleet_used = result
+    df = df.reset_index(drop=True).copy()
+    codes = df['Code'].astype(str).str.strip().str.upper()
+    bus = df['BU'].astype(str).str.strip().str.upper() if 'BU' in df.columns else None
+    punthai = bus.isin(PUNTHAI_BUS).groupby(codes).all().to_dict() if bus is not None else {}
+    ranks = df['_max_vehicle'].map(lambda v: {'4W': 1, 'JB': 2, '6W': 3}.get(str(v), 3)) \
+        if '_max_vehicle' in df.columns else None
+    rank_of = ranks.groupby(codes).min().to_dict() if ranks is not None else {}
+    region_by_province = df.groupby('_province')['Region'].first().to_dict() \
+        if {'_province', 'Region'} <= set(df.columns) else {}
+    is_punthai = lambda c: punthai.get(str(c).strip().upper(), False)
+    vehicle_rank = lambda c: rank_of.get(str(c).strip().upper(), 3)
+    region_of = lambda province: str(region_by_province.get(province, '') or '')
+
+    before = df['Trip'].to_numpy(copy=True)
+    state = TripState(df, is_punthai=is_punthai, vehicle_rank=vehicle_rank, region_of=region_of)
+    report = improve_trips(state, limits, time_budget_s, punthai_buffer=punthai_buffer, maxmart_buffer=maxmart_buffer,
+                           is_punthai=is_punthai, vehicle_rank=vehicle_rank, region_of=region_of,
+                           max_qty_per_trip=max_qty_per_trip, should_stop=should_stop, cross_zone=cross_zone, log=log)
+    after = df['Trip'].to_numpy()
+    moved = before != after
+    changed = {int(t) for t in before[moved]} | {int(t) for t in after[moved]}
+    if changed:
+        df, summary_df, fleet_used = rebuild_trips(df, summary_df, changed, limits, punthai_buffer, maxmart_buffer,
+                                                   max_qty_per_trip, fleet_limits)
+    else:
+        df, summary_df, fleet_used = result
+    summary_df.attrs['local_search'] = report
+    return df, summary_df, fleet_used
+
+
+def trip_mixing(df, cross_zone=None):
+    """
+    การปนจังหวัด/zone ของแผน → {ชนิด: [เลขทริป]}
+      multi_province / multi_zone : ทริปที่มีมากกว่า 1 จังหวัด / _logistics_zone
+      zone_split : ผิด Step 6.6 — สาขาในทริปไม่เชื่อมกันด้วยจังหวัดหรือ zone ที่ร่วมกัน
+      cross_zone : มีคู่จังหวัดต้องห้าม (cross_zone = is_cross_zone_violation)
+    """
+    out = {'multi_province': [], 'multi_zone': [], 'zone_split': [], 'cross_zone': []}
+    if '_province' not in df.columns and '_logistics_zone' not in df.columns:
+        return out
+    for trip, g in df[df['Trip'] > 0].groupby('Trip', sort=True):
+        blank = [''] * len(g)
+        provinces = g['_province'] if '_province' in g.columns else blank
+        zones = g['_logistics_zone'] if '_logistics_zone' in g.columns else blank
+        pairs = {(_text(p), _text(z)) for p, z in zip(provinces, zones)}
+        pairs = [(p, z) for p, z in pairs if p or z]
+        provs = sorted({p for p, _ in pairs if p})
+        zones = {z for _, z in pairs if z}
+        trip = int(trip)
+        if len(provs) > 1:
+            out['multi_province'].append(trip)
+        if len(zones) > 1:
+            out['multi_zone'].append(trip)
+        # union-find: จังหวัด/zone ของสาขาเดียวกันเชื่อมกัน → มากกว่า 1 กลุ่ม = ผิด Step 6.6
+        parent = {}
+
+        def find(x):
+            while parent.setdefault(x, x) != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for p, z in pairs:
+            if p and z:
+                parent[find(('p', p))] = find(('z', z))
+        roots = {find(('p', p) if p else ('z', z)) for p, z in pairs}
+        if len(roots) > 1:
+            out['zone_split'].append(trip)
+        if cross_zone is not None and any(cross_zone(a, b) for i, a in enumerate(provs) for b in provs[i + 1:]):
+            out['cross_zone'].append(trip)
+    return out
+
+
+def combine_reports(reports):
+    """รวมรายงานของหลายกลุ่ม (parallel planner — แต่ละกลุ่มรันพร้อมกัน → seconds = กลุ่มที่นานสุด)"""
+    def _total(key):
+        return {v: sum(r[key]['vehicles'][v] for r in reports) for v in VEHICLE_ORDER}
+
+    def _side(key):
+        trips = sum(r[key]['trips'] for r in reports)
+        util = sum(r[key]['avg_util'] * r[key]['trips'] for r in reports)
+        return {'trips': trips, 'vehicles': _total(key), 'cost': round(sum(r[key]['cost'] for r in reports), 2),
+                'avg_util': util / trips if trips else 0.0}
+
+    before, after = _side('before'), _side('after')
+    moves = Counter()
+    for r in reports:
+        moves.update(r['moves'])
+    seconds = max(r['seconds'] for r in reports)
+    trucks_saved = before['trips'] - after['trips']
+    util_gain = after['avg_util'] - before['avg_util']
+    return {
+        'seconds': seconds,
+        'budget_s': max(r['budget_s'] for r in reports),
+        'timed_out': any(r['timed_out'] for r in reports),
+        'passes': max(r['passes'] for r in reports),
+        'moves': dict(moves),
+        'before': before,
+        'after': after,
+        'trucks_saved': trucks_saved,
+        'six_w_saved': before['vehicles']['6W'] - after['vehicles']['6W'],
+        'cost_saved': round(before['cost'] - after['cost'], 2),
+        'util_gain_pts': round(util_gain, 2),
+        'trucks_saved_per_s': round(trucks_saved / seconds, 3) if seconds > 0 else 0.0,
+        'util_gain_per_s': round(util_gain / seconds, 3) if seconds > 0 else 0.0,
+    }
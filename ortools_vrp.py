@@ -14,6 +14,8 @@ import numpy as np
 from typing import Dict, List, Tuple, Optional
 import math
 
+from fleet_cost import LONG_HAUL_REGIONS, VEHICLE_COST_UNITS, VEHICLE_RANK, VEHICLE_TYPES, pick_vehicle, vehicle_caps
+
 # Import vehicle logic
 try:
     from vehicle_logic import (
@@ -476,6 +478,370 @@ def determine_global_limiting_factor(df):
         return 'cube'
 
 
+# ==========================================
+# 🧩 DECOMPOSED CP-SAT — ปัญหาย่อยตามภาค/โซน + warm start จากผล greedy
+# ==========================================
+# optimize() สร้างตัวแปร n_branches × max_trips ทั้งไฟล์ → ใหญ่เกินสำหรับออเดอร์ทั้งวัน
+# optimize_decomposed() รับผลของ predict_trips แล้ว:
+#   1. แยกทริปตาม (ภาค, กรุงเทพฯ) แล้วตัดเป็นโซนทิศทางละ ≤ max_sub_trips ทริป (ZONE_NEARBY แยกจังหวัด)
+#   2. สาขาในกลุ่มเดียวกันของ branch_groups.json + ทริปเดียวกัน → item เดียว
+#   3. bin = ทริปของ greedy ในกลุ่มนั้น, item เรียงใหญ่ → เล็ก และ item i อยู่ได้เฉพาะ bin ≤ i,
+#      bin ที่ใช้ต้องเรียงติดกัน (symmetry breaking) + AddHint จากทริปของ greedy
+#   4. แก้ปัญหาย่อยพร้อมกันใน process pool → ไม่พบคำตอบ/ไม่ดีกว่า greedy → ใช้ทริปเดิม
+#   5. เลือกรถ + summary + เลขทริปแบบ Step 7/9 (เหนือ/ใต้ = รถใหญ่สุดที่สาขาอนุญาต)
+
+# ต้นทุนต่อคัน (objective หลัก) = fleet_cost.VEHICLE_COST_UNITS + ค่าปรับต่ออำเภอที่ทริปวิ่งผ่าน (ให้ทริปกระชับ)
+DISTRICT_PENALTY = 5
+# ระยะสูงสุดระหว่างสาขาในทริปเดียวกัน (km เส้นตรง) เหมือน Step 6.6 ช่วงทริปเกือบเต็ม
+# — คู่ที่ greedy จัดไว้ด้วยกันอยู่แล้วไม่ถูกห้าม (hint ต้องยังทำได้)
+PAIR_KM_SAME_PROVINCE = 80
+PAIR_KM_OTHER_PROVINCE = 40
+PUNTHAI_BUS = ('211', 'PUNTHAI')
+BKK_PROVINCE = 'กรุงเทพมหานคร'
+MAX_SUB_TRIPS = 12
+
+
+def _vehicle_caps(limits, buffer_punthai, buffer_maxmart):
+    """{vehicle: ((w, c, drops) Punthai ล้วน, (w, c, drops) ผสม)} รวม buffer แล้ว (limits ที่ไม่ส่งมา = ค่าในไฟล์นี้)"""
+    return vehicle_caps({'punthai': limits.get('punthai', PUNTHAI_LIMITS), 'maxmart': limits.get('maxmart', LIMITS)},
+                        buffer_punthai, buffer_maxmart)
+
+
+def _plan_items(df, branch_to_group):
+    """
+    item ของแต่ละทริป: สาขากลุ่มเดียวกัน (branch_groups.json) ในทริปเดียวกันรวมเป็น item เดียว
+    คืน {trip: [item, ...]} โดย item = dict(rows, weight, cube, qty, drops, rank, punthai, districts)
+    """
+    codes = df['Code'].astype(str).str.strip().str.upper().tolist()
+    trips = df['Trip'].astype(int).tolist()
+    weight = pd.to_numeric(df['Weight'], errors='coerce').fillna(0).tolist()
+    cube = pd.to_numeric(df['Cube'], errors='coerce').fillna(0).tolist()
+    qty = pd.to_numeric(df['OriginalQty'], errors='coerce').fillna(0).tolist() \
+        if 'OriginalQty' in df.columns else [0] * len(df)
+    ranks = [VEHICLE_RANK.get(str(v), 3) for v in df['_max_vehicle']] \
+        if '_max_vehicle' in df.columns else [3] * len(df)
+    bus = df['BU'].astype(str).str.strip().str.upper().tolist() if 'BU' in df.columns else [''] * len(df)
+    provinces = df['_province'].astype(str).tolist() if '_province' in df.columns else [''] * len(df)
+    districts = df['_district'].astype(str).tolist() if '_district' in df.columns else [''] * len(df)
+    lats = pd.to_numeric(df['_lat'], errors='coerce').fillna(0).tolist() if '_lat' in df.columns else [0] * len(df)
+    lons = pd.to_numeric(df['_lon'], errors='coerce').fillna(0).tolist() if '_lon' in df.columns else [0] * len(df)
+
+    items = {}
+    for pos, (code, trip) in enumerate(zip(codes, trips)):
+        if trip <= 0:
+            continue
+        key = (branch_to_group.get(code, code) if branch_to_group else code, trip)
+        item = items.get(key)
+        if item is None:
+            item = items[key] = {'rows': [], 'weight': 0.0, 'cube': 0.0, 'qty': 0.0, 'drops': 0,
+                                 'rank': 3, 'punthai': True, 'districts': set(),
+                                 'province': provinces[pos], 'lat': 0.0, 'lon': 0.0}
+        item['rows'].append(pos)
+        item['weight'] += weight[pos]
+        item['cube'] += cube[pos]
+        item['qty'] += qty[pos]
+        item['drops'] += 1
+        item['rank'] = min(item['rank'], ranks[pos])
+        item['punthai'] = item['punthai'] and bus[pos] in PUNTHAI_BUS
+        item['districts'].add(f"{provinces[pos]}/{districts[pos]}")
+        if not item['lat'] and lats[pos] > 0 and lons[pos] > 0:
+            item['lat'], item['lon'] = lats[pos], lons[pos]
+    by_trip = {}
+    for (_, trip), item in items.items():
+        by_trip.setdefault(trip, []).append(item)
+    return by_trip
+
+
+def decompose_trips(df, max_sub_trips=MAX_SUB_TRIPS):
+    """
+    แบ่งทริปของ greedy เป็นปัญหาย่อย [(key, region, [trip, ...]), ...]
+    key = ภาค/กรุงเทพฯ (ZONE_NEARBY แยกตามจังหวัด) แล้วตัดเป็นช่วงละ ≤ max_sub_trips ทริป
+    ตามทิศ+ระยะจาก DC (ทริปที่อยู่กลุ่มเดียวกันจึงอยู่ในโซนทิศทางเดียวกัน)
+    """
+    assigned = df[df['Trip'] > 0]
+    if assigned.empty:
+        return []
+    col = lambda name, default: assigned[name] if name in assigned.columns else pd.Series(default, index=assigned.index)
+    info = pd.DataFrame({
+        'Trip': assigned['Trip'].astype(int),
+        'region': col('Region', '').astype(str),
+        'bkk': col('_province', '').astype(str) == BKK_PROVINCE,
+        'zone': col('_logistics_zone', '').fillna('').astype(str).replace('None', ''),
+        'province': col('_province', '').astype(str),
+        'bearing': pd.to_numeric(col('_bearing_from_dc', 0), errors='coerce').fillna(0),
+        'dist': pd.to_numeric(col('_distance_from_dc', 0), errors='coerce').fillna(0),
+    })
+    per_trip = info.groupby('Trip', sort=True).agg(
+        region=('region', 'first'), bkk=('bkk', 'any'), zone=('zone', 'first'),
+        province=('province', 'first'), bearing=('bearing', 'mean'), dist=('dist', 'mean'))
+    groups = {}
+    for trip, r in per_trip.iterrows():
+        # ZONE_NEARBY ต้องจังหวัดเดียวกัน → กลุ่มของจังหวัดนั้นเอง
+        nearby = r['zone'].startswith('ZONE_NEARBY')
+        key = (r['region'], 'BKK' if r['bkk'] else '', r['province'] if nearby else '')
+        groups.setdefault(key, []).append((r['bearing'], r['dist'], int(trip)))
+    out = []
+    for key in sorted(groups):
+        members = [t for _, _, t in sorted(groups[key])]
+        for start in range(0, len(members), max_sub_trips):
+            out.append(('/'.join(k for k in key if k) + f"#{start // max_sub_trips + 1}", key[0],
+                        members[start:start + max_sub_trips]))
+    return out
+
+
+def _hint_objective(bins, long_haul, caps):
+    """objective ของทริปจริง (ใช้เทียบกับคำตอบ CP-SAT) — None ถ้ามีทริปที่ผิดกติกา"""
+    total = 0
+    for items in bins:
+        if not items:
+            continue
+        vehicle = pick_vehicle(sum(i['weight'] for i in items), sum(i['cube'] for i in items),
+                               sum(i['drops'] for i in items), min(i['rank'] for i in items),
+                               all(i['punthai'] for i in items), long_haul, caps)
+        if vehicle is None:
+            return None
+        total += VEHICLE_COST_UNITS[vehicle] + DISTRICT_PENALTY * len(set().union(*(i['districts'] for i in items)))
+    return total
+
+
+def solve_subproblem(task):
+    """
+    แก้ปัญหาย่อย 1 กลุ่ม (รันใน worker process ได้ — รับ/คืนเฉพาะ dict/list)
+    task: key, items [(w, c, q, drops, rank, punthai, districts, hint_bin, lat, lon, province)],
+          n_bins, long_haul, caps, max_qty, time_limit
+    คืน dict(key, status, assign (bin ของแต่ละ item หรือ None), objective, seconds)
+    """
+    import time
+    t0 = time.perf_counter()
+    items, n_bins, caps = task['items'], task['n_bins'], task['caps']
+    n = len(items)
+    model = cp_model.CpModel()
+
+    # item i อยู่ได้เฉพาะ bin ≤ i (items เรียงใหญ่ → เล็ก)
+    x = {(i, t): model.NewBoolVar(f'x_{i}_{t}') for i in range(n) for t in range(min(i + 1, n_bins))}
+    active = [model.NewBoolVar(f'active_{t}') for t in range(n_bins)]
+    mixed = [model.NewBoolVar(f'mixed_{t}') for t in range(n_bins)]
+    use = {(t, v): model.NewBoolVar(f'use_{t}_{v}') for t in range(n_bins) for v in VEHICLE_TYPES}
+    both = {(t, v): model.NewBoolVar(f'both_{t}_{v}') for t in range(n_bins) for v in VEHICLE_TYPES}
+    for i in range(n):
+        model.AddExactlyOne(x[i, t] for t in range(min(i + 1, n_bins)))
+
+    # คู่ที่ไกลเกิน (และ greedy ไม่ได้จัดไว้ด้วยกัน) → ห้ามอยู่ทริปเดียวกัน
+    lat = np.array([it[8] for it in items], dtype=float)
+    lon = np.array([it[9] for it in items], dtype=float)
+    far_pairs = []
+    for i in range(n):
+        if lat[i] <= 0:
+            continue
+        phi1, phi2 = np.radians(lat[i]), np.radians(lat[i + 1:])
+        a = (np.sin((phi2 - phi1) / 2) ** 2
+             + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lon[i + 1:] - lon[i]) / 2) ** 2)
+        dist = 2 * 6371 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+        for k in np.nonzero((lat[i + 1:] > 0) & (dist > PAIR_KM_OTHER_PROVINCE))[0].tolist():
+            j = i + 1 + k
+            if items[i][7] == items[j][7]:
+                continue
+            limit = PAIR_KM_SAME_PROVINCE if items[i][10] == items[j][10] else PAIR_KM_OTHER_PROVINCE
+            if dist[k] > limit:
+                far_pairs.append((i, j))
+
+    district_ids = sorted({d for it in items for d in it[6]})
+    objective = []
+    for t in range(n_bins):
+        members = [i for i in range(n) if (i, t) in x]
+        if t + 1 < n_bins:
+            model.Add(active[t] >= active[t + 1])
+        model.Add(sum(use[t, v] for v in VEHICLE_TYPES) == active[t])
+        for i in members:
+            model.AddImplication(x[i, t], active[t])
+        # Punthai ล้วน / ผสม → limit + buffer ต่างกัน (both = รถ v และทริปผสม)
+        non_punthai = [x[i, t] for i in members if not items[i][5]]
+        for lit in non_punthai:
+            model.AddImplication(lit, mixed[t])
+        model.Add(mixed[t] <= sum(non_punthai))
+        for v in VEHICLE_TYPES:
+            model.AddImplication(both[t, v], use[t, v])
+            model.AddImplication(both[t, v], mixed[t])
+            model.AddBoolOr([both[t, v], use[t, v].Not(), mixed[t].Not()])
+            rank = VEHICLE_RANK[v]
+            for i in members:
+                if items[i][4] < rank:
+                    model.AddBoolOr([x[i, t].Not(), use[t, v].Not()])
+            if task['long_haul'] and rank < 3:
+                # เหนือ/ใต้ใช้รถใหญ่สุดที่อนุญาต → รถเล็กกว่า 6W ได้เมื่อมีสาขาที่จำกัดรถระดับนี้เท่านั้น
+                model.Add(use[t, v] <= sum(x[i, t] for i in members if items[i][4] == rank))
+        for k, scale in ((0, 1), (1, 100), (2, 1)):
+            load = sum(int(round(items[i][k if k < 2 else 3] * scale)) * x[i, t] for i in members)
+            cap = []
+            for v in VEHICLE_TYPES:
+                p, m = caps[v][0][k] * scale, caps[v][1][k] * scale
+                cap.append(int(p) * use[t, v] + (int(m) - int(p)) * both[t, v])
+            model.Add(load <= sum(cap))
+        for i, j in far_pairs:
+            if (i, t) in x:
+                model.AddBoolOr([x[i, t].Not(), x[j, t].Not()])
+        if task['max_qty']:
+            model.Add(sum(int(round(items[i][2])) * x[i, t] for i in members) <= int(task['max_qty']))
+        objective.extend(VEHICLE_COST_UNITS[v] * use[t, v] for v in VEHICLE_TYPES)
+        if len(district_ids) > 1:
+            for d in district_ids:
+                lits = [x[i, t] for i in members if d in items[i][6]]
+                if lits:
+                    y = model.NewBoolVar(f'd_{t}_{d}')
+                    for lit in lits:
+                        model.AddImplication(lit, y)
+                    objective.append(DISTRICT_PENALTY * y)
+        else:
+            objective.append(DISTRICT_PENALTY * active[t])
+    model.Minimize(sum(objective))
+
+    # warm start: ทริปของ greedy (bin เรียงตาม item แรกที่อยู่ในทริป)
+    for (i, t), var in x.items():
+        model.AddHint(var, items[i][7] == t)
+    used_bins = {it[7] for it in items}
+    for t in range(n_bins):
+        model.AddHint(active[t], t in used_bins)
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = float(task['time_limit'])
+    solver.parameters.num_search_workers = 1
+    solver.parameters.random_seed = 0
+    status = solver.Solve(model)
+    result = {'key': task['key'], 'status': solver.StatusName(status), 'assign': None, 'objective': None,
+              'seconds': time.perf_counter() - t0}
+    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        result['assign'] = [next(t for t in range(min(i + 1, n_bins)) if solver.Value(x[i, t])) for i in range(n)]
+        result['objective'] = solver.ObjectiveValue()
+    return result
+
+
+def _run_subproblems(tasks, max_workers, log):
+    import multiprocessing
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+    if workers >= 2:
+        try:
+            ctx = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                # ปัญหาใหญ่ก่อน → worker ว่างพร้อมกันมากที่สุด
+                order = sorted(range(len(tasks)), key=lambda k: -len(tasks[k]['items']))
+                futures = {k: pool.submit(solve_subproblem, tasks[k]) for k in order}
+                return [futures[k].result() for k in range(len(tasks))]
+        except Exception as e:
+            log(f"⚠️ CP-SAT แบบขนานไม่สำเร็จ ({e}) → แก้ทีละกลุ่ม")
+    return [solve_subproblem(task) for task in tasks]
+
+
+def optimize_decomposed(greedy_result, limits=None, buffer_punthai=1.0, buffer_maxmart=1.10,
+                        branch_to_group=None, fleet_limits=None, max_qty_per_trip=0,
+                        time_limit_seconds=60, max_workers=None, max_sub_trips=MAX_SUB_TRIPS, log=print):
+    """
+    ปรับผล greedy (predict_trips) ด้วย CP-SAT แบบแยกปัญหาย่อย
+
+    Args:
+        greedy_result: (result_df, summary_df, fleet_used) จาก predict_trips
+        limits: {'punthai': PUNTHAI_LIMITS, 'maxmart': LIMITS}
+        branch_to_group: {code: group_id} จาก branch_groups.json
+        time_limit_seconds: เวลารวมโดยประมาณ (แบ่งให้ปัญหาย่อยตามจำนวน worker)
+
+    Returns:
+        (result_df, summary_df, fleet_used) รูปแบบเดียวกับ predict_trips
+        summary_df.attrs['cpsat'] = รายงานต่อปัญหาย่อย
+    """
+    import os
+    import time
+    from plan_update import rebuild_trips
+
+    t0 = time.perf_counter()
+    limits = limits or {'punthai': PUNTHAI_LIMITS, 'maxmart': LIMITS}
+    df, summary_df, _ = greedy_result
+    df = df.reset_index(drop=True).copy()
+    caps = _vehicle_caps(limits, buffer_punthai, buffer_maxmart)
+    trip_items = _plan_items(df, {str(k).upper(): v for k, v in (branch_to_group or {}).items()})
+    # ทริปของ greedy ที่ผิดกติกาอยู่แล้ว (เกิน limit/รถของสาขา) → คงไว้ ไม่ใส่ในปัญหาย่อย (hint ต้องทำได้)
+    subproblems = []
+    for key, region, trips in decompose_trips(df, max_sub_trips):
+        long_haul = region in LONG_HAUL_REGIONS
+        trips = [t for t in trips if _hint_objective([trip_items.get(t, [])], long_haul, caps) is not None]
+        if len(trips) > 1:
+            subproblems.append((key, long_haul, trips))
+
+    workers = min(max_workers or os.cpu_count() or 1, max(len(subproblems), 1))
+    per_task = max(1.0, time_limit_seconds * workers / max(len(subproblems), 1))
+    tasks, task_items = [], []
+    for key, long_haul, trips in subproblems:
+        items = [it for t in trips for it in trip_items.get(t, [])]
+        items.sort(key=lambda it: (-it['weight'], -it['cube'], it['rows'][0]))
+        trip_of = {id(it): t for t in trips for it in trip_items.get(t, [])}
+        # bin ของ hint = ลำดับของทริปตาม item แรก (ใหญ่สุด) ที่อยู่ในทริปนั้น
+        hint_bin = {}
+        for it in items:
+            hint_bin.setdefault(trip_of[id(it)], len(hint_bin))
+        tasks.append({
+            'key': key,
+            'items': [(it['weight'], it['cube'], it['qty'], it['drops'], it['rank'], it['punthai'],
+                       sorted(it['districts']), hint_bin[trip_of[id(it)]], it['lat'], it['lon'],
+                       it['province']) for it in items],
+            'n_bins': len(trips),
+            'long_haul': long_haul,
+            'caps': caps,
+            'max_qty': max_qty_per_trip,
+            'time_limit': per_task,
+        })
+        task_items.append((trips, items, long_haul))
+
+    log(f"🤖 CP-SAT (decomposed): {len(tasks)} ปัญหาย่อย, {sum(len(t['items']) for t in tasks)} items, "
+        f"{workers} workers, ≤{per_task:.1f}s ต่อกลุ่ม")
+    results = _run_subproblems(tasks, max_workers, log) if tasks else []
+
+    trip_col = df.columns.get_loc('Trip')
+    changed, report = set(), []
+    for (trips, items, long_haul), res in zip(task_items, results):
+        before = _hint_objective([trip_items.get(t, []) for t in trips], long_haul, caps)
+        after = None
+        bins = None
+        if res['assign'] is not None:
+            bins = [[] for _ in trips]
+            for it, b in zip(items, res['assign']):
+                bins[b].append(it)
+            after = _hint_objective(bins, long_haul, caps)
+        accepted = after is not None and (before is None or after < before)
+        report.append({'key': res['key'], 'status': res['status'], 'trips': len(trips), 'items': len(items),
+                       'trips_after': sum(1 for b in bins if b) if accepted else len(trips),
+                       'objective_before': before, 'objective_after': after if accepted else before,
+                       'seconds': round(res['seconds'], 3), 'accepted': accepted})
+        if not accepted:
+            continue
+        # bin ที่ใช้ → เลขทริปเดิมของกลุ่ม (ทริปที่ว่างหายไป)
+        for trip, members in zip(trips, [b for b in bins if b]):
+            for it in members:
+                df.iloc[it['rows'], trip_col] = trip
+        changed.update(trips)
+
+    if changed:
+        df, summary_df, fleet_used = rebuild_trips(df, summary_df, changed, limits, buffer_punthai, buffer_maxmart,
+                                                   max_qty_per_trip, fleet_limits)
+    else:
+        # ไม่มีกลุ่มไหนดีขึ้น → คืนผล greedy เดิมทั้งชุด
+        df, summary_df, fleet_used = greedy_result
+
+    trips_before = sum(r['trips'] for r in report)
+    trips_after = sum(r['trips_after'] for r in report)
+    seconds = time.perf_counter() - t0
+    summary_df.attrs['cpsat'] = {
+        'subproblems': report,
+        'improved': sum(r['accepted'] for r in report),
+        'trips_before': trips_before,
+        'trips_after': trips_after,
+        'trucks_saved': trips_before - trips_after,
+        'seconds': round(seconds, 3),
+    }
+    log(f"🤖 CP-SAT: ปรับได้ {sum(r['accepted'] for r in report)}/{len(report)} กลุ่ม, "
+        f"ทริป {trips_before} → {trips_after} ({seconds:.1f}s)")
+    return df, summary_df, fleet_used
+
+
 if __name__ == "__main__":
     print("🤖 OR-Tools Trip Optimizer Module")
     print("   Import this module to use: from ortools_vrp import predict_trips_ortools")
@@ -0,0 +1,279 @@
+"""
+OSRM Client — client เดียวของ OSRM ทั้งโปรเจกต์ (แทน requests.get ทีละคู่ที่เปิด connection ใหม่ทุกครั้ง)
+
+  - requests.Session แบบ keep-alive (HTTPAdapter pool ขนาดเท่าจำนวน worker)
+  - rate limit ต่อ host (public server ห้าม flood) + exponential backoff เมื่อ 429 / 5xx / timeout
+    (เคารพ Retry-After ของ server)
+  - ต่อ host ไม่ได้ (ไม่มีเน็ต / DNS) → พัก host นั้น DOWN_SECONDS วินาที คืน None ทันทีไม่รอ timeout ซ้ำ
+  - route_legs(points): เส้นทางผ่านทุกจุด แยก geometry + ระยะรายช่วง (steps=true) — เกิน max_coords
+    แบ่งเป็นหลาย /route (จุดต่อคาบเกี่ยวกัน) รันพร้อมกัน
+  - table(): sources × destinations แตกเป็นหลาย /table call (ไม่เกิน max_coords พิกัดต่อ call)
+    รันพร้อมกันใน thread pool
+  - matrices(groups): N×N ของหลายกลุ่ม (เช่นสาขาในแต่ละจังหวัด) พร้อมกัน
+  - distances(pairs): หลายคู่ → /table ชุดเดียว (จัดกลุ่มตามต้นทาง/ปลายทาง)
+  - distance(a, b): คู่เดียว — ส่งทันทีถ้าไม่มีคำขอค้าง; คำขอที่ cache miss เข้ามาระหว่าง /table ก่อนหน้ายังไม่กลับ
+    ถูกรวมเป็น /table call ถัดไปชุดเดียว (ไม่มีการหน่วงเวลารอ)
+
+พิกัดทุกเมธอดเป็น (lat, lon) — แปลงเป็น lon,lat ของ OSRM ให้เอง | ระยะทางคืนเป็น km
+"""
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_BASE_URL = os.environ.get('OSRM_BASE_URL', 'http://router.project-osrm.org')
+MAX_COORDS = 100          # public server รับพิกัดต่อ request ได้ ~100
+RATE_PER_SECOND = 5.0     # request ต่อวินาทีต่อ host
+RETRY_STATUS = (429, 500, 502, 503, 504)
+DOWN_SECONDS = 30.0       # ต่อ host ไม่ได้ → ไม่ลองใหม่ภายในเวลานี้
+
+
+def _lonlat(points):
+    return ';'.join(f"{lon},{lat}" for lat, lon in points)
+
+
+class _HostLimiter:
+    """เว้นระยะ request ต่อ host ≥ 1/rate_per_s วินาที (ใช้ร่วมทุก thread)"""
+
+    def __init__(self, rate_per_s):
+        self.interval = 1.0 / rate_per_s if rate_per_s and rate_per_s > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = {}
+        self._down_until = {}
+
+    def wait(self, host):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, 0.0))
+            self._next[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def is_down(self, host):
+        return time.monotonic() < self._down_until.get(host, 0.0)
+
+    def mark_down(self, host, seconds):
+        self._down_until[host] = time.monotonic() + seconds
+
+
+class OsrmClient:
+    """OSRM route / table ผ่าน session + thread pool เดียว (ใช้ร่วมได้ทุก thread)"""
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, profile='driving', max_coords=MAX_COORDS, max_workers=4,
+                 rate_per_s=RATE_PER_SECOND, timeout=10, retries=2, backoff=0.5, down_seconds=DOWN_SECONDS):
+        self.base_url = base_url.rstrip('/')
+        self.host = urlsplit(self.base_url).netloc
+        self.profile = profile
+        self.max_coords = max(2, int(max_coords))
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.down_seconds = down_seconds
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, max_workers))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._limiter = _HostLimiter(rate_per_s)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='osrm')
+        self._lock = threading.Lock()
+        self._pending = {}     # (a, b) → Future ที่รอ /table ถัดไป
+        self._in_flight = False   # มี /table ของ distance() ค้างอยู่
+        self.stats = Counter()
+
+    # ------------------------------------------------------------------
+    def _get(self, service, points, params=None, timeout=None, retries=None):
+        """GET /{service}/v1/{profile}/{coords} → JSON (code == 'Ok') หรือ None"""
+        if self._limiter.is_down(self.host):
+            self.stats['skipped_down'] += 1
+            return None
+        url = f"{self.base_url}/{service}/v1/{self.profile}/{_lonlat(points)}"
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            self._limiter.wait(self.host)
+            self.stats['requests'] += 1
+            wait = self.backoff * (2 ** attempt)
+            try:
+                r = self.session.get(url, params=params, timeout=timeout or self.timeout)
+            except requests.Timeout:
+                self.stats['timeouts'] += 1
+            except requests.RequestException:
+                # ต่อไม่ได้เลย → พัก host (ไม่ให้ทุก cache miss รอ timeout ซ้ำ)
+                self.stats['connection_errors'] += 1
+                self._limiter.mark_down(self.host, self.down_seconds)
+                return None
+            else:
+                if r.status_code not in RETRY_STATUS:
+                    try:
+                        data = r.json()
+                    except ValueError:
+                        data = {}
+                    if data.get('code') == 'Ok':
+                        return data
+                    self.stats['not_ok'] += 1
+                    return None  # NoRoute / InvalidQuery ลองใหม่ก็ได้ผลเดิม
+                self.stats[f'http_{r.status_code}'] += 1
+                retry_after = r.headers.get('Retry-After')
+                if retry_after and retry_after.isdigit():
+                    wait = max(wait, float(retry_after))
+            if attempt < retries:
+                self.stats['retries'] += 1
+                time.sleep(wait)
+        self.stats['failures'] += 1
+        return None
+
+    def route(self, points, timeout=None, retries=None):
+        """
+        เส้นทางผ่านทุกจุดตามลำดับ → (coords [[lat, lon], ...], distance_km) หรือ None
+        """
+        data = self._get('route', points, {'overview': 'full', 'geometries': 'geojson'}, timeout, retries)
+        if not data or not data.get('routes'):
+            return None
+        route = data['routes'][0]
+        coords = [[lat, lon] for lon, lat in route['geometry']['coordinates']]
+        return coords, route.get('distance', 0) / 1000.0
+
+    def _route_legs_block(self, points, timeout, retries):
+        data = self._get('route', points, {'overview': 'false', 'steps': 'true', 'geometries': 'geojson'},
+                         timeout, retries)
+        if not data or not data.get('routes'):
+            return [None] * (len(points) - 1)
+        out = []
+        for leg in data['routes'][0].get('legs', []):
+            coords = []
+            for step in leg.get('steps', []):
+                for lon, lat in step['geometry']['coordinates']:
+                    if not coords or coords[-1] != [lat, lon]:
+                        coords.append([lat, lon])
+            out.append((coords, leg.get('distance', 0) / 1000.0))
+        return out if len(out) == len(points) - 1 else [None] * (len(points) - 1)
+
+    def route_legs(self, points, timeout=None, retries=None):
+        """
+        เส้นทางผ่านทุกจุดตามลำดับ แยกรายช่วง → [(coords [[lat, lon], ...], distance_km) | None, ...]
+        (ยาว len(points) - 1) — block ที่ล้มเหลว = None ทุกช่วงใน block
+        """
+        points = [tuple(p) for p in points]
+        if len(points) < 2:
+            return []
+        step = self.max_coords - 1
+        futures = [self._pool.submit(self._route_legs_block, points[i:i + self.max_coords], timeout, retries)
+                   for i in range(0, len(points) - 1, step)]
+        out = []
+        for fut in futures:
+            out.extend(fut.result())
+        return out
+
+    def _table_block(self, sources, destinations, timeout, retries):
+        points = list(sources) + list(destinations)
+        params = {
+            'sources': ';'.join(str(i) for i in range(len(sources))),
+            'destinations': ';'.join(str(i) for i in range(len(sources), len(points))),
+            'annotations': 'distance',
+        }
+        data = self._get('table', points, params, timeout, retries)
+        if not data:
+            return None
+        return [[v / 1000.0 if v else None for v in row] for row in data['distances']]
+
+    def table(self, sources, destinations=None, timeout=None, retries=None):
+        """
+        ระยะถนน (km) sources × destinations (ไม่ระบุ destinations = N×N ของ sources)
+        แตกเป็น block ไม่เกิน max_coords พิกัด รันพร้อมกัน — block ที่ล้มเหลว = None ทั้ง block
+        """
+        sources = list(sources)
+        if destinations is None:
+            if len(sources) <= self.max_coords:
+                km = self.matrices([sources], timeout, retries)[0]
+                return km if km is not None else [[None] * len(sources) for _ in sources]
+            destinations = sources
+        destinations = list(destinations)
+        out = [[None] * len(destinations) for _ in sources]
+        if not sources or not destinations:
+            return out
+        if len(sources) + len(destinations) <= self.max_coords:
+            s_size, d_size = len(sources), len(destinations)
+        else:
+            s_size = min(len(sources), max(1, self.max_coords // 2))
+            d_size = self.max_coords - s_size
+        blocks = {}
+        for si in range(0, len(sources), s_size):
+            for di in range(0, len(destinations), d_size):
+                blocks[(si, di)] = self._pool.submit(
+                    self._table_block, sources[si:si + s_size], destinations[di:di + d_size], timeout, retries)
+        for (si, di), fut in blocks.items():
+            km = fut.result()
+            if km is None:
+                continue
+            for i, row in enumerate(km):
+                out[si + i][di:di + len(row)] = row
+        return out
+
+    def matrices(self, groups, timeout=None, retries=None):
+        """N×N ของหลายกลุ่มพิกัด (แต่ละกลุ่ม ≤ max_coords) รันพร้อมกัน → list ของ matrix (None = ล้มเหลว)"""
+        def _one(points):
+            data = self._get('table', points, {'annotations': 'distance'}, timeout, retries)
+            if not data:
+                return None
+            return [[v / 1000.0 if v else None for v in row] for row in data['distances']]
+        futures = [self._pool.submit(_one, list(points)) for points in groups]
+        return [f.result() for f in futures]
+
+    def distances(self, pairs, timeout=None, retries=None):
+        """ระยะถนน (km) ของหลายคู่ [(a, b), ...] ผ่าน /table ชุดเดียว → list (None = ไม่ได้ผล)"""
+        pairs = list(pairs)
+        if not pairs:
+            return []
+        sources = list(dict.fromkeys(a for a, _ in pairs))
+        destinations = list(dict.fromkeys(b for _, b in pairs))
+        s_index = {p: i for i, p in enumerate(sources)}
+        d_index = {p: i for i, p in enumerate(destinations)}
+        km = self.table(sources, destinations, timeout, retries)
+        return [km[s_index[a]][d_index[b]] for a, b in pairs]
+
+    def distance(self, a, b, timeout=None):
+        """
+        ระยะถนน (km) คู่เดียว (None = ไม่ได้ผล)
+        ไม่มี /table ค้างอยู่ → ส่งทันทีใน thread นี้ | มีค้างอยู่ → รอรวมกับคำขออื่นเป็น /table ถัดไป
+        """
+        key = (tuple(a), tuple(b))
+        with self._lock:
+            fut = self._pending.get(key)
+            if fut is None:
+                fut = Future()
+                self._pending[key] = fut
+            else:
+                self.stats['coalesced'] += 1
+            lead = not self._in_flight
+            if lead:
+                self._in_flight = True
+        if lead:
+            self._flush(timeout)
+        return fut.result()
+
+    def _flush(self, timeout):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                self._in_flight = False
+                return
+        keys = list(pending)
+        try:
+            results = self.distances(keys, timeout=timeout)
+        except Exception:
+            results = [None] * len(keys)
+        self.stats['batched_pairs'] += len(keys)
+        for key, km in zip(keys, results):
+            pending[key].set_result(km)
+        # คำขอที่เข้ามาระหว่างรอ → ส่งเป็น /table ถัดไปใน thread แยก (thread นี้คืนผลของตัวเองได้เลย)
+        with self._lock:
+            if not self._pending:
+                self._in_flight = False
+                return
+        threading.Thread(target=self._flush, args=(timeout,), daemon=True, name='osrm-coalesce').start()
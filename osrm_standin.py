@@ -0,0 +1,205 @@
+"""
+OSRM Stand-in — HTTP server เล็กๆ ที่ตอบ /route และ /table แบบ OSRM (สำหรับรัน offline / benchmark / ทดสอบ)
+
+ระยะทาง = เส้นตรง (great circle) × road factor → ผลเหมือนเดิมทุกครั้ง (deterministic)
+เส้นทาง (geometry) = ลากตรงระหว่างจุด แบ่งแต่ละช่วงเป็น SEGMENT_POINTS จุด
+จำลองความหน่วง (latency) และความล้มเหลว (503 + Retry-After / timeout) ได้ — สุ่มด้วย seed คงที่
+เกินจำนวนพิกัดต่อ request → code 'TooBig' เหมือน server จริง
+
+    python osrm_standin.py [--port 5001] [--latency 0.05] [--failure-rate 0.1] [--seed 42]
+                           [--factor 1.35] [--max-coords 100] [--speed 40]
+
+    server = start_standin(latency_s=0.02)   # ใน process เดียวกัน (daemon thread)
+    server.url  → 'http://127.0.0.1:<port>'
+"""
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from distance_store import ROAD_FACTOR
+from spatial_index import great_circle_km
+
+DEFAULT_PORT = 5001
+SEGMENT_POINTS = 4          # จุดต่อช่วงของ geometry (รวมต้นทาง)
+DEFAULT_SPEED_KMH = 40.0    # สำหรับ duration
+
+
+class StandinConfig:
+    """ค่าตั้งของ stand-in (แก้ระหว่างรันได้ เช่น เปิดความล้มเหลวกลางการทดสอบ)"""
+
+    def __init__(self, latency_s=0.0, failure_rate=0.0, seed=42, factor=ROAD_FACTOR,
+                 max_coords=100, speed_kmh=DEFAULT_SPEED_KMH):
+        self.latency_s = float(latency_s)
+        self.failure_rate = float(failure_rate)
+        self.factor = float(factor)
+        self.max_coords = int(max_coords)
+        self.speed_kmh = float(speed_kmh)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            fail = self.failure_rate > 0 and self.rng.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+            return fail
+
+
+def _parse_coords(text):
+    """'lon,lat;lon,lat' → [(lat, lon), ...]"""
+    out = []
+    for part in text.split(';'):
+        lon, lat = part.split(',')
+        out.append((float(lat), float(lon)))
+    return out
+
+
+def _indices(value, n):
+    if not value or value[0] == 'all':
+        return list(range(n))
+    return [int(i) for i in value[0].split(';')]
+
+
+def _km_matrix(config, src, dst):
+    lats = np.array([p[0] for p in dst], dtype=np.float64)
+    lons = np.array([p[1] for p in dst], dtype=np.float64)
+    return [great_circle_km(lat, lon, lats, lons) * config.factor for lat, lon in src]
+
+
+def route_response(config, points, steps=False):
+    """JSON ของ /route — geometry ลากตรง, distance/duration ตามระยะ × factor (steps → geometry รายช่วง)"""
+    coords = []
+    legs = []
+    for a, b in zip(points, points[1:]):
+        km = float(_km_matrix(config, [a], [b])[0][0])
+        leg = {'distance': km * 1000, 'duration': km / config.speed_kmh * 3600}
+        leg_coords = [[a[1] + (b[1] - a[1]) * k / SEGMENT_POINTS, a[0] + (b[0] - a[0]) * k / SEGMENT_POINTS]
+                      for k in range(SEGMENT_POINTS)]
+        coords.extend(leg_coords)
+        if steps:
+            # เหมือน OSRM: step เดินทาง + step 'arrive' (จุดเดียว) ท้ายช่วง
+            end = [b[1], b[0]]
+            leg['steps'] = [
+                {'distance': leg['distance'], 'geometry': {'type': 'LineString', 'coordinates': leg_coords + [end]}},
+                {'distance': 0, 'geometry': {'type': 'LineString', 'coordinates': [end, end]}},
+            ]
+        legs.append(leg)
+    coords.append([points[-1][1], points[-1][0]])
+    distance = sum(leg['distance'] for leg in legs)
+    return {
+        'code': 'Ok',
+        'routes': [{
+            'distance': distance,
+            'duration': sum(leg['duration'] for leg in legs),
+            'geometry': {'type': 'LineString', 'coordinates': coords},
+            'legs': legs,
+        }],
+        'waypoints': [{'location': [lon, lat]} for lat, lon in points],
+    }
+
+
+def table_response(config, points, sources, destinations, annotations):
+    """JSON ของ /table — distances (m) / durations (s) ตามที่ขอใน annotations"""
+    km = _km_matrix(config, [points[i] for i in sources], [points[j] for j in destinations])
+    body = {'code': 'Ok'}
+    if 'distance' in annotations:
+        body['distances'] = [[round(float(v) * 1000, 1) for v in row] for row in km]
+    if 'duration' in annotations:
+        body['durations'] = [[round(float(v) / config.speed_kmh * 3600, 1) for v in row] for row in km]
+    return body
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    server_version = 'OSRMStandin/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        config = self.server.config
+        if config.latency_s:
+            time.sleep(config.latency_s)
+        if config.should_fail():
+            self._send(503, {'code': 'Unavailable', 'message': 'stand-in failure'}, {'Retry-After': '0'})
+            return
+        url = urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        # /{service}/v1/{profile}/{coords}
+        if len(parts) != 4 or parts[1] != 'v1' or parts[0] not in ('route', 'table'):
+            self._send(400, {'code': 'InvalidUrl', 'message': self.path})
+            return
+        try:
+            points = _parse_coords(parts[3])
+        except ValueError:
+            self._send(400, {'code': 'InvalidQuery', 'message': 'bad coordinates'})
+            return
+        if len(points) > config.max_coords:
+            self._send(400, {'code': 'TooBig', 'message': f'max {config.max_coords} coordinates'})
+            return
+        query = parse_qs(url.query)
+        if parts[0] == 'route':
+            if len(points) < 2:
+                self._send(400, {'code': 'InvalidQuery', 'message': 'need 2 coordinates'})
+                return
+            steps = query.get('steps', ['false'])[0] == 'true'
+            self._send(200, route_response(config, points, steps))
+            return
+        annotations = query.get('annotations', ['duration'])[0].split(',')
+        self._send(200, table_response(config, points, _indices(query.get('sources'), len(points)),
+                                       _indices(query.get('destinations'), len(points)), annotations))
+
+
+def start_standin(host='127.0.0.1', port=0, **config):
+    """เปิด stand-in ใน daemon thread → server (server.url, server.config) | port=0 = เลือก port ว่างให้"""
+    server = ThreadingHTTPServer((host, port), StandinHandler)
+    server.daemon_threads = True
+    server.config = StandinConfig(**config)
+    server.url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True, name='osrm-standin').start()
+    return server
+
+
+def main(argv):
+    opts = {}
+    i = 0
+    while i < len(argv):
+        if argv[i].startswith('--') and i + 1 < len(argv):
+            opts[argv[i][2:]] = argv[i + 1]
+            i += 1
+        i += 1
+    server = ThreadingHTTPServer(('0.0.0.0', int(opts.get('port', DEFAULT_PORT))), StandinHandler)
+    server.config = StandinConfig(
+        latency_s=float(opts.get('latency', 0)), failure_rate=float(opts.get('failure-rate', 0)),
+        seed=int(opts.get('seed', 42)), factor=float(opts.get('factor', ROAD_FACTOR)),
+        max_coords=int(opts.get('max-coords', 100)), speed_kmh=float(opts.get('speed', DEFAULT_SPEED_KMH)),
+    )
+    print(f"🧪 OSRM stand-in: http://127.0.0.1:{server.server_address[1]} "
+          f"(latency {server.config.latency_s}s, failure {server.config.failure_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n⏹️ หยุด — {server.config.requests:,} requests, ล้มเหลว {server.config.failures:,}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,243 @@
+"""
+Parallel Planner — จัดทริปแยกตามภาคใน process pool แล้วรวมผลแบบ deterministic
+
+ทริปไม่เคยข้ามภาค (Step 6.7 REGION AUDIT / Step 8.8 แยกทริปปนภาค + กรุงเทพฯ ออกอยู่แล้ว)
+จึงแบ่งออเดอร์ตามภาค (+ กรุงเทพฯ แยกเป็นกลุ่มของตัวเอง) แล้วรัน predict_trips ทั้งชุดต่อกลุ่ม
+ใน ProcessPoolExecutor (spawn — แต่ละ worker import app เอง ไม่ fork process ของ Streamlit)
+master data + index ส่งจาก process หลักผ่าน pool initializer (PlannerContext.snapshot)
+→ worker ไม่ต่อ Google Sheets / ไม่โหลด master + สร้าง index ซ้ำ
+
+รวมผล:
+- เลขทริปต่อกันตามลำดับ key ของกลุ่ม (ไม่ขึ้นกับว่า worker ไหนเสร็จก่อน)
+- เรียงเลขทริปใหม่ทั้งชุดแบบ Step 9 (ไกล DC ก่อน, เสมอกัน → ตามลำดับที่พบ)
+- ทุกกลุ่มรันแบบไม่จำกัดรถ แล้ว reconcile fleet_limits รวมทีเดียว
+  (กติกาเดียวกับ Step 7: โควต้าเต็ม → upgrade รถใหญ่ขึ้นถ้าสาขาอนุญาต ไม่งั้น ⚠️ เกินโควต้า)
+
+ผลไม่จำเป็นต้องเหมือนโหมดปกติทุกทริป (greedy เห็นสาขาเฉพาะในภาคเดียวกัน) → เปิดใช้เมื่อเลือกเท่านั้น
+"""
+import importlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+from local_search import combine_reports
+from plan_cancel import CancelToken, PlanningCancelled, combine_reports as combine_cancel_reports
+from planner_profiler import PlannerProfiler, mark as profile_mark
+
+# ข้อมูลน้อยกว่านี้ → รันแบบปกติ (ค่า spawn + import app ของ worker ไม่คุ้ม)
+MIN_PARALLEL_ROWS = 300
+
+VEHICLE_RANK = {'4W': 1, 'JB': 2, '6W': 3}
+RANK_VEHICLE = {1: '4W', 2: 'JB', 3: '6W'}
+CANCEL_POLL_S = 0.5       # process หลักตรวจปุ่ม Cancel ระหว่างรอ worker ทุกกี่วินาที
+
+_cancel_event = None      # ใน worker: multiprocessing.Event ร่วมกับ process หลัก (ตั้งตอนสร้าง worker)
+_worker_context = None    # ใน worker: (values, versions) ของ PlannerContext จาก process หลัก
+
+
+def _init_worker(cancel_event, context=None):
+    global _cancel_event, _worker_context
+    _cancel_event = cancel_event
+    _worker_context = context
+    if context is not None:
+        importlib.import_module('app')   # สร้าง context จาก snapshot ครั้งเดียวตอนเริ่ม worker
+
+
+def worker_context():
+    """snapshot ของ PlannerContext ที่ process หลักส่งมา (None = ไม่ใช่ worker → app build เอง)"""
+    return _worker_context
+
+
+def _plan_partition(key, part_df, model_data, options):
+    """รันใน worker process: predict_trips ของกลุ่มเดียว (หยุดตาม deadline เดียวกัน / Cancel ของ process หลัก)"""
+    import app
+    options = dict(options)
+    token = CancelToken(options.pop('deadline_s', None), event=_cancel_event)
+    t0 = time.perf_counter()
+    df, summary_df, _ = app.predict_trips(part_df, model_data, cancel=token, **options)
+    return key, df, summary_df, summary_df.attrs.get('planner_profile', []), time.perf_counter() - t0
+
+
+def _truck_head(value):
+    return str(value).split()[0] if pd.notna(value) and str(value).strip() else ''
+
+
+def step9_trip_order(df):
+    """
+    ลำดับทริปของ Step 9 (ใช้ทั้ง predict_trips และ merge_partitions)
+    ไกล DC ก่อน (sorted เป็น stable → เสมอกันใช้ลำดับที่พบใน df)
+    คืน (เลขทริปเดิมตามลำดับใหม่, {trip: ระยะไกลสุด})
+    """
+    assigned = df[df['Trip'] > 0]
+    appearance = pd.unique(assigned['Trip']).tolist()
+    if '_distance_from_dc' in df.columns:
+        max_dist = assigned.groupby('Trip')['_distance_from_dc'].max().fillna(0).to_dict()
+    else:
+        max_dist = {}
+    max_dist = {t: max_dist.get(t, 0) for t in appearance}
+    return sorted(appearance, key=lambda t: -max_dist[t]), max_dist
+
+
+def merge_partitions(results):
+    """
+    results = [(key, df, summary_df), ...] เรียงตาม key
+    → (df, summary_df) เลขทริปรวมกัน + เรียงใหม่แบบ Step 9
+    """
+    frames, summaries = [], []
+    offset = 0
+    for _, df, summary_df in results:
+        df = df.copy()
+        trips = df['Trip'].where(df['Trip'] > 0, 0).astype('int64')
+        df['Trip'] = trips.where(trips == 0, trips + offset)
+        summary_df = summary_df.copy()
+        if not summary_df.empty:
+            summary_df['Trip'] = summary_df['Trip'].astype('int64') + offset
+        offset = max(offset, int(df['Trip'].max()) if len(df) else offset)
+        frames.append(df)
+        summaries.append(summary_df)
+    df = pd.concat(frames, ignore_index=True)
+    summary_df = pd.concat([s for s in summaries if not s.empty], ignore_index=True) if any(
+        not s.empty for s in summaries) else pd.DataFrame()
+
+    ordered, _ = step9_trip_order(df)
+    renumber = {old: new for new, old in enumerate(ordered, 1)}
+    df['Trip'] = df['Trip'].map(lambda t: renumber.get(t, 0)).astype('int64')
+    if not summary_df.empty:
+        summary_df['Trip'] = summary_df['Trip'].map(renumber)
+        summary_df = summary_df.dropna(subset=['Trip'])
+        summary_df['Trip'] = summary_df['Trip'].astype('int64')
+        summary_df = summary_df.sort_values('Trip').reset_index(drop=True)
+
+    if '_distance_from_dc' in df.columns:
+        df = df.sort_values(['Trip', '_distance_from_dc'], ascending=[True, False], kind='stable').reset_index(drop=True)
+    else:
+        df = df.sort_values('Trip', kind='stable').reset_index(drop=True)
+    return df, summary_df
+
+
+def reconcile_fleet(df, summary_df, fleet_limits, limits):
+    """
+    บังคับ fleet_limits รวมทุกกลุ่ม (ทริปเลขน้อย = ไกลสุด ได้โควต้าก่อน)
+    limits = {'punthai': PUNTHAI_LIMITS, 'maxmart': LIMITS} ใช้คำนวณ utilization ของรถใหม่
+    คืน fleet_used {'4W': n, 'JB': n, '6W': n}
+    """
+    fleet_limits = fleet_limits or {'4W': 999, 'JB': 999, '6W': 999}
+    fleet_used = {'4W': 0, 'JB': 0, '6W': 0}
+    if summary_df.empty:
+        return fleet_used
+    max_rank = {}
+    if '_max_vehicle' in df.columns:
+        ranks = df.loc[df['Trip'] > 0, ['Trip', '_max_vehicle']]
+        max_rank = ranks.groupby('Trip')['_max_vehicle'].agg(
+            lambda s: min(VEHICLE_RANK.get(v, 3) for v in s)).to_dict()
+    truck_col = df.columns.get_loc('Truck') if 'Truck' in df.columns else None
+
+    for i, row in summary_df.iterrows():
+        trip = int(row['Trip'])
+        truck = _truck_head(row['Truck']) or '6W'
+        vehicle, rank = truck, VEHICLE_RANK.get(truck, 3)
+        note = ''
+        while fleet_used.get(vehicle, 0) >= fleet_limits.get(vehicle, 999):
+            if rank + 1 <= 3 and rank + 1 <= max_rank.get(trip, 3):
+                rank += 1
+                vehicle = RANK_VEHICLE[rank]
+            else:
+                note = ' ⚠️ เกินโควต้า'
+                break
+        fleet_used[vehicle] = fleet_used.get(vehicle, 0) + 1
+        if vehicle == truck and not note:
+            continue
+
+        rest = str(row['Truck'])[len(truck):] if pd.notna(row['Truck']) else ''
+        if vehicle != truck:
+            note = f" ↑ Fleet({truck}→{vehicle})" + note
+        new_truck = f"{vehicle}{rest}{note}"
+        summary_df.at[i, 'Truck'] = new_truck
+        lim = limits.get('punthai' if row.get('BU_Type') == 'punthai' else 'maxmart', {}).get(vehicle)
+        if lim:
+            summary_df.at[i, 'Weight_Use%'] = (row['Weight'] / lim['max_w']) * 100
+            summary_df.at[i, 'Cube_Use%'] = (row['Cube'] / lim['max_c']) * 100
+        if truck_col is not None:
+            df.iloc[(df['Trip'] == trip).to_numpy().nonzero()[0], truck_col] = new_truck
+    return fleet_used
+
+
+def plan_parallel(test_df, model_data, partitions, serial, punthai_buffer=1.0, maxmart_buffer=1.10,
+                  fleet_limits=None, max_qty_per_trip=0, max_workers=None, limits=None, log=print,
+                  improve_seconds=0, deadline_s=None, cancel=None, context=None):
+    """
+    partitions = [(key, positions), ...] แบ่งแถวของ test_df (จาก app.planning_partitions)
+    serial     = predict_trips แบบปกติ (ใช้เมื่อแบ่งแล้วได้กลุ่มเดียว / ข้อมูลน้อย / pool ล้มเหลว)
+    deadline_s = เวลาที่เหลือของงาน → ทุก worker ได้ deadline เดียวกัน
+    cancel     = CancelToken ของงาน → หยุดแล้ว (กด Cancel) ส่งต่อให้ทุก worker ผ่าน multiprocessing.Event
+    context    = ฟังก์ชันคืน snapshot ของ PlannerContext (เรียกเมื่อจะสร้าง pool จริงเท่านั้น)
+    คืน (df, summary_df, fleet_used) เหมือน predict_trips
+    """
+    options = dict(punthai_buffer=punthai_buffer, maxmart_buffer=maxmart_buffer,
+                   fleet_limits=None, max_qty_per_trip=max_qty_per_trip, improve_seconds=improve_seconds,
+                   deadline_s=deadline_s)
+    partitions = [(key, pos) for key, pos in partitions if len(pos)]
+    workers = min(max_workers or os.cpu_count() or 1, len(partitions))
+    if workers < 2 or len(test_df) < MIN_PARALLEL_ROWS:
+        return serial(test_df, model_data, punthai_buffer=punthai_buffer, maxmart_buffer=maxmart_buffer,
+                      fleet_limits=fleet_limits, max_qty_per_trip=max_qty_per_trip,
+                      improve_seconds=improve_seconds, deadline_s=deadline_s)
+
+    prof = PlannerProfiler()
+    with prof.activate():
+        profile_mark('Parallel partition', rows=len(test_df))
+        parts = [(key, test_df.iloc[pos].reset_index(drop=True)) for key, pos in partitions]
+        log(f"⚡ จัดทริปแบบขนาน: {len(parts)} กลุ่ม, {workers} workers "
+            + ', '.join(f"{'/'.join(k)}={len(p)}" for k, p in parts))
+
+        profile_mark('Parallel workers', rows=len(test_df))
+        try:
+            ctx = multiprocessing.get_context('spawn')
+            cancel_event = ctx.Event()
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                     initializer=_init_worker,
+                                     initargs=(cancel_event, context() if context else None)) as pool:
+                # ส่งกลุ่มใหญ่ก่อน → worker ว่างพร้อมกันมากที่สุด
+                futures = [pool.submit(_plan_partition, key, part, model_data, options)
+                           for key, part in sorted(parts, key=lambda kp: -len(kp[1]))]
+                pending = set(futures)
+                while pending:
+                    finished, pending = wait(pending, timeout=CANCEL_POLL_S, return_when=FIRST_EXCEPTION)
+                    if any(f.exception() is not None for f in finished):
+                        break
+                    if cancel is not None and cancel.stopped and not cancel_event.is_set():
+                        cancel_event.set()
+                done = {f.result()[0]: f.result() for f in futures}
+        except PlanningCancelled:
+            raise  # หมดเวลาก่อนมีแผน → จัดแบบปกติก็ไม่ทันเหมือนกัน
+        except Exception as e:
+            log(f"⚠️ จัดแบบขนานไม่สำเร็จ ({e}) → จัดแบบปกติ")
+            return serial(test_df, model_data, punthai_buffer=punthai_buffer, maxmart_buffer=maxmart_buffer,
+                          fleet_limits=fleet_limits, max_qty_per_trip=max_qty_per_trip,
+                          improve_seconds=improve_seconds, deadline_s=deadline_s)
+
+        profile_mark('Parallel merge + fleet', rows=len(test_df))
+        ordered = [done[key] for key, _ in parts]
+        df, summary_df = merge_partitions([(key, d, s) for key, d, s, _, _ in ordered])
+        fleet_used = reconcile_fleet(df, summary_df, fleet_limits, limits or {})
+
+    summary_df.attrs['planner_profile'] = prof.to_records()
+    reports = [s.attrs['local_search'] for _, _, s, _, _ in ordered if 'local_search' in s.attrs]
+    if reports:
+        summary_df.attrs['local_search'] = combine_reports(reports)
+    cancelled = combine_cancel_reports([s.attrs.get('cancelled') for _, _, s, _, _ in ordered])
+    if cancelled:
+        if cancel is not None and cancel.reason:
+            cancelled['reason'] = cancel.reason   # เหตุผลจริงของงาน (worker เห็นแค่ event)
+        summary_df.attrs['cancelled'] = cancelled
+    summary_df.attrs['partition_profiles'] = {
+        '/'.join(key): {'rows': len(d), 'seconds': round(sec, 3), 'phases': phases}
+        for key, d, _, phases, sec in ordered
+    }
+    log(prof.report())
+    for key, d, _, _, sec in ordered:
+        log(f"   {sec:7.2f}s  {'/'.join(key)} ({len(d):,} แถว)")
+    return df, summary_df, fleet_used
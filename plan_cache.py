@@ -0,0 +1,181 @@
+"""
+Plan Cache — เก็บผล predict_trips ตาม hash ของ input → กดจัดเที่ยวซ้ำ / refresh หน้าเว็บ ได้ผลทันที
+
+key = sha256 ของ
+  - ตารางออเดอร์ที่ normalize แล้ว (Code, BU, Weight, Cube, OriginalQty, พื้นที่, พิกัด — ตามลำดับแถว)
+  - พารามิเตอร์ (punthai_buffer, maxmart_buffer, fleet_limits, max_qty_per_trip, ...)
+  - version ของ master data / zone / group และโค้ด planner (ผู้เรียกส่งมา)
+
+ชั้นเก็บ:
+  - memory: LRU (OrderedDict) จำนวนจำกัด
+  - disk:   <dir>/<key>.pkl จำกัดขนาดรวม → ลบไฟล์ที่ใช้ล่าสุดนานสุดก่อน (mtime = เวลาใช้ล่าสุด)
+get() คืนสำเนา DataFrame เสมอ (ผู้เรียกแก้ผลได้โดยไม่กระทบ cache)
+"""
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+DEFAULT_CACHE_DIR = 'plan_cache'
+DEFAULT_MAX_ITEMS = 8
+DEFAULT_MAX_DISK_MB = 256
+
+# คอลัมน์ที่มีผลต่อการจัดทริป (มีเท่าที่มีใน df)
+KEY_COLUMNS = ['Code', 'BU', 'Weight', 'Cube', 'OriginalQty', 'Province', 'District', 'Subdistrict',
+               'Route', 'Latitude', 'Longitude']
+_NUMERIC_COLUMNS = {'Weight', 'Cube', 'OriginalQty', 'Latitude', 'Longitude'}
+
+
+def frame_fingerprint(df):
+    """hash ของออเดอร์ (ไม่ขึ้นกับ index/dtype/คอลัมน์อื่นที่ไม่ใช้จัดทริป)"""
+    h = hashlib.sha256()
+    h.update(str(len(df)).encode())
+    for col in KEY_COLUMNS:
+        if col not in df.columns:
+            continue
+        if col in _NUMERIC_COLUMNS:
+            values = pd.to_numeric(df[col], errors='coerce').round(6).fillna(0.0)
+        elif col == 'Code':
+            values = df[col].astype(str).str.strip().str.upper()
+        else:
+            values = df[col].astype(str).str.strip()
+        h.update(col.encode('utf-8'))
+        h.update(pd.util.hash_pandas_object(values, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _json_default(value):
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def plan_cache_key(df, params, versions=None):
+    """key ของผลจัดทริป: ออเดอร์ + พารามิเตอร์ + version ข้อมูล/โค้ด"""
+    payload = json.dumps({'params': params, 'versions': versions or {}}, sort_keys=True,
+                         ensure_ascii=False, default=_json_default)
+    return hashlib.sha256(f"{frame_fingerprint(df)}|{payload}".encode('utf-8')).hexdigest()[:32]
+
+
+def content_version(obj):
+    """version สั้นๆ ของ dict / DataFrame (ใช้ใน versions ของ plan_cache_key)"""
+    if obj is None:
+        return None
+    if isinstance(obj, pd.DataFrame):
+        if obj.empty:
+            return 'empty'
+        hashed = pd.util.hash_pandas_object(obj.astype(str), index=False).to_numpy().tobytes()
+        return hashlib.sha256(hashed).hexdigest()[:16]
+    data = json.dumps(obj, sort_keys=True, ensure_ascii=False, default=_json_default)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]
+
+
+def file_version(*paths):
+    """version ของไฟล์โค้ด/ข้อมูล (ไม่มีไฟล์ → ข้าม)"""
+    h = hashlib.sha256()
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def _copy_result(result):
+    df, summary_df, fleet_used = result
+    return df.copy(), summary_df.copy(), dict(fleet_used or {})
+
+
+class PlanCache:
+    """LRU ใน memory + ไฟล์บน disk (จำกัดขนาด) ของ (result_df, summary_df, fleet_used)"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_items=DEFAULT_MAX_ITEMS, max_disk_mb=DEFAULT_MAX_DISK_MB):
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def get(self, key):
+        """ผลที่เก็บไว้ (สำเนา) หรือ None"""
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return _copy_result(result)
+        path = self._path(key)
+        if self.max_disk_bytes > 0 and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    result = pickle.load(f)
+                os.utime(path)
+            except Exception:
+                result = None
+            if result is not None:
+                with self._lock:
+                    self._remember(key, result)
+                    self.hits += 1
+                return _copy_result(result)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result):
+        """เก็บผล (เก็บสำเนา ผู้เรียกแก้ต่อได้)"""
+        result = _copy_result(result)
+        with self._lock:
+            self._remember(key, result)
+        if self.max_disk_bytes <= 0:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = self._path(key) + '.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+            self._evict_disk()
+        except Exception:
+            pass
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.cache_dir, name)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.pkl'):
+                    try:
+                        os.remove(os.path.join(self.cache_dir, name))
+                    except OSError:
+                        pass
@@ -0,0 +1,178 @@
+"""
+Plan Cancel — ยกเลิก / deadline แบบ cooperative ของ predict_trips (คืนแผนที่ดีที่สุดเท่าที่มี)
+
+predict_trips รันใน thread แยกจาก UI จึงหยุดจากข้างนอกไม่ได้ → ส่ง CancelToken เข้าไป
+แล้ว _predict_trips ตรวจเองระหว่าง phase และในลูปยาว (ผ่านฟังก์ชันระดับ module
+→ token ที่ active ของ thread นั้น เหมือน planner_profiler)
+
+  - phase จำเป็น (Step 1 → 6.4 greedy): หยุดก่อนจบ → PlanningCancelled (ยังไม่มีแผนให้คืน)
+  - plan_ready() หลัง greedy: นับจากนี้มีแผนครบทุกสาขาแล้ว
+  - phase เสริม (fill-up / merge / consolidation / local search): หยุด → ข้ามหรือจบลูปกลางทาง
+  - Step 6.7 region audit + Step 7 เป็นต้นไป (summary / ตรวจกติกา / เลขทริป) รันเสมอ
+
+    token = CancelToken(deadline_s=120)
+    with token.activate():
+        phase('Step 6.6 branch merge', optional=True)
+        for ...:
+            if stopped():
+                break
+    token.report()   # → summary_df.attrs['cancelled']
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class PlanningCancelled(Exception):
+    """หยุดก่อนจัดทริป greedy เสร็จ — ไม่มีแผนที่ครบให้คืน"""
+
+
+class CancelToken:
+    """สถานะยกเลิกของงานจัดทริป 1 ครั้ง (cancel() เรียกจาก thread อื่นได้)"""
+
+    def __init__(self, deadline_s=None, event=None):
+        # event = multiprocessing.Event ร่วมกับ process หลัก (worker ของ parallel planner) → กด Cancel ข้าม process ได้
+        self._event = event if event is not None else threading.Event()
+        self._t0 = time.monotonic()
+        self.deadline = self._t0 + float(deadline_s) if deadline_s else None
+        self.reason = None
+        self.plan_ready = False
+        self.phase = None
+        self.skipped = []
+        self.cut_short = []
+
+    def cancel(self, reason='user'):
+        """สั่งหยุด (ครั้งแรกที่เรียกเป็นเหตุผลที่บันทึก)"""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def stopped(self):
+        """ถูกยกเลิก หรือเลย deadline แล้ว"""
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel('deadline')
+        if self._event.is_set() and self.reason is None:
+            self.reason = 'user'   # ถูกสั่งหยุดจาก process อื่นผ่าน event ร่วม
+        return self._event.is_set()
+
+    def remaining(self):
+        """วินาทีที่เหลือก่อน deadline (None = ไม่มี deadline, หยุดแล้ว = 0)"""
+        if self.stopped:
+            return 0.0
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def cap(self, seconds):
+        """จำกัดเวลาของขั้นที่ตั้งเวลาเองได้ (local search / CP-SAT) ไม่ให้เกิน deadline"""
+        left = self.remaining()
+        return seconds if left is None else min(float(seconds), left)
+
+    def child(self, deadline_s=None):
+        """token ของงานย่อย: หยุดพร้อม token นี้ (event เดียวกัน) + deadline ไม่เกินของ token นี้"""
+        caps = [s for s in (deadline_s, self.remaining()) if s is not None]
+        token = CancelToken(min(caps) if caps else None, event=self._event)
+        if self.stopped:
+            token.reason = self.reason
+        return token
+
+    def check(self):
+        """ใน phase จำเป็น: หยุดแล้ว + ยังไม่มีแผน → PlanningCancelled"""
+        if self.stopped and not self.plan_ready:
+            raise PlanningCancelled(f"หยุดจัดทริประหว่าง {self.phase or 'เริ่มต้น'} ({self.reason})")
+
+    def enter(self, name, optional=False):
+        """เริ่ม phase name → False ถ้า phase เสริมถูกข้ามเพราะหยุดแล้ว"""
+        self.phase = name
+        if not optional:
+            self.check()
+            return True
+        if self.stopped:
+            self.skipped.append(name)
+            return False
+        return True
+
+    def interrupted(self):
+        """ในลูปของ phase เสริม: หยุดแล้ว → True (บันทึกว่า phase นี้จบกลางทาง)"""
+        if not self.stopped:
+            return False
+        if not self.plan_ready:
+            self.check()
+        if self.phase and self.phase not in self.skipped and self.phase not in self.cut_short:
+            self.cut_short.append(self.phase)
+        return True
+
+    def report(self):
+        """สรุปสำหรับ summary_df.attrs['cancelled'] / UI"""
+        return {
+            'reason': self.reason,
+            'phase': self.phase,
+            'skipped': list(self.skipped),
+            'cut_short': list(self.cut_short),
+            'seconds': round(time.monotonic() - self._t0, 2),
+        }
+
+    @contextmanager
+    def activate(self):
+        """ผูก token กับ thread ปัจจุบัน (ซ้อนได้ — คืนค่าเดิมเมื่อออก)"""
+        prev = getattr(_local, 'token', None)
+        _local.token = self
+        try:
+            yield self
+        finally:
+            _local.token = prev
+
+
+def combine_reports(reports):
+    """รวมรายงานหลายกลุ่ม (parallel planner) — phase ที่ข้าม/จบกลางทางในกลุ่มใดก็ตาม"""
+    reports = [r for r in reports if r]
+    if not reports:
+        return None
+
+    def _union(key):
+        out = []
+        for r in reports:
+            out.extend(p for p in r[key] if p not in out)
+        return out
+
+    return {
+        'reason': reports[0]['reason'],
+        'phase': reports[0]['phase'],
+        'skipped': _union('skipped'),
+        'cut_short': _union('cut_short'),
+        'seconds': max(r['seconds'] for r in reports),
+    }
+
+
+def current():
+    """token ที่ active ของ thread นี้ (None ถ้าไม่มี)"""
+    return getattr(_local, 'token', None)
+
+
+def phase(name, optional=False):
+    """เริ่ม phase ใน token ที่ active (ไม่มี token → True เสมอ)"""
+    token = getattr(_local, 'token', None)
+    return token.enter(name, optional) if token is not None else True
+
+
+def check():
+    """phase จำเป็น: หยุดก่อนมีแผน → PlanningCancelled (ไม่มี token → ไม่ทำอะไร)"""
+    token = getattr(_local, 'token', None)
+    if token is not None:
+        token.check()
+
+
+def stopped():
+    """ลูปของ phase เสริม: ควรหยุดหรือยัง (ไม่มี token → False)"""
+    token = getattr(_local, 'token', None)
+    return token.interrupted() if token is not None else False
+
+
+def plan_ready():
+    """จัดทริปครบทุกสาขาแล้ว — หยุดหลังจากนี้คืนแผนได้"""
+    token = getattr(_local, 'token', None)
+    if token is not None:
+        token.plan_ready = True
@@ -0,0 +1,431 @@
+"""
+Plan Update — ปรับแผนเดิมเมื่อมีออเดอร์เพิ่ม/ลบ/แก้ (late orders) โดยไม่รันทั้งไฟล์
+
+1. แยก delta ตาม (Code, BU) ของแถว: คู่ใหม่ = เพิ่ม, คู่เดิม = แก้ (ถอดแถวเดิมของคู่นั้น + ใส่ใหม่
+   — แถว BU อื่นของสาขาเดียวกันถูกจัดใหม่พร้อมกัน ให้สาขาเดียวอยู่ทริปเดียว), น้ำหนัก+คิว ≤ 0 = ลบคู่นั้น,
+   removed_codes = ลบทุก BU ของสาขา
+2. strategy='insert' (ค่าเริ่มต้น):
+   - รัน predict_trips เฉพาะแถว delta → ได้พื้นที่/รถสูงสุดของสาขา + ทริปสำรองของ delta เอง
+   - เติมสาขา delta เข้าทริปเดิมที่มีสาขาใกล้สุด (≤ radius_km เส้นตรง, SpatialIndex จาก _lat/_lon
+     ที่รอบก่อนคำนวณไว้แล้ว) ถ้าภาค/กรุงเทพฯ ตรงกัน ไม่ข้ามโซนต้องห้าม (NO_CROSS_ZONE / ZONE_NEARBY
+     ต่างจังหวัด) รถไม่เกินข้อจำกัดสาขา และน้ำหนัก/คิว/ชิ้น/จุดส่ง ไม่เกิน limit × buffer
+     — ที่เติมไม่ได้ใช้ทริปสำรองจาก predict_trips
+   strategy='replan':
+   - ปลดล็อกทริปเดิมที่มีสาขาในรัศมีของ delta แล้วรัน predict_trips กับสาขาเหล่านั้น + delta
+     (ช้ากว่า แต่จัดพื้นที่นั้นใหม่ทั้งหมด)
+3. ทริปอื่นคงสมาชิก/รถ/เลขทริปเดิม → ทริปที่เปลี่ยน (ถูกเติม/เสียสมาชิก) เลือกรถใหม่แบบ Step 7
+   (repick_vehicles — ทริปที่เบาลงไม่ค้างรถคันใหญ่) + สรุปใหม่, ทริปใหม่ได้เลขที่ว่าง
+   (ทริปที่ถูกปลดล็อก/ไม่เหลือสาขา) ก่อนแล้วต่อท้าย + reconcile fleet_limits (reconcile_fleet ของ parallel_planner)
+"""
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+
+from fleet_cost import LONG_HAUL_REGIONS, VEHICLE_TYPES, pick_vehicle, truck_label, vehicle_caps
+from parallel_planner import VEHICLE_RANK, merge_partitions, reconcile_fleet
+from spatial_index import SpatialIndex
+
+# รัศมีพื้นที่รอบสาขา delta (km เส้นตรง)
+DEFAULT_RADIUS_KM = 10.0
+
+# คอลัมน์ที่ predict_trips เติมให้ผลลัพธ์ (ตัดออกก่อนส่งกลับเข้า planner)
+DERIVED_COLUMNS = ('Trip', 'Truck', 'Region', 'Distance_from_DC', 'MaxVehicle', 'VehicleCheck')
+
+PUNTHAI_BUS = ('211', 'PUNTHAI')
+BKK_PROVINCE = 'กรุงเทพมหานคร'
+
+
+def order_rows(result_df):
+    """แถวผลลัพธ์ → รูปแบบ input ของ predict_trips (ตัดคอลัมน์ที่ planner เติม)"""
+    drop = [c for c in result_df.columns if c in DERIVED_COLUMNS or str(c).startswith('_')]
+    return result_df.drop(columns=drop)
+
+
+def _codes(df):
+    return df['Code'].astype(str).str.strip().str.upper()
+
+
+def _row_keys(df):
+    """identity ของแถวออเดอร์ = Code|BU (สาขาเดียวมีได้หลาย BU)"""
+    if 'BU' not in df.columns:
+        return _codes(df)
+    return _codes(df) + '|' + df['BU'].astype(str).str.strip().str.upper()
+
+
+def _truck_head(value):
+    return str(value).split()[0] if pd.notna(value) and str(value).strip() else ''
+
+
+def _number(value):
+    value = pd.to_numeric(value, errors='coerce')
+    return 0.0 if pd.isna(value) else float(value)
+
+
+def split_delta(previous_df, delta_orders, removed_codes=None):
+    """คืน (added_df, changed_df, removed_keys) ของ delta — removed_keys = Code|BU ของแถวเดิมที่ต้องถอด"""
+    prev_keys = _row_keys(previous_df)
+    removed_codes = {str(c).strip().upper() for c in (removed_codes or ())}
+    removed = set(prev_keys[_codes(previous_df).isin(removed_codes)])
+    if delta_orders is None or delta_orders.empty:
+        empty = pd.DataFrame(columns=previous_df.columns)
+        return empty, empty, removed
+    delta = delta_orders.copy()
+    codes, keys = _codes(delta), _row_keys(delta)
+    weight = pd.to_numeric(delta.get('Weight', 0), errors='coerce').fillna(0)
+    cube = pd.to_numeric(delta.get('Cube', 0), errors='coerce').fillna(0)
+    zero = (weight <= 0) & (cube <= 0)
+    removed |= set(keys[zero]) & set(prev_keys)
+    keep = ~zero & ~codes.isin(removed_codes)
+    changed = delta[keep & keys.isin(set(prev_keys))]
+    added = delta[keep & ~keys.isin(set(prev_keys))]
+    return added, changed, removed
+
+
+class TripLimits:
+    """limit ของทริปตามรถ + BU (เหมือน Step 9: Punthai ล้วน → PUNTHAI_LIMITS + punthai_buffer)"""
+
+    def __init__(self, limits, punthai_buffer=1.0, maxmart_buffer=1.10, max_qty_per_trip=0):
+        self.limits = limits or {}
+        self.punthai_buffer = punthai_buffer
+        self.maxmart_buffer = maxmart_buffer
+        self.max_qty = max_qty_per_trip
+
+    @staticmethod
+    def is_punthai(bus):
+        bus = list(bus)
+        return bool(bus) and all(str(b).strip().upper() in PUNTHAI_BUS for b in bus)
+
+    def of(self, truck, is_punthai):
+        table = self.limits.get('punthai' if is_punthai else 'maxmart', {})
+        return table.get(truck) or table.get('6W') or {'max_w': float('inf'), 'max_c': float('inf')}
+
+    def fits(self, truck, weight, cube, qty, is_punthai, drops=0):
+        lim = self.of(truck, is_punthai)
+        buf = self.punthai_buffer if is_punthai else self.maxmart_buffer
+        if weight > lim['max_w'] * buf or cube > lim['max_c'] * buf:
+            return False
+        if drops > lim.get('max_drops', float('inf')):
+            return False   # Punthai ล้วน → max_drops ของ PUNTHAI_LIMITS
+        return not (self.max_qty and qty > self.max_qty)
+
+    def summary_row(self, trip, rows, truck):
+        """แถว summary ของทริป (คอลัมน์เดียวกับ Step 9)"""
+        is_punthai = self.is_punthai(rows['BU']) if 'BU' in rows.columns else False
+        lim = self.of(_truck_head(truck) or '6W', is_punthai)
+        total_w, total_c = rows['Weight'].sum(), rows['Cube'].sum()
+        max_dist = rows['_distance_from_dc'].max() if '_distance_from_dc' in rows.columns else 0
+        return {
+            'Trip': trip,
+            'Branches': len(rows),
+            'Weight': total_w,
+            'Cube': total_c,
+            'Truck': truck,
+            'BU_Type': 'punthai' if is_punthai else 'maxmart',
+            'Buffer': f"🅿️ {int(self.punthai_buffer*100)}%" if is_punthai else f"🅼 {int(self.maxmart_buffer*100)}%",
+            'Weight_Use%': (total_w / lim['max_w']) * 100,
+            'Cube_Use%': (total_c / lim['max_c']) * 100,
+            'Total_Distance': max_dist if pd.notna(max_dist) else 0,
+        }
+
+
+def resummarize(df, summary_df, trips, trip_limits):
+    """สร้างแถว summary ใหม่เฉพาะ trips (ทริปที่ไม่เหลือสาขาถูกตัดออก)"""
+    trips = {int(t) for t in trips}
+    keep = summary_df[~summary_df['Trip'].astype(int).isin(trips)] if not summary_df.empty else summary_df
+    rows = []
+    for trip in sorted(trips):
+        members = df[df['Trip'] == trip]
+        if len(members):
+            rows.append(trip_limits.summary_row(trip, members, members['Truck'].iloc[0]))
+    if not rows:
+        return keep.reset_index(drop=True)
+    out = pd.concat([keep, pd.DataFrame(rows)], ignore_index=True) if not keep.empty else pd.DataFrame(rows)
+    return out.sort_values('Trip', kind='stable').reset_index(drop=True)
+
+
+def vehicle_check(truck, max_vehicle):
+    """ค่า VehicleCheck ของแถว (เหมือน check_vehicle_compliance ใน Step 8)"""
+    truck = _truck_head(truck)
+    truck = 'JB' if truck == '4WJ' else truck
+    if max_vehicle not in VEHICLE_RANK or truck not in VEHICLE_RANK:
+        return '✅ ใช้ได้'
+    if VEHICLE_RANK[truck] <= VEHICLE_RANK[max_vehicle]:
+        return '✅ ใช้ได้'
+    return f'❌ เกินข้อจำกัด (Max: {max_vehicle}, ใช้: {truck})'
+
+
+def repick_vehicles(df, trips, limits, punthai_buffer=1.0, maxmart_buffer=1.10):
+    """รถของ trips ใหม่แบบ Step 7 + ป้ายที่มาแบบ Step 7.5 + VehicleCheck (แก้ df ในที่)"""
+    caps = vehicle_caps(limits, punthai_buffer, maxmart_buffer)
+    truck_col = df.columns.get_loc('Truck')
+    check_col = df.columns.get_loc('VehicleCheck') if 'VehicleCheck' in df.columns else None
+    region_of = df.groupby('Trip')['Region'].first().to_dict() if 'Region' in df.columns else {}
+    for trip in sorted(trips):
+        members = (df['Trip'] == trip).to_numpy().nonzero()[0]
+        if not len(members):
+            continue
+        rows = df.iloc[members]
+        ranks = [VEHICLE_RANK.get(str(v), 3) for v in rows['_max_vehicle']] if '_max_vehicle' in rows.columns else [3]
+        bus = rows['BU'].astype(str).str.strip().str.upper() if 'BU' in rows.columns else pd.Series(dtype=str)
+        long_haul = str(region_of.get(trip, '')) in LONG_HAUL_REGIONS
+        vehicle = pick_vehicle(rows['Weight'].sum(), rows['Cube'].sum(), rows['Code'].nunique(), min(ranks),
+                               bool(len(bus)) and bus.isin(PUNTHAI_BUS).all(), long_haul, caps)
+        label = truck_label(vehicle or VEHICLE_TYPES[min(ranks) - 1], min(ranks), long_haul)
+        df.iloc[members, truck_col] = label
+        if check_col is not None:
+            max_vehicles = rows['_max_vehicle'] if '_max_vehicle' in rows.columns else [None] * len(rows)
+            df.iloc[members, check_col] = [vehicle_check(label, v) for v in max_vehicles]
+    return df
+
+
+def rebuild_trips(df, summary_df, trips, limits, punthai_buffer=1.0, maxmart_buffer=1.10, max_qty_per_trip=0,
+                  fleet_limits=None):
+    """
+    ทริปที่ solver ย้ายสมาชิก (CP-SAT / local search บนแผนที่เสร็จแล้ว): รถใหม่ (repick_vehicles)
+    → สรุปใหม่เฉพาะทริปเหล่านั้น → เรียงเลขทริปแบบ Step 9 + reconcile fleet_limits
+    คืน (df, summary_df, fleet_used) — attrs เดิมของ summary_df คงไว้
+    """
+    repick_vehicles(df, trips, limits, punthai_buffer, maxmart_buffer)
+    trip_limits = TripLimits(limits, punthai_buffer, maxmart_buffer, max_qty_per_trip)
+    attrs = dict(summary_df.attrs)
+    summary_df = resummarize(df, summary_df, trips, trip_limits)
+    df, summary_df = merge_partitions([('rebuild', df, summary_df)])
+    fleet_used = reconcile_fleet(df, summary_df, fleet_limits, limits)
+    summary_df.attrs.update(attrs)
+    return df, summary_df, fleet_used
+
+
+def _is_nearby_zone(zone):
+    return str(zone or '').startswith('ZONE_NEARBY_')
+
+
+def _trip_state(rows):
+    regions = set(rows['Region'].dropna().astype(str)) if 'Region' in rows.columns else set()
+    provinces = rows['_province'].astype(str) if '_province' in rows.columns else pd.Series(dtype=str)
+    zones = rows['_logistics_zone'].dropna().astype(str) if '_logistics_zone' in rows.columns else ()
+    return {
+        'codes': set(_codes(rows)),
+        'provinces': set(provinces) - {'', 'nan'},
+        'nearby': any(_is_nearby_zone(z) for z in zones),
+        'weight': rows['Weight'].sum(),
+        'cube': rows['Cube'].sum(),
+        'qty': pd.to_numeric(rows['OriginalQty'], errors='coerce').fillna(0).sum() if 'OriginalQty' in rows.columns else 0.0,
+        'bus': list(rows['BU']) if 'BU' in rows.columns else [],
+        'regions': regions - {'', 'ไม่ระบุ'},
+        'bkk': set((provinces == BKK_PROVINCE).tolist()),
+        'truck': rows['Truck'].iloc[0],
+    }
+
+
+def insert_into_trips(fixed_df, delta_df, trip_limits, radius_km=DEFAULT_RADIUS_KM, cross_zone=None):
+    """
+    เติมแถวของ delta_df (ผลจาก predict_trips) เข้าทริปใน fixed_df ที่มีสาขาใกล้สุดและยังรับได้
+    แถว Code เดียวกัน (หลาย BU) เติมเข้าทริปเดียวกันทั้งชุด | รถของทริปที่ถูกเติมให้ repick_vehicles ตั้งใหม่ภายหลัง
+    cross_zone(prov1, prov2) → True ถ้าห้ามรวมสองจังหวัด (NO_CROSS_ZONE_PAIRS ของ app)
+    คืน (fixed_df ที่เติมแล้ว, delta_df ที่เหลือ, เลขทริปเดิมที่ถูกเติม)
+    """
+    assigned = fixed_df[fixed_df['Trip'] > 0]
+    if assigned.empty or delta_df.empty or '_lat' not in assigned.columns:
+        return fixed_df, delta_df, set()
+    lats = pd.to_numeric(assigned['_lat'], errors='coerce').fillna(0).to_numpy()
+    lons = pd.to_numeric(assigned['_lon'], errors='coerce').fillna(0).to_numpy()
+    trip_of = assigned['Trip'].astype(int).to_numpy()
+    index = SpatialIndex(lats, lons)
+    state = {int(t): _trip_state(g) for t, g in assigned.groupby('Trip')}
+
+    # แถวของสาขาเดียวกัน (หลาย BU) เติมเข้าทริปเดียวกันทั้งชุด
+    codes_of = _codes(delta_df).tolist()
+    groups = {}
+    for pos, code in enumerate(codes_of):
+        groups.setdefault(code, []).append(pos)
+
+    inserted, new_rows, filled = [], [], set()
+    for code, positions in groups.items():
+        rows = delta_df.iloc[positions]
+        row = rows.iloc[0]
+        lat, lon = _number(row.get('_lat')), _number(row.get('_lon'))
+        if not (lat > 0 and lon > 0):
+            continue
+        near, dist = index.within(lat, lon, radius_km, with_distance=True)
+        closest = {}
+        for p, d in zip(near.tolist(), dist.tolist()):
+            t = int(trip_of[p])
+            closest[t] = min(closest.get(t, d), d)
+
+        region = str(row.get('Region', '') or '')
+        region = '' if region in ('', 'ไม่ระบุ', 'nan') else region
+        province = str(row.get('_province', '') or '')
+        province = '' if province == 'nan' else province
+        is_bkk = province == BKK_PROVINCE
+        is_nearby = _is_nearby_zone(row.get('_logistics_zone'))
+        max_vehicles = rows['_max_vehicle'].tolist() if '_max_vehicle' in rows.columns else [None]
+        max_rank = min(VEHICLE_RANK.get(v, 3) for v in max_vehicles)
+        for t in sorted(closest, key=lambda t: (closest[t], t)):
+            s = state[t]
+            truck = _truck_head(s['truck']) or '6W'
+            if VEHICLE_RANK.get(truck, 3) > max_rank:
+                continue
+            if region and s['regions'] and s['regions'] != {region}:
+                continue
+            if s['bkk'] and s['bkk'] != {is_bkk}:
+                continue
+            if province and s['provinces'] and province not in s['provinces']:
+                # ZONE_NEARBY รวมได้เฉพาะจังหวัดเดียวกัน / คู่จังหวัดต้องห้าม (Step 6 greedy + 6.6 merge)
+                if is_nearby or s['nearby']:
+                    continue
+                if cross_zone is not None and any(cross_zone(province, p) for p in s['provinces']):
+                    continue
+            bus = s['bus'] + (list(rows['BU']) if 'BU' in rows.columns else [])
+            weight = s['weight'] + sum(_number(v) for v in rows['Weight'])
+            cube = s['cube'] + sum(_number(v) for v in rows['Cube'])
+            qty = s['qty'] + (sum(_number(v) for v in rows['OriginalQty']) if 'OriginalQty' in rows.columns else 0.0)
+            codes = s['codes'] | {code}
+            if not trip_limits.fits(truck, weight, cube, qty, trip_limits.is_punthai(bus), drops=len(codes)):
+                continue
+            s.update(weight=weight, cube=cube, qty=qty, bus=bus, codes=codes)
+            if region:
+                s['regions'].add(region)
+            if province:
+                s['provinces'].add(province)
+            s['nearby'] = s['nearby'] or is_nearby
+            s['bkk'].add(is_bkk)
+            for pos in positions:
+                new = delta_df.iloc[pos].copy()
+                new['Trip'] = t
+                new['Truck'] = s['truck']
+                new['VehicleCheck'] = vehicle_check(s['truck'], new.get('_max_vehicle'))
+                new_rows.append(new)
+            inserted.extend(positions)
+            filled.add(t)
+            break
+
+    if not inserted:
+        return fixed_df, delta_df, set()
+    fixed_df = pd.concat([fixed_df, pd.DataFrame(new_rows)], ignore_index=True)
+    rest = delta_df.drop(delta_df.index[inserted])
+    return fixed_df, rest, filled
+
+
+def merge_keep_trips(fixed_df, fixed_summary, update_df=None, update_summary=None):
+    """
+    รวมผล update: ทริปใน fixed_df คงเลขเดิม, ทริปของ update_df เรียงแบบ Step 9 (ไกล DC ก่อน)
+    แล้วได้เลขที่ว่าง (ทริปที่ถูกปลดล็อก/ไม่เหลือสาขา) ก่อนต่อท้าย → (df, summary_df)
+    """
+    frames, summaries = [fixed_df], [fixed_summary]
+    if update_df is not None and len(update_df):
+        update_df = update_df.copy()
+        assigned = update_df[update_df['Trip'] > 0]
+        appearance = pd.unique(assigned['Trip']).tolist()
+        max_dist = assigned.groupby('Trip')['_distance_from_dc'].max().fillna(0).to_dict() \
+            if '_distance_from_dc' in update_df.columns else {}
+        used = set(fixed_df.loc[fixed_df['Trip'] > 0, 'Trip'].astype(int))
+        free = (t for t in itertools.count(1) if t not in used)
+        renumber = {old: next(free) for old in sorted(appearance, key=lambda t: -max_dist.get(t, 0))}
+        update_df['Trip'] = update_df['Trip'].map(lambda t: renumber.get(t, 0)).astype('int64')
+        frames.append(update_df)
+        if update_summary is not None and not update_summary.empty:
+            update_summary = update_summary.copy()
+            update_summary['Trip'] = update_summary['Trip'].map(renumber)
+            summaries.append(update_summary.dropna(subset=['Trip']))
+    df = pd.concat(frames, ignore_index=True)
+    df['Trip'] = df['Trip'].astype('int64')
+    summaries = [x for x in summaries if x is not None and not x.empty]
+    summary_df = pd.concat(summaries, ignore_index=True) if summaries else pd.DataFrame()
+    if not summary_df.empty:
+        summary_df['Trip'] = summary_df['Trip'].astype('int64')
+        summary_df = summary_df.sort_values('Trip', kind='stable').reset_index(drop=True)
+    if '_distance_from_dc' in df.columns:
+        df = df.sort_values(['Trip', '_distance_from_dc'], ascending=[True, False], kind='stable')
+    else:
+        df = df.sort_values('Trip', kind='stable')
+    return df.reset_index(drop=True), summary_df
+
+
+def update_plan(previous_result, delta_orders, plan, coords_of, removed_codes=None, fleet_limits=None,
+                limits=None, punthai_buffer=1.0, maxmart_buffer=1.10, max_qty_per_trip=0,
+                strategy='insert', radius_km=DEFAULT_RADIUS_KM, cross_zone=None, log=print):
+    """
+    previous_result = (result_df, summary_df, fleet_used) ของรอบก่อน
+    delta_orders    = ออเดอร์ที่เพิ่ม/แก้ (ผ่าน process_dataframe แล้ว) — น้ำหนัก+คิว 0 = ลบสาขานั้น
+    plan(df)        = predict_trips ของ subset (app ผูกพารามิเตอร์ buffer/max_qty ให้)
+    coords_of(df)   = [(lat, lon), ...] ของแต่ละแถว delta (ใช้หาพื้นที่ของ strategy='replan')
+    cross_zone      = (prov1, prov2) → True ถ้าห้ามรวม (ใช้ตอนเติมเข้าทริปเดิม)
+    คืน (result_df, summary_df, fleet_used) — summary_df.attrs['plan_update'] บอกส่วนที่เปลี่ยน
+    """
+    t0 = time.perf_counter()
+    trip_limits = TripLimits(limits, punthai_buffer, maxmart_buffer, max_qty_per_trip)
+    prev_df, prev_summary, _ = previous_result
+    prev_df = prev_df.reset_index(drop=True)
+    prev_summary = prev_summary if prev_summary is not None else pd.DataFrame()
+    added, changed, removed = split_delta(prev_df, delta_orders, removed_codes)
+    delta_rows = pd.concat([added, changed], ignore_index=True)
+    touched = _row_keys(prev_df).isin(set(_row_keys(changed)) | removed).to_numpy(copy=True)
+    assigned = (prev_df['Trip'] > 0).to_numpy()
+
+    unlocked = np.zeros(len(prev_df), dtype=bool)
+    unlocked_trips = []
+    if strategy == 'replan' and '_lat' in prev_df.columns:
+        # พื้นที่ที่โดน: รอบแถวใหม่/แก้ + รอบตำแหน่งเดิมของสาขาที่แก้/ลบ
+        lats = pd.to_numeric(prev_df['_lat'], errors='coerce').fillna(0).to_numpy()
+        lons = pd.to_numeric(prev_df['_lon'], errors='coerce').fillna(0).to_numpy()
+        points = (list(coords_of(delta_rows)) if len(delta_rows) else []) \
+            + [(lats[i], lons[i]) for i in np.nonzero(touched)[0]]
+        area = np.zeros(len(prev_df), dtype=bool)
+        area[SpatialIndex(lats, lons).within_any(points, radius_km)] = True
+        unlocked_trips = sorted({int(t) for t in prev_df.loc[area & assigned, 'Trip']})
+        unlocked = prev_df['Trip'].isin(unlocked_trips).to_numpy() | (area & ~assigned)
+
+    # แถว BU อื่นของสาขาใน delta → จัดใหม่พร้อมกัน (สาขาเดียวกันต้องอยู่ทริปเดียวกัน)
+    regroup = _codes(prev_df).isin(set(_codes(delta_rows))).to_numpy() & ~touched & ~unlocked \
+        if len(delta_rows) else np.zeros(len(prev_df), dtype=bool)
+
+    # ทริปเดิมที่เสียสมาชิก (ลบ/แก้/ย้ายไปจัดพร้อมสาขา delta) → เลือกรถ + สรุปใหม่
+    changed_trips = {int(t) for t in prev_df.loc[(touched | regroup) & assigned & ~unlocked, 'Trip']}
+    fixed_df = prev_df[~unlocked & ~touched & ~regroup].copy()
+    kept_trips = set(prev_df.loc[assigned & ~unlocked, 'Trip'].astype(int))
+    fixed_summary = prev_summary[prev_summary['Trip'].astype(int).isin(kept_trips)].copy() \
+        if not prev_summary.empty else pd.DataFrame()
+
+    subset = pd.concat([order_rows(prev_df[(unlocked | regroup) & ~touched]), order_rows(delta_rows)],
+                       ignore_index=True)
+    n_inserted = 0
+    update_part = None
+    if len(subset):
+        sub_df, sub_summary, _ = plan(subset)
+        if strategy != 'replan':
+            fixed_df, rest, filled = insert_into_trips(fixed_df, sub_df, trip_limits, radius_km, cross_zone)
+            n_inserted = len(sub_df) - len(rest)
+            changed_trips |= filled
+            if n_inserted and not sub_summary.empty:
+                sub_summary = resummarize(rest, sub_summary, sub_summary['Trip'], trip_limits)
+            sub_df = rest
+        if len(sub_df):
+            update_part = (sub_df, sub_summary)
+    if changed_trips and limits:
+        fixed_df = repick_vehicles(fixed_df.reset_index(drop=True), changed_trips, limits,
+                                   punthai_buffer, maxmart_buffer)
+    if changed_trips and not fixed_summary.empty:
+        fixed_summary = resummarize(fixed_df, fixed_summary, changed_trips, trip_limits)
+
+    df, summary_df = merge_keep_trips(fixed_df, fixed_summary, *(update_part or ()))
+    fleet_used = reconcile_fleet(df, summary_df, fleet_limits, limits or {})
+    seconds = time.perf_counter() - t0
+    log(f"🔁 update_plan ({strategy}): +{len(added)} แก้ {len(changed)} ลบ {len(removed)} → "
+        f"เติมทริปเดิม {n_inserted} สาขา, จัดใหม่ {len(subset)} แถว, ปลดล็อก {len(unlocked_trips)} ทริป "
+        f"({seconds:.2f}s)")
+
+    summary_df.attrs['plan_update'] = {
+        'strategy': strategy,
+        'added': int(len(added)),
+        'changed': int(len(changed)),
+        'removed': sorted(removed),
+        'inserted': int(n_inserted),
+        'changed_trips': len(changed_trips),
+        'unlocked_trips': unlocked_trips,
+        'rows_replanned': int(len(subset)),
+        'radius_km': radius_km,
+        'seconds': round(seconds, 3),
+    }
+    return df, summary_df, fleet_used
@@ -0,0 +1,175 @@
+"""
+Planner Profiler — จับเวลา + ตัวนับต่อ phase ของ predict_trips
+
+ใช้แบบ waterfall: mark('Step X') ปิด phase ก่อนหน้าแล้วเริ่ม phase ใหม่ (ไม่ต้องครอบโค้ดด้วย with)
+ตัวนับ (เช่น haversine_distance, distance cache hit/miss, get_trip_capacity)
+นับผ่าน count() ระดับ module → ไปลง profiler ที่ active ของ thread นั้นเท่านั้น
+(predict_trips รันใน thread แยกจาก UI / precache-routes จึงไม่ปนกัน)
+
+rows ของ phase: ส่งตรงๆ (rows=len(df) — phase ที่ทำทุกแถว) หรือ track=callable ที่คืนคอลัมน์สถานะต่อแถว
+(เช่น Trip / Truck) → ตอนปิด phase นับเฉพาะแถวที่ phase นั้น assign / เปลี่ยนจริง
+
+    prof = PlannerProfiler()
+    with prof.activate():
+        prof.mark('Step 1', rows=len(df))
+        prof.mark('Step 6', track=lambda: [df['Trip'].to_numpy(copy=True)])
+        ...
+    prof.to_frame()
+"""
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+_local = threading.local()
+
+# ตัวนับที่แสดงเป็นคอลัมน์ในตาราง (ตามลำดับนี้) — ตัวอื่นดูได้จาก report()
+COUNTER_COLUMNS = [
+    ('haversine_distance', 'haversine'),
+    ('distance_pairs', 'คู่ระยะ (batch)'),
+    ('get_trip_capacity', 'get_trip_capacity'),
+]
+
+# (hit, miss) → คอลัมน์ hit rate
+HIT_RATES = [
+    ('distance_cache_hit', 'distance_cache_miss', 'cache ระยะ hit%'),
+    ('trip_summary_hit', 'trip_summary_build', 'trip summary hit%'),
+]
+
+
+def current():
+    """profiler ที่ active ของ thread นี้ (None ถ้าไม่มี)"""
+    return getattr(_local, 'profiler', None)
+
+
+def count(name, n=1):
+    """เพิ่มตัวนับของ profiler ที่ active (ไม่มี → ไม่ทำอะไร)"""
+    prof = getattr(_local, 'profiler', None)
+    if prof is not None:
+        prof.counters[name] += n
+
+
+def mark(name, rows=None, track=None):
+    """เริ่ม phase ใหม่ใน profiler ที่ active (ไม่มี → ไม่ทำอะไร — track ไม่ถูกเรียก)"""
+    prof = getattr(_local, 'profiler', None)
+    if prof is not None:
+        prof.mark(name, rows=rows, track=track)
+
+
+def changed_rows(before, after):
+    """จำนวนแถวที่ค่าในคอลัมน์ใดๆ ต่างกัน (NaN = NaN) — จำนวนแถวเปลี่ยน → นับทุกแถวของ after"""
+    if not after:
+        return None
+    n = len(after[0])
+    if not before or len(before[0]) != n:
+        return n
+    diff = np.zeros(n, dtype=bool)
+    for b, a in zip(before, after):
+        diff |= ~((b == a) | (pd.isna(b) & pd.isna(a)))
+    return int(diff.sum())
+
+
+class PlannerProfiler:
+    """เก็บ phase = (ชื่อ, เริ่ม, จบ, rows, ตัวนับที่เพิ่มระหว่าง phase)"""
+
+    def __init__(self):
+        self.counters = Counter()
+        self.phases = []
+        self._open = None
+        self._t0 = None
+
+    @contextmanager
+    def activate(self):
+        """ผูก profiler กับ thread ปัจจุบัน (ซ้อนได้ — คืนค่าเดิมเมื่อออก)"""
+        prev = getattr(_local, 'profiler', None)
+        _local.profiler = self
+        self._t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.finish()
+            _local.profiler = prev
+
+    def mark(self, name, rows=None, track=None):
+        """
+        ปิด phase ที่เปิดอยู่ แล้วเริ่ม phase ใหม่ชื่อ name
+        rows = จำนวนแถวที่ phase นี้ทำงานด้วย / track = callable → [คอลัมน์] นับแถวที่เปลี่ยนตอนปิด phase
+        """
+        self._close(time.perf_counter())
+        before = track() if track is not None else None
+        now = time.perf_counter()   # snapshot ของ track ไม่นับเป็นเวลาของ phase
+        if self._t0 is None:
+            self._t0 = now
+        self._open = {'name': name, 'start': now, 'rows': rows, 'track': track, 'before': before,
+                      'base': Counter(self.counters)}
+
+    def finish(self):
+        """ปิด phase สุดท้าย"""
+        self._close(time.perf_counter())
+
+    def _close(self, now):
+        ph = self._open
+        if ph is None:
+            return
+        delta = Counter(self.counters)
+        delta.subtract(ph['base'])
+        rows = ph['rows']
+        if ph['track'] is not None:
+            rows = changed_rows(ph['before'], ph['track']())
+        self.phases.append({
+            'name': ph['name'],
+            'offset': ph['start'] - self._t0,
+            'seconds': now - ph['start'],
+            'rows': rows,
+            'counters': {k: v for k, v in delta.items() if v},
+        })
+        self._open = None
+
+    @property
+    def total_seconds(self):
+        return sum(p['seconds'] for p in self.phases)
+
+    def to_records(self):
+        """list ของ dict (เก็บใน session_state / summary_df.attrs ได้)"""
+        return [dict(p, counters=dict(p['counters'])) for p in self.phases]
+
+    def to_frame(self):
+        return profile_frame(self.to_records())
+
+    def report(self):
+        """ข้อความสรุปสำหรับ safe_print (phase ละบรรทัด เรียงตามลำดับที่รัน)"""
+        total = self.total_seconds or 1e-9
+        lines = [f"⏱️ Planner profile: {total:.2f}s"]
+        for p in self.phases:
+            extra = ', '.join(f"{k}={v:,}" for k, v in sorted(p['counters'].items()))
+            rows = f" rows={p['rows']:,}" if p['rows'] is not None else ''
+            lines.append(f"   {p['seconds']:7.3f}s {p['seconds'] / total * 100:5.1f}%  {p['name']}{rows}"
+                         + (f"  [{extra}]" if extra else ''))
+        return '\n'.join(lines)
+
+
+def profile_frame(records):
+    """records (จาก to_records) → DataFrame สำหรับแสดงผล: เวลา, %, rows, ตัวนับ, hit rate"""
+    if not records:
+        return pd.DataFrame()
+    total = sum(r['seconds'] for r in records) or 1e-9
+    rows = []
+    for r in records:
+        c = r.get('counters', {})
+        row = {
+            'Phase': r['name'],
+            'เริ่ม (s)': round(r['offset'], 3),
+            'เวลา (s)': round(r['seconds'], 3),
+            '%': round(r['seconds'] / total * 100, 1),
+            'rows': r['rows'],
+        }
+        for key, label in COUNTER_COLUMNS:
+            row[label] = c.get(key, 0)
+        for hit, miss, label in HIT_RATES:
+            n = c.get(hit, 0) + c.get(miss, 0)
+            row[label] = round(c.get(hit, 0) / n * 100, 1) if n else None
+        rows.append(row)
+    return pd.DataFrame(rows)
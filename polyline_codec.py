@@ -0,0 +1,120 @@
+"""
+Polyline Codec — เก็บ geometry เส้นทางแบบบีบอัด (encoded polyline) + pyramid ความละเอียด
+
+  - encode / decode: Google encoded polyline (precision 5 ≈ 1 m) — เล็กกว่า [[lat, lon], ...] ใน JSON / RAM
+    ราว 10 เท่า และถอดได้ใน browser ตรงๆ
+  - simplify: Douglas-Peucker ตามระยะคลาดเคลื่อน (เมตร) บนระนาบ equirectangular
+  - pyramid: เข้ารหัสทุกระดับใน LEVELS ไว้ล่วงหน้าตอนเก็บ cache → ตอนแสดงผลเลือกระดับได้ทันที
+    (แผนที่ทั้งประเทศใช้ 500m, ซูมเข้าใช้ 100m / full)
+
+entry ของ route cache: {'poly': {'full': str, '100m': str, '500m': str}, 'distance': km}
+entry แบบเดิม {'coords': [[lat, lon], ...]} ยังอ่านได้ผ่าน coords_of()
+"""
+import numpy as np
+
+PRECISION = 5
+LEVELS = {'full': 0.0, '100m': 100.0, '500m': 500.0}   # ชื่อระดับ → tolerance (เมตร)
+EARTH_RADIUS_M = 6371008.8
+
+
+def _encode_value(v):
+    v = ~(v << 1) if v < 0 else v << 1
+    chunks = []
+    while v >= 0x20:
+        chunks.append(chr((0x20 | (v & 0x1f)) + 63))
+        v >>= 5
+    chunks.append(chr(v + 63))
+    return ''.join(chunks)
+
+
+def encode(coords, precision=PRECISION):
+    """[[lat, lon], ...] → encoded polyline"""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for lat, lon in coords:
+        ilat, ilon = int(round(lat * factor)), int(round(lon * factor))
+        out.append(_encode_value(ilat - prev_lat))
+        out.append(_encode_value(ilon - prev_lon))
+        prev_lat, prev_lon = ilat, ilon
+    return ''.join(out)
+
+
+def decode(text, precision=PRECISION):
+    """encoded polyline → [[lat, lon], ...]"""
+    factor = float(10 ** precision)
+    coords = []
+    index = lat = lon = 0
+    n = len(text)
+    while index < n:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(text[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coords.append([lat / factor, lon / factor])
+    return coords
+
+
+def simplify(coords, tolerance_m):
+    """Douglas-Peucker: ตัดจุดที่ห่างจากเส้นตรงของช่วงไม่เกิน tolerance_m เมตร (เก็บจุดต้น/ปลายเสมอ)"""
+    n = len(coords)
+    if tolerance_m <= 0 or n < 3:
+        return [list(p) for p in coords]
+    pts = np.asarray(coords, dtype=np.float64)
+    cos_lat = np.cos(np.radians(pts[:, 0].mean()))
+    xy = np.column_stack((np.radians(pts[:, 1]) * cos_lat, np.radians(pts[:, 0]))) * EARTH_RADIUS_M
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+        a, d = xy[i], xy[j] - xy[i]
+        seg = xy[i + 1:j] - a
+        length2 = float(d @ d)
+        if length2 > 0:
+            t = np.clip((seg @ d) / length2, 0.0, 1.0)
+            seg = seg - t[:, None] * d
+        dist = np.hypot(seg[:, 0], seg[:, 1])
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance_m:
+            m = i + 1 + k
+            keep[m] = True
+            stack.append((i, m))
+            stack.append((m, j))
+    return pts[keep].tolist()
+
+
+def pyramid(coords):
+    """encoded polyline ทุกระดับใน LEVELS"""
+    return {name: encode(simplify(coords, tol)) for name, tol in LEVELS.items()}
+
+
+def coords_of(entry, level='full'):
+    """geometry ของ entry ใน route cache ที่ระดับ level (entry แบบเดิมที่มี 'coords' → simplify ตอนอ่าน)"""
+    if isinstance(entry, list):
+        entry = {'coords': entry}
+    poly = entry.get('poly')
+    if poly:
+        return decode(poly.get(level) or poly['full'])
+    coords = entry.get('coords') or []
+    return simplify(coords, LEVELS.get(level, 0.0)) if level != 'full' else coords
+
+
+def compact_entry(entry):
+    """entry แบบเดิม {'coords': [...]} / list → {'poly': pyramid, 'distance'} (entry ใหม่คืนตัวเดิม)"""
+    if isinstance(entry, list):
+        entry = {'coords': entry, 'distance': 0}
+    if 'poly' in entry or not isinstance(entry.get('coords'), list):
+        return entry
+    return {'poly': pyramid(entry['coords']), 'distance': entry.get('distance', 0)}
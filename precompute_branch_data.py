@@ -6,12 +6,12 @@
 """
 import json
 import math
-import os
-import requests
 import sys
-import time
 from collections import defaultdict
 
+from distance_cache_db import TrackedCache, load_cache
+from routing_backend import make_backend
+
 # ตั้ง stdout เป็น UTF-8 เพื่อรองรับ emoji และภาษาไทยใน Windows console
 if hasattr(sys.stdout, 'reconfigure'):
     sys.stdout.reconfigure(encoding='utf-8', errors='replace')
@@ -22,43 +22,26 @@ if hasattr(sys.stderr, 'reconfigure'):
 DC_LAT = 14.179394
 DC_LON = 100.648149
 
-# โหลด OSRM distance cache (ถ้ามี)
-OSRM_CACHE = {}
-if os.path.exists('distance_cache.json'):
-    try:
-        with open('distance_cache.json', 'r', encoding='utf-8') as f:
-            OSRM_CACHE = json.load(f)
+# โหลด OSRM distance cache (ถ้ามี) — distance_cache.db (SQLite) หรือ migrate จาก distance_cache.json
+OSRM_CACHE = TrackedCache()
+_CACHE_DB = None
+try:
+    OSRM_CACHE, _CACHE_DB = load_cache()
+    if OSRM_CACHE:
         print(f"📦 โหลด OSRM distance cache: {len(OSRM_CACHE):,} รายการ")
-    except Exception as e:
-        print(f"⚠️ โหลด distance_cache.json ไม่สำเร็จ: {e}")
+except Exception as e:
+    print(f"⚠️ โหลด distance_cache.db ไม่สำเร็จ: {e}")
 
 BATCH_SIZE = 90        # จำนวน coordinates ต่อ 1 OSRM Table call (public server รองรับ ~100)
-OSRM_DELAY = 0.15      # วินาที หน่วงระหว่าง call เพื่อไม่ flood public server
+OSRM_DELAY = 0.15      # วินาที เว้นระยะระหว่าง call เพื่อไม่ flood public server (rate limit ของ client)
 OSRM_TIMEOUT = 20      # timeout ต่อ request
+OSRM_WORKERS = 4       # call ที่รันพร้อมกัน
+PROVINCE_BATCH = 10    # จำนวนจังหวัดต่อรอบ (ยิงพร้อมกัน แล้วบันทึก cache)
 
-
-def _osrm_table_call(coords_lonlat, retries=3):
-    """
-    เรียก OSRM Table API ครั้งเดียวแบบ full N×N matrix
-    coords_lonlat: list ของ (lon, lat)
-    คืน matrix distances[i][j] เป็น km หรือ None ถ้า fail
-    """
-    coord_str = ";".join(f"{lon},{lat}" for lon, lat in coords_lonlat)
-    url = f"http://router.project-osrm.org/table/v1/driving/{coord_str}?annotations=distance"
-    for attempt in range(retries):
-        try:
-            r = requests.get(url, timeout=OSRM_TIMEOUT)
-            data = r.json()
-            if data.get("code") == "Ok":
-                raw = data["distances"]  # N×N matrix in meters
-                km = [[v / 1000.0 if v else None for v in row] for row in raw]
-                return km
-        except KeyboardInterrupt:
-            raise  # ปล่อยให้ outer handler จัดการ
-        except Exception:
-            if attempt < retries - 1:
-                time.sleep(1 + attempt)
-    return None
+# routing backend ตาม ROUTING_BACKEND (ค่าเริ่มต้น OSRM: keep-alive + rate limit + backoff 429/5xx/timeout)
+# backend จำลอง (haversine / standin) → รันครบทุกขั้นได้ offline (ระยะอยู่ในหน่วยความจำ ไม่เขียนลง distance_cache.db)
+OSRM = make_backend(max_coords=BATCH_SIZE, max_workers=OSRM_WORKERS, rate_per_s=1.0 / OSRM_DELAY,
+                    timeout=OSRM_TIMEOUT, retries=2, backoff=1.0)
 
 
 def build_osrm_cache_batched(branch_data):
@@ -92,34 +75,22 @@ def build_osrm_cache_batched(branch_data):
     if not dc_missing:
         print("       ✅ ครบแล้ว ข้ามไป")
     else:
-        dc_coord = (DC_LON, DC_LAT)  # (lon, lat) format
-        for start in range(0, len(dc_missing), BATCH_SIZE - 1):
-            chunk = dc_missing[start:start + BATCH_SIZE - 1]
-            coords = [dc_coord] + [(b['lon'], b['lat']) for b in chunk]
-            coord_str = ";".join(f"{lon},{lat}" for lon, lat in coords)
-            dst_str = ";".join(str(i) for i in range(1, len(coords)))
-            url = (f"http://router.project-osrm.org/table/v1/driving/{coord_str}"
-                   f"?sources=0&destinations={dst_str}&annotations=distance")
+        # DC → สาขา: ทีละ 20 call (client แตก batch ละ BATCH_SIZE พิกัด ยิงพร้อมกัน)
+        step = (BATCH_SIZE - 1) * 20
+        for start in range(0, len(dc_missing), step):
+            chunk = dc_missing[start:start + step]
             try:
-                r = requests.get(url, timeout=OSRM_TIMEOUT)
-                data = r.json()
-                if data.get("code") == "Ok":
-                    for j, dist_m in enumerate(data["distances"][0]):
-                        b = chunk[j]
-                        key = f"{DC_LAT:.4f},{DC_LON:.4f}_{b['lat']:.4f},{b['lon']:.4f}"
-                        if dist_m and dist_m > 0 and key not in OSRM_CACHE:
-                            OSRM_CACHE[key] = round(dist_m / 1000.0, 3)
-                            new_pairs += 1
+                row = OSRM.table([(DC_LAT, DC_LON)], [(b['lat'], b['lon']) for b in chunk])[0]
             except KeyboardInterrupt:
                 _save_cache()
                 print(f"\n⚠️ DC→branch ถูกหยุด — บันทึก cache แล้ว (+{new_pairs} pairs)")
                 raise
-            except Exception:
-                pass
-            time.sleep(OSRM_DELAY)
-
-            if (start // (BATCH_SIZE - 1)) % 20 == 0:
-                print(f"     ⏳ DC→branch {min(start + BATCH_SIZE - 1, len(dc_missing))}/{len(dc_missing)} (+{new_pairs} ใหม่)")
+            for b, dist_km in zip(chunk, row):
+                key = f"{DC_LAT:.4f},{DC_LON:.4f}_{b['lat']:.4f},{b['lon']:.4f}"
+                if dist_km and dist_km > 0 and key not in OSRM_CACHE:
+                    OSRM_CACHE[key] = round(dist_km, 3)
+                    new_pairs += 1
+            print(f"     ⏳ DC→branch {min(start + step, len(dc_missing))}/{len(dc_missing)} (+{new_pairs} ใหม่)")
 
     # บันทึกหลัง DC pass
     _save_cache()
@@ -133,45 +104,31 @@ def build_osrm_cache_batched(branch_data):
     for b in branches:
         by_prov[b['province']].append(b)
 
+    def _pair_key(bi, bj):
+        return f"{bi['lat']:.4f},{bi['lon']:.4f}_{bj['lat']:.4f},{bj['lon']:.4f}"
+
     prov_list = sorted(by_prov.keys())
     try:
-        for p_idx, prov in enumerate(prov_list):
-            prov_branches = by_prov[prov]
-            n = len(prov_branches)
-            if n < 2:
-                continue
-
-            # ตรวจว่า province นี้มีคู่ที่ยังไม่ใน cache หรือเปล่า
-            prov_missing = False
-            for bi in prov_branches:
-                for bj in prov_branches:
-                    if bi is bj:
+        for p_start in range(0, len(prov_list), PROVINCE_BATCH):
+            # รวม batch ที่ยังขาดของ PROVINCE_BATCH จังหวัด → ยิง /table พร้อมกัน
+            # (province มี > BATCH_SIZE สาขา → split เป็น batch ย่อย)
+            chunks = []
+            for prov in prov_list[p_start:p_start + PROVINCE_BATCH]:
+                prov_branches = by_prov[prov]
+                for start in range(0, len(prov_branches), BATCH_SIZE):
+                    chunk = prov_branches[start:start + BATCH_SIZE]
+                    if len(chunk) < 2:
                         continue
-                    k = f"{bi['lat']:.4f},{bi['lon']:.4f}_{bj['lat']:.4f},{bj['lon']:.4f}"
-                    if k not in OSRM_CACHE:
-                        prov_missing = True
-                        break
-                if prov_missing:
-                    break
-            if not prov_missing:
-                continue  # ✅ ครบแล้ว ข้ามจังหวัดนี้
-
-            # ถ้า province มี > BATCH_SIZE สาขา → split เป็น batch ย่อย
-            for start in range(0, n, BATCH_SIZE):
-                chunk = prov_branches[start:start + BATCH_SIZE]
-                if len(chunk) < 2:
-                    continue
-                # ข้าม batch ถ้าทุกคู่ใน chunk มีใน cache แล้ว
-                batch_missing = any(
-                    f"{bi['lat']:.4f},{bi['lon']:.4f}_{bj['lat']:.4f},{bj['lon']:.4f}" not in OSRM_CACHE
-                    for i, bi in enumerate(chunk) for j, bj in enumerate(chunk) if i != j
-                )
-                if not batch_missing:
-                    continue
-                coords = [(b['lon'], b['lat']) for b in chunk]
-                matrix = _osrm_table_call(coords)
+                    # ข้าม batch ถ้าทุกคู่ใน chunk มีใน cache แล้ว
+                    if any(_pair_key(bi, bj) not in OSRM_CACHE
+                           for i, bi in enumerate(chunk) for j, bj in enumerate(chunk) if i != j):
+                        chunks.append(chunk)
+            if not chunks:
+                continue  # ✅ ครบแล้ว ข้ามกลุ่มจังหวัดนี้
+
+            matrices = OSRM.matrices([[(b['lat'], b['lon']) for b in chunk] for chunk in chunks])
+            for chunk, matrix in zip(chunks, matrices):
                 if matrix is None:
-                    time.sleep(2)
                     continue
                 for i, bi in enumerate(chunk):
                     for j, bj in enumerate(chunk):
@@ -180,17 +137,15 @@ def build_osrm_cache_batched(branch_data):
                         dist_km = matrix[i][j]
                         if dist_km is None or dist_km <= 0:
                             continue
-                        key = f"{bi['lat']:.4f},{bi['lon']:.4f}_{bj['lat']:.4f},{bj['lon']:.4f}"
+                        key = _pair_key(bi, bj)
                         if key not in OSRM_CACHE:
                             OSRM_CACHE[key] = round(dist_km, 3)
                             new_pairs += 1
-                time.sleep(OSRM_DELAY)
 
-            # บันทึกทุก 10 จังหวัด
-            if (p_idx + 1) % 10 == 0:
-                _save_cache()
-                print(f"     ⏳ {p_idx+1}/{len(prov_list)} จังหวัด (+{new_pairs} pairs ใหม่, cache={len(OSRM_CACHE):,})")
-                new_pairs = 0
+            # บันทึกทุก PROVINCE_BATCH จังหวัด
+            _save_cache()
+            done = min(p_start + PROVINCE_BATCH, len(prov_list))
+            print(f"     ⏳ {done}/{len(prov_list)} จังหวัด (+{new_pairs} pairs ใหม่, cache={len(OSRM_CACHE):,})")
 
     except KeyboardInterrupt:
         print(f"\n⚠️ ถูกหยุด — บันทึก cache ที่ทำไว้แล้ว ({len(OSRM_CACHE):,} entries)")
@@ -202,10 +157,12 @@ def build_osrm_cache_batched(branch_data):
 
 
 def _save_cache():
-    """บันทึก OSRM_CACHE ลงไฟล์"""
+    """บันทึก OSRM_CACHE ลง distance_cache.db — เขียนเฉพาะ entry ใหม่ (backend จำลอง → ไม่บันทึก)"""
+    if OSRM.simulated:
+        return
     try:
-        with open('distance_cache.json', 'w', encoding='utf-8') as f:
-            json.dump(OSRM_CACHE, f, ensure_ascii=False)
+        if _CACHE_DB is not None:
+            _CACHE_DB.flush(OSRM_CACHE)
     except Exception as e:
         print(f"⚠️ บันทึก cache ไม่สำเร็จ: {e}")
 
@@ -222,22 +179,12 @@ def get_road_distance(lat1, lon1, lat2, lon2):
         return OSRM_CACHE[key], True
     if key_rev in OSRM_CACHE:
         return OSRM_CACHE[key_rev], True
-    # cache miss → เรียก OSRM live (Table API: lon,lat format)
-    try:
-        url = (
-            f"http://router.project-osrm.org/table/v1/driving/"
-            f"{lon1},{lat1};{lon2},{lat2}?annotations=distance"
-        )
-        r = requests.get(url, timeout=8)
-        data = r.json()
-        if data.get("code") == "Ok":
-            dist_m = data["distances"][0][1]
-            if dist_m and dist_m > 0:
-                dist_km = round(dist_m / 1000.0, 3)
-                OSRM_CACHE[key] = dist_km   # บันทึก cache
-                return dist_km, True
-    except Exception:
-        pass
+    # cache miss → เรียก OSRM live ผ่าน client (miss ที่มาพร้อมกันรวมเป็น /table เดียว)
+    dist_km = OSRM.distance((lat1, lon1), (lat2, lon2), timeout=8)
+    if dist_km and dist_km > 0:
+        dist_km = round(dist_km, 3)
+        OSRM_CACHE[key] = dist_km   # บันทึก cache
+        return dist_km, True
     # OSRM ล้มเหลว → คืน None เพื่อให้ caller ตัดสินใจเอง
     return None, False
 
@@ -278,6 +225,8 @@ def precompute_all():
     print("="*60)
     print("🚀 เริ่มต้น Pre-compute ข้อมูลสาขา")
     print("="*60)
+    print(f"🛣️ Routing backend: {OSRM.name}"
+          + (" (จำลอง — ไม่บันทึกลง distance_cache.db)" if OSRM.simulated else ""))
     
     # 1. โหลดข้อมูลสาขา
     print("\n📥 โหลดข้อมูลสาขา...")
@@ -484,7 +433,7 @@ def precompute_all():
 
     print("\n✅ Pre-compute เสร็จสิ้น!")
     _save_cache()
-    print(f"💾 distance_cache.json: {len(OSRM_CACHE):,} รายการ")
+    print(f"💾 distance_cache.db: {len(OSRM_CACHE):,} รายการ")
     return stats
 
 def build_branch_groups(branch_data, max_km=0.5):
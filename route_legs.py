@@ -0,0 +1,126 @@
+"""
+Route Legs — cache เส้นทางระดับช่วง (leg A→B) แทน key ทั้งเส้น DC|b1|b2|...|DC
+
+  - key ของช่วง: "lat,lon>lat,lon" (ทศนิยม 4 ตำแหน่งเหมือน key เดิม) → {'poly', 'distance'}
+    (geometry เป็น encoded polyline หลายระดับ — polyline_codec)
+  - เส้นทางหลายจุด = ต่อ geometry + รวมระยะของทุกช่วงที่ cache ไว้
+    → ย้ายสาขา 1 จุด / จัดทริปใหม่ ขอใหม่แค่ 2 ช่วงรอบจุดนั้น ที่เหลือ hit cache
+  - ช่วงที่ขาด (ของหลายเส้นทางพร้อมกันได้) ต่อเป็นสายเดียว → backend.route_legs() request เดียว
+    (แบ่งตาม max_coords) — ช่วงเชื่อมระหว่างช่วงที่ขาดได้มาฟรีและเก็บด้วย
+  - key ทั้งเส้นแบบเดิมใน route_cache.json ยังอ่านได้ (ตรวจก่อนต่อจากช่วง)
+  - level: 'full' / '100m' / '500m' — ต่อ geometry จากระดับเดียวกันของทุกช่วง
+"""
+from polyline_codec import coords_of, pyramid
+
+GAP = None  # ช่วงที่ขอไม่สำเร็จ
+
+
+def point_key(lat, lon):
+    return f"{lat:.4f},{lon:.4f}"
+
+
+def route_key(waypoints):
+    """key ทั้งเส้นแบบเดิม (route_cache.json รุ่นก่อน)"""
+    return "|".join(point_key(lat, lon) for lat, lon in waypoints)
+
+
+def leg_key(a, b):
+    return f"{point_key(*a)}>{point_key(*b)}"
+
+
+def is_leg_key(key):
+    return '>' in key
+
+
+def _legs(waypoints):
+    return [(tuple(a), tuple(b)) for a, b in zip(waypoints, waypoints[1:])]
+
+
+def _same_point(a, b):
+    return point_key(*a) == point_key(*b)
+
+
+def missing_legs(cache, waypoints):
+    """ช่วงของ waypoints ที่ยังไม่มีใน cache (ไม่นับช่วงที่จุดซ้ำกัน)"""
+    return [(a, b) for a, b in _legs(waypoints) if not _same_point(a, b) and leg_key(a, b) not in cache]
+
+
+def is_cached(cache, waypoints):
+    """มีเส้นทางครบใน cache แล้วหรือยัง (ไม่ถอด geometry)"""
+    return route_key(waypoints) in cache or not missing_legs(cache, waypoints)
+
+
+def compose(cache, waypoints, level='full'):
+    """ต่อเส้นทางจากช่วงใน cache → (coords, distance_km) หรือ None ถ้ายังขาดช่วงใด"""
+    coords = []
+    km = 0.0
+    for a, b in _legs(waypoints):
+        if _same_point(a, b):
+            leg = {'coords': [list(a)], 'distance': 0.0}
+        else:
+            leg = cache.get(leg_key(a, b))
+            if leg is None:
+                return None
+        pts = coords_of(leg, level) or [list(a), list(b)]
+        coords.extend(pts[1:] if coords and coords[-1] == pts[0] else pts)
+        km += leg.get('distance', 0) or 0
+    return coords, km
+
+
+def cached_route(cache, waypoints, level='full'):
+    """เส้นทางจาก cache อย่างเดียว (ไม่เรียก network): key ทั้งเส้นแบบเดิม → ต่อจากช่วง | None"""
+    if len(waypoints) < 2:
+        return None
+    full = cache.get(route_key(waypoints))
+    if isinstance(full, dict):
+        return coords_of(full, level) or waypoints, full.get('distance', 0)
+    return compose(cache, waypoints, level)
+
+
+def _chain(legs):
+    """ต่อช่วงที่ขาดเป็นสายจุดเดียว (ช่วงที่ต่อกันอยู่แล้วไม่ต้องซ้ำจุด)"""
+    chain = []
+    for a, b in legs:
+        if not chain or not _same_point(chain[-1], a):
+            chain.append(a)
+        chain.append(b)
+    return chain
+
+
+def fetch_missing(cache, routes, backend, timeout=10, retries=None):
+    """
+    ขอช่วงที่ขาดของหลายเส้นทางใน request ชุดเดียว แล้วเก็บลง cache
+    → จำนวนช่วงที่เก็บใหม่ (รวมช่วงเชื่อมที่ได้มาระหว่างทาง)
+    """
+    wanted = {}
+    for waypoints in routes:
+        for a, b in missing_legs(cache, waypoints):
+            wanted.setdefault(leg_key(a, b), (a, b))
+    if not wanted:
+        return 0
+    chain = _chain(wanted.values())
+    results = backend.route_legs(chain, timeout=timeout, retries=retries) or []
+    stored = 0
+    for (a, b), leg in zip(_legs(chain), results):
+        if leg is GAP or _same_point(a, b):
+            continue
+        key = leg_key(a, b)
+        if key not in cache:
+            cache[key] = {'poly': pyramid(leg[0]), 'distance': leg[1]}
+            stored += 1
+    return stored
+
+
+def route(cache, waypoints, backend, timeout=10, retries=None, level='full'):
+    """
+    เส้นทางหลายจุด: cache ก่อน → ขอเฉพาะช่วงที่ขาด → (coords, distance_km, ช่วงที่เก็บใหม่)
+    ยังขาดช่วงหลังขอแล้ว (network ล้มเหลว) → None
+    """
+    hit = cached_route(cache, waypoints, level)
+    if hit is not None:
+        return hit[0], hit[1], 0
+    stored = fetch_missing(cache, [waypoints], backend, timeout, retries)
+    composed = compose(cache, waypoints, level)
+    if composed is None:
+        return None
+    return composed[0], composed[1], stored
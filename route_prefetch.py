@@ -0,0 +1,187 @@
+"""
+Route Prefetch — คิวขอเส้นทางเบื้องหลังของทั้ง process (ใช้ร่วมทุก session ของ Streamlit)
+
+  - submit(routes, priority): เส้นทาง (waypoints) ที่ key ซ้ำกันรวมเป็นงานเดียว — สองคนจัดทริปพร้อมกัน
+    ไม่ขอซ้ำ, เส้นทางที่มีใน cache แล้วเสร็จทันที, ขอซ้ำด้วย priority สูงกว่า → เลื่อนคิวขึ้น
+  - priority: PRIORITY_FOCUS (ทริปที่กำลังดู) < PRIORITY_VIEW (แผนที่ที่เปิดอยู่) < PRIORITY_PLAN (หลังจัดทริป)
+  - worker ไม่กี่ตัวดึงงานทีละ batch → route_legs.fetch_missing (ช่วงที่ขาดของทั้ง batch = request ชุดเดียว
+    ผ่าน routing backend ที่มี connection pool) → แผนที่ได้เส้นทางทยอยตาม batch ไม่ต้องรอไล่ทีละทริป
+  - status(routes): นับ ready / pending / failed ให้หน้าแผนที่ poll
+
+    prefetcher = RoutePrefetcher(cache_for=lambda backend: cache)
+    prefetcher.submit(routes, PRIORITY_PLAN)
+    prefetcher.status(routes)   # → {'total', 'ready', 'pending', 'failed'}
+"""
+import heapq
+import itertools
+import threading
+from collections import Counter, OrderedDict
+
+import route_legs
+from routing_backend import get_backend
+
+PRIORITY_FOCUS = 0
+PRIORITY_VIEW = 1
+PRIORITY_PLAN = 2
+DEFAULT_WORKERS = 2
+BATCH_ROUTES = 8          # เส้นทางต่อ batch ของ worker
+MAX_FINISHED = 20000      # งานที่เสร็จแล้วที่จำสถานะไว้
+
+
+class _Job:
+    __slots__ = ('key', 'waypoints', 'priority', 'state')
+
+    def __init__(self, key, waypoints, priority):
+        self.key = key
+        self.waypoints = waypoints
+        self.priority = priority
+        self.state = 'queued'     # queued → running → ready | failed
+
+
+class RoutePrefetcher:
+    """คิว priority + dedupe + worker pool ของการขอเส้นทาง (thread-safe)"""
+
+    def __init__(self, cache_for, on_stored=None, workers=DEFAULT_WORKERS, batch=BATCH_ROUTES):
+        self.cache_for = cache_for            # backend → cache (dict / RouteStore)
+        self.on_stored = on_stored            # (backend, จำนวนช่วงใหม่) → None เช่น save ตาม batch
+        self.workers = max(1, int(workers))
+        self.batch = max(1, int(batch))
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._jobs = OrderedDict()            # key → _Job
+        self._threads = []
+        self.stats = Counter()
+
+    # ------------------------------------------------------------------
+    def _start_workers(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._work, daemon=True, name=f"route-prefetch-{len(self._threads)}")
+            t.start()
+            self._threads.append(t)
+
+    def _push(self, job):
+        heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+
+    def submit(self, routes, priority=PRIORITY_PLAN):
+        """เพิ่มเส้นทางเข้าคิว (ซ้ำ = รวมงาน / เลื่อน priority) → จำนวนงานที่เข้าคิวใหม่"""
+        backend = get_backend()
+        cache = self.cache_for(backend)
+        queued = 0
+        with self._cond:
+            for waypoints in routes:
+                if len(waypoints) < 2:
+                    continue
+                key = route_legs.route_key(waypoints)
+                job = self._jobs.get(key)
+                if job is not None and job.state in ('queued', 'running', 'ready'):
+                    if job.state == 'queued' and priority < job.priority:
+                        job.priority = priority
+                        self._push(job)          # entry เดิมใน heap ถูกข้ามตอน pop
+                        self.stats['promoted'] += 1
+                    else:
+                        self.stats['deduplicated'] += 1
+                    continue
+                job = _Job(key, [list(p) for p in waypoints], priority)
+                self._jobs[key] = job
+                self._jobs.move_to_end(key)
+                if route_legs.is_cached(cache, waypoints):
+                    job.state = 'ready'
+                    self.stats['already_cached'] += 1
+                    continue
+                self._push(job)
+                queued += 1
+            self._prune()
+            if queued:
+                self.stats['submitted'] += queued
+                self._start_workers()
+                self._cond.notify_all()
+        return queued
+
+    def _prune(self):
+        finished = sum(1 for j in self._jobs.values() if j.state in ('ready', 'failed'))
+        for key in list(self._jobs):
+            if finished <= MAX_FINISHED:
+                break
+            if self._jobs[key].state in ('ready', 'failed'):
+                del self._jobs[key]
+                finished -= 1
+
+    def _take(self):
+        """งาน priority สูงสุดไม่เกิน batch (priority เดียวกัน) — รอจนมีงาน"""
+        with self._cond:
+            while True:
+                jobs = []
+                while self._heap and len(jobs) < self.batch:
+                    priority, _, job = self._heap[0]
+                    if job.state != 'queued' or priority != job.priority:
+                        heapq.heappop(self._heap)   # entry เก่าจากการเลื่อน priority
+                        continue
+                    if jobs and priority != jobs[0].priority:
+                        break
+                    heapq.heappop(self._heap)
+                    job.state = 'running'
+                    jobs.append(job)
+                if jobs:
+                    return jobs
+                self._cond.wait()
+
+    def _work(self):
+        while True:
+            jobs = self._take()
+            backend = get_backend()
+            cache = self.cache_for(backend)
+            try:
+                stored = route_legs.fetch_missing(cache, [j.waypoints for j in jobs], backend)
+                if self.on_stored is not None:
+                    self.on_stored(backend, stored)
+            except Exception:
+                stored = 0
+                self.stats['errors'] += 1
+            with self._cond:
+                for job in jobs:
+                    job.state = 'ready' if route_legs.is_cached(cache, job.waypoints) else 'failed'
+                    self.stats[job.state] += 1
+                self.stats['batches'] += 1
+                self.stats['legs_stored'] += stored
+                self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    def status(self, routes):
+        """สถานะของชุดเส้นทาง (เช่นทุกทริปของแผนที่เปิดอยู่) → {'total', 'ready', 'pending', 'failed'}"""
+        counts = Counter()
+        unknown = []
+        with self._cond:
+            for waypoints in routes:
+                if len(waypoints) < 2:
+                    continue
+                job = self._jobs.get(route_legs.route_key(waypoints))
+                if job is None:
+                    unknown.append(waypoints)
+                elif job.state in ('queued', 'running'):
+                    counts['pending'] += 1
+                else:
+                    counts[job.state] += 1
+        if unknown:
+            cache = self.cache_for(get_backend())
+            for waypoints in unknown:
+                counts['ready' if route_legs.is_cached(cache, waypoints) else 'failed'] += 1
+        return {'total': sum(counts.values()), 'ready': counts['ready'],
+                'pending': counts['pending'], 'failed': counts['failed']}
+
+    def wait(self, routes, timeout=None):
+        """รอจนชุดเส้นทางไม่มีงานค้าง (สคริปต์ / benchmark) → status"""
+        keys = [route_legs.route_key(w) for w in routes if len(w) >= 2]
+        with self._cond:
+            self._cond.wait_for(
+                lambda: all(self._jobs.get(k) is None or self._jobs[k].state not in ('queued', 'running')
+                            for k in keys),
+                timeout)
+        return self.status(routes)
+
+    def summary(self):
+        with self._cond:
+            states = Counter(j.state for j in self._jobs.values())
+        return {'queued': states['queued'], 'running': states['running'], 'workers': len(self._threads),
+                **dict(self.stats)}
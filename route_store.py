@@ -0,0 +1,367 @@
+"""
+Route Store — route cache แบบแบ่ง shard บนดิสก์ โหลดเฉพาะที่ใช้ (แทน route_cache.json ที่โหลดทั้งไฟล์ทุกครั้ง)
+
+  - <dir>/<xx>.jsonl: shard ตาม hash prefix ของ key (SHARDS ไฟล์) — append-only ทีละบรรทัด
+        key \\t day \\t {"poly": ..., "distance": ...}    ค่า (บรรทัดหลังสุดชนะ)
+        key \\t day \\t                                   touch: ถูกใช้ในวันนั้น (สำหรับ compaction)
+  - เปิด shard ครั้งแรกที่ถูกถาม → อ่านแค่ index (key → offset) ยังไม่ parse ค่า
+  - ค่าที่อ่านแล้วเก็บใน LRU จำกัดจำนวน byte (max_bytes) — เกินแล้วทิ้งตัวที่ใช้นานสุดก่อน
+  - counters: hits (memory) / disk_reads / misses / evictions / writes / touches / skipped_records (บรรทัดเสียที่ข้าม)
+  - compact(days): เขียน shard ใหม่ เก็บเฉพาะ key ที่ถูกใช้ภายใน N วันล่าสุด (ทิ้งค่าซ้ำ + touch เก่า)
+
+ใช้แทน dict ได้ (get / in / [] / []= / len) → route_legs ใช้ได้ตรงๆ | flush() เขียนของใหม่ลงดิสก์
+
+    python route_store.py migrate [route_cache.json] [route_store]
+    python route_store.py compact [--days 30] [route_store]
+    python route_store.py stats   [route_store]
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from polyline_codec import compact_entry
+
+DEFAULT_STORE_DIR = 'route_store'
+DEFAULT_JSON_FILE = 'route_cache.json'
+DEFAULT_MAX_MB = 32
+DEFAULT_KEEP_DAYS = 30
+SHARDS = 256
+MANIFEST = 'manifest.json'   # จำนวน key ต่อ shard (len() ไม่ต้องเปิดทุก shard)
+ENTRY_OVERHEAD = 200         # byte ต่อ entry โดยประมาณ (dict + key + float ใน Python)
+
+_MISSING = object()
+
+
+def _today():
+    return int(time.time() // 86400)
+
+
+def shard_of(key):
+    """ชื่อ shard ของ key (hash prefix → 00..ff)"""
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=2).digest()
+    return f"{int.from_bytes(digest, 'big') % SHARDS:02x}"
+
+
+def _entry_bytes(key, value):
+    poly = value.get('poly') if isinstance(value, dict) else None
+    if poly:
+        return ENTRY_OVERHEAD + len(key) + sum(len(v) for v in poly.values())
+    return ENTRY_OVERHEAD + len(key) + len(json.dumps(value, separators=(',', ':')))
+
+
+class _Shard:
+    """index ของ shard เดียว: key → (offset, length) ของค่าล่าสุด + วันที่ใช้ล่าสุด"""
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = {}
+        self.used = {}
+        self.skipped = 0      # บรรทัดเสีย / เขียนไม่จบ (process ตายกลาง append) ที่ข้ามไป
+        if os.path.exists(path):
+            self._scan()
+
+    def _scan(self):
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                start, offset = offset, offset + len(line)
+                if not line.endswith(b'\n'):
+                    self.skipped += 1          # บรรทัดสุดท้ายเขียนไม่จบ
+                    break
+                try:
+                    key, day, value = line[:-1].split(b'\t', 2)
+                    key = key.decode('utf-8')
+                    day = int(day)
+                except ValueError:
+                    self.skipped += 1
+                    continue
+                if value and not value.endswith(b'}'):
+                    self.skipped += 1          # ค่าถูกตัดกลาง JSON → ไม่ทับค่าเดิมที่ดีอยู่
+                    continue
+                if value:
+                    self.offsets[key] = (start + len(line) - 1 - len(value), len(value))
+                self.used[key] = max(day, self.used.get(key, 0))
+
+    def read(self, key):
+        offset, length = self.offsets[key]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+
+    def append(self, records):
+        """records: [(key, day, value | None)] → เขียนต่อท้ายไฟล์ + อัปเดต index"""
+        with open(self.path, 'a+b') as f:
+            offset = f.seek(0, os.SEEK_END)
+            if offset:
+                f.seek(offset - 1)
+                if f.read(1) != b'\n':      # บรรทัดท้ายเขียนไม่จบ → ขึ้นบรรทัดใหม่ก่อน ไม่ต่อท้ายเศษเดิม
+                    f.write(b'\n')
+                    offset += 1
+            for key, day, value in records:
+                head = f"{key}\t{day}\t".encode('utf-8')
+                body = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8') \
+                    if value is not None else b''
+                f.write(head + body + b'\n')
+                if value is not None:
+                    self.offsets[key] = (offset + len(head), len(body))
+                self.used[key] = max(day, self.used.get(key, 0))
+                offset += len(head) + len(body) + 1
+
+
+class RouteStore:
+    """route cache แบบ shard + LRU จำกัด byte (ใช้ร่วมได้ทุก thread)"""
+
+    def __init__(self, root=DEFAULT_STORE_DIR, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.RLock()
+        self._shards = {}
+        self._lru = OrderedDict()     # key → (value, bytes)
+        self._bytes = 0
+        self._pending = {}            # shard → {key: value} ยังไม่ได้เขียน
+        self._touched = {}            # shard → {key: day}
+        self._manifest = self._read_manifest()
+        self.stats = Counter()
+
+    # ------------------------------------------------------------------
+    def exists(self):
+        return os.path.isdir(self.root)
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self):
+        counts = dict(self._manifest)
+        for sid, shard in self._shards.items():
+            counts[sid] = len(shard.offsets)
+        self._manifest = counts
+        tmp = os.path.join(self.root, MANIFEST + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(counts, f)
+        os.replace(tmp, os.path.join(self.root, MANIFEST))
+
+    def _shard(self, sid):
+        shard = self._shards.get(sid)
+        if shard is None:
+            shard = _Shard(os.path.join(self.root, f"{sid}.jsonl"))
+            self._shards[sid] = shard
+            self.stats['shard_loads'] += 1
+            self.stats['skipped_records'] += shard.skipped
+        return shard
+
+    def _remember(self, key, value):
+        size = _entry_bytes(key, value)
+        old = self._lru.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._lru[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._lru) > 1:
+            _, (_, dropped) = self._lru.popitem(last=False)
+            self._bytes -= dropped
+            self.stats['evictions'] += 1
+
+    def _touch(self, sid, shard, key):
+        today = _today()
+        if shard.used.get(key, 0) < today and self._touched.setdefault(sid, {}).get(key) != today:
+            self._touched[sid][key] = today
+
+    # ------------------------------------------------------------------
+    def get(self, key, default=None):
+        sid = shard_of(key)
+        with self._lock:
+            hit = self._lru.get(key)
+            if hit is not None:
+                self._lru.move_to_end(key)
+                self.stats['hits'] += 1
+                self._touch(sid, self._shard(sid), key)
+                return hit[0]
+            pending = self._pending.get(sid, {})
+            if key in pending:
+                self.stats['hits'] += 1
+                return pending[key]
+            shard = self._shard(sid)
+            if key not in shard.offsets:
+                self.stats['misses'] += 1
+                return default
+            try:
+                value = shard.read(key)
+            except (OSError, ValueError):
+                self.stats['misses'] += 1
+                return default
+            self.stats['disk_reads'] += 1
+            self._remember(key, value)
+            self._touch(sid, shard, key)
+            return value
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        sid = shard_of(key)
+        with self._lock:
+            return key in self._lru or key in self._pending.get(sid, {}) or key in self._shard(sid).offsets
+
+    def __setitem__(self, key, value):
+        sid = shard_of(key)
+        with self._lock:
+            self._pending.setdefault(sid, {})[key] = value
+            self._remember(key, value)
+
+    def __len__(self):
+        with self._lock:
+            counts = dict(self._manifest)
+            for sid, shard in self._shards.items():
+                counts[sid] = len(shard.offsets)
+            n = sum(counts.values())
+            for sid, pending in self._pending.items():
+                offsets = self._shard(sid).offsets
+                n += sum(1 for k in pending if k not in offsets)
+            return n
+
+    @property
+    def dirty(self):
+        return sum(len(p) for p in self._pending.values())
+
+    def memory_bytes(self):
+        return self._bytes
+
+    def flush(self):
+        """เขียน entry ใหม่ + touch ของวันนี้ลง shard (append) → จำนวน entry ที่เขียน"""
+        with self._lock:
+            if not self._pending and not self._touched:
+                return 0
+            os.makedirs(self.root, exist_ok=True)
+            written = 0
+            for sid in set(self._pending) | set(self._touched):
+                pending = self._pending.pop(sid, {})
+                touched = self._touched.pop(sid, {})
+                records = [(k, _today(), v) for k, v in pending.items()]
+                records += [(k, day, None) for k, day in touched.items() if k not in pending]
+                self._shard(sid).append(records)
+                written += len(pending)
+                self.stats['touches'] += len(records) - len(pending)
+            self.stats['writes'] += written
+            self._write_manifest()
+            return written
+
+    # ------------------------------------------------------------------
+    def import_json(self, json_path=DEFAULT_JSON_FILE):
+        """นำเข้า route_cache.json เดิม (one-time migration — geometry แปลงเป็น polyline pyramid) → จำนวน"""
+        if not os.path.exists(json_path):
+            return 0
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for key, value in data.items():
+            self[key] = compact_entry(value)
+        self.flush()
+        return len(data)
+
+    def compact(self, days=DEFAULT_KEEP_DAYS):
+        """เขียนทุก shard ใหม่: เก็บเฉพาะ key ที่ใช้ภายใน days วัน → (เก็บไว้, ทิ้ง)"""
+        with self._lock:
+            self.flush()
+            if not self.exists():
+                return 0, 0
+            cutoff = _today() - int(days)
+            kept = dropped = 0
+            for name in sorted(os.listdir(self.root)):
+                if not name.endswith('.jsonl'):
+                    continue
+                sid = name[:-len('.jsonl')]
+                shard = self._shard(sid)
+                live = [(k, shard.used.get(k, 0)) for k in shard.offsets if shard.used.get(k, 0) >= cutoff]
+                dropped += len(shard.offsets) - len(live)
+                if os.path.exists(shard.path + '.tmp'):
+                    os.remove(shard.path + '.tmp')
+                tmp = _Shard(shard.path + '.tmp')
+                records = []
+                for k, day in live:
+                    try:
+                        records.append((k, day, shard.read(k)))
+                    except ValueError:
+                        dropped += 1             # ค่าเสียบนดิสก์ → ทิ้งตอน compact
+                tmp.append(records)
+                os.replace(tmp.path, shard.path)
+                self._shards[sid] = _Shard(shard.path)
+                for k in list(self._lru):
+                    if shard_of(k) == sid and k not in self._shards[sid].offsets:
+                        self._bytes -= self._lru.pop(k)[1]
+                kept += len(records)
+            self._write_manifest()
+            return kept, dropped
+
+    def summary(self):
+        """สถานะสำหรับ log / UI"""
+        lookups = self.stats['hits'] + self.stats['disk_reads'] + self.stats['misses']
+        return {
+            'entries': len(self),
+            'memory_mb': round(self._bytes / 1e6, 2),
+            'max_mb': round(self.max_bytes / 1e6, 2),
+            'shards_loaded': len(self._shards),
+            'hit_rate': round(self.stats['hits'] / lookups, 3) if lookups else None,
+            **dict(self.stats),
+        }
+
+
+def open_store(root=DEFAULT_STORE_DIR, json_path=DEFAULT_JSON_FILE, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+    """เปิด store (ยังไม่มี + มี route_cache.json เดิม → migrate ให้อัตโนมัติ) → (RouteStore, จำนวนที่ migrate)"""
+    store = RouteStore(root, max_bytes=max_bytes)
+    migrated = 0
+    if not store.exists() and os.path.exists(json_path):
+        migrated = store.import_json(json_path)
+    return store, migrated
+
+
+def _disk_mb(root):
+    if not os.path.isdir(root):
+        return 0.0
+    return sum(os.path.getsize(os.path.join(root, n)) for n in os.listdir(root)) / 1e6
+
+
+def main(argv):
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+    cmd = argv[0] if argv else 'stats'
+    args = list(argv[1:])
+    days = DEFAULT_KEEP_DAYS
+    if '--days' in args:
+        i = args.index('--days')
+        days = int(args[i + 1])
+        del args[i:i + 2]
+    if cmd == 'migrate':
+        json_path = args[0] if args else DEFAULT_JSON_FILE
+        store = RouteStore(args[1] if len(args) > 1 else DEFAULT_STORE_DIR)
+        n = store.import_json(json_path)
+        print(f"✅ นำเข้า {n:,} เส้นทางจาก {json_path} → {store.root}/ ({_disk_mb(store.root):.1f} MB)")
+    elif cmd == 'compact':
+        store = RouteStore(args[0] if args else DEFAULT_STORE_DIR)
+        before = _disk_mb(store.root)
+        kept, dropped = store.compact(days)
+        print(f"✅ compact {store.root}/: เก็บ {kept:,} ทิ้ง {dropped:,} (ไม่ได้ใช้เกิน {days} วัน) "
+              f"{before:.1f} → {_disk_mb(store.root):.1f} MB")
+    elif cmd == 'stats':
+        store = RouteStore(args[0] if args else DEFAULT_STORE_DIR)
+        if not store.exists():
+            print(f"⚠️ ไม่พบ {store.root}/")
+            return 1
+        print(f"📦 {store.root}/: {len(store):,} เส้นทาง ({_disk_mb(store.root):.1f} MB)")
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
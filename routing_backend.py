@@ -0,0 +1,142 @@
+"""
+Routing Backend — ที่มาของระยะถนน + เส้นทาง (geometry) เลือกได้จาก config
+
+  - osrm      : OSRM ผ่าน HTTP (public หรือ self-hosted ตาม OSRM_BASE_URL) — ค่าเริ่มต้น
+  - haversine : เส้นตรง × road factor ไม่ใช้ network (เส้นทาง = ลากตรงระหว่างจุด)
+  - standin   : OSRM stand-in ในเครื่อง (osrm_standin) ผ่าน HTTP จริง — ทดสอบ/benchmark เส้นทาง network
+                แบบ offline พร้อมจำลอง latency / ความล้มเหลว
+
+config (environment):
+    ROUTING_BACKEND          osrm | haversine | standin
+    OSRM_BASE_URL            URL ของ OSRM (backend osrm)
+    ROUTING_ROAD_FACTOR      road factor ของ haversine / standin (ค่าเริ่มต้น 1.35)
+    ROUTING_STANDIN_LATENCY  วินาทีต่อ request ของ standin
+    ROUTING_STANDIN_FAILURE  สัดส่วน request ที่ล้มเหลว (503) ของ standin
+
+ทุก backend มีเมธอดเดียวกับ OsrmClient: route / route_legs / table / matrices / distances / distance
+(พิกัด (lat, lon), km)
+simulated = True → ไม่ใช่ระยะถนนจริง: ผู้เรียกต้องไม่บันทึกลง distance/route cache ถาวร
+                   (ใช้ route_cache ในหน่วยความจำของ backend แทน)
+"""
+import os
+import threading
+from collections import Counter
+
+import numpy as np
+
+from distance_store import ROAD_FACTOR
+from osrm_client import DEFAULT_BASE_URL, OsrmClient
+from spatial_index import great_circle_km
+
+BACKENDS = ('osrm', 'haversine', 'standin')
+DEFAULT_BACKEND = 'osrm'
+
+
+class OsrmBackend(OsrmClient):
+    """OSRM ผ่าน HTTP (keep-alive / rate limit / batch ของ OsrmClient)"""
+    name = 'osrm'
+    simulated = False
+
+
+class StandinBackend(OsrmBackend):
+    """OsrmBackend ที่ชี้ไป stand-in ในเครื่อง (เปิด server ให้เองใน daemon thread)"""
+    name = 'standin'
+    simulated = True
+
+    def __init__(self, latency_s=0.0, failure_rate=0.0, factor=ROAD_FACTOR, seed=42, **options):
+        from osrm_standin import start_standin
+        self.server = start_standin(latency_s=latency_s, failure_rate=failure_rate, factor=factor, seed=seed)
+        options.setdefault('rate_per_s', 0)   # server ในเครื่อง ไม่ต้องเว้นระยะ
+        super().__init__(self.server.url, **options)
+        self.route_cache = {}
+
+
+class HaversineBackend:
+    """เส้นตรง × factor — ไม่มี network, ผลเหมือนเดิมทุกครั้ง"""
+    name = 'haversine'
+    simulated = True
+
+    def __init__(self, factor=ROAD_FACTOR, **_options):
+        self.factor = float(factor)
+        self.stats = Counter()
+        self.route_cache = {}
+
+    def _rows(self, sources, destinations):
+        lats = np.array([p[0] for p in destinations], dtype=np.float64)
+        lons = np.array([p[1] for p in destinations], dtype=np.float64)
+        return [great_circle_km(lat, lon, lats, lons) * self.factor for lat, lon in sources]
+
+    def route(self, points, timeout=None, retries=None):
+        points = [tuple(p) for p in points]
+        if len(points) < 2:
+            return None
+        self.stats['routes'] += 1
+        km = sum(float(self._rows([a], [b])[0][0]) for a, b in zip(points, points[1:]))
+        return [[lat, lon] for lat, lon in points], km
+
+    def route_legs(self, points, timeout=None, retries=None):
+        points = [tuple(p) for p in points]
+        self.stats['routes'] += 1
+        return [([list(a), list(b)], float(self._rows([a], [b])[0][0])) for a, b in zip(points, points[1:])]
+
+    def table(self, sources, destinations=None, timeout=None, retries=None):
+        sources = list(sources)
+        destinations = sources if destinations is None else list(destinations)
+        self.stats['tables'] += 1
+        return [[float(v) if v > 0 else None for v in row] for row in self._rows(sources, destinations)]
+
+    def matrices(self, groups, timeout=None, retries=None):
+        return [self.table(points) for points in groups]
+
+    def distances(self, pairs, timeout=None, retries=None):
+        return [self.distance(a, b) for a, b in pairs]
+
+    def distance(self, a, b, timeout=None):
+        self.stats['pairs'] += 1
+        km = float(self._rows([a], [b])[0][0])
+        return km if km > 0 else None
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def make_backend(name=None, **options):
+    """
+    สร้าง backend ตามชื่อ (ไม่ระบุ → ROUTING_BACKEND) — options ส่งต่อให้ OsrmClient
+    (max_coords, max_workers, rate_per_s, timeout, retries, backoff) backend ที่ไม่ใช้ HTTP ไม่สนใจ
+    """
+    name = (name or os.environ.get('ROUTING_BACKEND') or DEFAULT_BACKEND).strip().lower()
+    factor = _env_float('ROUTING_ROAD_FACTOR', ROAD_FACTOR)
+    if name == 'osrm':
+        return OsrmBackend(os.environ.get('OSRM_BASE_URL', DEFAULT_BASE_URL), **options)
+    if name == 'haversine':
+        return HaversineBackend(factor=factor)
+    if name == 'standin':
+        return StandinBackend(latency_s=_env_float('ROUTING_STANDIN_LATENCY', 0.0),
+                              failure_rate=_env_float('ROUTING_STANDIN_FAILURE', 0.0), factor=factor, **options)
+    raise ValueError(f"unknown routing backend: {name} (ใช้ได้: {', '.join(BACKENDS)})")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """backend ที่ใช้ร่วมทั้ง process (สร้างครั้งแรกที่เรียกตาม config)"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = make_backend()
+        return _backend
+
+
+def set_backend(backend):
+    """เปลี่ยน backend ของ process (เช่น benchmark / สคริปต์ทดสอบ) → คืนตัวเดิม"""
+    global _backend
+    with _backend_lock:
+        prev, _backend = _backend, backend
+        return prev
@@ -0,0 +1,228 @@
+"""
+Solver Portfolio — แข่ง engine จัดทริปหลายตัวพร้อมกันภายใต้ deadline เดียว แล้วเลือกแผนที่ดีที่สุด
+
+greedy (plan = predict_trips) รันครั้งเดียวใน process ที่เรียก → เป็น seed ของทุก engine:
+  - greedy       : seed ตรงๆ
+  - local_search : local_search.improve_result(seed) — relocate/swap/exchange บนแผนที่เสร็จแล้ว
+  - cpsat        : ortools_vrp.optimize_decomposed(seed) (เฉพาะเมื่อติดตั้ง ortools)
+engine ปรับปรุงรันใน process แยก (spawn — ไม่ import app, รับ seed ที่ pickle มา) ได้เวลาเป็นสัดส่วน
+ของเวลาที่เหลือหลัง greedy (ที่เหลือเผื่อ spawn + import)
+
+ให้คะแนนทุกแผนด้วย objective เดียว (น้อย = ดี) — ต้นทุนรถจาก fleet_cost (ชุดเดียวกับ local search / CP-SAT):
+  score = VIOLATION_WEIGHT × violations + TRUCK_WEIGHT × fleet_cost(รถ) − utilization เฉลี่ย (%)
+  violations = ทริปที่เกิน limit × buffer, ⚠️ เกินโควต้ารถ, สาขาที่รถเกินข้อจำกัด, แถวที่ไม่ได้จัดทริป,
+               ทริปที่ผิด Step 6.6 (จังหวัด/zone ไม่เชื่อมกัน), ทริปที่มีคู่จังหวัดต้องห้าม (NO_CROSS_ZONE_PAIRS)
+greedy seed ได้ CancelToken ที่ deadline ไม่เกิน deadline_s (phase เสริมถูกตัดเมื่อถึง deadline)
+ถึง deadline → ใช้แผนที่ดีที่สุดที่เสร็จแล้ว (มี seed เสมอ), process ที่ยังไม่เสร็จถูกหยุด
+cancel (CancelToken) หยุดระหว่าง greedy → PlanningCancelled / หลังจากนั้น → ใช้แผนที่เสร็จแล้วทันที
+"""
+import importlib.util
+import multiprocessing
+import queue
+import time
+
+import pandas as pd
+
+from fleet_cost import fleet_cost
+from local_search import trip_mixing
+from plan_cancel import CancelToken
+
+ENGINES = ('greedy', 'local_search', 'cpsat')
+# สัดส่วนของเวลาที่เหลือหลัง greedy ที่ให้ขั้นปรับปรุง (local search / CP-SAT)
+IMPROVE_SHARE = 0.7
+
+VIOLATION_WEIGHT = 1000
+TRUCK_WEIGHT = 100   # ต่อหน่วยของ fleet_cost (4W = 100, 6W = 200)
+
+
+def available_engines():
+    """engine ที่รันได้ในเครื่องนี้ (cpsat ต้องมี ortools)"""
+    engines = ['greedy', 'local_search']
+    if importlib.util.find_spec('ortools') is not None:
+        engines.append('cpsat')
+    return engines
+
+
+def improve_budget(remaining_s):
+    """เวลาปรับปรุงของ engine จากเวลาที่เหลือหลัง greedy"""
+    return max(1.0, remaining_s * IMPROVE_SHARE)
+
+
+def cross_zone_rule(pairs):
+    """NO_CROSS_ZONE_PAIRS → (จังหวัด, จังหวัด) → bool แบบ is_cross_zone_violation (สร้างใน worker ได้ ไม่ต้อง import app)"""
+    pairs = {(str(a).strip(), str(b).strip()) for a, b in (pairs or ())}
+    if not pairs:
+        return None
+    return lambda a, b: (str(a).strip(), str(b).strip()) in pairs or (str(b).strip(), str(a).strip()) in pairs
+
+
+def _truck_head(value):
+    return str(value).split()[0] if pd.notna(value) and str(value).strip() else ''
+
+
+def score_plan(result, punthai_buffer=1.0, maxmart_buffer=1.10, cross_zone=None):
+    """
+    คะแนนของแผน (df, summary_df, fleet_used) → dict
+    trucks, vehicles, avg_util, violations (แยกชนิด), score | cross_zone = cross_zone_rule(NO_CROSS_ZONE_PAIRS)
+    """
+    df, summary_df, _ = result
+    vehicles = {'4W': 0, 'JB': 0, '6W': 0}
+    over_capacity = over_quota = 0
+    utils = []
+    for _, row in summary_df.iterrows():
+        truck = str(row.get('Truck', ''))
+        head = _truck_head(truck)
+        vehicles[head] = vehicles.get(head, 0) + 1
+        buffer = punthai_buffer if row.get('BU_Type') == 'punthai' else maxmart_buffer
+        util = max(float(row.get('Weight_Use%', 0) or 0), float(row.get('Cube_Use%', 0) or 0))
+        utils.append(util)
+        if util > buffer * 100 + 1e-6:
+            over_capacity += 1
+        if '⚠️' in truck:
+            over_quota += 1
+    vehicle_check = df['VehicleCheck'].astype(str) if 'VehicleCheck' in df.columns else pd.Series(dtype=str)
+    bad_vehicle = int((~vehicle_check.str.startswith('✅')).sum()) if len(vehicle_check) else 0
+    unassigned = int((df['Trip'] <= 0).sum()) if 'Trip' in df.columns else 0
+    mixing = trip_mixing(df, cross_zone)
+    zone_split, cross_zone_trips = len(mixing['zone_split']), len(mixing['cross_zone'])
+    violations = over_capacity + over_quota + bad_vehicle + unassigned + zone_split + cross_zone_trips
+    trucks = len(summary_df)
+    avg_util = sum(utils) / len(utils) if utils else 0.0
+    score = VIOLATION_WEIGHT * violations + TRUCK_WEIGHT * fleet_cost(vehicles) - avg_util
+    return {
+        'trucks': trucks,
+        'vehicles': vehicles,
+        'avg_util': round(avg_util, 2),
+        'violations': violations,
+        'over_capacity': over_capacity,
+        'over_quota': over_quota,
+        'bad_vehicle': bad_vehicle,
+        'unassigned': unassigned,
+        'zone_split': zone_split,
+        'cross_zone': cross_zone_trips,
+        'score': round(score, 2),
+    }
+
+
+def improve_seed(engine, seed, budget_s, limits, options, branch_to_group=None, no_cross_pairs=()):
+    """ปรับปรุง seed ด้วย engine เดียว (local_search / cpsat) → (df, summary_df, fleet_used)"""
+    buffers = dict(punthai_buffer=options.get('punthai_buffer', 1.0), maxmart_buffer=options.get('maxmart_buffer', 1.10))
+    if engine == 'local_search':
+        from local_search import improve_result
+        return improve_result(seed, limits, budget_s, max_qty_per_trip=options.get('max_qty_per_trip', 0),
+                              fleet_limits=options.get('fleet_limits'), cross_zone=cross_zone_rule(no_cross_pairs),
+                              **buffers)
+    if engine == 'cpsat':
+        from ortools_vrp import optimize_decomposed
+        return optimize_decomposed(seed, limits, buffer_punthai=buffers['punthai_buffer'],
+                                   buffer_maxmart=buffers['maxmart_buffer'], branch_to_group=branch_to_group,
+                                   fleet_limits=options.get('fleet_limits'),
+                                   max_qty_per_trip=options.get('max_qty_per_trip', 0),
+                                   time_limit_seconds=budget_s, max_workers=1)
+    raise ValueError(f"engine ไม่รู้จัก: {engine}")
+
+
+def _engine_worker(engine, seed, budget_s, limits, options, branch_to_group, no_cross_pairs, out):
+    """รันใน process แยก: ปรับปรุง seed ด้วย engine เดียว → ส่งผลกลับทาง queue"""
+    t0 = time.perf_counter()
+    try:
+        result = improve_seed(engine, seed, budget_s, limits, options, branch_to_group, no_cross_pairs)
+        out.put((engine, result, time.perf_counter() - t0, None))
+    except Exception as e:  # ส่ง error กลับ ให้ engine อื่นแข่งต่อได้
+        out.put((engine, None, time.perf_counter() - t0, f"{type(e).__name__}: {e}"))
+
+
+def run_portfolio(test_df, model_data, deadline_s, plan, limits, options=None, engines=None, branch_to_group=None,
+                  no_cross_pairs=(), log=print, cancel=None):
+    """
+    แข่ง engine ภายใต้ deadline_s วินาที (wall clock ตั้งแต่เริ่ม รวม greedy)
+    plan    = predict_trips (greedy seed — รันครั้งเดียวใน process นี้)
+    limits  = {'punthai': PUNTHAI_LIMITS, 'maxmart': LIMITS}, branch_to_group สำหรับ CP-SAT
+    no_cross_pairs = NO_CROSS_ZONE_PAIRS (กติกาของ local search + นับ violation)
+    options = พารามิเตอร์ร่วมของ predict_trips (buffer, fleet_limits, max_qty_per_trip)
+    cancel  = CancelToken ของงาน (ปุ่ม Cancel / deadline รวม) — ตรวจทุก 1 วินาทีระหว่างรอ
+    คืน (df, summary_df, fleet_used) ของผู้ชนะ — summary_df.attrs['portfolio'] บอกผลทุก engine
+    """
+    options = dict(options or {})
+    engines = [e for e in (engines or available_engines()) if e in ENGINES]
+    if 'greedy' not in engines:
+        engines.insert(0, 'greedy')   # seed เป็นแผนสำรองเสมอ
+    t0 = time.perf_counter()
+    deadline = t0 + float(deadline_s)
+    log(f"🏁 Portfolio: {', '.join(engines)} (deadline {deadline_s:g}s) — greedy seed ครั้งเดียว")
+    seed_token = cancel.child(deadline_s) if cancel is not None else CancelToken(deadline_s)
+    seed = plan(test_df, model_data, cancel=seed_token, **options)
+    seed_seconds = time.perf_counter() - t0
+    results, status = {'greedy': (seed, seed_seconds)}, {e: 'running' for e in engines}
+    status['greedy'] = 'done'
+    log(f"   ✅ greedy seed เสร็จใน {seed_seconds:.1f}s → {len(seed[1])} ทริป")
+
+    ctx = multiprocessing.get_context('spawn')
+    out = ctx.Queue()
+    procs = {}
+    remaining = deadline - time.perf_counter()
+    budget = improve_budget(remaining)
+    for engine in engines:
+        if engine == 'greedy':
+            continue
+        if remaining <= 0 or (cancel is not None and cancel.stopped):
+            status[engine] = 'timeout'   # greedy ใช้เวลาหมด deadline แล้ว / ถูกยกเลิก
+            continue
+        p = ctx.Process(target=_engine_worker,
+                        args=(engine, seed, budget, limits, options, branch_to_group, no_cross_pairs, out))
+        p.start()
+        procs[engine] = p
+
+    while any(s == 'running' for s in status.values()):
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0 or (cancel is not None and cancel.stopped):
+            break
+        try:
+            engine, result, seconds, error = out.get(timeout=min(remaining, 1.0))
+        except queue.Empty:
+            if not any(p.is_alive() for e, p in procs.items() if status[e] == 'running'):
+                break
+            continue
+        if error:
+            status[engine] = f'error: {error}'
+            log(f"   ⚠️ {engine} ล้มเหลว ({error})")
+            continue
+        status[engine] = 'done'
+        results[engine] = (result, seed_seconds + seconds)
+        log(f"   ✅ {engine} เสร็จใน {seconds:.1f}s (+ greedy) → {len(result[1])} ทริป")
+
+    for engine, p in procs.items():
+        if p.is_alive():
+            p.terminate()
+            if status[engine] == 'running':
+                status[engine] = 'timeout'
+        p.join(timeout=5)
+
+    buffers = dict(punthai_buffer=options.get('punthai_buffer', 1.0),
+                   maxmart_buffer=options.get('maxmart_buffer', 1.10))
+    cross_zone = cross_zone_rule(no_cross_pairs)
+    report = {}
+    for engine in engines:
+        entry = {'engine': engine, 'status': status[engine]}
+        if engine in results:
+            result, seconds = results[engine]
+            entry.update(score_plan(result, cross_zone=cross_zone, **buffers), seconds=round(seconds, 2))
+        report[engine] = entry
+    ranked = sorted(results, key=lambda e: (report[e]['score'], engines.index(e)))
+    winner = ranked[0]
+    runner_up = ranked[1] if len(ranked) > 1 else None
+    df, summary_df, fleet_used = results[winner][0]
+    summary_df.attrs['portfolio'] = {
+        'winner': winner,
+        'runner_up': runner_up,
+        'margin': round(report[runner_up]['score'] - report[winner]['score'], 2) if runner_up else 0.0,
+        'trucks_saved': report[runner_up]['trucks'] - report[winner]['trucks'] if runner_up else 0,
+        'engines': list(report.values()),
+        'deadline_s': float(deadline_s),
+        'seconds': round(time.perf_counter() - t0, 2),
+    }
+    if cancel is not None and cancel.stopped:
+        summary_df.attrs['cancelled'] = dict(cancel.report(), skipped=[e for e in engines if status[e] == 'timeout'])
+    log(f"🏆 Portfolio: {winner} ชนะ (score {report[winner]['score']:.1f}"
+        + (f", ดีกว่า {runner_up} {summary_df.attrs['portfolio']['margin']:.1f})" if runner_up else ")"))
+    return df, summary_df, fleet_used
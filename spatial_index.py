@@ -0,0 +1,125 @@
+"""
+Spatial Index — grid bucket ของพิกัดสาขา สำหรับค้นหาตามรัศมี / k สาขาใกล้สุด
+แทนการวน iterrows() ทุกสาขาต่อ 1 คำถาม
+
+- แบ่งพิกัดเป็นช่อง (cell) ขนาด ~cell_km × cell_km
+- query ตรวจเฉพาะช่องที่ครอบ bounding box ของรัศมี แล้วกรองด้วย haversine จริง
+- รัศมีเป็นระยะเส้นตรง (great-circle) — ระยะถนน ≥ เส้นตรงเสมอ
+  จึงใช้กรองเบื้องต้นก่อนเช็คระยะถนน (haversine×1.35 / cache) ได้โดยไม่ตกหล่น
+"""
+from math import radians, cos, floor
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG_LAT = EARTH_RADIUS_KM * np.pi / 180.0   # ~111.19 km
+
+
+def great_circle_km(lat, lon, lats, lons):
+    """ระยะเส้นตรง (km) จากจุดเดียว → หลายจุด (ไม่คูณ road factor, ไม่ปัดเศษ)"""
+    phi1 = np.radians(lat)
+    phi2 = np.radians(lats)
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lons, dtype=np.float64) - lon)
+    a = np.sin(dphi/2)**2 + np.cos(phi1)*np.cos(phi2)*np.sin(dlambda/2)**2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+
+
+class SpatialIndex:
+    """
+    Uniform grid index ของพิกัด (lat, lon)
+
+    ตำแหน่ง (position) = ลำดับของจุดตอนสร้าง → ใช้คู่กับ array/list ของผู้เรียก
+    (เช่น id ใน DistanceStore.subset ของรอบการจัดทริป)
+    keys (optional) = ชื่อจุด เช่น Plan Code → index.position[key]
+    จุดที่พิกัดไม่ถูกต้อง (≤0 / NaN) ไม่ถูกใส่ใน grid
+    """
+
+    def __init__(self, lats, lons, keys=None, cell_km=5.0):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.keys = list(keys) if keys is not None else None
+        self.position = {k: i for i, k in enumerate(self.keys)} if self.keys is not None else {}
+        self.cell_km = float(cell_km)
+        self._dlat = self.cell_km / KM_PER_DEG_LAT
+        valid = (self.lats > 0) & (self.lons > 0)
+        # ความกว้าง cell ตาม longitude ใช้ latitude สูงสุด → cell ไม่แคบกว่า cell_km
+        _max_lat = float(np.abs(self.lats[valid]).max()) if valid.any() else 0.0
+        self._dlon = self.cell_km / (KM_PER_DEG_LAT * max(cos(radians(min(_max_lat, 89.0))), 1e-6))
+        self._cells = {}
+        for i in np.nonzero(valid)[0]:
+            self._cells.setdefault(self._cell(self.lats[i], self.lons[i]), []).append(int(i))
+        self._cells = {c: np.asarray(v, dtype=np.int64) for c, v in self._cells.items()}
+
+    @classmethod
+    def from_coords(cls, coords, cell_km=5.0):
+        """สร้างจาก {key: (lat, lon)} (เช่น BRANCH_COORDS)"""
+        keys = list(coords.keys())
+        return cls([coords[k][0] for k in keys], [coords[k][1] for k in keys], keys=keys, cell_km=cell_km)
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _cell(self, lat, lon):
+        return (floor(lat / self._dlat), floor(lon / self._dlon))
+
+    def _candidates(self, lat, lon, radius_km):
+        """ตำแหน่งในทุก cell ที่ครอบ bounding box ของรัศมี"""
+        dlat = radius_km / KM_PER_DEG_LAT
+        _edge = min(abs(lat) + dlat, 89.0)
+        dlon = radius_km / (KM_PER_DEG_LAT * max(cos(radians(_edge)), 1e-6))
+        i0, j0 = self._cell(lat - dlat, lon - dlon)
+        i1, j1 = self._cell(lat + dlat, lon + dlon)
+        parts = []
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._cells):
+            parts = list(self._cells.values())
+        else:
+            for ci in range(i0, i1 + 1):
+                for cj in range(j0, j1 + 1):
+                    arr = self._cells.get((ci, cj))
+                    if arr is not None:
+                        parts.append(arr)
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(parts)
+
+    def within(self, lat, lon, radius_km, with_distance=False):
+        """
+        ตำแหน่งของจุดที่ห่างจาก (lat, lon) ≤ radius_km (เส้นตรง) เรียงตามตำแหน่ง
+        with_distance=True → คืน (positions, distances_km)
+        """
+        cand = self._candidates(lat, lon, radius_km)
+        if cand.size == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return (empty, np.empty(0)) if with_distance else empty
+        cand.sort()
+        d = great_circle_km(lat, lon, self.lats[cand], self.lons[cand])
+        keep = d <= radius_km + 1e-9
+        return (cand[keep], d[keep]) if with_distance else cand[keep]
+
+    def within_any(self, points, radius_km):
+        """ตำแหน่ง (unique, เรียง) ที่ห่างจากจุดใดจุดหนึ่งใน points ≤ radius_km"""
+        found = [self.within(la, lo, radius_km) for la, lo in points if la and lo and la > 0 and lo > 0]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def nearest(self, lat, lon, k=1, max_km=None):
+        """
+        k จุดใกล้สุด → (positions, distances_km) เรียงใกล้→ไกล
+        ขยายรัศมีทีละเท่าจนได้ครบ k (หรือถึง max_km)
+        """
+        n_valid = sum(len(v) for v in self._cells.values())
+        k = min(k, n_valid)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        radius = self.cell_km
+        while True:
+            pos, d = self.within(lat, lon, radius, with_distance=True)
+            if len(pos) >= k or (max_km is not None and radius >= max_km) or len(pos) == n_valid:
+                break
+            radius *= 2
+            if max_km is not None:
+                radius = min(radius, max_km)
+        order = np.argsort(d, kind='stable')[:k]
+        return pos[order], d[order]
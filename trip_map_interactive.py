@@ -1,11 +1,14 @@
 """
 trip_map_interactive.py — Modern Interactive Trip Map v4
-White/Green theme, OSRM routes, trip confirmation, vehicle edit, Excel export with styles.
+White/Green theme, cached road routes (server-side), trip confirmation, vehicle edit, Excel export with styles.
 """
 import json
 import pathlib
 import pandas as pd
 
+from polyline_codec import encode as encode_polyline
+from route_legs import cached_route
+
 _STATIC = pathlib.Path(__file__).parent / "static"
 
 try:
@@ -24,6 +27,10 @@ VEHICLE_LIMITS = {
     "6W":  {"max_w": 6000, "max_c": 20.0, "max_drops": 999},
 }
 
+# เส้นทาง pre-computed: ระดับ geometry ที่ฝังใน HTML (เลือกตาม zoom ฝั่ง browser)
+ROUTE_LEVELS = {"overview": "500m", "detail": "100m", "full": "full"}
+ROUTE_FULL_POINT_BUDGET = 20000   # ฝังระดับ full เฉพาะเมื่อจุดรวมทุกทริปไม่เกินนี้
+
 PUNTHAI_VEHICLE_LIMITS = {
     "4W":  {"max_w": 2500, "max_c": 5.0,  "max_drops": 5},
     "JB":  {"max_w": 3500, "max_c": 7.0,  "max_drops": 7},
@@ -168,22 +175,30 @@ def build_interactive_map_html(
     colors_js    = json.dumps(TRIP_COLORS,               ensure_ascii=False)
 
     # Build pre-computed route lookup indexed by trip ID
+    # geometry เป็น encoded polyline หลายระดับ (overview/detail/full) — browser ถอดเฉพาะระดับที่ zoom ใช้
     tid_routes = {}
     if route_cache:
         from collections import defaultdict as _dd
         trip_br_map = _dd(list)
         for b in branches_json:
             trip_br_map[str(b['trip'])].append(b)
+        full_points = 0
         for tid, tbrs in trip_br_map.items():
             wps = [[dc_lat, dc_lon]] + [[b['lat'], b['lon']] for b in tbrs] + [[dc_lat, dc_lon]]
-            ckey = '|'.join([f'{lat:.4f},{lon:.4f}' for lat, lon in wps])
-            if ckey in route_cache:
-                rv = route_cache[ckey]
-                coords_f = rv.get('coords', [])
-                if len(coords_f) > 500:
-                    step = max(1, len(coords_f) // 500)
-                    coords_f = coords_f[::step]
-                tid_routes[tid] = {'coords': coords_f, 'distance_m': rv.get('distance', 0) * 1000}
+            poly = {}
+            dist_km = 0
+            for name, level in ROUTE_LEVELS.items():
+                rv = cached_route(route_cache, wps, level)  # key ทั้งเส้นแบบเดิม หรือต่อจากช่วง (leg)
+                if rv is None:
+                    break
+                coords_f, dist_km = rv
+                if name == "full":
+                    full_points += len(coords_f)
+                    if full_points > ROUTE_FULL_POINT_BUDGET:
+                        break
+                poly[name] = encode_polyline(coords_f)
+            if poly:
+                tid_routes[tid] = {'poly': poly, 'distance_m': dist_km * 1000}
     tid_routes_js = json.dumps(tid_routes, ensure_ascii=False)
 
     html = f"""<!DOCTYPE html>
@@ -598,7 +613,6 @@ let _summaryCache   = {{}};
 let _filterTrip     = 'ALL';   // 'ALL' or trip id string
 let _settingsOpen   = false;
 let _legendOpen     = false;
-window._osrmCache        = {{}};
 window._routeLines       = [];
 window._tripDistances    = {{}};
 window._tripRouteStatus  = {{}};
@@ -624,6 +638,7 @@ function _initMap() {{
   _renderer = L.canvas({{ padding: 0.5 }});
   try {{
   map = L.map('map', {{ center: DC, zoom: 6, zoomControl: true, preferCanvas: true, renderer: _renderer }});
+  map.on('zoomend', _refreshRouteDetail);
   L.tileLayer('https://{{s}}.basemaps.cartocdn.com/rastertiles/voyager/{{z}}/{{x}}/{{y}}{{r}}.png', {{
     maxZoom: 19, subdomains: 'abcd',
     attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OSM</a> &copy; <a href="https://carto.com/">CARTO</a>',
@@ -976,38 +991,44 @@ function refreshTripMarkers(tid) {{
 }}
 
 // ── ROUTES ────────────────────────────────────────────────────────────────
+// ── PRE-COMPUTED ROUTES: encoded polyline หลายระดับ → ถอดตาม zoom ────────
+const ROUTE_DETAIL_ZOOM = 10, ROUTE_FULL_ZOOM = 14;
+function _decodePolyline(str) {{
+  const pts = []; let i = 0, lat = 0, lon = 0;
+  while (i < str.length) {{
+    for (let k = 0; k < 2; k++) {{
+      let shift = 0, result = 0, b;
+      do {{ b = str.charCodeAt(i++) - 63; result |= (b & 0x1f) << shift; shift += 5; }} while (b >= 0x20);
+      const d = (result & 1) ? ~(result >> 1) : (result >> 1);
+      if (k === 0) lat += d; else lon += d;
+    }}
+    pts.push([lat / 1e5, lon / 1e5]);
+  }}
+  return pts;
+}}
+function _routeLevel(r) {{
+  const z = map ? map.getZoom() : 6;
+  if (z >= ROUTE_FULL_ZOOM && r.poly.full) return 'full';
+  if (z >= ROUTE_DETAIL_ZOOM && r.poly.detail) return 'detail';
+  return 'overview';
+}}
+function _preRouteCoords(r, lv) {{
+  r._dec = r._dec || {{}};
+  if (!r._dec[lv]) r._dec[lv] = _decodePolyline(r.poly[lv]);
+  return r._dec[lv];
+}}
+function _refreshRouteDetail() {{
+  window._routeLines.forEach(l => {{
+    if (!l._pre) return;
+    const lv = _routeLevel(l._pre);
+    if (lv !== l._lv) {{ l._lv = lv; l.setLatLngs(_preRouteCoords(l._pre, lv)); }}
+  }});
+}}
 function _clearRoutes() {{
   if (!map) return;
   window._routeLines.forEach(l => map.removeLayer(l));
   window._routeLines = [];
 }}
-async function _fetchOsrmRoute(waypoints) {{
-  let wps = waypoints;
-  if (wps.length > 20) {{
-    const step = Math.max(1, Math.floor((wps.length-2) / 18));
-    const s2 = [wps[0]];
-    for (let i = 1; i < wps.length-1; i += step) s2.push(wps[i]);
-    s2.push(wps[wps.length-1]);
-    wps = s2;
-  }}
-  const cacheKey = JSON.stringify(wps);
-  if (window._osrmCache[cacheKey]) return window._osrmCache[cacheKey];
-  const coords = wps.map(([lat,lon]) => lon + ',' + lat).join(';');
-  const url = 'https://router.project-osrm.org/route/v1/driving/' + coords + '?overview=full&geometries=geojson';
-  try {{
-    const ctrl = new AbortController();
-    const timeout = setTimeout(() => ctrl.abort(), 12000);
-    const resp = await fetch(url, {{ signal: ctrl.signal }});
-    clearTimeout(timeout);
-    const data = await resp.json();
-    if (data.routes && data.routes[0]) {{
-      const r = data.routes[0];
-      const result = {{ coords: r.geometry.coordinates.map(([lon,lat]) => [lat, lon]), distance_m: r.distance }};
-      window._osrmCache[cacheKey] = result; return result;
-    }}
-  }} catch(e) {{}}
-  return null;
-}}
 async function _drawRoutes() {{
   if (!map) return;
   _clearRoutes();
@@ -1021,28 +1042,27 @@ async function _drawRoutes() {{
     if (!brs.length) return;
     window._tripRouteStatus[tid] = 'loading';
     const col = tripColor(parseInt(tid));
-    // ── ลองใช้ pre-computed route ก่อน (ไม่ต้องเรียก OSRM) ────────────
+    // ── เส้นทางจาก server เท่านั้น (route cache / prefetch) — browser ไม่เรียก routing service เอง ──
     let result = null;
     if (TID_ROUTES && TID_ROUTES[tid]) {{
-      result = TID_ROUTES[tid];
-    }} else {{
-      const wps = [DC].concat(brs.map(b => [b.lat, b.lon])).concat([DC]);
-      result = await _fetchOsrmRoute(wps);
+      const pre = TID_ROUTES[tid], lv = _routeLevel(pre);
+      result = {{ coords: _preRouteCoords(pre, lv), distance_m: pre.distance_m, pre: pre, lv: lv }};
     }}
     if (!_showRoutes) return;
     if (result && result.coords && result.coords.length > 1) {{
       const line = L.polyline(result.coords, {{ color: col, weight: 4, opacity: 0.82, renderer: _renderer, lineJoin: 'round', lineCap: 'round' }});
       line.bindTooltip('Trip ' + tid + ' · ' + (result.distance_m/1000).toFixed(1) + ' km', {{ sticky: true }});
+      if (result.pre) {{ line._pre = result.pre; line._lv = result.lv; }}
       line.addTo(map);
       window._routeLines.push(line);
       window._tripDistances[tid]   = result.distance_m / 1000;
       window._tripRouteStatus[tid] = 'ok';
       done++;
     }} else {{
-      // Straight-line fallback when OSRM unavailable
+      // Straight-line fallback: ยังไม่มีเส้นทางใน cache (กำลังโหลดเบื้องหลัง / ขอไม่สำเร็จ)
       const wps2 = [[DC[0],DC[1]]].concat(brs.map(b => [b.lat,b.lon])).concat([[DC[0],DC[1]]]);
       const line2 = L.polyline(wps2, {{ color:col, weight:2.5, opacity:0.55, dashArray:'7,5' }});
-      line2.bindTooltip('Trip ' + tid + ' (เส้นตรง · OSRM unavailable)', {{ sticky:true }});
+      line2.bindTooltip('Trip ' + tid + ' (เส้นตรง · ยังไม่มีเส้นทาง)', {{ sticky:true }});
       line2.addTo(map);
       window._routeLines.push(line2);
       window._tripRouteStatus[tid] = 'fallback';
@@ -1448,7 +1468,7 @@ function _cleanupEmptyTrips() {{
       const rbtn = document.getElementById('route-btn');
       if (rbtn) {{ rbtn.textContent = '&#128739; เส้นทาง'; rbtn.classList.remove('active'); }}
     }}
-    window._osrmCache = {{}}; window._tripDistances = {{}}; window._tripRouteStatus = {{}};
+    window._tripDistances = {{}}; window._tripRouteStatus = {{}};
     showToast('🔢 เรียงเลขทริปใหม่ ' + remaining.length + ' ทริป (ลบทริปว่าง ' + emptyTids.length + ' ทริป)');
   }}
   _invalidateCache();
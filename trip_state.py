@@ -0,0 +1,259 @@
+"""
+Trip State — ทะเบียนสมาชิก + ผลรวมต่อทริประหว่าง predict_trips
+แทนการกรอง df[df['Trip'] == t] ทั้งตารางทุกครั้งที่ต้องการข้อมูลทริป
+
+- เก็บตำแหน่งแถว (position) ของแต่ละทริป + คอลัมน์ที่ใช้บ่อยเป็น numpy array ครั้งเดียว
+- ย้ายสาขา/รวมทริป/เรียงเลขใหม่ ผ่าน TripState → อัปเดต df['Trip'] และสมาชิกพร้อมกัน
+  ต้นทุนตามจำนวนแถวที่ย้าย (ไม่ใช่ขนาด df)
+- summary ต่อทริป (น้ำหนัก/คิว/drops/centroid/จังหวัด/zone/ภาค ฯลฯ) cache ไว้
+  คำนวณใหม่เฉพาะทริปที่มีสมาชิกเปลี่ยน จากแถวของทริปนั้นเท่านั้น
+  (ผลรวมใช้ลำดับแถวเดียวกับ pandas → ค่าตรงกับ trip_data['Weight'].sum() ทุกหลัก)
+- แก้ df['Trip'] ตรงๆ ได้ แต่ต้องเรียก sync() ก่อนอ่านต่อ (diff เฉพาะแถวที่เปลี่ยน)
+"""
+import numpy as np
+import pandas as pd
+
+
+def _nan_sum(values):
+    """เหมือน pandas Series.sum() (NaN → 0 แล้วรวมตามลำดับ)"""
+    if values.dtype.kind == 'f':
+        values = np.where(np.isnan(values), 0.0, values)
+    return values.sum()
+
+
+def _nan_mean(values):
+    """เหมือน pandas Series.mean() (ไม่นับ NaN)"""
+    values = values.astype(np.float64, copy=True)
+    mask = np.isnan(values)
+    count = len(values) - int(mask.sum())
+    if count == 0:
+        return np.nan
+    np.putmask(values, mask, 0.0)
+    return values.sum() / count
+
+
+def _distinct(values):
+    """set ของค่าที่ไม่ใช่ NA (เหมือน set(series.dropna().unique()))"""
+    return {v for v in values if not pd.isna(v)}
+
+
+class TripState:
+    """
+    ทะเบียนทริปของ df หนึ่งตัว (index/ลำดับแถวต้องไม่เปลี่ยนระหว่างใช้งาน)
+
+    is_punthai(code) → bool, vehicle_rank(code) → 1/2/3, region_of(province) → ชื่อภาค
+    ใช้คำนวณ summary (ส่งมาจาก predict_trips ซึ่งมี cache ของรอบนั้นอยู่แล้ว)
+    """
+
+    def __init__(self, df, is_punthai=None, vehicle_rank=None, region_of=None):
+        self.df = df
+        self._is_punthai = is_punthai or (lambda code: False)
+        self._vehicle_rank = vehicle_rank or (lambda code: 3)
+        self._region_of = region_of or (lambda province: '')
+        self._rebuild()
+
+    # ------------------------------------------------------------------
+    # สมาชิก
+    # ------------------------------------------------------------------
+    def _rebuild(self):
+        self._index = self.df.index
+        self._columns = {}
+        self._code_pos = {}
+        for pos, code in enumerate(self.column('Code')):
+            self._code_pos.setdefault(code, []).append(pos)
+        self._trip = self.df['Trip'].to_numpy(dtype=np.int64, copy=True)
+        self._members = {}
+        for pos, t in enumerate(self._trip.tolist()):
+            self._members.setdefault(t, set()).add(pos)
+        self._sorted = {}
+        self._summary = {}
+
+    def _touch(self, trip):
+        self._sorted.pop(trip, None)
+        self._summary.pop(trip, None)
+
+    def _move(self, positions, trip):
+        trip = int(trip)
+        dst = self._members.setdefault(trip, set())
+        for pos in positions:
+            old = int(self._trip[pos])
+            if old == trip:
+                continue
+            src = self._members[old]
+            src.discard(pos)
+            if not src:
+                del self._members[old]
+            self._touch(old)
+            dst.add(pos)
+            self._trip[pos] = trip
+        self._touch(trip)
+        if not dst:
+            del self._members[trip]
+
+    def sync(self):
+        """รับการแก้ df['Trip'] ที่ไม่ได้ผ่าน TripState → ย้ายเฉพาะแถวที่ค่าเปลี่ยน"""
+        if not self.df.index.equals(self._index) or len(self.df) != len(self._trip):
+            self._rebuild()
+            return
+        current = self.df['Trip'].to_numpy(dtype=np.int64)
+        changed = np.nonzero(current != self._trip)[0]
+        for pos in changed.tolist():
+            self._move((pos,), current[pos])
+
+    def column(self, name):
+        """คอลัมน์เป็น numpy array (cache — ใช้กับคอลัมน์ที่ไม่เปลี่ยนระหว่างจัดทริปเท่านั้น)"""
+        arr = self._columns.get(name)
+        if arr is None:
+            arr = self.df[name].to_numpy()
+            self._columns[name] = arr
+        return arr
+
+    def positions_of(self, codes):
+        """ตำแหน่งแถวของ Code (รับ code เดียวหรือหลายตัว) เรียงตามลำดับใน df"""
+        if isinstance(codes, str):
+            codes = (codes,)
+        out = []
+        for code in codes:
+            out.extend(self._code_pos.get(code, ()))
+        return sorted(out)
+
+    def members(self, trip):
+        """ตำแหน่งแถวของทริป เรียงตามลำดับใน df (เหมือนผลของ df[df['Trip'] == trip])"""
+        arr = self._sorted.get(trip)
+        if arr is None:
+            arr = np.fromiter(sorted(self._members.get(trip, ())), dtype=np.int64)
+            self._sorted[trip] = arr
+        return arr
+
+    def size(self, trip):
+        """จำนวนแถวของทริป"""
+        return len(self._members.get(trip, ()))
+
+    def trips(self, order='number'):
+        """
+        เลขทริป (> 0) ที่มีสมาชิก
+        order='number' → เรียงเลขทริป, order='appearance' → ตามแถวแรกใน df (เหมือน .unique())
+        """
+        trips = [t for t in self._members if t > 0]
+        if order == 'appearance':
+            return sorted(trips, key=lambda t: min(self._members[t]))
+        return sorted(trips)
+
+    def max_trip(self):
+        """เลขทริปสูงสุดที่มีสมาชิก (0 ถ้าไม่มี)"""
+        return max(self._members) if self._members else 0
+
+    def rows(self, trip):
+        """แถวของทริป = df[df['Trip'] == trip] โดยไม่ต้องสแกนทั้ง df"""
+        return self.df.iloc[self.members(trip)]
+
+    def codes(self, trip):
+        """Code ของทริป ตามลำดับใน df"""
+        return self.column('Code')[self.members(trip)].tolist()
+
+    # ------------------------------------------------------------------
+    # แก้เลขทริป (เขียน df['Trip'] + อัปเดตสมาชิกพร้อมกัน)
+    # ------------------------------------------------------------------
+    def _write(self, positions, trip):
+        if len(positions) == 0:
+            return
+        self.df.iloc[positions, self.df.columns.get_loc('Trip')] = trip
+        self._move(positions, trip)
+
+    def assign_codes(self, codes, trip):
+        """df.loc[df['Code'].isin(codes), 'Trip'] = trip"""
+        self._write(self.positions_of(codes), trip)
+
+    def merge(self, src, dst):
+        """df.loc[df['Trip'] == src, 'Trip'] = dst"""
+        if src != dst:
+            self._write(self.members(src).tolist(), dst)
+
+    def set_value(self, trip, column, value):
+        """df.loc[df['Trip'] == trip, column] = value (คอลัมน์อื่นที่ไม่ใช่ Trip เช่น Truck)"""
+        pos = self.members(trip)
+        if len(pos):
+            self.df.iloc[pos, self.df.columns.get_loc(column)] = value
+            self._columns.pop(column, None)
+
+    def renumber(self, mapping, missing=None):
+        """
+        เรียงเลขทริปใหม่: ทริป > 0 → mapping.get(t, t)
+        missing != None → ทริปที่ไม่อยู่ใน mapping และทริป ≤ 0 ได้ค่า missing แทน
+        """
+        def _new(t):
+            if t > 0:
+                return mapping.get(t, t if missing is None else missing)
+            return t if missing is None else missing
+
+        remap = {t: int(_new(t)) for t in self._members}
+        self._trip = np.fromiter((remap[t] for t in self._trip.tolist()), dtype=np.int64, count=len(self._trip))
+        self.df['Trip'] = self._trip.copy()
+        members, sorted_, summary = {}, {}, {}
+        sources = {}
+        for old, new in remap.items():
+            sources.setdefault(new, []).append(old)
+        for new, olds in sources.items():
+            if len(olds) == 1:
+                members[new] = self._members[olds[0]]
+                if olds[0] in self._sorted:
+                    sorted_[new] = self._sorted[olds[0]]
+                if olds[0] in self._summary:
+                    summary[new] = self._summary[olds[0]]
+            else:
+                members[new] = set().union(*(self._members[o] for o in olds))
+        self._members, self._sorted, self._summary = members, sorted_, summary
+
+    # ------------------------------------------------------------------
+    # summary ต่อทริป
+    # ------------------------------------------------------------------
+    def has_summary(self, trip):
+        """summary ของทริปนี้ cache อยู่แล้ว (ยังไม่มีสมาชิกเปลี่ยน)"""
+        return trip in self._summary
+
+    def summary(self, trip):
+        """
+        ผลรวมของทริป (cache จนกว่าสมาชิกจะเปลี่ยน) หรือ None ถ้าทริปว่าง
+        keys: weight, cube, qty, codes, drops, centroid_lat/lon, min_priority,
+              is_punthai, provinces, logistics_zones, highways, regions
+        """
+        cached = self._summary.get(trip)
+        if cached is not None:
+            return cached
+        pos = self.members(trip)
+        if len(pos) == 0:
+            return None
+        df = self.df
+        codes = self.column('Code')[pos].tolist()
+        provinces = _distinct(self.column('_province')[pos]) if '_province' in df.columns else set()
+        zones = _distinct(self.column('_logistics_zone')[pos]) if '_logistics_zone' in df.columns else set()
+        highways = set()
+        if '_zone_highway' in df.columns:
+            for hw in _distinct(self.column('_zone_highway')[pos]):
+                highways.update(str(hw).split('/'))
+        regions = set()
+        for p in provinces:
+            r = self._region_of(str(p)) if p else 'ไม่ระบุ'
+            if r and r != 'ไม่ระบุ':
+                regions.add(r)
+        if not regions and '_region_name' in df.columns:
+            for rn in _distinct(self.column('_region_name')[pos]):
+                if rn and rn != 'ไม่ระบุ':
+                    regions.add(rn)
+        result = {
+            'weight': _nan_sum(self.column('Weight')[pos]),
+            'cube': _nan_sum(self.column('Cube')[pos]),
+            'qty': _nan_sum(self.column('OriginalQty')[pos]) if 'OriginalQty' in df.columns else 0,
+            'codes': codes,
+            'drops': len(codes),
+            'centroid_lat': _nan_mean(self.column('_lat')[pos]),
+            'centroid_lon': _nan_mean(self.column('_lon')[pos]),
+            'min_priority': min(self._vehicle_rank(c) for c in codes),
+            'is_punthai': all(self._is_punthai(c) for c in codes),
+            'provinces': provinces,
+            'logistics_zones': zones,
+            'highways': highways,
+            'regions': regions,
+        }
+        self._summary[trip] = result
+        return result
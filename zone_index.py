@@ -0,0 +1,172 @@
+"""
+Zone Index — index โซนที่ compile ครั้งเดียวจาก LOGISTICS_ZONES / PROVINCE_ZONE_MAP
+
+แทนการวนทุกโซน + sort โซนหลักทุกครั้งที่เรียก get_logistics_zone
+และ dict ที่สร้างใหม่ทุกครั้งใน get_zone_priority / get_zone_highway
+
+  province → {district → [(zone, subdistricts | None), ...]}  (โซนย่อย ตามลำดับใน LOGISTICS_ZONES)
+  province → โซนหลัก (priority น้อยสุด, เสมอกัน → ตัวแรก)
+  zone     → priority / highway
+
+ผลเหมือนฟังก์ชันเดิมทุกกรณี + จำผลต่อ (จังหวัด, อำเภอ, ตำบล) ที่เคยถาม
+classify_zones() รับเป็นคอลัมน์/array → คำนวณต่อค่า unique ครั้งเดียว
+"""
+import numpy as np
+
+# zone_viewer format (เหนือ_จังหวัด_อำเภอ / BKK_เขต) → priority / ทางหลวง จาก prefix
+VIEWER_PREFIX_PRIORITY = {
+    'เหนือ': 5, 'อีสาน': 12, 'ใต้': 20, 'ตะวันออก': 16,
+    'ตะวันตก': 18, 'ปริมณฑล': 80, 'BKK': 90,
+}
+VIEWER_PREFIX_HIGHWAY = {
+    'เหนือ': '1/11', 'อีสาน': '2/24', 'ใต้': '4',
+    'ตะวันออก': '3', 'ตะวันตก': '32/4', 'ปริมณฑล': '',
+}
+PROVINCE_ALIAS = {'กรุงเทพฯ': 'กรุงเทพมหานคร', 'กทม': 'กรุงเทพมหานคร',
+                  'กทม.': 'กรุงเทพมหานคร', 'โคราช': 'นครราชสีมา'}
+
+
+def _prefix(zone_name):
+    return zone_name.split('_')[0] if '_' in zone_name else zone_name
+
+
+class ZoneIndex:
+    """lookup โซนแบบ dict (สร้างครั้งเดียวต่อชุด LOGISTICS_ZONES / PROVINCE_ZONE_MAP)"""
+
+    def __init__(self, logistics_zones, province_zone_map=None):
+        self.province_zone_map = dict(province_zone_map or {})
+        self._sub = {}    # province → {district → [(zone, subdistricts or None)]}
+        self._main = {}   # province → (priority, zone)
+        self._priority = {}
+        self._highway = {}
+        for zone_name, info in logistics_zones.items():
+            self._priority[zone_name] = info['priority']
+            self._highway[zone_name] = info.get('highway', '')
+            districts = info.get('districts')
+            subdistricts = frozenset(info['subdistricts']) if info.get('subdistricts') else None
+            for province in info['provinces']:
+                if districts:
+                    by_district = self._sub.setdefault(province, {})
+                    for district in districts:
+                        entries = by_district.setdefault(district, [])
+                        if (zone_name, subdistricts) not in entries:
+                            entries.append((zone_name, subdistricts))
+                else:
+                    rank = info.get('priority', 999)
+                    if province not in self._main or rank < self._main[province][0]:
+                        self._main[province] = (rank, zone_name)
+        self._zone_memo = {}
+        self._prov_zone_memo = {}
+
+    # ---- LOGISTICS_ZONES ----
+    def logistics_zone(self, province, district='', subdistrict=''):
+        """เหมือน get_logistics_zone: โซนย่อย (อำเภอ/ตำบล) ก่อน → โซนหลักของจังหวัด → None"""
+        if not province or str(province).strip() == '':
+            return None
+        key = (str(province).strip(), str(district).strip() if district else '',
+               str(subdistrict).strip() if subdistrict else '')
+        if key in self._zone_memo:
+            return self._zone_memo[key]
+        province, district, subdistrict = key
+        zone = None
+        if district:
+            for zone_name, subdistricts in self._sub.get(province, {}).get(district, ()):
+                if subdistricts is None or (subdistrict and subdistrict in subdistricts):
+                    zone = zone_name
+                    break
+        if zone is None and province in self._main:
+            zone = self._main[province][1]
+        self._zone_memo[key] = zone
+        return zone
+
+    def priority(self, zone_name):
+        """เหมือน get_zone_priority (1 = ไกลสุด, ไม่มีโซน = 999)"""
+        if not zone_name:
+            return 999
+        value = self._priority.get(zone_name)
+        if value is None:
+            value = VIEWER_PREFIX_PRIORITY.get(_prefix(zone_name), 50)
+            self._priority[zone_name] = value
+        return value
+
+    def highway(self, zone_name):
+        """เหมือน get_zone_highway ('' = ไม่ทราบ)"""
+        if not zone_name:
+            return ''
+        value = self._highway.get(zone_name)
+        if value is None:
+            value = VIEWER_PREFIX_HIGHWAY.get(_prefix(zone_name), '')
+            self._highway[zone_name] = value
+        return value
+
+    # ---- PROVINCE_ZONE_MAP (zone_viewer format) ----
+    def province_zone(self, province, district=''):
+        """เหมือน get_prov_zone: BKK → BKK_{เขต} | จังหวัดอื่น → {ภาค}_{จังหวัด}"""
+        if not province:
+            return 'ไม่ระบุ'
+        key = (str(province), str(district) if district else '')
+        zone = self._prov_zone_memo.get(key)
+        if zone is None:
+            prov = str(province).strip()
+            prov = PROVINCE_ALIAS.get(prov, prov)
+            rz = self.province_zone_map.get(prov)
+            if rz == '__BKK__':
+                dist = str(district).strip() if district else ''
+                zone = f'BKK_{dist}' if dist else 'BKK_ไม่ระบุ'
+            else:
+                zone = rz if rz else f'ไม่ระบุ_{prov}'
+            self._prov_zone_memo[key] = zone
+        return zone
+
+    def viewer_zone(self, province, district=''):
+        """โซนระดับอำเภอแบบ zone_viewer (fallback ของ branch_zones.json): {ภาค}_{จังหวัด}_{อำเภอ}"""
+        prov = str(province or '').strip()
+        prov = PROVINCE_ALIAS.get(prov, prov)
+        dist = str(district or '').strip()
+        rz = self.province_zone_map.get(prov)
+        if rz == '__BKK__':
+            return f'BKK_{dist}' if dist else 'BKK_ไม่ระบุ'
+        if rz:
+            parts = rz.split('_', 1)
+            prefix, prov_short = parts[0], parts[1] if len(parts) > 1 else rz
+            return f'{prefix}_{prov_short}_{dist}' if dist else rz
+        return f'ไม่ระบุ_{prov}' if prov else 'ไม่ระบุ'
+
+    # ---- vectorized ----
+    def classify(self, provinces, districts=None, subdistricts=None, scheme='logistics'):
+        """
+        โซนของทุกแถว (ndarray object) — คำนวณต่อชุด (จังหวัด, อำเภอ, ตำบล) ที่ไม่ซ้ำครั้งเดียว
+        scheme: 'logistics' = LOGISTICS_ZONES (None ถ้าไม่พบ) | 'province' = get_prov_zone
+                | 'viewer' = โซนระดับอำเภอแบบ zone_viewer
+        """
+        provinces = list(provinces)
+        n = len(provinces)
+        districts = list(districts) if districts is not None else [''] * n
+        subdistricts = list(subdistricts) if subdistricts is not None else [''] * n
+        if scheme == 'logistics':
+            func = self.logistics_zone
+        elif scheme == 'province':
+            func = lambda p, d, s: self.province_zone(p, d)
+        elif scheme == 'viewer':
+            func = lambda p, d, s: self.viewer_zone(p, d)
+        else:
+            raise ValueError(f"unknown zone scheme: {scheme}")
+        keys = list(zip(provinces, districts, subdistricts))
+        lookup = {k: func(*k) for k in set(keys)}
+        out = np.empty(n, dtype=object)
+        out[:] = [lookup[k] for k in keys]
+        return out
+
+    def priorities(self, zones):
+        """priority ของทุกแถว (ndarray int)"""
+        zones = list(zones)
+        lookup = {z: self.priority(z) for z in set(zones)}
+        return np.array([lookup[z] for z in zones], dtype=np.int64)
+
+    def highways(self, zones):
+        """ทางหลวงของทุกแถว (ndarray object)"""
+        zones = list(zones)
+        lookup = {z: self.highway(z) for z in set(zones)}
+        out = np.empty(len(zones), dtype=object)
+        out[:] = [lookup[z] for z in zones]
+        return out